@@ -0,0 +1,6 @@
+"""
+Benchmarks of the chat server and the chat protocol.
+
+Run them from the project root, e.g.:
+        $ python -m benchmarks.bench_fanout
+"""
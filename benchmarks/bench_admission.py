@@ -0,0 +1,131 @@
+# -*- coding: utf-8 -*-
+"""
+Admission control load test: `--clients` more clients than the server admits keep reconnecting.
+
+The server admits `--capacity` clients. The benchmark joins them, then `--clients` more clients
+(2x capacity in total by default) connect again and again for `--duration` seconds: every one of
+them must get the REJECT frame at once. The server's CPU is measured idle at capacity, during the
+storm and idle after it: once the storm is over the server must be idle again, and the admitted
+clients must still be connected.
+
+Example:
+        $ python -m benchmarks.bench_admission --capacity 500 --duration 5
+"""
+
+import argparse
+import asyncio
+import sys
+import time
+
+from benchmarks.bench_engine import (
+    BenchClient,
+    proc_usage,
+    read_frame,
+    start_server,
+    wait_for_server,
+)
+from chat_protocol import *
+from chat_server import raise_open_files_limit
+
+
+async def cpu_percent(pid, seconds):
+    """It returns the CPU % of the process over the next `seconds`"""
+    cpu0, _ = proc_usage(pid)
+    await asyncio.sleep(seconds)
+    cpu1, _ = proc_usage(pid)
+    return (cpu1 - cpu0) / seconds * 100
+
+
+async def knock(host, port, until, retry, stats):
+    """A client over the capacity: it reconnects until `until`, it must be refused every time"""
+    while time.monotonic() < until:
+        reader, writer = await asyncio.open_connection(host, port)
+        try:
+            msg_type, _, _, reason = await asyncio.wait_for(read_frame(reader), 5.0)
+            stats["rejected" if msg_type == REJECT else "admitted"] += 1
+        except (asyncio.TimeoutError, asyncio.IncompleteReadError, ConnectionError):
+            stats["no answer"] += 1
+        writer.close()
+        await asyncio.sleep(retry)
+
+
+async def run(args):
+    host = "127.0.0.1"
+    server = start_server(
+        host, args.port, max_clients=args.capacity, max_pending=args.capacity
+    )
+    pid = server.pid
+    stats = {"rejected": 0, "admitted": 0, "no answer": 0}
+    try:
+        await wait_for_server(host, args.port)
+        clients = [BenchClient(idx, 1, {"latency": []}) for idx in range(args.capacity)]
+        for idx in range(0, args.capacity, 100):
+            await asyncio.gather(
+                *(c.join(host, args.port) for c in clients[idx : idx + 100])
+            )
+        idle_full = await cpu_percent(pid, 1.0)
+
+        cpu0, _ = proc_usage(pid)
+        until = time.monotonic() + args.duration
+        await asyncio.gather(
+            *(
+                knock(host, args.port, until, args.retry, stats)
+                for _ in range(args.clients)
+            )
+        )
+        storm_cpu = proc_usage(pid)[0] - cpu0
+        idle_after = await cpu_percent(pid, 1.0)
+        still_joined = sum(not c.reader.at_eof() for c in clients)
+        for client in clients:
+            client.writer.close()
+    finally:
+        server.terminate()
+        server.wait()
+
+    attempts = sum(stats.values())
+    print(f"capacity                 : {args.capacity} clients joined")
+    print(
+        f"over capacity            : {args.clients} clients, {attempts} connection attempts "
+        f"in {args.duration:.0f} s"
+    )
+    print(
+        f"refused with REJECT      : {stats['rejected']}  admitted: {stats['admitted']}  "
+        f"no answer: {stats['no answer']}"
+    )
+    print(f"server cpu idle, full    : {idle_full:5.1f} %")
+    print(
+        f"server cpu storm         : {storm_cpu / args.duration * 100:5.1f} %  "
+        f"({storm_cpu / max(attempts, 1) * 1e6:.0f} us per refused connection)"
+    )
+    print(f"server cpu idle, after   : {idle_after:5.1f} %")
+    print(f"admitted clients kept    : {still_joined}/{args.capacity}")
+    failed = []
+    if stats["admitted"] or stats["no answer"]:
+        failed.append("some over-capacity connections were not refused")
+    if idle_after > args.max_idle_cpu:
+        failed.append(f"the server is not idle after the storm: {idle_after:.1f} %")
+    if still_joined != args.capacity:
+        failed.append("admitted clients were disconnected")
+    for failure in failed:
+        print(f"FAILED: {failure}")
+    return not failed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--port", type=int, default=9591)
+    parser.add_argument("--capacity", type=int, default=500)
+    parser.add_argument("--clients", type=int, default=500, help="over the capacity")
+    parser.add_argument("--duration", type=float, default=5.0, help="seconds")
+    parser.add_argument(
+        "--retry", type=float, default=0.05, help="seconds between reconnects"
+    )
+    parser.add_argument("--max-idle-cpu", type=float, default=5.0, help="%%")
+    args = parser.parse_args()
+    raise_open_files_limit()
+    if not asyncio.run(run(args)):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
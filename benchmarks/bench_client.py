@@ -0,0 +1,150 @@
+# -*- coding: utf-8 -*-
+"""
+Client library overhead: `--clients` ChatClient connections in one process vs. the asyncio streams
+clients of bench_engine.
+
+Every kind of client runs in a new process. It starts a server, connects the clients (handshake,
+then into one of `--rooms` rooms), lets every client send `--messages` CHAT_CONVERSATION messages
+and reports the connect rate and, for the client process, the memory per client and the CPU time
+of the whole run: the clients receive the announcements of all the joins too. It fails if a
+ChatClient misses a message.
+
+Example:
+        $ python -m benchmarks.bench_client --clients 2000 --rooms 9 --messages 5
+"""
+
+import argparse
+import asyncio
+import collections
+import concurrent.futures
+import os
+import sys
+import time
+
+from benchmarks.bench_engine import (
+    BenchClient,
+    proc_usage,
+    start_server,
+    wait_for_server,
+)
+from chat_client import ChatClient
+from chat_protocol import *
+from chat_server import raise_open_files_limit
+
+
+class LibraryClient:
+    """A bench_engine client on top of ChatClient"""
+
+    def __init__(self, idx, room_id, stats):
+        self.room_id = room_id
+        self.stats = stats
+        self.client = None
+        self.nickname = f"u{idx}"
+
+    def on_frame(self, frame):
+        if frame[0] == CHAT_CONVERSATION:
+            self.stats["latency"].append(time.perf_counter_ns() - int(frame[3]))
+
+    async def join(self, host, port):
+        self.client = ChatClient(self.nickname, host, port, on_frame=self.on_frame)
+        await self.client.connect()
+        await self.client.join_room(rooms_name[self.room_id])
+
+    async def listen(self):
+        await self.client.wait_closed()
+
+    async def chat(self, messages, interval):
+        for _ in range(messages):
+            self.client.send(str(time.perf_counter_ns()))
+            await self.client.drain()
+            await asyncio.sleep(interval)
+
+    def close(self):
+        self.client.close()
+
+
+class StreamsClient(BenchClient):
+    def close(self):
+        self.writer.close()
+
+
+async def run(kind, port, args):
+    """It returns (connects/s, KB per client, CPU seconds, delivered, expected)"""
+    host = "127.0.0.1"
+    server = start_server(host, port, max_clients=args.clients + 10)
+    try:
+        await wait_for_server(host, port)
+        stats = {"latency": []}
+        clients = [
+            kind(idx, 1 + idx % args.rooms, stats) for idx in range(args.clients)
+        ]
+        cpu0, rss0 = proc_usage(os.getpid())
+        start = time.perf_counter()
+        for idx in range(0, len(clients), args.batch):
+            await asyncio.gather(
+                *(c.join(host, port) for c in clients[idx : idx + args.batch])
+            )
+        join_time = time.perf_counter() - start
+        listeners = [asyncio.create_task(c.listen()) for c in clients]
+        await asyncio.gather(*(c.chat(args.messages, 0.01) for c in clients))
+        room_sizes = collections.Counter(c.room_id for c in clients)
+        expected = args.messages * sum(size * size for size in room_sizes.values())
+        deadline = time.monotonic() + 30
+        while len(stats["latency"]) < expected and time.monotonic() < deadline:
+            await asyncio.sleep(0.01)
+        cpu1, rss1 = proc_usage(os.getpid())
+        for client in clients:
+            client.close()
+        await asyncio.gather(*listeners, return_exceptions=True)
+    finally:
+        server.terminate()
+        server.wait()
+    delivered = len(stats["latency"])
+    return (
+        args.clients / join_time,
+        (rss1 - rss0) * 1024 / args.clients,
+        cpu1 - cpu0,
+        delivered,
+        expected,
+    )
+
+
+def run_process(kind, port, args):
+    """run() in the process of the ProcessPoolExecutor"""
+    raise_open_files_limit()
+    return asyncio.run(run(kind, port, args))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--port", type=int, default=10391)
+    parser.add_argument("--clients", type=int, default=2000)
+    parser.add_argument("--rooms", type=int, default=MAX_PRIVATE_ROOMS)
+    parser.add_argument("--messages", type=int, default=5, help="per client")
+    parser.add_argument("--batch", type=int, default=100, help="concurrent connects")
+    args = parser.parse_args()
+    raise_open_files_limit()
+
+    failed = []
+    print(f"{args.clients} clients in {args.rooms} rooms, one process")
+    for offset, (name, kind) in enumerate(
+        (("asyncio streams", StreamsClient), ("ChatClient", LibraryClient))
+    ):
+        with concurrent.futures.ProcessPoolExecutor(1) as process:
+            rate, memory, cpu, delivered, expected = process.submit(
+                run_process, kind, args.port + offset, args
+            ).result()
+        print(
+            f"{name:<16}: {rate:6.0f} connects/s  {memory:5.1f} KB/client  "
+            f"{cpu:5.2f} s CPU  {delivered}/{expected} delivered"
+        )
+        if kind is LibraryClient and delivered != expected:
+            failed.append(f"ChatClient: {delivered}/{expected} messages delivered")
+    for failure in failed:
+        print(f"FAILED: {failure}")
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,236 @@
+# -*- coding: utf-8 -*-
+"""
+Aggregate relay throughput of the multi-process server as the workers scale from 1 to the CPUs.
+
+For every number of workers it starts `python -m chat_cluster --workers N`, joins `--clients`
+clients into `--rooms` rooms (the kernel spreads them over the workers, so most rooms have members
+on several workers) and lets every client send `--messages` CHAT_CONVERSATION messages as fast as
+it can. The clients run in `--generators` processes, so the load is not limited by one core of
+the benchmark. It reports the chat messages delivered per second (every message is delivered to
+every member of its room), and checks that every message reached every member.
+
+Then `--seq-clients` clients (protocol v3, spread over the workers) chat in one room: it fails if
+they don't all get the room's messages in the same order with the same seqs, or if a client that
+joins the room later, on any worker, doesn't get the same messages and seqs from its history.
+
+Example:
+        $ python -m benchmarks.bench_cluster --workers 1 2 4 8 --clients 1000
+"""
+
+import argparse
+import asyncio
+import collections
+import multiprocessing
+import os
+import subprocess
+import sys
+import time
+
+from benchmarks.bench_engine import BenchClient, wait_for_server
+from chat_client import ChatClient
+from chat_protocol import CHAT_CONVERSATION
+from chat_server import raise_open_files_limit
+
+SEQ_ROOM = "Private Room 1"
+
+
+def chat_seen(client):
+    """It returns the (seq, payload) of the chat messages the client has got so far"""
+    seen = []
+    while not client.frames.empty():
+        frame = client.frames.get_nowait()
+        if frame[0] == CHAT_CONVERSATION:
+            seen.append((frame.seq, frame[3]))
+    return seen
+
+
+async def check_seqs(host, port, args):
+    """It returns the failures of the seqs of a room, see the module's docstring"""
+    failures = []
+    clients = [
+        await ChatClient(f"s{idx}", host, port).connect()
+        for idx in range(args.seq_clients)
+    ]
+    try:
+        for client in clients:
+            await client.join_room(SEQ_ROOM)
+        await asyncio.sleep(0.5)  # the presence reaches every worker
+        for client in clients:
+            chat_seen(client)
+        for num in range(args.seq_messages):
+            for client in clients:
+                client.send(f"{client.nickname} {num}")
+        expected = args.seq_clients * args.seq_messages
+        seen = [[] for _ in clients]
+        deadline = time.monotonic() + args.timeout
+        while time.monotonic() < deadline:
+            for got, client in zip(seen, clients):
+                got += chat_seen(client)
+            if all(len(got) >= expected for got in seen):
+                break
+            await asyncio.sleep(0.05)
+        if any(got != seen[0] for got in seen) or len(seen[0]) != expected:
+            failures.append(
+                f"the clients of a room got {min(map(len, seen))}..{max(map(len, seen))} "
+                f"of {expected} messages, not in the same order with the same seqs"
+            )
+            return failures
+        for idx in range(args.seq_clients):
+            async with ChatClient(f"h{idx}", host, port) as late:
+                await late.join_room(SEQ_ROOM)
+                chat_seen(late)
+                late.history(after=seen[0][0][0] - 1)  # from the first one on
+                history = []
+                deadline = time.monotonic() + args.timeout
+                while len(history) < len(seen[0]) and time.monotonic() < deadline:
+                    history += chat_seen(late)
+                    await asyncio.sleep(0.05)
+                if history != seen[0]:
+                    failures.append(
+                        f"a late client got {len(history)} messages from the history, not "
+                        f"the ones of the room with the same seqs"
+                    )
+                    break
+    finally:
+        for client in clients:
+            client.close()
+    return failures
+
+
+async def load(host, port, indexes, args, room_sizes, ready, go):
+    stats = {"latency": []}
+    clients = [BenchClient(idx, 1 + idx % args.rooms, stats) for idx in indexes]
+    for first in range(0, len(clients), 100):
+        await asyncio.gather(
+            *(c.join(host, port) for c in clients[first : first + 100])
+        )
+    listeners = [asyncio.create_task(c.listen()) for c in clients]
+    ready.put(len(clients))
+    await asyncio.get_running_loop().run_in_executor(None, go.wait)
+
+    await asyncio.gather(*(c.chat(args.messages, 0.0) for c in clients))
+    expected = sum(args.messages * room_sizes[c.room_id] for c in clients)
+    deadline = time.monotonic() + args.timeout
+    while len(stats["latency"]) < expected and time.monotonic() < deadline:
+        await asyncio.sleep(0.01)
+    done = time.monotonic()
+    for client in clients:
+        client.writer.close()
+    for task in listeners:
+        task.cancel()
+    return len(stats["latency"]), expected, done
+
+
+def generator(host, port, indexes, args, room_sizes, ready, go, results):
+    """A load generator process: it runs the clients of `indexes`"""
+    raise_open_files_limit()
+    results.put(asyncio.run(load(host, port, indexes, args, room_sizes, ready, go)))
+
+
+def run_cluster(workers, port, args):
+    host = "127.0.0.1"
+    server = subprocess.Popen(
+        [
+            sys.executable,
+            "-m",
+            "chat_cluster",
+            "--workers",
+            str(workers),
+            "--port",
+            str(port),
+            "--max-clients",
+            str(2 * args.clients + 10 * workers),
+            "--log-level",
+            "WARNING",
+        ]
+    )
+    try:
+        asyncio.run(wait_for_server(host, port))
+        room_sizes = collections.Counter(
+            1 + idx % args.rooms for idx in range(args.clients)
+        )
+        ready, go, results = (
+            multiprocessing.Queue(),
+            multiprocessing.Event(),
+            multiprocessing.Queue(),
+        )
+        generators = [
+            multiprocessing.Process(
+                target=generator,
+                args=(
+                    host,
+                    port,
+                    range(gen, args.clients, args.generators),
+                    args,
+                    room_sizes,
+                    ready,
+                    go,
+                    results,
+                ),
+            )
+            for gen in range(args.generators)
+        ]
+        for process in generators:
+            process.start()
+        for _ in generators:
+            ready.get(timeout=120)
+        time.sleep(0.5)  # the presence of the last clients reaches every worker
+        start = time.monotonic()
+        go.set()
+        outcome = [results.get(timeout=args.timeout + 120) for _ in generators]
+        for process in generators:
+            process.join()
+        failures = asyncio.run(check_seqs(host, port, args))
+    finally:
+        server.terminate()
+        server.wait()
+    delivered = sum(result[0] for result in outcome)
+    expected = sum(result[1] for result in outcome)
+    elapsed = max(result[2] for result in outcome) - start
+    return delivered, expected, elapsed, failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--port", type=int, default=9791)
+    parser.add_argument(
+        "--workers",
+        type=int,
+        nargs="+",
+        default=list(range(1, (os.cpu_count() or 1) + 1)),
+        help="default: 1 .. the number of CPUs",
+    )
+    parser.add_argument("--clients", type=int, default=500)
+    parser.add_argument("--rooms", type=int, default=9)
+    parser.add_argument("--messages", type=int, default=20, help="per client")
+    parser.add_argument("--generators", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--seq-clients", type=int, default=6)
+    parser.add_argument("--seq-messages", type=int, default=10, help="per client")
+    parser.add_argument("--timeout", type=float, default=60.0)
+    args = parser.parse_args()
+    raise_open_files_limit()
+
+    print(
+        f"{'workers':>7} {'delivered':>17} {'seconds':>8} {'msgs/s':>9} {'speedup':>8}"
+    )
+    base = None
+    failures = []
+    for idx, workers in enumerate(args.workers):
+        delivered, expected, elapsed, seqs = run_cluster(workers, args.port + idx, args)
+        rate = delivered / elapsed
+        base = base or rate
+        print(
+            f"{workers:>7} {f'{delivered}/{expected}':>17} {elapsed:>8.2f} {rate:>9.0f} "
+            f"{rate / base:>7.2f}x"
+        )
+        if delivered < expected:
+            failures.append(f"{workers} workers: {expected - delivered} not delivered")
+        failures += [f"{workers} workers: {failure}" for failure in seqs]
+    for failure in failures:
+        print(f"FAILED: {failure}")
+    if failures:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
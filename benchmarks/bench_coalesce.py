@@ -0,0 +1,132 @@
+# -*- coding: utf-8 -*-
+"""
+Write coalescing: send calls per delivered message and latency, at several message rates.
+
+For every coalescing setting (`--ticks`: 'off' writes every message at once, 0 collects the
+messages of one event loop iteration, a number of seconds collects them for that long) and every
+message rate (`--rates`, messages/s sent to the room), it starts the headless server, joins
+`--members` clients into one room and lets them send the messages for `--duration` seconds. Every
+message is delivered to every member. It reports the server's write calls per frame sent (the
+server counts them and logs them when it stops; a write is one send syscall, or none when the
+transport already buffers) and the delivery latency. It checks that every message was delivered.
+
+Example:
+        $ python -m benchmarks.bench_coalesce --rates 200 1000 4000 --ticks off 0 0.002
+"""
+
+import argparse
+import asyncio
+import subprocess
+import sys
+import time
+
+from benchmarks.bench_engine import BenchClient, wait_for_server
+from chat_protocol import *
+from chat_server import raise_open_files_limit
+
+
+def start_headless(port, tick):
+    """It starts `python -m chat_server --headless` with the coalescing setting"""
+    command = [sys.executable, "-m", "chat_server", "--headless", "--port", str(port)]
+    command += ["--no-coalesce"] if tick == "off" else ["--coalesce-tick", tick]
+    return subprocess.Popen(command, stdout=subprocess.PIPE, text=True)
+
+
+def server_totals(output):
+    """It returns (frames_sent, writes) of the server's 'event=stopped' log line"""
+    line = next(line for line in output.splitlines() if "event=stopped" in line)
+    fields = dict(item.split("=", 1) for item in line.split() if "=" in item)
+    return int(fields["frames_sent"]), int(fields["writes"])
+
+
+async def sender(client, interval, until):
+    """It sends a message every `interval` s until `until` and returns the number sent"""
+    sent = 0
+    while time.monotonic() < until:
+        client.send(CHAT_CONVERSATION, client.room_id, str(time.perf_counter_ns()))
+        sent += 1
+        await asyncio.sleep(interval)
+    return sent
+
+
+async def load(port, rate, args):
+    host = "127.0.0.1"
+    await wait_for_server(host, port)
+    stats = {"latency": []}
+    clients = [BenchClient(idx, 1, stats) for idx in range(args.members)]
+    for client in clients:
+        await client.join(host, port)
+    listeners = [asyncio.create_task(c.listen()) for c in clients]
+    until = time.monotonic() + args.duration
+    interval = args.members / rate
+    # the members start one after the other over the interval: a steady rate
+    senders = []
+    for client in clients:
+        senders.append(asyncio.create_task(sender(client, interval, until)))
+        await asyncio.sleep(interval / args.members)
+    sent = sum(await asyncio.gather(*senders))
+    deadline = time.monotonic() + 10
+    while len(stats["latency"]) < sent * args.members and time.monotonic() < deadline:
+        await asyncio.sleep(0.05)
+    for client in clients:
+        client.writer.close()
+    for task in listeners:
+        task.cancel()
+    return sorted(stats["latency"]) or [0], sent * args.members
+
+
+def run(port, tick, rate, args):
+    server = start_headless(port, tick)
+    try:
+        latency, expected = asyncio.run(load(port, rate, args))
+    finally:
+        server.terminate()
+        output, _ = server.communicate(timeout=30)
+    return latency, expected, server_totals(output)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--port", type=int, default=9991)
+    parser.add_argument("--members", type=int, default=20)
+    parser.add_argument(
+        "--rates", type=float, nargs="+", default=[200, 1000, 3000], help="msgs/s"
+    )
+    parser.add_argument(
+        "--ticks",
+        nargs="+",
+        default=["off", "0", "0.002", "0.01"],
+        help="'off', or seconds",
+    )
+    parser.add_argument("--duration", type=float, default=3.0, help="seconds per run")
+    args = parser.parse_args()
+    raise_open_files_limit()
+
+    pct = lambda values, p: values[min(len(values) - 1, int(len(values) * p))] / 1e6
+    print(
+        f"{'tick':>6} {'msgs/s':>7} {'delivered':>10} {'writes':>8} {'writes/frame':>12} "
+        f"{'p50 ms':>7} {'p99 ms':>7}"
+    )
+    failed = False
+    runs = 0
+    for tick in args.ticks:
+        for rate in args.rates:
+            latency, expected, (frames_sent, writes) = run(
+                args.port + runs, tick, rate, args
+            )
+            runs += 1
+            delivered = len(latency)
+            print(
+                f"{tick:>6} {rate:>7.0f} {delivered:>10} {writes:>8} "
+                f"{writes / max(frames_sent, 1):>12.3f} "
+                f"{pct(latency, 0.5):>7.2f} {pct(latency, 0.99):>7.2f}"
+            )
+            if delivered != expected:
+                print(f"FAILED: {delivered}/{expected} messages delivered")
+                failed = True
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
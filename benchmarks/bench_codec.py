@@ -0,0 +1,292 @@
+# -*- coding: utf-8 -*-
+"""
+Protocol codecs: ns/frame of the v1 functions vs. the struct-based v2 and v3 codecs, and interop
+checks.
+
+It times every encoder and decoder on the same chat messages (the best of `--repeat` runs of
+`--number` frames), checks that random frames survive v1 -> v2 -> v1 and v1 -> v3 -> v1
+unchanged, and starts a server to check that a v1 client and a v2 client chat in the same room:
+every client gets the other's messages in its own protocol, and the v2 client gets the HISTORY
+answer in v2. A v3 ChatClient in the room checks the seqs: 1, 2, 3... in the order relayed, the
+same seqs in a HISTORY answer, and a 'seq:N' request answered with the messages after N only.
+
+Example:
+        $ python -m benchmarks.bench_codec --number 100000
+"""
+
+import argparse
+import asyncio
+import random
+import sys
+import time
+
+from benchmarks.bench_engine import (
+    BenchClient,
+    read_frame,
+    start_server,
+    wait_for_server,
+)
+from chat_client import ChatClient
+from chat_protocol import *
+
+NICKNAME = "Nickname"
+ROOM_ID = 3
+PAYLOAD = "Hello everybody in this room, how are you today?"
+
+
+def best_ns(function, number, repeat):
+    """It returns the best time of `number` calls of function(), in ns per call"""
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter_ns()
+        for _ in range(number):
+            function()
+        best = min(best, (time.perf_counter_ns() - start) / number)
+    return best
+
+
+def decode_stream(decoder, stream):
+    """It returns a function that feeds the stream to the decoder in 4 KB reads, and decodes
+    every frame"""
+
+    def run():
+        for offset in range(0, len(stream), 4096):
+            decoder.feed(stream[offset : offset + 4096])
+
+    return run
+
+
+def timings(number, repeat):
+    """It returns [(name, ns per frame), ...]"""
+    v1_str = msg_composer(CHAT_CONVERSATION, NICKNAME, ROOM_ID, PAYLOAD)
+    v1 = v1_str.encode("utf-8")
+    v2 = msg_composer_v2(CHAT_CONVERSATION, NICKNAME, ROOM_ID, PAYLOAD)
+    v3 = v1_to_v3(v1, [(1, time.time())])
+    v1_view, v2_view, v3_view = memoryview(v1), memoryview(v2), memoryview(v3)
+    nickname, payload = NICKNAME.encode("utf-8"), PAYLOAD.encode("utf-8")
+    buf = bytearray(RECV_BUFSIZE)
+    frames = 1000  # per stream
+    v1_stream, v2_stream, v3_stream = v1 * frames, v2 * frames, v3 * frames
+
+    def encode_into():
+        encode_v2_into(buf, 0, CHAT_CONVERSATION, nickname, ROOM_ID, payload)
+
+    cases = [
+        (
+            "encode v1 msg_composer().encode()",
+            lambda: msg_composer(CHAT_CONVERSATION, NICKNAME, ROOM_ID, PAYLOAD).encode(
+                "utf-8"
+            ),
+        ),
+        (
+            "encode v2 msg_composer_v2()",
+            lambda: msg_composer_v2(CHAT_CONVERSATION, NICKNAME, ROOM_ID, PAYLOAD),
+        ),
+        ("encode v2 encode_v2_into()", encode_into),
+        (
+            "encode v3 msg_composer_v3()",
+            lambda: msg_composer_v3(CHAT_CONVERSATION, NICKNAME, ROOM_ID, PAYLOAD),
+        ),
+        ("decode v1 msg_parser(str)", lambda: msg_parser(v1_str)),
+        ("decode v1 frame_parser()", lambda: frame_parser(v1_view)),
+        ("decode v2 frame_parser_v2()", lambda: frame_parser_v2(v2_view)),
+        ("decode v3 frame_parser_v3()", lambda: frame_parser_v3(v3_view)),
+        ("header v1 header_parser()", lambda: header_parser(v1_view)),
+        ("header v2 header_parser_v2()", lambda: header_parser_v2(v2_view)),
+        ("transcode v1_to_v2()", lambda: v1_to_v2(v1)),
+        ("transcode v2_to_v1()", lambda: v2_to_v1(v2)),
+        ("transcode v1_to_v3()", lambda: v1_to_v3(v1, [(1, 0.0)])),
+        ("transcode v3_to_v1()", lambda: v3_to_v1(v3)),
+        ("transcode v3 to v2", lambda: transcode(v3, PROTOCOL_V3, PROTOCOL_V2)),
+        ("restamp v3 restamp_v3()", lambda: restamp_v3(v3, [(2, 0.0)])),
+    ]
+    results = [(name, best_ns(case, number, repeat)) for name, case in cases]
+    for name, decoder, stream in (
+        ("stream v1 FrameDecoder", FrameDecoder(), v1_stream),
+        ("stream v2 FrameDecoder", FrameDecoder(version=PROTOCOL_V2), v2_stream),
+        ("stream v3 FrameDecoder", FrameDecoder(version=PROTOCOL_V3), v3_stream),
+    ):
+        run = decode_stream(decoder, stream)
+        results.append((name, best_ns(run, max(1, number // frames), repeat) / frames))
+    return results
+
+
+def fuzz(count):
+    """It returns the number of random frames that don't survive v1 -> v2 (v3) -> v1"""
+    alphabet = "abcXYZ 019éש😀"
+    failures = 0
+    for _ in range(count):
+        nickname = "".join(random.choices(alphabet[:6], k=random.randint(0, 10)))
+        payload = "".join(random.choices(alphabet, k=random.randint(0, 20)))
+        # the CHUNK frames are v3 only, the room ids up to MAX_ROOM_ID (a created room)
+        msg_type = random.choice([t for t in range(1, MAX_MSG_TYPE + 1) if t != CHUNK])
+        room_id = random.choice(
+            [*rooms_name, random.randint(BUILTIN_ROOMS, MAX_ROOM_ID)]
+        )
+        v1 = msg_composer(msg_type, nickname, room_id, payload).encode("utf-8")
+        v2 = msg_composer_v2(msg_type, nickname, room_id, payload)
+        seq, stamp = random.randint(0, 2**32 - 1), random.random() * 2e9
+        v3 = msg_composer_v3(msg_type, nickname, room_id, payload, seq, stamp)
+        frame = frame_parser_v3(memoryview(v3))
+        if (
+            v1_to_v2(v1) != v2
+            or v2_to_v1(v2) != v1
+            or frame_parser_v2(memoryview(v2)) != (msg_type, nickname, room_id, payload)
+            or v1_to_v3(v1, [(seq, stamp)]) != v3
+            or v3_to_v1(v3) != v1
+            or transcode(v3, PROTOCOL_V3, PROTOCOL_V2) != v2
+            or transcode(v2, PROTOCOL_V2, PROTOCOL_V3, [(seq, stamp)]) != v3
+            or restamp_v3(v3 + v3, [(seq, stamp)] * 2) != v3 + v3
+            or compose_frames(PROTOCOL_V2, [(msg_type, nickname, room_id, payload)])
+            != v2
+            or frame != (msg_type, nickname, room_name(room_id), payload)
+            or (frame.seq, frame.time) != (seq, stamp)
+        ):
+            failures += 1
+    return failures
+
+
+class V2Client(BenchClient):
+    """A client that negotiates protocol v2 in the handshake"""
+
+    async def join(self, host, port):
+        await self.connect(host, port)
+        offer = (await read_frame(self.reader))[3]  # the GET_NICKNAME request
+        if PROTOCOL_V2 not in parse_protocol_payload(offer):
+            raise RuntimeError(f"the server doesn't offer protocol v2: {offer!r}")
+        self.writer.write(
+            msg_composer(
+                GET_NICKNAME, self.nickname, 0, protocol_payload([PROTOCOL_V2])
+            ).encode("utf-8")
+        )
+        self.send(EXIT_ROOM, rooms_id["Lobby"], "left 'Lobby'")
+        self.send(ENTER_ROOM, self.room_id, "joined")
+        await self.read_until(ENTER_ROOM, self.nickname, self.room_id)
+
+    def send(self, msg_type, room_id, payload):
+        self.writer.write(msg_composer_v2(msg_type, self.nickname, room_id, payload))
+
+    async def read_frame(self):
+        head = await self.reader.readexactly(V2_HEADER_LEN)
+        header = header_parser_v2(head)
+        body = await self.reader.readexactly(header[1] + header[3])
+        return frame_parser_v2(memoryview(head + body), 0, header)
+
+    async def read_until(self, msg_type, nickname, room_id=None):
+        while True:
+            frame = await self.read_frame()
+            if frame[:2] == (msg_type, nickname) and room_id in (None, frame[2]):
+                return frame
+
+
+async def history_answer(client, **request):
+    """It returns the HISTORY frame and the messages of the answer to the request"""
+    client.history(**request)
+    async for frame in client:
+        if frame[0] == HISTORY:
+            return frame, [await client.__anext__() for _ in range(int(frame[3]))]
+    raise ConnectionError("closed before the HISTORY answer")
+
+
+async def seqs(host, port, old):
+    """It returns the failed checks of the seqs seen by a v3 client, `old` is the v1 client"""
+    failed = []
+    client = await ChatClient("v3", host, port).connect()
+    await client.join_room(rooms_name[ROOM_ID])
+    first = client.seq  # the messages before it entered
+    for idx in range(10):
+        old.send(CHAT_CONVERSATION, ROOM_ID, f"seq {idx}")
+    live = []
+    async for frame in client:
+        if frame[0] == CHAT_CONVERSATION:
+            live.append(frame)
+            if len(live) == 10:
+                break
+    if client.version != PROTOCOL_V3:
+        failed.append(f"the ChatClient took v{client.version}")
+    got = [frame.seq for frame in live]
+    if got != list(range(got[0], got[0] + 10)) or got[0] <= first:
+        failed.append(f"the v3 client got the seqs {got}")
+    header, answer = await history_answer(client, last=10)
+    if [(f.seq, f[3]) for f in answer] != [(f.seq, f[3]) for f in live]:
+        failed.append("the HISTORY answer has other seqs than the relayed messages")
+    if header.seq != got[-1]:
+        failed.append(
+            f"the HISTORY frame has the newest seq {header.seq}, not {got[-1]}"
+        )
+    _, delta = await history_answer(client, after=got[6])
+    if [f.seq for f in delta] != got[7:]:
+        failed.append(f"'seq:{got[6]}' answered with {[f.seq for f in delta]}")
+    client.close()
+    await client.wait_closed()
+    return failed
+
+
+async def interop(port):
+    """It returns the list of the failed checks of a v1 and a v2 client in one room"""
+    host = "127.0.0.1"
+    server = start_server(host, port)
+    failed = []
+    try:
+        await wait_for_server(host, port)
+        old = BenchClient("v1", ROOM_ID, {})
+        await old.join(host, port)
+        new = V2Client("v2", ROOM_ID, {})
+        await new.join(host, port)
+
+        old.send(CHAT_CONVERSATION, ROOM_ID, "from v1 é")
+        frame = await new.read_until(CHAT_CONVERSATION, old.nickname)
+        if frame != (CHAT_CONVERSATION, old.nickname, ROOM_ID, "from v1 é"):
+            failed.append(f"the v2 client got {frame}")
+        new.send(CHAT_CONVERSATION, ROOM_ID, "from v2 ש")
+        while (frame := await read_frame(old.reader))[:2] != (
+            CHAT_CONVERSATION,
+            new.nickname,
+        ):
+            pass
+        if frame != (CHAT_CONVERSATION, new.nickname, ROOM_ID, "from v2 ש"):
+            failed.append(f"the v1 client got {frame}")
+
+        new.send(HISTORY, ROOM_ID, history_payload(last=10))
+        while (frame := await new.read_frame())[0] != HISTORY:
+            pass
+        answer = [await new.read_frame() for _ in range(int(frame[3]))]
+        if [payload for *_, payload in answer] != ["from v1 é", "from v2 ש"]:
+            failed.append(f"the v2 client got the history {answer}")
+        failed += await seqs(host, port, old)
+        for client in (old, new):
+            client.writer.close()
+    except (asyncio.IncompleteReadError, ConnectionError, RuntimeError) as error:
+        failed.append(f"interop: {error!r}")
+    finally:
+        server.terminate()
+        server.wait()
+    return failed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--port", type=int, default=10191)
+    parser.add_argument("--number", type=int, default=100_000, help="frames per run")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--fuzz", type=int, default=20_000, help="random frames")
+    args = parser.parse_args()
+
+    results = timings(args.number, args.repeat)
+    width = max(len(name) for name, _ in results)
+    for name, ns in results:
+        print(f"{name:<{width}} : {ns:8.0f} ns/frame")
+    failed = []
+    if failures := fuzz(args.fuzz):
+        failed.append(f"{failures}/{args.fuzz} random frames changed in a round trip")
+    failed += asyncio.run(interop(args.port))
+    print(f"v1 <-> v2, v3 round trip: {args.fuzz} random frames")
+    print("v1, v2 and v3 clients   : one room, chat, HISTORY and seq:N")
+    for failure in failed:
+        print(f"FAILED: {failure}")
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
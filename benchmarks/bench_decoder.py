@@ -0,0 +1,179 @@
+# -*- coding: utf-8 -*-
+"""
+Streaming FrameDecoder: fuzz check and throughput against msg_parser().
+
+The fuzz check encodes random frames (ASCII and non-ASCII text) into one stream, cuts it at
+random boundaries (1 byte up to several frames per read) and checks that the decoder returns
+exactly the frames that were sent, through feed() and through the get_buffer()/buffer_updated()
+receive path with the smallest buffer allowed. It exits with 1 if a frame is lost or corrupted:
+this script is the decoder's test. The same reads given to the receive path of the original
+server, one msg_parser() per recv(BUFSIZE), show the frames that path loses.
+
+The throughput part decodes a large multi-frame buffer with the decoder, and with msg_parser()
+called on every frame. msg_parser() can't find the frame boundaries by itself, so it gets the
+frames already split: its numbers are the best case of the one-frame-per-recv path, which the
+socket doesn't give. The frames/s are on par: the decoder is worth it for the frames it doesn't
+lose, and for the reads, many frames per recv_into() into one reused buffer instead of a recv()
+and a new bytes object per frame.
+
+Example:
+        $ python -m benchmarks.bench_decoder --frames 200000
+"""
+
+import argparse
+import collections
+import random
+import sys
+import time
+
+from chat_protocol import *
+
+LETTERS = "abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZאבגדהוזחטйцукенгшщзéüöñ"
+
+
+def random_text(rnd, max_bytes, min_chars=0):
+    text = ""
+    while len(text) < min_chars or rnd.random() < 0.95:
+        char = rnd.choice(LETTERS + " .,!?0123456789")
+        if len((text + char).encode("utf-8")) > max_bytes:
+            break
+        text += char
+    return text
+
+
+def random_frame(rnd):
+    msg_type = rnd.choice((GET_NICKNAME, EXIT_ROOM, ENTER_ROOM, CHAT_CONVERSATION))
+    nickname = random_text(rnd, 10, min_chars=1)
+    room_id = rnd.choice(list(rooms_name))
+    payload = random_text(rnd, MAX_PAYLOAD)
+    return msg_type, nickname, rooms_name[room_id], payload, room_id
+
+
+def cut(rnd, stream):
+    """It yields the stream in randomly cut reads, 1 byte up to several frames each"""
+    pos = 0
+    while pos < len(stream):
+        size = rnd.choice((1, 2, 7, rnd.randint(1, 3 * MAX_FRAME_LEN)))
+        yield stream[pos : pos + size]
+        pos += size
+
+
+def one_frame_per_read(reads):
+    """The receive path of the original server: every read parsed as one frame"""
+    frames = []
+    for data in reads:
+        try:
+            frames.append(msg_parser(data.decode("utf-8")))
+        except (ValueError, IndexError):  # UnicodeDecodeError too
+            pass
+    return frames
+
+
+def fuzz(rounds, seed):
+    """
+    It checks the decoder on `rounds` randomly cut streams, and returns the failures and the
+    (frames sent, frames the one-frame-per-read path got right)
+    """
+    rnd = random.Random(seed)
+    failures, sent, kept = [], 0, 0
+    for _ in range(rounds):
+        frames = [random_frame(rnd) for _ in range(rnd.randint(1, 200))]
+        stream = b"".join(
+            msg_composer(msg_type, nick, room_id, payload).encode("utf-8")
+            for msg_type, nick, _, payload, room_id in frames
+        )
+        expected = [frame[:4] for frame in frames]
+
+        # feed(): arbitrary chunks
+        decoder = FrameDecoder()
+        reads = list(cut(rnd, stream))
+        decoded = [frame for data in reads for frame in decoder.feed(data)]
+        if decoded != expected:
+            failures.append("feed() lost or corrupted frames")
+        sent += len(expected)
+        got = collections.Counter(one_frame_per_read(reads))
+        kept += sum((got & collections.Counter(expected)).values())
+
+        # recv_into() path with the smallest buffer: the pending bytes are moved a lot
+        decoder = FrameDecoder(bufsize=MAX_FRAME_LEN)
+        decoded, pos = [], 0
+        while pos < len(stream):
+            buf = decoder.get_buffer()
+            size = min(len(buf), rnd.randint(1, len(buf)), len(stream) - pos)
+            buf[:size] = stream[pos : pos + size]
+            decoder.buffer_updated(size)
+            decoded.extend(decoder)
+            pos += size
+        if decoded != expected:
+            failures.append("get_buffer() lost or corrupted frames")
+    return failures, sent, kept
+
+
+def throughput(num_frames, seed):
+    rnd = random.Random(seed)
+    frames = [
+        msg_composer(msg_type, nick, room_id, payload).encode("utf-8")
+        for msg_type, nick, _, payload, room_id in (
+            random_frame(rnd) for _ in range(num_frames)
+        )
+    ]
+    stream = b"".join(frames)
+    mb = len(stream) / 2**20
+
+    start = time.perf_counter()
+    for frame in frames:
+        msg_parser(frame.decode("utf-8"))
+    old = time.perf_counter() - start
+    print(
+        f"msg_parser per frame     : {num_frames / old:>10.0f} frames/s {mb / old:>7.1f} MB/s"
+    )
+
+    for read_size in (BUFSIZE, RECV_BUFSIZE, 64 * BUFSIZE):
+        decoder = FrameDecoder(bufsize=max(read_size, RECV_BUFSIZE))
+        view = memoryview(stream)
+        count, pos, reads = 0, 0, 0
+        start = time.perf_counter()
+        while pos < len(stream):
+            reads += 1
+            buf = decoder.get_buffer()
+            size = min(len(buf), read_size, len(stream) - pos)
+            buf[:size] = view[pos : pos + size]  # what recv_into() does
+            decoder.buffer_updated(size)
+            pos += size
+            for _ in decoder:
+                count += 1
+        new = time.perf_counter() - start
+        print(
+            f"FrameDecoder {read_size:>6}B reads: {num_frames / new:>10.0f} frames/s "
+            f"{mb / new:>7.1f} MB/s {count / reads:>6.1f} frames/read"
+        )
+        if count != num_frames:
+            return [f"{count}/{num_frames} frames decoded from {read_size} B reads"]
+    return []
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--frames", type=int, default=200_000)
+    parser.add_argument("--fuzz", type=int, default=500, help="random streams to check")
+    parser.add_argument("--seed", type=int, default=2022)
+    args = parser.parse_args()
+
+    failures, sent, kept = fuzz(args.fuzz, args.seed)
+    print(
+        f"fuzz                     : {args.fuzz} randomly cut streams, "
+        f"{len(failures)} decoded wrong"
+    )
+    print(
+        f"one msg_parser() per read: {kept}/{sent} frames ({kept / sent:.1%}) of the same "
+        f"reads, the rest lost"
+    )
+    failures += throughput(args.frames, args.seed)
+    for failure in failures:
+        print(f"FAILED: {failure}")
+    if failures:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,218 @@
+# -*- coding: utf-8 -*-
+"""
+Concurrent connections benchmark of the chat server engine.
+
+It starts the asyncio server ('chat_server.py') in a separate process, connects `--clients`
+protocol clients (GET_NICKNAME handshake, EXIT_ROOM 'Lobby' / ENTER_ROOM into one of `--rooms`
+rooms), lets every client send `--messages` CHAT_CONVERSATION messages and reports the
+handshake rate, the relay throughput and latency, and the server's CPU time and memory.
+
+To measure the threaded server of an older release, start it yourself and point the benchmark
+at it with `--server HOST:PORT --pid PID`.
+
+Example:
+        $ python -m benchmarks.bench_engine --clients 2000 --rooms 10 --messages 5
+"""
+
+import argparse
+import asyncio
+import collections
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+from chat_protocol import *
+from chat_server import raise_open_files_limit
+
+HEADER_LEN = 7
+
+
+async def read_frame(reader):
+    """It reads one frame from the stream and returns (msg_type, nickname, room_id, payload)"""
+    header = (await reader.readexactly(HEADER_LEN)).decode("utf-8")
+    nick_len, room_len, payload_len = (
+        int(header[1:3]),
+        int(header[3:5]),
+        int(header[5:7]),
+    )
+    body = (await reader.readexactly(nick_len + room_len + payload_len)).decode("utf-8")
+    nickname = body[:nick_len]
+    room_id = int(body[nick_len : nick_len + room_len])
+    return int(header[0]), nickname, room_id, body[nick_len + room_len :]
+
+
+async def read_until(reader, msg_type, nickname):
+    """It reads frames until the frame of msg_type sent by nickname arrives"""
+    while True:
+        frame = await read_frame(reader)
+        if frame[0] == msg_type and frame[1] == nickname:
+            return
+
+
+class BenchClient:
+    """One simulated chat client"""
+
+    def __init__(self, idx, room_id, stats):
+        self.nickname = f"u{idx}"
+        self.room_id = room_id
+        self.stats = stats
+        self.reader = self.writer = None
+
+    async def connect(self, host, port):
+        self.reader, self.writer = await asyncio.open_connection(host, port)
+
+    async def join(self, host, port):
+        await self.connect(host, port)
+        await read_frame(self.reader)  # GET_NICKNAME request
+        self.send(GET_NICKNAME, rooms_id["Lobby"], "#Empty")
+        await read_until(self.reader, ENTER_ROOM, self.nickname)
+        # one frame at a time: wait for the echo before sending the next one
+        self.send(EXIT_ROOM, rooms_id["Lobby"], "left 'Lobby'")
+        await read_until(self.reader, EXIT_ROOM, self.nickname)
+        self.send(ENTER_ROOM, self.room_id, "joined")
+        await read_until(self.reader, ENTER_ROOM, self.nickname)
+
+    def send(self, msg_type, room_id, payload):
+        self.writer.write(
+            msg_composer(msg_type, self.nickname, room_id, payload).encode("utf-8")
+        )
+
+    async def listen(self):
+        try:
+            while True:
+                msg_type, _, _, payload = await read_frame(self.reader)
+                if msg_type == CHAT_CONVERSATION:
+                    self.stats["latency"].append(time.perf_counter_ns() - int(payload))
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+
+    async def chat(self, messages, interval):
+        for _ in range(messages):
+            self.send(CHAT_CONVERSATION, self.room_id, str(time.perf_counter_ns()))
+            await self.writer.drain()
+            await asyncio.sleep(interval)
+
+
+def proc_usage(pid):
+    """It returns (cpu seconds, rss MB) of the process, read from /proc (Linux only)"""
+    try:
+        with open(f"/proc/{pid}/stat") as f:
+            fields = f.read().rsplit(")", 1)[1].split()
+        cpu = (int(fields[11]) + int(fields[12])) / os.sysconf("SC_CLK_TCK")
+        with open(f"/proc/{pid}/status") as f:
+            rss = next(int(line.split()[1]) for line in f if line.startswith("VmRSS"))
+        return cpu, rss / 1024
+    except (OSError, StopIteration):
+        return float("nan"), float("nan")
+
+
+def start_server(host, port, **options):
+    """It starts ChatServer(host, port, **options) in a new process and returns the Popen"""
+    kwargs = "".join(f", {key}={value!r}" for key, value in options.items())
+    return subprocess.Popen(
+        [
+            sys.executable,
+            "-c",
+            f"from chat_server import ChatServer; ChatServer({host!r}, {port}{kwargs}).run()",
+        ],
+        stdout=subprocess.DEVNULL,
+    )
+
+
+async def wait_for_server(host, port, timeout=10.0):
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            _, writer = await asyncio.open_connection(host, port)
+            writer.close()
+            return
+        except OSError:
+            if time.monotonic() > deadline:
+                raise
+            await asyncio.sleep(0.1)
+
+
+async def run(args):
+    host, port = args.server.split(":")
+    port = int(port)
+    server_proc = None
+    pid = args.pid
+    if pid is None:
+        server_proc = start_server(host, port, max_clients=args.clients + 1)
+        pid = server_proc.pid
+    try:
+        await wait_for_server(host, port)
+        cpu0, rss0 = proc_usage(pid)
+
+        stats = {"latency": []}
+        clients = [
+            BenchClient(idx, 1 + idx % args.rooms, stats) for idx in range(args.clients)
+        ]
+        start = time.perf_counter()
+        for idx in range(0, len(clients), args.batch):
+            await asyncio.gather(
+                *(c.join(host, port) for c in clients[idx : idx + args.batch])
+            )
+        join_time = time.perf_counter() - start
+        cpu1, rss1 = proc_usage(pid)
+
+        listeners = [asyncio.create_task(c.listen()) for c in clients]
+        interval = 1.0 / args.rate
+        start = time.perf_counter()
+        await asyncio.gather(*(c.chat(args.messages, interval) for c in clients))
+        room_sizes = collections.Counter(c.room_id for c in clients)
+        expected = args.messages * sum(size * size for size in room_sizes.values())
+        deadline = time.monotonic() + 30
+        while len(stats["latency"]) < expected and time.monotonic() < deadline:
+            await asyncio.sleep(0.05)
+        relay_time = time.perf_counter() - start
+        cpu2, rss2 = proc_usage(pid)
+
+        for c in clients:
+            c.writer.close()
+        for task in listeners:
+            task.cancel()
+    finally:
+        if server_proc is not None:
+            server_proc.terminate()
+            server_proc.wait()
+
+    latency = sorted(stats["latency"]) or [0]
+    pct = lambda p: latency[min(len(latency) - 1, int(len(latency) * p))] / 1e6
+    print(f"clients                : {args.clients} in {args.rooms} rooms")
+    print(
+        f"join (handshake+rooms) : {join_time:.2f} s, {args.clients / join_time:.0f} clients/s"
+    )
+    print(
+        f"server memory          : {rss1:.1f} MB ({(rss1 - rss0) * 1024 / args.clients:.1f} KB/client)"
+    )
+    print(f"server cpu join        : {cpu1 - cpu0:.2f} s")
+    print(f"delivered              : {len(stats['latency'])}/{expected} chat frames")
+    print(f"relay throughput       : {len(stats['latency']) / relay_time:.0f} frames/s")
+    print(f"server cpu relay       : {cpu2 - cpu1:.2f} s")
+    print(
+        f"latency ms             : p50 {pct(0.50):.2f}  p95 {pct(0.95):.2f}  "
+        f"p99 {pct(0.99):.2f}  mean {statistics.fmean(latency) / 1e6:.2f}"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--server", default="127.0.0.1:9191", help="HOST:PORT")
+    parser.add_argument("--pid", type=int, help="pid of an already running server")
+    parser.add_argument("--clients", type=int, default=1000)
+    parser.add_argument("--rooms", type=int, default=MAX_PRIVATE_ROOMS)
+    parser.add_argument("--messages", type=int, default=5, help="per client")
+    parser.add_argument(
+        "--rate", type=float, default=10.0, help="messages/s per client"
+    )
+    parser.add_argument("--batch", type=int, default=100, help="concurrent connects")
+    args = parser.parse_args()
+    raise_open_files_limit()
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,82 @@
+# -*- coding: utf-8 -*-
+"""
+Sends per relayed CHAT_CONVERSATION message: broadcast to every client vs. room-scoped fan-out.
+
+The clients are spread evenly over the first `num_rooms` rooms, every client writes one message
+to its room, and the send() calls are counted on in-memory sockets.
+
+Example:
+        $ python -m benchmarks.bench_fanout --clients 100
+"""
+
+import argparse
+
+from chat_protocol import *
+from chat_registry import SessionRegistry
+from chat_server import broadcast, route
+
+
+class CountingSocket:
+    """A socket stand-in that only counts the send() calls and the bytes sent"""
+
+    sends = 0
+    bytes_sent = 0
+
+    def send(self, data, stamps=None, version=PROTOCOL_V1):
+        CountingSocket.sends += 1
+        CountingSocket.bytes_sent += len(data)
+        return len(data)
+
+
+def run(num_clients, num_rooms):
+    """
+    It joins `num_clients` clients to `num_rooms` rooms, relays one chat message per client and
+    returns the (sends, bytes) per message for the old broadcast and the room-scoped fan-out.
+    """
+    sessions = SessionRegistry()
+    messages = []
+    for idx in range(num_clients):
+        room_id = idx % num_rooms
+        session = sessions.add(CountingSocket(), idx, ("127.0.0.1", idx), f"u{idx}")
+        enter = msg_composer(ENTER_ROOM, f"u{idx}", room_id, "joined").encode("utf-8")
+        route(enter, session, sessions)
+        chat = msg_composer(CHAT_CONVERSATION, f"u{idx}", room_id, "x" * 40).encode(
+            "utf-8"
+        )
+        messages.append((session, chat))
+    clients = sessions.connections()
+
+    results = []
+    for scoped in (False, True):
+        CountingSocket.sends = CountingSocket.bytes_sent = 0
+        for session, message in messages:
+            targets = route(message, session, sessions) if scoped else clients
+            broadcast(message, targets)
+        results.append(
+            (
+                CountingSocket.sends / len(messages),
+                CountingSocket.bytes_sent / len(messages),
+            )
+        )
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--clients", type=int, default=MAX_CLIENTS)
+    args = parser.parse_args()
+
+    print(
+        f"{'rooms':>5} {'sends/msg (all)':>16} {'sends/msg (room)':>17} "
+        f"{'bytes/msg (all)':>16} {'bytes/msg (room)':>17} {'reduction':>10}"
+    )
+    for num_rooms in range(1, len(rooms_name) + 1):
+        (all_sends, all_bytes), (room_sends, room_bytes) = run(args.clients, num_rooms)
+        print(
+            f"{num_rooms:>5} {all_sends:>16.1f} {room_sends:>17.1f} "
+            f"{all_bytes:>16.0f} {room_bytes:>17.0f} {all_sends / room_sends:>9.1f}x"
+        )
+
+
+if __name__ == "__main__":
+    main()
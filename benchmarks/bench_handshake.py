@@ -0,0 +1,110 @@
+# -*- coding: utf-8 -*-
+"""
+Silent connections check: clients that never answer GET_NICKNAME must not delay the other clients.
+
+It opens `--silent` connections that never send anything, then joins `--clients` real clients
+(handshake, EXIT_ROOM 'Lobby', ENTER_ROOM) one by one and checks that every join takes less than
+`--max-join-ms`. At last it checks that the server disconnects the silent connections once their
+handshake deadline (`--handshake-timeout`) is over. This script is the test of the handshake
+deadline: it exits with 1 if a join is too slow or a silent connection is left open.
+
+Example:
+        $ python -m benchmarks.bench_handshake --silent 500 --clients 20
+"""
+
+import argparse
+import asyncio
+import statistics
+import sys
+import time
+
+from benchmarks.bench_engine import BenchClient, start_server, wait_for_server
+from chat_server import raise_open_files_limit
+
+
+async def join_times(host, port, count, first_idx):
+    """It joins `count` clients one by one and returns their join times in ms"""
+    times, clients = [], []
+    for idx in range(first_idx, first_idx + count):
+        client = BenchClient(idx, 1, {"latency": []})
+        start = time.perf_counter()
+        await client.join(host, port)
+        times.append((time.perf_counter() - start) * 1e3)
+        clients.append(client)
+    for client in clients:
+        client.writer.close()
+    return times
+
+
+async def run(args):
+    host = "127.0.0.1"
+    server = start_server(
+        host,
+        args.port,
+        max_clients=args.silent + args.clients + 10,
+        handshake_timeout=args.handshake_timeout,
+    )
+    failed = []
+    try:
+        await wait_for_server(host, args.port)
+        base = await join_times(host, args.port, args.clients, 0)
+
+        silent = [
+            await asyncio.open_connection(host, args.port) for _ in range(args.silent)
+        ]
+        opened = time.monotonic()
+        await asyncio.sleep(0.2)  # the server has accepted them all
+        loaded = await join_times(host, args.port, args.clients, args.clients)
+        if max(loaded) > args.max_join_ms:
+            failed.append(f"a join took {max(loaded):.1f} ms with silent connections")
+
+        # the server must close the silent connections after their deadline
+        await asyncio.sleep(
+            max(0.0, opened + args.handshake_timeout + 1.0 - time.monotonic())
+        )
+        alive = 0
+        for reader, writer in silent:
+            try:
+                while await asyncio.wait_for(reader.read(4096), 0.01):
+                    pass  # the GET_NICKNAME request, then EOF
+            except asyncio.TimeoutError:
+                alive += 1  # still open
+            except ConnectionError:
+                pass
+            writer.close()
+        if alive:
+            failed.append(
+                f"{alive}/{args.silent} silent connections not closed by the deadline"
+            )
+    finally:
+        server.terminate()
+        server.wait()
+
+    for label, times in (
+        ("no silent connections", base),
+        (f"{args.silent} silent connections", loaded),
+    ):
+        print(
+            f"join ms, {label:<24}: p50 {statistics.median(times):6.2f}  max {max(times):6.2f}"
+        )
+    print(f"{'silent connections closed':<33}: {args.silent - alive}/{args.silent}")
+    for failure in failed:
+        print(f"FAILED: {failure}")
+    return not failed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--port", type=int, default=9491)
+    parser.add_argument("--silent", type=int, default=500)
+    parser.add_argument("--clients", type=int, default=20)
+    parser.add_argument("--max-join-ms", type=float, default=50.0)
+    parser.add_argument("--handshake-timeout", type=float, default=2.0)
+    args = parser.parse_args()
+    raise_open_files_limit()
+    if not asyncio.run(run(args)):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
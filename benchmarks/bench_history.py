@@ -0,0 +1,176 @@
+# -*- coding: utf-8 -*-
+"""
+Room history: HISTORY requests answered from the ring and the mmap segment files, and their
+effect on the live relay of the room.
+
+The server keeps `--history-size` messages per room in memory and the older ones in segment
+files. The room is filled with `--fill` messages, then `--members` clients of the room get live
+messages at `--rate` per second for `--duration` seconds: once alone, and once while
+`--requesters` clients ask for the last 1000 messages of the room every `--interval` seconds. It
+checks that every answer holds the messages as they were sent, and reports the live latency of
+both runs.
+
+Example:
+        $ python -m benchmarks.bench_history --fill 20000 --requesters 4
+"""
+
+import argparse
+import asyncio
+import statistics
+import sys
+import tempfile
+import time
+
+from benchmarks.bench_engine import (
+    BenchClient,
+    read_frame,
+    read_until,
+    start_server,
+    wait_for_server,
+)
+from chat_history import HISTORY_MAX_REPLY
+from chat_protocol import *
+from chat_server import raise_open_files_limit
+
+ROOM_ID = 1
+
+
+async def fill(host, port, count):
+    """It sends `count` messages 'fill <n>' to the room and waits until they're all relayed"""
+    client = BenchClient("fill", ROOM_ID, {"latency": []})
+    await client.join(host, port)
+    for idx in range(count):
+        client.send(CHAT_CONVERSATION, ROOM_ID, f"fill {idx}")
+        if idx % 1000 == 999:
+            await client.writer.drain()
+    client.send(CHAT_CONVERSATION, ROOM_ID, "fill done")
+    while (await read_frame(client.reader))[3] != "fill done":
+        pass
+    client.writer.close()
+
+
+async def request_history(client, stats, until, interval):
+    """It asks for the room's history every `interval` s until `until`, it checks every answer"""
+    while time.monotonic() < until:
+        await asyncio.sleep(interval)
+        client.send(HISTORY, ROOM_ID, history_payload(last=HISTORY_MAX_REPLY))
+        start = time.perf_counter()
+        while True:  # skip the live frames of the Lobby
+            msg_type, _, _, count = await read_frame(client.reader)
+            if msg_type == HISTORY:
+                break
+        payloads = [(await read_frame(client.reader))[3] for _ in range(int(count))]
+        stats["answers"].append(time.perf_counter() - start)
+        stats["frames"] += len(payloads)
+        fills = [p for p in payloads if p.startswith("fill ") and p != "fill done"]
+        numbers = [int(p.split()[1]) for p in fills]
+        if numbers != list(
+            range(numbers[0], numbers[0] + len(numbers)) if numbers else []
+        ):
+            stats["bad"] += 1
+
+
+async def live_run(host, port, args, requesters):
+    stats = {"latency": []}
+    members = [BenchClient(idx, ROOM_ID, stats) for idx in range(args.members)]
+    for member in members:
+        await member.join(host, port)
+    history = {"answers": [], "frames": 0, "bad": 0}
+    askers = [BenchClient(f"h{idx}", 0, {}) for idx in range(requesters)]
+    for asker in askers:
+        await asker.connect(host, port)
+        await read_frame(asker.reader)  # GET_NICKNAME request
+        asker.send(GET_NICKNAME, 0, "#Empty")
+        await read_until(asker.reader, ENTER_ROOM, asker.nickname)
+    listeners = [asyncio.create_task(m.listen()) for m in members]
+
+    until = time.monotonic() + args.duration
+    tasks = [
+        asyncio.create_task(request_history(a, history, until, args.interval))
+        for a in askers
+    ]
+    sender = members[0]
+    while time.monotonic() < until:
+        sender.send(CHAT_CONVERSATION, ROOM_ID, str(time.perf_counter_ns()))
+        await asyncio.sleep(1 / args.rate)
+    await asyncio.gather(*tasks)
+    await asyncio.sleep(0.5)
+    for client in members + askers:
+        client.writer.close()
+    for task in listeners:
+        task.cancel()
+    latency = sorted(stats["latency"]) or [0]
+    return latency, history
+
+
+async def run(args, history_dir):
+    host = "127.0.0.1"
+    server = start_server(
+        host,
+        args.port,
+        max_clients=args.members + args.requesters + 10,
+        history_size=args.history_size,
+        history_dir=history_dir,
+    )
+    try:
+        await wait_for_server(host, args.port)
+        start = time.perf_counter()
+        await fill(host, args.port, args.fill)
+        print(
+            f"fill              : {args.fill} messages in {time.perf_counter() - start:.2f} s"
+        )
+        results = [
+            ("no requests", *await live_run(host, args.port, args, 0)),
+            (
+                f"{args.requesters} requesters",
+                *await live_run(host, args.port, args, args.requesters),
+            ),
+        ]
+    finally:
+        server.terminate()
+        server.wait()
+
+    pct = lambda values, p: values[min(len(values) - 1, int(len(values) * p))]
+    failed = False
+    for label, latency, history in results:
+        print(
+            f"live ms, {label:<14}: p50 {pct(latency, 0.5) / 1e6:6.2f}  "
+            f"p99 {pct(latency, 0.99) / 1e6:6.2f}  max {latency[-1] / 1e6:6.2f}"
+        )
+        if history["answers"]:
+            answers = history["answers"]
+            print(
+                f"history answers   : {len(answers)} ({history['frames']} messages), "
+                f"p50 {statistics.median(answers) * 1e3:.2f} ms, "
+                f"{history['frames'] / args.duration:.0f} messages/s replayed"
+            )
+            if history["bad"]:
+                print(
+                    f"FAILED: {history['bad']} answers with missing or unordered messages"
+                )
+                failed = True
+    return not failed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--port", type=int, default=9891)
+    parser.add_argument("--fill", type=int, default=20_000)
+    parser.add_argument("--history-size", type=int, default=100, help="in memory")
+    parser.add_argument("--members", type=int, default=20)
+    parser.add_argument("--requesters", type=int, default=4)
+    parser.add_argument("--rate", type=float, default=200.0, help="live messages/s")
+    parser.add_argument(
+        "--interval", type=float, default=0.1, help="seconds between requests"
+    )
+    parser.add_argument("--duration", type=float, default=5.0, help="seconds per run")
+    args = parser.parse_args()
+    raise_open_files_limit()
+    with tempfile.TemporaryDirectory(prefix="chat-history-") as history_dir:
+        ok = asyncio.run(run(args, history_dir))
+    if not ok:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
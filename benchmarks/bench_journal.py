@@ -0,0 +1,219 @@
+# -*- coding: utf-8 -*-
+"""
+Cost of the traffic journal: the relay throughput and the server's CPU time per delivered
+message with and without '--journal-dir', and a check of the journal files it leaves.
+
+The headless server runs `--runs` times with the journal and `--runs` times without it
+(alternately). Every run joins `--clients` clients into one room and lets each send `--messages`
+CHAT_CONVERSATION messages as fast as the server takes them. It reports the delivered msgs/s and
+the server's CPU time per delivered message (the journal's writer thread included), the medians
+of the runs. The journal files are rotated at `--max-bytes` and gzipped, so every run with the
+journal rotates and compresses too. The cost on the server's event loop, queueing one relayed
+message for the journal, is also timed alone: it fails when that costs more than
+`--max-overhead` percent of the server's CPU time per relayed message. It also fails if the
+journal files of a run (rotated, gzipped, and the active one) don't hold every join, relayed
+message and leave of the run.
+
+Example:
+        $ python -m benchmarks.bench_journal --clients 50 --messages 400 --runs 3
+"""
+
+import argparse
+import asyncio
+import collections
+import gzip
+import json
+import os
+import shutil
+import signal
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+from benchmarks.bench_engine import BenchClient, proc_usage, wait_for_server
+from chat_journal import TrafficJournal
+from chat_protocol import *
+from chat_server import now, raise_open_files_limit
+
+ROOM_ID = 1
+
+
+def start_server(host, port, max_clients, journal_dir, max_bytes):
+    """It starts a headless server in a new process and returns the Popen"""
+    journal = []
+    if journal_dir:
+        journal = [
+            "--journal-dir",
+            journal_dir,
+            "--journal-max-bytes",
+            str(max_bytes),
+            "--journal-backups",
+            "1000",
+            "--journal-compress",
+        ]
+    return subprocess.Popen(
+        [
+            sys.executable,
+            "-m",
+            "chat_server",
+            "--headless",
+            "--host",
+            host,
+            "--port",
+            str(port),
+            "--max-clients",
+            str(max_clients),
+            "--log-level",
+            "WARNING",
+            *journal,
+        ],
+        stdout=subprocess.DEVNULL,
+    )
+
+
+def queueing_ns(number=200_000):
+    """It returns the ns the server's thread spends to journal a relayed message, best of 5"""
+    journal = TrafficJournal(tempfile.mkdtemp(prefix="chat-journal-"))
+    data = msg_composer(CHAT_CONVERSATION, "u1", ROOM_ID, "x" * 40).encode("utf-8")
+    best = float("inf")
+    try:
+        for _ in range(5):
+            start = time.perf_counter_ns()
+            for _ in range(number):
+                event = (now(), "Client-1", "u1", data)
+                journal.write_event_value("-BROADCAST_EVENT-", event)
+            best = min(best, (time.perf_counter_ns() - start) / number)
+    finally:
+        shutil.rmtree(journal.directory, ignore_errors=True)
+    return best
+
+
+def read_journal(directory):
+    """It returns the records of all the journal files of the directory"""
+    records = []
+    for name in sorted(os.listdir(directory)):
+        path = os.path.join(directory, name)
+        opener = gzip.open if name.endswith(".gz") else open
+        with opener(path, "rt", encoding="utf-8") as file:
+            records += [json.loads(line) for line in file]
+    return records
+
+
+async def run(port, journal_dir, args):
+    """It returns (delivered msgs/s, server CPU ns per delivered message)"""
+    host = "127.0.0.1"
+    server = start_server(host, port, args.clients + 10, journal_dir, args.max_bytes)
+    try:
+        await wait_for_server(host, port)
+        stats = {"latency": []}
+        clients = [BenchClient(idx, ROOM_ID, stats) for idx in range(args.clients)]
+        for client in clients:
+            await client.join(host, port)
+        listeners = [asyncio.create_task(c.listen()) for c in clients]
+        expected = args.clients * args.messages * args.clients
+        cpu0, _ = proc_usage(server.pid)
+        start = time.perf_counter()
+        await asyncio.gather(*(c.chat(args.messages, 0) for c in clients))
+        deadline = time.monotonic() + 60
+        while len(stats["latency"]) < expected and time.monotonic() < deadline:
+            await asyncio.sleep(0.01)
+        elapsed = time.perf_counter() - start
+        await asyncio.sleep(0.5)  # the journal's writer catches up
+        cpu1, _ = proc_usage(server.pid)
+        for client in clients:
+            client.writer.close()
+        for task in listeners:
+            task.cancel()
+        await asyncio.sleep(0.2)  # the leaves
+    finally:
+        server.send_signal(signal.SIGTERM)  # the journal is flushed and closed
+        server.wait()
+    if len(stats["latency"]) != expected:
+        raise RuntimeError(f"{len(stats['latency'])}/{expected} messages delivered")
+    return expected / elapsed, (cpu1 - cpu0) * 1e9 / expected
+
+
+def check_journal(directory, args):
+    """It returns the failures: the events of the run missing from its journal"""
+    files = os.listdir(directory)
+    records = read_journal(directory)
+    events = collections.Counter(record["event"] for record in records)
+    chats = sum(
+        record["event"] == "relay" and record.get("type") == CHAT_CONVERSATION
+        for record in records
+    )
+    failures = []
+    if not any(name.endswith(".gz") for name in files):
+        failures.append(f"no journal file rotated and gzipped: {files}")
+    if events["join"] != args.clients or events["leave"] != args.clients:
+        failures.append(f"{events['join']} joins, {events['leave']} leaves journaled")
+    if chats != args.clients * args.messages:
+        failures.append(
+            f"{chats}/{args.clients * args.messages} chat messages journaled"
+            f" ({events['dropped']} drops)"
+        )
+    return failures, len(files), len(records)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--port", type=int, default=10791)
+    parser.add_argument("--clients", type=int, default=50)
+    parser.add_argument("--messages", type=int, default=400, help="per client")
+    parser.add_argument("--runs", type=int, default=3, help="per setting")
+    parser.add_argument(
+        "--max-bytes", type=int, default=1 << 20, help="per journal file"
+    )
+    parser.add_argument("--max-overhead", type=float, default=5.0, help="%%")
+    args = parser.parse_args()
+    raise_open_files_limit()
+
+    rate = {True: [], False: []}
+    cost = {True: [], False: []}
+    failures = []
+    for idx in range(args.runs):
+        for journal in (False, True):
+            directory = tempfile.mkdtemp(prefix="chat-journal-") if journal else None
+            try:
+                msgs, ns = asyncio.run(run(args.port + idx, directory, args))
+                if journal:
+                    failed, files, records = check_journal(directory, args)
+                    failures += [f"run {idx + 1}: {failure}" for failure in failed]
+            finally:
+                if directory:
+                    shutil.rmtree(directory, ignore_errors=True)
+            rate[journal].append(msgs)
+            cost[journal].append(ns)
+            print(
+                f"run {idx + 1} journal {'on ' if journal else 'off'}: "
+                f"{msgs:9.0f} msgs/s  {ns:6.0f} ns/msg"
+                + (f"  ({records} records in {files} files)" if journal else "")
+            )
+
+    without, with_ = statistics.median(cost[False]), statistics.median(cost[True])
+    print(
+        f"delivered msgs/s, median: off {statistics.median(rate[False]):.0f}  "
+        f"on {statistics.median(rate[True]):.0f}"
+    )
+    print(
+        f"server CPU per delivered message, median: off {without:.0f} ns  on {with_:.0f} ns "
+        f"({(with_ / without - 1) * 100:+.1f} %, the writer thread included)"
+    )
+    queueing = queueing_ns()
+    overhead = queueing / (without * args.clients) * 100
+    print(
+        f"event loop: {queueing:.0f} ns per relayed message queued for the journal, "
+        f"{overhead:.2f} % of the relay  (max {args.max_overhead} %)"
+    )
+    if overhead > args.max_overhead:
+        failures.append(f"the journal costs the event loop {overhead:.1f} %")
+    for failure in failures:
+        print(f"FAILED: {failure}")
+    if failures:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,351 @@
+# -*- coding: utf-8 -*-
+"""
+Load generator of the chat protocol: throughput and end-to-end latency per room count and fan-out.
+
+It starts the headless server (`python -m chat_server --headless`) on localhost, or uses the one
+at `--server`, and runs one scenario for every `--clients` x `--rooms` value. The clients run in
+`--generators` processes. Every client does the GET_NICKNAME handshake, leaves the Lobby
+(EXIT_ROOM) and enters one of the rooms (ENTER_ROOM), then sends CHAT_CONVERSATION messages at
+`--rate` messages/s for `--duration` seconds. With `--switch-every` every client also moves to the
+next room (EXIT_ROOM / ENTER_ROOM) every that many seconds. The fan-out of a scenario is the
+number of members of a room: clients / rooms.
+
+Every scenario reports the join rate, the messages sent and delivered, the delivery throughput,
+the p50/p95/p99 latency from the sender's write to the member's read, and the server's CPU time
+and memory. `--json FILE` saves the results, `--compare FILE` compares them to a saved run: the
+exit code is 1 when the throughput of a scenario falls, or its p99 rises, by more than
+`--tolerance`.
+
+Example:
+        $ python -m benchmarks.bench_load --clients 1000 --rooms 1 3 9 --json base.json
+        $ python -m benchmarks.bench_load --clients 1000 --rooms 1 3 9 --compare base.json
+"""
+
+import argparse
+import asyncio
+import collections
+import datetime
+import json
+import math
+import multiprocessing
+import os
+import platform
+import random
+import subprocess
+import sys
+import time
+
+from benchmarks.bench_engine import BenchClient, proc_usage, wait_for_server
+from chat_protocol import *
+from chat_server import raise_open_files_limit
+
+BUCKETS_PER_OCTAVE = 16  # latency histogram resolution: 2**(1/16), about 4.4 %
+
+
+def bucket(ns):
+    return int(math.log2(max(ns, 1)) * BUCKETS_PER_OCTAVE)
+
+
+def percentile(histogram, p):
+    """It returns the p-th (0..1) percentile of the {bucket: count} histogram, in ms"""
+    total = sum(histogram.values())
+    if not total:
+        return 0.0
+    rank = p * total
+    seen = 0
+    for key in sorted(histogram):
+        seen += histogram[key]
+        if seen >= rank:
+            return 2 ** ((key + 0.5) / BUCKETS_PER_OCTAVE) / 1e6
+    return 0.0
+
+
+class LoadClient(BenchClient):
+    """A simulated client: it chats at a fixed rate and records the latency of what it reads"""
+
+    def __init__(self, idx, room_id, stats):
+        super().__init__(idx, room_id, stats)
+        self.decoder = FrameDecoder()
+        self.sent = 0
+
+    async def listen(self):
+        histogram = self.stats["histogram"]
+        try:
+            while data := await self.reader.read(RECV_BUFSIZE):
+                self.stats["last"] = time.monotonic()
+                for msg_type, _, _, payload in self.decoder.feed(data):
+                    if msg_type == CHAT_CONVERSATION:
+                        histogram[bucket(time.monotonic_ns() - int(payload))] += 1
+                        self.stats["delivered"] += 1
+        except (ConnectionError, ValueError):
+            pass
+
+    async def run_chat(self, rate, until, switch_every, rooms):
+        """
+        It sends a message every 1/rate s until `until`, and moves to the next room every
+        `switch_every` s
+        """
+        await asyncio.sleep(random.random() / rate)  # the clients don't send in step
+        next_switch = time.monotonic() + switch_every if switch_every else None
+        while (moment := time.monotonic()) < until:
+            if next_switch is not None and moment >= next_switch:
+                room_id = self.room_id % rooms + 1
+                self.send(EXIT_ROOM, self.room_id, f"left '{rooms_name[self.room_id]}'")
+                self.send(ENTER_ROOM, room_id, "joined")
+                self.room_id = room_id
+                next_switch += switch_every
+            self.send(CHAT_CONVERSATION, self.room_id, str(time.monotonic_ns()))
+            self.sent += 1
+            await asyncio.sleep(1 / rate)
+
+
+async def load(host, port, indexes, args, rooms, ready, go):
+    stats = {"histogram": collections.Counter(), "delivered": 0, "last": 0.0}
+    clients = [LoadClient(idx, 1 + idx % rooms, stats) for idx in indexes]
+    start = time.monotonic()
+    for first in range(0, len(clients), args.batch):
+        await asyncio.gather(
+            *(c.join(host, port) for c in clients[first : first + args.batch])
+        )
+    ready.put(time.monotonic() - start)
+    listeners = [asyncio.create_task(c.listen()) for c in clients]
+    await asyncio.get_running_loop().run_in_executor(None, go.wait)
+
+    until = time.monotonic() + args.duration
+    await asyncio.gather(
+        *(c.run_chat(args.rate, until, args.switch_every, rooms) for c in clients)
+    )
+    # the messages still on the way: wait until nothing more arrives
+    delivered = -1
+    deadline = time.monotonic() + args.timeout
+    while stats["delivered"] != delivered and time.monotonic() < deadline:
+        delivered = stats["delivered"]
+        await asyncio.sleep(0.5)
+    for client in clients:
+        client.writer.close()
+    for task in listeners:
+        task.cancel()
+    sent = collections.Counter()  # per room, without --switch-every
+    for client in clients:
+        sent[client.room_id] += client.sent
+    return dict(sent), stats["delivered"], dict(stats["histogram"]), stats["last"]
+
+
+def generator(host, port, indexes, args, rooms, ready, go, results):
+    """A load generator process: it runs the clients of `indexes`"""
+    raise_open_files_limit()
+    results.put(asyncio.run(load(host, port, indexes, args, rooms, ready, go)))
+
+
+def start_headless(port, clients):
+    return subprocess.Popen(
+        [
+            sys.executable,
+            "-m",
+            "chat_server",
+            "--headless",
+            "--port",
+            str(port),
+            "--max-clients",
+            str(clients + 10),
+            "--max-pending",
+            str(clients + 10),
+            "--log-level",
+            "WARNING",
+        ]
+    )
+
+
+def run_scenario(host, port, pid, clients, rooms, args):
+    """It runs one scenario and returns its results dictionary"""
+    ready, go, results = (
+        multiprocessing.Queue(),
+        multiprocessing.Event(),
+        multiprocessing.Queue(),
+    )
+    generators = [
+        multiprocessing.Process(
+            target=generator,
+            args=(
+                host,
+                port,
+                range(gen, clients, args.generators),
+                args,
+                rooms,
+                ready,
+                go,
+                results,
+            ),
+        )
+        for gen in range(min(args.generators, clients))
+    ]
+    for process in generators:
+        process.start()
+    join_seconds = max(ready.get(timeout=600) for _ in generators)
+    time.sleep(0.5)  # the last join broadcasts
+    cpu0, _ = proc_usage(pid) if pid else (float("nan"), None)
+    start = time.monotonic()
+    go.set()
+    outcome = [
+        results.get(timeout=args.duration + args.timeout + 60) for _ in generators
+    ]
+    # CLOCK_MONOTONIC is the same clock in every process
+    elapsed = max(result[3] for result in outcome) - start
+    cpu1, rss = proc_usage(pid) if pid else (float("nan"), float("nan"))
+    for process in generators:
+        process.join()
+
+    sent = collections.Counter()
+    histogram = collections.Counter()
+    for room_sent, _, room_histogram, _ in outcome:
+        sent.update(room_sent)
+        histogram.update(room_histogram)
+    delivered = sum(result[1] for result in outcome)
+    members = collections.Counter(1 + idx % rooms for idx in range(clients))
+    # the rooms change under the messages with --switch-every, no exact count then
+    expected = (
+        None
+        if args.switch_every
+        else sum(count * members[room_id] for room_id, count in sent.items())
+    )
+    return {
+        "clients": clients,
+        "rooms": rooms,
+        "fanout": round(clients / rooms, 1),
+        "rate": args.rate,
+        "join_seconds": round(join_seconds, 3),
+        "joins_per_s": round(clients / join_seconds, 1),
+        "sent": sum(sent.values()),
+        "delivered": delivered,
+        "expected": expected,
+        "throughput": round(delivered / elapsed, 1),
+        "latency_ms": {
+            f"p{round(p * 100)}": round(percentile(histogram, p), 3)
+            for p in (0.5, 0.95, 0.99)
+        },
+        "server_cpu_s": round(cpu1 - cpu0, 3),
+        "server_rss_mb": round(rss, 1),
+    }
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def print_scenario(result):
+    latency = result["latency_ms"]
+    expected = result["expected"]
+    print(
+        f"{result['clients']:>7} {result['rooms']:>5} {result['fanout']:>7} "
+        f"{result['joins_per_s']:>8.0f} {result['sent']:>8} "
+        f"{result['delivered']:>9}/{expected if expected is not None else '-':<9} "
+        f"{result['throughput']:>9.0f} {latency['p50']:>7.2f} {latency['p95']:>7.2f} "
+        f"{latency['p99']:>7.2f} {result['server_cpu_s']:>6.2f}"
+    )
+
+
+def compare(results, baseline, tolerance):
+    """It prints the change of every scenario against the baseline and returns the regressions"""
+    key = lambda s: (s["clients"], s["rooms"], s["rate"])
+    base = {key(scenario): scenario for scenario in baseline["scenarios"]}
+    regressions = []
+    print(f"\ncompared to {baseline.get('commit')} of {baseline.get('time')}:")
+    for scenario in results["scenarios"]:
+        old = base.get(key(scenario))
+        if old is None:
+            continue
+        throughput = scenario["throughput"] / old["throughput"] - 1
+        p99 = scenario["latency_ms"]["p99"] / max(old["latency_ms"]["p99"], 1e-9) - 1
+        print(
+            f"  clients {scenario['clients']} rooms {scenario['rooms']}: "
+            f"throughput {throughput:+.1%}, p99 {p99:+.1%}"
+        )
+        if throughput < -tolerance or p99 > tolerance:
+            regressions.append(key(scenario))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--server", help="HOST:PORT of a running server")
+    parser.add_argument("--pid", type=int, help="pid of the --server, for its CPU")
+    parser.add_argument("--port", type=int, default=10091)
+    parser.add_argument("--clients", type=int, nargs="+", default=[1000])
+    parser.add_argument(
+        "--rooms", type=int, nargs="+", default=[3, MAX_PRIVATE_ROOMS], help="1..9"
+    )
+    parser.add_argument("--rate", type=float, default=0.2, help="messages/s per client")
+    parser.add_argument("--duration", type=float, default=10.0, help="seconds")
+    parser.add_argument(
+        "--switch-every", type=float, default=0.0, help="seconds, 0: never"
+    )
+    parser.add_argument("--generators", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--batch", type=int, default=100, help="concurrent joins")
+    parser.add_argument(
+        "--timeout", type=float, default=30.0, help="seconds to wait for the last"
+    )
+    parser.add_argument("--json", help="save the results to this file")
+    parser.add_argument("--compare", help="compare to the results of this file")
+    parser.add_argument("--tolerance", type=float, default=0.1, help="0.1: 10 %%")
+    args = parser.parse_args()
+    if not all(1 <= rooms <= MAX_PRIVATE_ROOMS for rooms in args.rooms):
+        parser.error(f"--rooms must be 1..{MAX_PRIVATE_ROOMS}")
+    raise_open_files_limit()
+
+    results = {
+        "time": datetime.datetime.now().isoformat(timespec="seconds"),
+        "commit": git_commit(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "args": vars(args),
+        "scenarios": [],
+    }
+    print(
+        f"{'clients':>7} {'rooms':>5} {'fanout':>7} {'joins/s':>8} {'sent':>8} "
+        f"{'delivered/expected':>19} {'msgs/s':>9} {'p50 ms':>7} {'p95 ms':>7} "
+        f"{'p99 ms':>7} {'cpu s':>6}"
+    )
+    idx = 0
+    for clients in args.clients:
+        for rooms in args.rooms:
+            if args.server:
+                host, port = args.server.split(":")
+                port, server, pid = int(port), None, args.pid
+            else:
+                host, port = "127.0.0.1", args.port + idx
+                server = start_headless(port, clients)
+                pid = server.pid
+            idx += 1
+            try:
+                asyncio.run(wait_for_server(host, port))
+                scenario = run_scenario(host, port, pid, clients, rooms, args)
+            finally:
+                if server is not None:
+                    server.terminate()
+                    server.wait()
+            results["scenarios"].append(scenario)
+            print_scenario(scenario)
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"saved to {args.json}")
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        if regressions:
+            print(f"FAILED: {len(regressions)} scenarios regressed over the tolerance")
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,149 @@
+# -*- coding: utf-8 -*-
+"""
+Cost of the live metrics: the server's CPU time per delivered message with and without them.
+
+The server runs `--runs` times with the metrics and `--runs` times without them (alternately, so
+a slower moment of the machine hits both). Every run joins `--clients` clients into one room and
+lets each send `--messages` CHAT_CONVERSATION messages as fast as the server takes them. The cost
+is the server's CPU time during the chat divided by the messages delivered, the median of the
+runs. On a busy machine that difference is within the noise of the runs, so the instrumentation
+of one relayed message (two perf_counter_ns() calls, ServerMetrics.on_relay() and one histogram
+bucket) is also timed alone: it fails when that costs more than `--max-overhead` percent of the
+server's CPU time per relayed message. The run with the metrics also reads the stats endpoint and
+checks its counters against the messages sent.
+
+Example:
+        $ python -m benchmarks.bench_metrics --clients 50 --messages 400 --runs 5
+"""
+
+import argparse
+import asyncio
+import json
+import statistics
+import sys
+import time
+import urllib.request
+
+from benchmarks.bench_engine import (
+    BenchClient,
+    proc_usage,
+    start_server,
+    wait_for_server,
+)
+from chat_metrics import ServerMetrics
+from chat_protocol import *
+from chat_server import raise_open_files_limit
+
+ROOM_ID = 1
+
+
+def instrumentation_ns(number=200_000):
+    """It returns the ns per relayed message spent in the metrics, the best of 5 runs"""
+    metrics = ServerMetrics()
+    best = float("inf")
+    for _ in range(5):
+        start = time.perf_counter_ns()
+        for _ in range(number):
+            relay_start = time.perf_counter_ns()
+            metrics.on_relay(ROOM_ID, 40, 50)
+            metrics.relay_latency.observe(time.perf_counter_ns() - relay_start)
+        best = min(best, (time.perf_counter_ns() - start) / number)
+    return best
+
+
+async def run(port, metrics, args):
+    """It returns (server CPU ns per delivered message, the stats or None)"""
+    host = "127.0.0.1"
+    server = start_server(
+        host,
+        port,
+        max_clients=args.clients + 10,
+        metrics=metrics,
+        stats_port=port + 1 if metrics else None,
+    )
+    try:
+        await wait_for_server(host, port)
+        stats = {"latency": []}
+        clients = [BenchClient(idx, ROOM_ID, stats) for idx in range(args.clients)]
+        for client in clients:
+            await client.join(host, port)
+        listeners = [asyncio.create_task(c.listen()) for c in clients]
+        expected = args.clients * args.messages * args.clients
+        cpu0, _ = proc_usage(server.pid)
+        await asyncio.gather(*(c.chat(args.messages, 0) for c in clients))
+        deadline = time.monotonic() + 60
+        while len(stats["latency"]) < expected and time.monotonic() < deadline:
+            await asyncio.sleep(0.01)
+        cpu1, _ = proc_usage(server.pid)
+        snapshot = None
+        if metrics:
+            url = f"http://{host}:{port + 1}/stats"
+            loop = asyncio.get_running_loop()
+            response = await loop.run_in_executor(None, urllib.request.urlopen, url)
+            snapshot = json.load(response)
+        for client in clients:
+            client.writer.close()
+        for task in listeners:
+            task.cancel()
+    finally:
+        server.terminate()
+        server.wait()
+    if len(stats["latency"]) != expected:
+        raise RuntimeError(f"{len(stats['latency'])}/{expected} messages delivered")
+    return (cpu1 - cpu0) * 1e9 / expected, snapshot
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--port", type=int, default=10291)
+    parser.add_argument("--clients", type=int, default=50)
+    parser.add_argument("--messages", type=int, default=400, help="per client")
+    parser.add_argument("--runs", type=int, default=5, help="per setting")
+    parser.add_argument("--max-overhead", type=float, default=3.0, help="%%")
+    args = parser.parse_args()
+    raise_open_files_limit()
+
+    cost = {True: [], False: []}
+    snapshot = None
+    for idx in range(args.runs):
+        for metrics in (False, True):
+            ns, stats = asyncio.run(run(args.port + 2 * idx, metrics, args))
+            cost[metrics].append(ns)
+            snapshot = stats or snapshot
+            print(
+                f"run {idx + 1} metrics {'on ' if metrics else 'off'}: {ns:7.0f} ns/msg"
+            )
+
+    without, with_ = statistics.median(cost[False]), statistics.median(cost[True])
+    print(
+        f"server CPU per delivered message, median: off {without:.0f} ns  on {with_:.0f} ns"
+    )
+    print(f"end to end difference: {(with_ / without - 1) * 100:+.1f} %")
+    instrumentation = instrumentation_ns()
+    overhead = instrumentation / (without * args.clients) * 100
+    print(
+        f"instrumentation: {instrumentation:.0f} ns per relayed message, "
+        f"{overhead:.2f} % of the relay  (max {args.max_overhead} %)"
+    )
+    room = snapshot["rooms"][rooms_name[ROOM_ID]]
+    sent = args.clients * args.messages
+    print(
+        f"stats endpoint: {room['msgs_in']} msgs in, {room['msgs_out']} msgs out, "
+        f"relay latency p99 {snapshot['relay_latency_ms']['p99']} ms"
+    )
+    failed = []
+    if overhead > args.max_overhead:
+        failed.append(f"the metrics cost {overhead:.1f} %")
+    # the room's counters also hold the ENTER_ROOM frames of the clients
+    if not sent <= room["msgs_in"] <= sent + args.clients:
+        failed.append(f"msgs_in {room['msgs_in']}, {sent} messages were sent")
+    if snapshot["relay_latency_ms"]["count"] < sent:
+        failed.append("the relay latency misses messages")
+    for failure in failed:
+        print(f"FAILED: {failure}")
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,196 @@
+# -*- coding: utf-8 -*-
+"""
+Reconnect under load: the server is restarted while `--clients` ChatClients chat, and every client
+must end up with every message of its room exactly once.
+
+It starts a headless server with `--history-dir`, connects the clients into `--rooms` rooms and
+lets each send `--messages` unique CHAT_CONVERSATION messages, one every `--interval` seconds.
+After `--restart-after` seconds the server is stopped (SIGTERM, it keeps its history) and started
+again on the same port `--down` seconds later. The clients reconnect and resume their rooms by
+themselves. It reports how long the clients took to resume, and fails if a client missed a
+message of its room, got one twice, or got a sender's messages out of order.
+
+Example:
+        $ python -m benchmarks.bench_reconnect --clients 50 --rooms 5 --messages 100
+"""
+
+import argparse
+import asyncio
+import collections
+import shutil
+import signal
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+from benchmarks.bench_engine import wait_for_server
+from chat_client import ChatClient
+from chat_protocol import *
+from chat_server import raise_open_files_limit
+
+
+def start_server(host, port, history_dir, max_clients):
+    """It starts a headless server in a new process and returns the Popen"""
+    return subprocess.Popen(
+        [
+            sys.executable,
+            "-m",
+            "chat_server",
+            "--headless",
+            "--host",
+            host,
+            "--port",
+            str(port),
+            "--max-clients",
+            str(max_clients),
+            "--history-dir",
+            history_dir,
+            "--log-level",
+            "WARNING",
+        ],
+        stdout=subprocess.DEVNULL,
+    )
+
+
+class ResumingClient:
+    """A ChatClient that keeps the messages of its room and times its reconnects"""
+
+    def __init__(self, idx, room_id):
+        self.nickname = f"u{idx}"
+        self.room_name = rooms_name[room_id]
+        self.received = []  # (nickname, payload) of the room's messages
+        self.lost_at = None
+        self.resume_times = []
+        self.client = None
+
+    def on_frame(self, frame):
+        if frame[0] == CHAT_CONVERSATION and frame[2] == self.room_name:
+            self.received.append((frame[1], frame[3]))
+
+    def on_state(self, state, error):
+        if state == "reconnecting":
+            self.lost_at = time.perf_counter()
+        else:
+            self.resume_times.append(time.perf_counter() - self.lost_at)
+
+    async def join(self, host, port):
+        self.client = ChatClient(
+            self.nickname, host, port, on_frame=self.on_frame, on_state=self.on_state
+        )
+        await self.client.connect()
+        await self.client.join_room(self.room_name)
+
+    async def chat(self, messages, interval):
+        for idx in range(messages):
+            self.client.send(f"{self.nickname}:{idx}")
+            await asyncio.sleep(interval)
+
+
+def check(clients, messages):
+    """It returns the failures: the messages of a room missed, duplicated or out of order"""
+    senders = collections.defaultdict(list)
+    for client in clients:
+        senders[client.room_name].append(client.nickname)
+    failures = []
+    for client in clients:
+        expected = len(senders[client.room_name]) * messages
+        counts = collections.Counter(client.received)
+        duplicates = sum(count - 1 for count in counts.values())
+        missed = expected - len(counts)
+        last = {}
+        disordered = 0
+        for nickname, payload in client.received:
+            idx = int(payload.rpartition(":")[2])
+            if idx <= last.get(nickname, -1):
+                disordered += 1
+            last[nickname] = max(idx, last.get(nickname, -1))
+        if missed or duplicates or disordered:
+            failures.append(
+                f"{client.nickname} in '{client.room_name}': {missed} missed, "
+                f"{duplicates} duplicated, {disordered} out of order"
+            )
+    return failures
+
+
+async def run(args):
+    host = "127.0.0.1"
+    history_dir = tempfile.mkdtemp(prefix="chat-history-")
+    server = start_server(host, args.port, history_dir, args.clients + 10)
+    clients = []
+    try:
+        await wait_for_server(host, args.port)
+        clients = [
+            ResumingClient(idx, 1 + idx % args.rooms) for idx in range(args.clients)
+        ]
+        for client in clients:
+            await client.join(host, args.port)
+        chat = asyncio.gather(*(c.chat(args.messages, args.interval) for c in clients))
+
+        await asyncio.sleep(args.restart_after)
+        server.send_signal(signal.SIGTERM)
+        await asyncio.get_running_loop().run_in_executor(None, server.wait)
+        print(f"server stopped after {args.restart_after} s, down for {args.down} s")
+        await asyncio.sleep(args.down)
+        server = start_server(host, args.port, history_dir, args.clients + 10)
+
+        await chat
+        expected = {
+            client: args.messages
+            * sum(c.room_name == client.room_name for c in clients)
+            for client in clients
+        }
+        deadline = time.monotonic() + args.timeout
+        while time.monotonic() < deadline and any(
+            len(c.received) < expected[c] or c.client.reconnecting for c in clients
+        ):
+            await asyncio.sleep(0.05)
+        await asyncio.sleep(0.5)  # for the duplicates, if any
+    finally:
+        for client in clients:
+            if client.client is not None:
+                client.client.close()
+        server.terminate()
+        server.wait()
+        shutil.rmtree(history_dir, ignore_errors=True)
+    return clients
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--port", type=int, default=10491)
+    parser.add_argument("--clients", type=int, default=50)
+    parser.add_argument("--rooms", type=int, default=5)
+    parser.add_argument("--messages", type=int, default=100, help="per client")
+    parser.add_argument("--interval", type=float, default=0.02, help="seconds")
+    parser.add_argument("--restart-after", type=float, default=1.0, help="seconds")
+    parser.add_argument("--down", type=float, default=1.0, help="seconds")
+    parser.add_argument("--timeout", type=float, default=60.0, help="seconds")
+    args = parser.parse_args()
+    raise_open_files_limit()
+
+    clients = asyncio.run(run(args))
+    resume_times = [t for c in clients for t in c.resume_times]
+    print(
+        f"{args.clients} clients in {args.rooms} rooms, "
+        f"{args.messages} messages each, {len(resume_times)} resumes"
+    )
+    if resume_times:
+        print(
+            f"time to resume: median {statistics.median(resume_times):.2f} s  "
+            f"max {max(resume_times):.2f} s"
+        )
+    received = sum(len(c.received) for c in clients)
+    print(f"{received} messages received")
+    failures = check(clients, args.messages)
+    if len(resume_times) < args.clients:
+        failures.append(f"{args.clients - len(resume_times)} clients didn't resume")
+    for failure in failures:
+        print(f"FAILED: {failure}")
+    if failures:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,131 @@
+# -*- coding: utf-8 -*-
+"""
+Lookup cost at `--sessions` joined clients: SessionRegistry vs. the parallel lists.
+
+The parallel lists are the `clients` / `nicknames` / `addresses` lists the server used to keep:
+every lookup is a list.index() scan, O(N). The SessionRegistry lookups are dictionary lookups.
+The room moves are timed again with a MembershipDiffs subscriber, the Status window's listener.
+
+Example:
+        $ python -m benchmarks.bench_registry --sessions 10000
+"""
+
+import argparse
+import random
+import time
+
+from chat_protocol import *
+from chat_registry import MembershipDiffs, SessionRegistry
+
+
+class Conn:
+    """A client connection stand-in"""
+
+    __slots__ = ("fd",)
+
+    def __init__(self, fd):
+        self.fd = fd
+
+
+def timed(label, func, keys, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for key in keys:
+            func(key)
+    elapsed = time.perf_counter() - start
+    ns = elapsed / (repeat * len(keys)) * 1e9
+    print(f"{label:<42} {ns:>12.0f} ns/op")
+    return ns
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--sessions", type=int, default=10_000)
+    parser.add_argument("--lookups", type=int, default=2_000)
+    args = parser.parse_args()
+
+    conns = [Conn(fd) for fd in range(args.sessions)]
+    addresses = [("10.0.0.1", 10_000 + fd) for fd in range(args.sessions)]
+    nicknames = [f"u{fd}" for fd in range(args.sessions)]
+
+    # the parallel lists
+    clients = list(conns)
+
+    # the registry
+    sessions = SessionRegistry()
+    for conn, address, nick in zip(conns, addresses, nicknames):
+        sessions.add(conn, conn.fd, address, nick, conn.fd % len(rooms_name))
+
+    rnd = random.Random(2022)
+    picks = [rnd.randrange(args.sessions) for _ in range(args.lookups)]
+    pick_conns = [conns[i] for i in picks]
+    pick_nicks = [nicknames[i] for i in picks]
+    pick_addrs = [addresses[i] for i in picks]
+    repeat = max(1, 200_000 // args.lookups)
+
+    print(f"{args.sessions} sessions")
+    old = timed(
+        "lists: nicknames[clients.index(client)]",
+        lambda conn: nicknames[clients.index(conn)],
+        pick_conns,
+        1,
+    )
+    new = timed(
+        "registry: by_fd(fd).nickname",
+        lambda conn: sessions.by_fd(conn.fd).nickname,
+        pick_conns,
+        repeat,
+    )
+    print(f"{'':<42} {old / new:>12.0f}x")
+    old = timed(
+        "lists: addresses[nicknames.index(nick)]",
+        lambda nick: addresses[nicknames.index(nick)],
+        pick_nicks,
+        1,
+    )
+    new = timed(
+        "registry: by_nickname(nick)[0].address",
+        lambda nick: sessions.by_nickname(nick)[0].address,
+        pick_nicks,
+        repeat,
+    )
+    print(f"{'':<42} {old / new:>12.0f}x")
+    old = timed(
+        "lists: nicknames[addresses.index(addr)]",
+        lambda addr: nicknames[addresses.index(addr)],
+        pick_addrs,
+        1,
+    )
+    new = timed(
+        "registry: by_address(addr).nickname",
+        lambda addr: sessions.by_address(addr).nickname,
+        pick_addrs,
+        repeat,
+    )
+    print(f"{'':<42} {old / new:>12.0f}x")
+    timed(
+        "registry: enter_room(session, room)",
+        lambda addr: sessions.enter_room(sessions.by_address(addr), 1),
+        pick_addrs,
+        repeat,
+    )
+    timed(
+        "registry: remove(session) + add(...)",
+        lambda addr: (
+            sessions.remove(session := sessions.by_address(addr)),
+            sessions.add(session.conn, session.fd, addr, session.nickname, 0),
+        ),
+        pick_addrs,
+        repeat,
+    )
+    sessions.subscribe(MembershipDiffs())
+    timed(
+        "registry: enter_room() with a subscriber",
+        lambda addr: sessions.enter_room(sessions.by_address(addr), 1),
+        pick_addrs,
+        repeat,
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,114 @@
+# -*- coding: utf-8 -*-
+"""
+Memory allocated per relayed message (tracemalloc): decode/parse relay vs. zero-decode relay.
+
+The 'decode' path is the relay as it was: msg_parser() decodes every field of the message to
+route it, and the GUI event carries the decoded message. The 'zero-decode' path is
+ChatServer.on_message(): only the 7-byte header and the room_id are read, the received bytes
+object is sent to every recipient and the GUI event carries the encoded message.
+
+Both paths relay to `--members` clients of one room, with and without a GUI window attached.
+
+Example:
+        $ python -m benchmarks.bench_relay --members 10
+"""
+
+import argparse
+import time
+import tracemalloc
+
+from chat_protocol import *
+from chat_server import ChatServer, broadcast, now
+
+
+class NullConnection:
+    """A client connection that drops what is sent to it"""
+
+    def __init__(self, idx):
+        self.name = f"Session-{idx}"
+        self.session = None
+        self.version = PROTOCOL_V1
+
+    def send(self, message, stamps=None, version=PROTOCOL_V1):
+        pass
+
+    def close(self):
+        pass
+
+
+class NullWindow:
+    """A GUI window that drops its events"""
+
+    def write_event_value(self, key, value):
+        pass
+
+
+def decode_relay(server, conn, data, header=None):
+    """The relay path before the zero-decode one"""
+    msg_type, _, msg_room_name, _ = msg_parser(data)
+    room_id = rooms_id[msg_room_name]
+    if msg_type == CHAT_CONVERSATION:
+        clients = server.sessions.members(room_id)
+    else:
+        clients = server.sessions.connections()
+    broadcast(data, clients)
+    server.notify(
+        "-BROADCAST_EVENT-",
+        (now(), conn.name, conn.session.nickname, data.decode("utf-8")),
+    )
+
+
+def zero_decode_relay(server, conn, data, header=None):
+    server.on_message(conn, data, header)
+
+
+def measure(relay, window, members, count):
+    server = ChatServer(observers=[window] if window else [])
+    for idx in range(members):
+        conn = NullConnection(idx)
+        conn.session = server.sessions.add(conn, idx, ("127.0.0.1", idx), f"u{idx}", 1)
+    sender = server.sessions.by_fd(0).conn
+    data = msg_composer(CHAT_CONVERSATION, "u0", 1, "x" * 60).encode("utf-8")
+    header = header_parser(data)
+
+    tracemalloc.start()
+    peak = retained = 0
+    for _ in range(count):
+        tracemalloc.reset_peak()
+        before = tracemalloc.get_traced_memory()[0]
+        relay(server, sender, data, header)
+        current, high = tracemalloc.get_traced_memory()
+        peak += high - before
+        retained += current - before
+    tracemalloc.stop()
+
+    start = time.perf_counter()
+    for _ in range(count):
+        relay(server, sender, data, header)
+    elapsed = time.perf_counter() - start
+    return peak / count, retained / count, elapsed / count * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument(
+        "--members", type=int, default=10, help="recipients in the room"
+    )
+    parser.add_argument("--count", type=int, default=20_000, help="messages per run")
+    args = parser.parse_args()
+
+    print(
+        f"{'path':<12} {'gui':<4} {'peak B/msg':>11} {'retained B/msg':>15} {'us/msg':>7}"
+    )
+    for window in (None, NullWindow()):
+        for name, relay in (
+            ("decode", decode_relay),
+            ("zero-decode", zero_decode_relay),
+        ):
+            peak, retained, usec = measure(relay, window, args.members, args.count)
+            gui = "yes" if window else "no"
+            print(f"{name:<12} {gui:<4} {peak:>11.0f} {retained:>15.1f} {usec:>7.2f}")
+
+
+if __name__ == "__main__":
+    main()
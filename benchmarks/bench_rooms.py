@@ -0,0 +1,216 @@
+# -*- coding: utf-8 -*-
+"""
+The dynamic room catalog: thousands of rooms created, listed a page at a time, joined and
+deleted by the server once they've been idle, with the catalog's diffs sent to the listeners.
+
+It starts a server with a `--idle` seconds room idle timeout, and a listener ChatClient that
+lists the catalog once, then only follows its diffs. `--creators` clients create `--rooms` rooms
+between them, all at once. A fresh client then pages through the whole catalog, and `--joiners`
+clients join created rooms and chat there. Once everybody has left, the server deletes the rooms
+after `--idle` seconds. It reports the create rate, the paging time, and the bytes of the diffs
+against a full list of the catalog per change. It fails if a room isn't created, isn't listed,
+can't be joined, or isn't deleted after being idle, or if the listener's copy of the catalog
+ends up differing from the server's.
+
+Example:
+        $ python -m benchmarks.bench_rooms --rooms 5000 --idle 5
+"""
+
+import argparse
+import asyncio
+import sys
+import time
+
+from benchmarks.bench_engine import start_server, wait_for_server
+from chat_client import ChatClient
+from chat_protocol import *
+from chat_server import ROOMS_PAGE
+
+
+class Listener:
+    """A client that keeps its own copy of the catalog from the ROOMS frames it gets"""
+
+    def __init__(self):
+        self.rooms = {}  # room_id -> name
+        self.diff_bytes = 0  # the bytes of the diffs, after the first page
+        self.listed = False
+        self.client = None
+
+    def on_frame(self, frame):
+        if frame[0] != ROOMS:
+            return
+        kind, value = parse_rooms_payload(frame[3])
+        if self.listed:
+            self.diff_bytes += len(
+                compose_frame(self.client.version, ROOMS, frame[1], 0, frame[3])
+            )
+        if kind == "+":
+            self.rooms[value[0]] = value[1]
+        elif kind == "-":
+            self.rooms.pop(value[0], None)
+
+    async def listen(self, host, port):
+        self.client = ChatClient("listener", host, port, on_frame=self.on_frame)
+        await self.client.connect()
+        _, following = await self.client.list_rooms()
+        while following:  # the catalog of a server that has rooms already
+            _, following = await self.client.list_rooms(following)
+        self.listed = True
+
+
+async def page_all(client):
+    """It lists the whole catalog and returns ({room_id: name}, pages)"""
+    catalog, pages, following = {}, 0, 0
+    while True:
+        page, following = await client.list_rooms(following)
+        catalog.update(page)
+        pages += 1
+        if not following:
+            return catalog, pages
+
+
+async def wait_until(predicate, timeout):
+    deadline = time.monotonic() + timeout
+    while not predicate() and time.monotonic() < deadline:
+        await asyncio.sleep(0.05)
+    return predicate()
+
+
+async def run(args):
+    host = "127.0.0.1"
+    server = start_server(
+        host,
+        args.port,
+        max_clients=args.creators + args.joiners + 10,
+        max_rooms=args.rooms + BUILTIN_ROOMS,
+        room_idle_timeout=args.idle,
+    )
+    clients = []
+    results = {"failures": []}
+    failures = results["failures"]
+    try:
+        await wait_for_server(host, args.port)
+        listener = Listener()
+        await listener.listen(host, args.port)
+        clients.append(listener.client)
+
+        creators = [
+            await ChatClient(f"c{idx}", host, args.port).connect()
+            for idx in range(args.creators)
+        ]
+        clients += creators
+        names = [f"room {idx}" for idx in range(args.rooms)]
+        start = time.perf_counter()
+        created = await asyncio.gather(
+            *(
+                creators[idx % args.creators].create_room(name, args.timeout)
+                for idx, name in enumerate(names)
+            )
+        )
+        results["create_time"] = time.perf_counter() - start
+        if len(set(created)) != args.rooms:
+            failures.append(f"{len(set(created))}/{args.rooms} distinct rooms created")
+        await wait_until(
+            lambda: len(listener.rooms) >= args.rooms + BUILTIN_ROOMS, args.timeout
+        )
+        results["diff_bytes"] = listener.diff_bytes
+
+        async with ChatClient("pager", host, args.port) as pager:
+            start = time.perf_counter()
+            catalog, results["pages"] = await page_all(pager)
+            results["page_time"] = time.perf_counter() - start
+        listed = {name for room_id, name in catalog.items() if room_id >= BUILTIN_ROOMS}
+        if listed != set(names):
+            failures.append(f"{len(set(names) - listed)} created rooms not listed")
+        # a full list per change: what a client without the diffs would read
+        page_bytes = sum(
+            len(compose_frame(PROTOCOL_V3, ROOMS, "pager", 0, rooms_payload("+", room)))
+            for room in catalog.items()
+        )
+        results["list_bytes"] = page_bytes
+
+        joiners = [
+            await ChatClient(f"j{idx}", host, args.port).connect()
+            for idx in range(args.joiners)
+        ]
+        clients += joiners
+        for idx, joiner in enumerate(joiners):
+            await page_all(joiner)  # every client knows the rooms of its own catalog
+            await joiner.join_room(names[idx * args.rooms // args.joiners])
+        received = []
+        joiners[0].on_frame = received.append
+        for joiner in joiners:
+            if joiner.room == joiners[0].room:
+                joiner.send(f"hello from {joiner.nickname}")
+        await wait_until(
+            lambda: sum(f[0] == CHAT_CONVERSATION for f in received)
+            >= sum(j.room == joiners[0].room for j in joiners),
+            args.timeout,
+        )
+        if not any(f[0] == CHAT_CONVERSATION for f in received):
+            failures.append("no message relayed in a created room")
+        for joiner in joiners:
+            await joiner.join_room("Lobby")
+
+        start = time.perf_counter()
+        emptied = await wait_until(
+            lambda: len(listener.rooms) == BUILTIN_ROOMS, args.idle + args.timeout
+        )
+        results["cleanup_time"] = time.perf_counter() - start
+        if not emptied:
+            failures.append(
+                f"{len(listener.rooms) - BUILTIN_ROOMS} rooms not deleted after "
+                f"{args.idle + args.timeout:.0f} s idle"
+            )
+        async with ChatClient("checker", host, args.port) as checker:
+            catalog, _ = await page_all(checker)
+        if catalog != listener.rooms:
+            failures.append(
+                f"the listener has {len(listener.rooms)} rooms, the server {len(catalog)}"
+            )
+    finally:
+        for client in clients:
+            client.close()
+        server.terminate()
+        server.wait()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--port", type=int, default=10691)
+    parser.add_argument("--rooms", type=int, default=5000)
+    parser.add_argument("--creators", type=int, default=20)
+    parser.add_argument("--joiners", type=int, default=50)
+    parser.add_argument("--idle", type=float, default=5.0, help="seconds")
+    parser.add_argument("--timeout", type=float, default=30.0, help="seconds")
+    args = parser.parse_args()
+
+    results = asyncio.run(run(args))
+    failures = results["failures"]
+    if "create_time" in results:
+        print(
+            f"{args.rooms} rooms created by {args.creators} clients in "
+            f"{results['create_time']:.2f} s: "
+            f"{args.rooms / results['create_time']:.0f} rooms/s"
+        )
+    if "page_time" in results:
+        print(
+            f"catalog listed in {results['pages']} pages of {ROOMS_PAGE}, "
+            f"{results['page_time'] * 1000:.0f} ms"
+        )
+        per_diff = results["diff_bytes"] / args.rooms
+        print(
+            f"listener: {per_diff:.0f} bytes per created room as a diff, "
+            f"{results['list_bytes']} bytes for a full list of the catalog"
+        )
+    if "cleanup_time" in results:
+        print(f"idle rooms deleted {results['cleanup_time']:.2f} s after the last left")
+    for failure in failures:
+        print(f"FAILED: {failure}")
+    if failures:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
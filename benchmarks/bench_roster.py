@@ -0,0 +1,207 @@
+# -*- coding: utf-8 -*-
+"""
+The rosters of the rooms: the presence bytes a big room costs its members with the ROSTER
+snapshots and diffs vs. the ENTER_ROOM / EXIT_ROOM broadcasts, the time a client joining the
+room takes to know who is there, and the rosters' consistency under churn.
+
+The server runs twice: once with clients that never ask for the roster (they hear of the
+presence from the ENTER_ROOM / EXIT_ROOM frames, as before), once with clients that do
+(list_members()). Each time `--members` clients join 'Private Room 1', then `--churn` of them
+leave the room for the 'Lobby' and come back, and `--drops` of them disconnect. It reports the
+bytes the clients have received for the churn, per client: it fails if the roster run costs
+more than `--max-ratio` times the broadcast run. The disconnects are reported apart: only the
+roster tells them. In the roster run, `--joins` clients then join the room one after the other,
+the time from the ENTER_ROOM to the room's first page is timed: it fails if the 99th percentile
+is over `--max-join` ms. Then a client pages through the whole roster: it fails if the pages
+aren't the room's members, or if a member's roster (its count, and the members it knows) differs
+from them.
+
+Example:
+        $ python -m benchmarks.bench_roster --members 2000 --churn 200 --drops 100
+"""
+
+import argparse
+import asyncio
+import statistics
+import sys
+import time
+
+from benchmarks.bench_engine import start_server, wait_for_server
+from chat_client import ChatClient
+from chat_server import ROSTER_PAGE, raise_open_files_limit
+
+ROOM = "Private Room 1"
+
+
+class CountingClient(ChatClient):
+    """A ChatClient that counts the bytes it receives"""
+
+    received = 0
+
+    def buffer_updated(self, nbytes):
+        self.received += nbytes
+        super().buffer_updated(nbytes)
+
+
+async def settle(clients, quiet=0.3, timeout=60.0):
+    """It waits until the clients haven't received anything for `quiet` seconds"""
+    deadline = time.monotonic() + timeout
+    total = -1
+    while time.monotonic() < deadline:
+        current = sum(client.received for client in clients)
+        if current == total:
+            return
+        total = current
+        await asyncio.sleep(quiet)
+
+
+async def wait_until(predicate, timeout):
+    deadline = time.monotonic() + timeout
+    while not predicate() and time.monotonic() < deadline:
+        await asyncio.sleep(0.001)
+    return predicate()
+
+
+async def page_all(client):
+    """It lists the whole roster of the client's room and returns ({member_id: nickname}, pages)"""
+    roster, pages, after = {}, 0, 0
+    while True:
+        page, after = await client.list_members(after)
+        roster.update(page)
+        pages += 1
+        if not after:
+            return roster, pages
+
+
+async def run(port, rostered, args):
+    """It returns the results of a run, with the roster (`rostered`) or without it"""
+    host = "127.0.0.1"
+    server = start_server(host, port, max_clients=args.members + args.joins + 10)
+    clients = []
+    results = {"failures": []}
+    failures = results["failures"]
+    try:
+        await wait_for_server(host, port)
+        for idx in range(args.members):
+            clients.append(await CountingClient(f"m{idx}", host, port).connect())
+        for client in clients:
+            await client.join_room(ROOM)
+            if rostered:
+                await client.list_members()
+        await settle(clients)
+
+        churners = clients[: args.churn]
+        dropped = clients[args.churn : args.churn + args.drops]
+        members = clients[args.churn + args.drops :] + churners
+        before = sum(client.received for client in clients)
+        for client in churners:
+            await client.join_room("Lobby")
+        for client in churners:
+            await client.join_room(ROOM)
+        await settle(clients)
+        results["per_client"] = (
+            sum(client.received for client in clients) - before
+        ) / args.members
+        before = sum(client.received for client in members)
+        for client in dropped:
+            client.close()
+            await client.wait_closed()
+        await settle(members)
+        drops = sum(client.received for client in members) - before
+        results["per_drop"] = drops / max(args.drops, 1) / len(members)
+        if not rostered:
+            return results
+
+        latencies = []
+        for idx in range(args.joins):
+            joiner = await CountingClient(f"j{idx}", host, port).connect()
+            clients.append(joiner)
+            await joiner.list_members()
+            start = time.perf_counter()
+            await joiner.join_room(ROOM, wait=False)
+            if not await wait_until(
+                lambda: joiner.members_count == len(members) + 1, args.timeout
+            ):
+                failures.append(f"{joiner.nickname} got no page of the room")
+                break
+            latencies.append((time.perf_counter() - start) * 1000)
+            members.append(joiner)
+        results["latencies"] = latencies
+        await settle(members)
+
+        start = time.perf_counter()
+        roster, results["pages"] = await page_all(members[-1])
+        results["page_time"] = time.perf_counter() - start
+        expected = {client.nickname for client in members}
+        if sorted(roster.values()) != sorted(expected):
+            failures.append(
+                f"the pages have {len(roster)} members, the room {len(expected)}"
+            )
+        wrong = [
+            client.nickname
+            for client in members
+            if client.members_count != len(expected)
+            or any(roster.get(key) != name for key, name in client.members.items())
+        ]
+        if wrong:
+            failures.append(f"{len(wrong)} members' rosters differ, e.g. {wrong[0]}")
+    finally:
+        for client in clients:
+            client.close()
+        server.terminate()
+        server.wait()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--port", type=int, default=10891)
+    parser.add_argument("--members", type=int, default=1000)
+    parser.add_argument("--churn", type=int, default=100, help="leave and come back")
+    parser.add_argument("--drops", type=int, default=50, help="disconnect")
+    parser.add_argument("--joins", type=int, default=20, help="timed joins")
+    parser.add_argument("--max-ratio", type=float, default=0.75)
+    parser.add_argument("--max-join", type=float, default=100.0, help="ms, p99")
+    parser.add_argument("--timeout", type=float, default=30.0, help="seconds")
+    args = parser.parse_args()
+    raise_open_files_limit()
+
+    broadcast = asyncio.run(run(args.port, False, args))
+    roster = asyncio.run(run(args.port + 1, True, args))
+    failures = broadcast["failures"] + roster["failures"]
+    if "per_client" in broadcast and "per_client" in roster:
+        ratio = roster["per_client"] / broadcast["per_client"]
+        print(
+            f"{args.members} members, {args.churn} leave and come back, {args.drops} "
+            f"disconnect: {broadcast['per_client']:.0f} bytes per client with the "
+            f"ENTER_ROOM / EXIT_ROOM broadcasts, {roster['per_client']:.0f} with the "
+            f"roster ({ratio:.2f}x, max {args.max_ratio}x)"
+        )
+        if ratio > args.max_ratio:
+            failures.append(f"the roster costs {ratio:.2f}x the broadcasts")
+        print(
+            f"a disconnect: {broadcast['per_drop']:.0f} bytes per member of the room with "
+            f"the broadcasts, {roster['per_drop']:.0f} with the roster"
+        )
+    if latencies := roster.get("latencies"):
+        p99 = sorted(latencies)[int(len(latencies) * 0.99)]
+        print(
+            f"joining a room of {args.members - args.drops} members: the first page of "
+            f"{ROSTER_PAGE} in {statistics.median(latencies):.2f} ms median, "
+            f"{p99:.2f} ms p99 (max {args.max_join} ms)"
+        )
+        if p99 > args.max_join:
+            failures.append(f"the first page took {p99:.1f} ms p99")
+    if "page_time" in roster:
+        print(
+            f"the whole roster listed in {roster['pages']} pages, "
+            f"{roster['page_time'] * 1000:.0f} ms"
+        )
+    for failure in failures:
+        print(f"FAILED: {failure}")
+    if failures:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
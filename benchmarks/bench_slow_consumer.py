@@ -0,0 +1,175 @@
+# -*- coding: utf-8 -*-
+"""
+Slow consumer check: one stalled reader must not slow down the other clients of its room.
+
+`--clients` clients join one room; `--senders` of them send `--messages` CHAT_CONVERSATION
+messages each, as fast as the server takes them. The run is done twice: with all the clients
+reading, and with one more client in the room that joins and then never reads (small receive
+buffer). The delivery throughput to the reading clients is compared for every overflow policy.
+
+It fails if a reading client is disconnected, under any policy. With DROP_OLDEST and DISCONNECT
+it fails if the throughput with the stalled client is under `--min-ratio` times the one without.
+BLOCK is out of that claim: it holds the room back to the stalled client until `--block-timeout`
+disconnects it, by design. It fails instead if a reading client misses a message. This script
+is the test of the overflow policies: it exits with 1 on a failure.
+
+Example:
+        $ python -m benchmarks.bench_slow_consumer --clients 99 --messages 1000
+"""
+
+import argparse
+import asyncio
+import socket
+import sys
+import time
+
+from benchmarks.bench_engine import BenchClient, start_server, wait_for_server
+from chat_protocol import *
+from chat_server import (
+    BLOCK,
+    BLOCK_TIMEOUT,
+    DISCONNECT,
+    DROP_OLDEST,
+    raise_open_files_limit,
+)
+
+
+class StalledClient(BenchClient):
+    """A client that joins the room and then stops reading"""
+
+    async def connect(self, host, port):
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 4096)
+        sock.setblocking(False)
+        await asyncio.get_running_loop().sock_connect(sock, (host, port))
+        self.reader, self.writer = await asyncio.open_connection(sock=sock)
+
+
+async def delivery_run(host, port, args, stalled):
+    stats = {"latency": []}
+    room_id = 1
+    clients = [BenchClient(idx, room_id, stats) for idx in range(args.clients)]
+    for client in clients:
+        await client.join(host, port)
+    slow = None
+    if stalled:
+        slow = StalledClient(args.clients, room_id, {"latency": []})
+        await slow.join(host, port)
+
+    listeners = [asyncio.create_task(c.listen()) for c in clients]
+    expected = args.clients * args.senders * args.messages
+    start = time.perf_counter()
+    for _ in range(args.messages):
+        for sender in clients[: args.senders]:
+            payload = f"{time.perf_counter_ns():<{MAX_PAYLOAD}}"  # full size
+            sender.send(CHAT_CONVERSATION, room_id, payload)
+        await asyncio.gather(*(s.writer.drain() for s in clients[: args.senders]))
+    deadline = time.monotonic() + args.timeout
+    while len(stats["latency"]) < expected and time.monotonic() < deadline:
+        await asyncio.sleep(0.01)
+    elapsed = time.perf_counter() - start
+
+    readers_lost = sum(client.reader.at_eof() for client in clients)
+    evicted = None
+    if slow is not None:
+        slow.writer.transport.resume_reading()
+        try:  # drain what the server kept for the stalled client, EOF means it was evicted
+            while True:
+                await asyncio.wait_for(read_any(slow.reader), 1.0)
+        except asyncio.IncompleteReadError:
+            evicted = True
+        except (asyncio.TimeoutError, ConnectionError):
+            evicted = False
+        slow.writer.close()
+    for client in clients:
+        client.writer.close()
+    for task in listeners:
+        task.cancel()
+    await asyncio.sleep(0.2)  # let the server clean up
+    delivered = len(stats["latency"])
+    return delivered / elapsed, delivered, expected, evicted, readers_lost
+
+
+async def read_any(reader):
+    if not await reader.read(RECV_BUFSIZE):
+        raise asyncio.IncompleteReadError(b"", None)
+
+
+async def run(args):
+    host = "127.0.0.1"
+    print(
+        f"{'policy':<12} {'stalled':<8} {'delivered':>15} {'frames/s':>10} "
+        f"{'ratio':>6} {'readers lost':>13}  stalled client"
+    )
+    failures = []
+    for idx, policy in enumerate(args.policy):
+        port = args.port + idx
+        server = start_server(
+            host,
+            port,
+            max_clients=args.clients + 2,
+            overflow_policy=policy,
+            outbox_size=args.outbox,
+            block_timeout=args.block_timeout,
+            send_buffer=args.sndbuf,
+        )
+        try:
+            await wait_for_server(host, port)
+            base, *_ = await delivery_run(host, port, args, stalled=False)
+            rate, delivered, expected, evicted, lost = await delivery_run(
+                host, port, args, stalled=True
+            )
+        finally:
+            server.terminate()
+            server.wait()
+        outcome = "evicted" if evicted else "kept (messages dropped)"
+        print(
+            f"{policy:<12} {'no':<8} {'':>15} {base:>10.0f}\n"
+            f"{policy:<12} {'yes':<8} {f'{delivered}/{expected}':>15} {rate:>10.0f} "
+            f"{rate / base:>6.2f} {lost:>13}  {outcome}"
+        )
+        if lost:
+            failures.append(f"{policy}: {lost} reading clients disconnected")
+        if policy == BLOCK:
+            if delivered < expected:
+                failures.append(f"{policy}: {delivered}/{expected} messages delivered")
+        elif rate / base < args.min_ratio:
+            failures.append(
+                f"{policy}: {rate / base:.2f}x the throughput, min {args.min_ratio}x"
+            )
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--port", type=int, default=9291)
+    parser.add_argument("--policy", nargs="+", default=[DROP_OLDEST, DISCONNECT, BLOCK])
+    parser.add_argument("--clients", type=int, default=99, help="reading clients")
+    parser.add_argument("--senders", type=int, default=10)
+    parser.add_argument("--messages", type=int, default=1000, help="per sender")
+    parser.add_argument("--outbox", type=int, default=256, help="outbound queue size")
+    parser.add_argument("--block-timeout", type=float, default=BLOCK_TIMEOUT)
+    parser.add_argument(
+        "--min-ratio",
+        type=float,
+        default=0.5,
+        help="throughput with/without the stalled client, but BLOCK",
+    )
+    parser.add_argument(
+        "--sndbuf",
+        type=int,
+        default=16 * BUFSIZE,
+        help="server SO_SNDBUF, 0: OS default",
+    )
+    parser.add_argument("--timeout", type=float, default=60.0)
+    args = parser.parse_args()
+    raise_open_files_limit()
+    failures = asyncio.run(run(args))
+    for failure in failures:
+        print(f"FAILED: {failure}")
+    if failures:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
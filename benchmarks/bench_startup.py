@@ -0,0 +1,102 @@
+# -*- coding: utf-8 -*-
+"""
+Cold start and memory of the chat server: headless mode vs. GUI mode.
+
+Every run starts a new `python -m chat_server` process and measures:
+    import   : the time to import the server modules ('chat_server' / 'chat_server_ui')
+    ready    : the time from the process start until the server socket accepts connections
+    rss / hwm: the resident memory (current / peak) of the server once it is ready
+The GUI mode needs PySimpleGUI and a display, it is reported as skipped when they are missing.
+
+Example:
+        $ python -m benchmarks.bench_startup --runs 5
+"""
+
+import argparse
+import asyncio
+import statistics
+import subprocess
+import sys
+import time
+
+from benchmarks.bench_engine import wait_for_server
+
+MODES = {
+    "headless": ("chat_server", ["--headless", "--log-level", "WARNING"]),
+    "gui": ("chat_server_ui", []),
+}
+
+
+def import_time(module):
+    """It returns the seconds a new interpreter takes to import the module, None on error"""
+    code = f"import time; t = time.perf_counter(); import {module}; print(time.perf_counter() - t)"
+    proc = subprocess.run(
+        [sys.executable, "-c", code], capture_output=True, text=True, check=False
+    )
+    return float(proc.stdout) if proc.returncode == 0 else None
+
+
+def memory(pid):
+    """It returns (VmRSS, VmHWM) in MB of the process, read from /proc (Linux only)"""
+    values = {}
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                key, _, value = line.partition(":")
+                if key in ("VmRSS", "VmHWM"):
+                    values[key] = int(value.split()[0]) / 1024
+    except OSError:
+        pass
+    return values.get("VmRSS", float("nan")), values.get("VmHWM", float("nan"))
+
+
+def ready_time(mode, port):
+    """It starts the server and returns (seconds until it accepts, rss, hwm), None on error"""
+    _, flags = MODES[mode]
+    start = time.perf_counter()
+    proc = subprocess.Popen(
+        [sys.executable, "-m", "chat_server", "--port", str(port), *flags],
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    try:
+        asyncio.run(wait_for_server("127.0.0.1", port, timeout=10.0))
+        elapsed = time.perf_counter() - start
+        if proc.poll() is not None:
+            return None
+        return (elapsed, *memory(proc.pid))
+    except OSError:
+        return None
+    finally:
+        proc.terminate()
+        proc.wait()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--port", type=int, default=9391)
+    parser.add_argument("--runs", type=int, default=5)
+    args = parser.parse_args()
+
+    print(f"{'mode':<9} {'import ms':>10} {'ready ms':>9} {'rss MB':>7} {'hwm MB':>7}")
+    for mode, (module, _) in MODES.items():
+        imports = [import_time(module) for _ in range(args.runs)]
+        if None in imports:
+            print(
+                f"{mode:<9} skipped: 'import {module}' failed (PySimpleGUI, display?)"
+            )
+            continue
+        runs = [ready_time(mode, args.port + idx) for idx in range(args.runs)]
+        if None in runs:
+            print(f"{mode:<9} skipped: the server did not start")
+            continue
+        ready, rss, hwm = zip(*runs)
+        print(
+            f"{mode:<9} {statistics.median(imports) * 1e3:>10.1f} "
+            f"{statistics.median(ready) * 1e3:>9.1f} "
+            f"{statistics.median(rss):>7.1f} {statistics.median(hwm):>7.1f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,140 @@
+# -*- coding: utf-8 -*-
+"""
+The client's room transcripts: memory through hours of busy chat, and the cost of entering a
+room and of scrolling back, whatever the size of the room's transcript file.
+
+A Transcript takes `--lines` chat lines, spread over `--rooms` rooms the way a client moves
+between them (a run of `--run` lines in a room, then the next room). The memory the process has
+allocated (tracemalloc) is sampled every tenth of the run: it fails if the last sample is more
+than `--max-growth` percent over the one after the second tenth. Then a room is entered cold
+(its file closed, its recent lines read back from the end of a file of `--lines / --rooms`
+lines), and the older lines are read a page at a time, from the end of the file back to its
+start: it fails if entering takes more than `--max-enter` ms, or if a page read at the start of
+the file takes more than `--max-page` ms. It also fails if the lines read back aren't the ones
+appended, in order.
+
+Example:
+        $ python -m benchmarks.bench_transcript --lines 1000000 --rooms 10
+"""
+
+import argparse
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+
+from chat_client import TRANSCRIPT_LINES, Transcript
+
+PAGE = 200  # the older lines read at once, like the GUI's chat view
+
+
+def chat_line(idx):
+    """It returns the idx-th chat line of the run, a message of about 60 characters"""
+    return [
+        1697541234.5 + idx,
+        "chat",
+        f"user{idx % 50}",
+        f"message {idx} " + "x" * 48,
+        0,
+    ]
+
+
+def fill(transcript, args):
+    """
+    It appends the lines, and returns the memory samples (bytes) and the lines/s. The first
+    tenth is timed, tracemalloc traces the others.
+    """
+    samples, tenth = [], args.lines // 10
+    start = time.perf_counter()
+    for idx in range(args.lines):
+        if idx == tenth:
+            rate = tenth / (time.perf_counter() - start)
+            tracemalloc.start()
+        transcript.append(f"Room {idx // args.run % args.rooms}", chat_line(idx))
+        if idx > tenth and (idx + 1) % tenth == 0:
+            samples.append(tracemalloc.get_traced_memory()[0])
+    tracemalloc.stop()
+    transcript.flush()
+    return samples, rate
+
+
+def expected(args, room_idx):
+    """It returns the texts of the room's lines, in order"""
+    return [
+        chat_line(idx)[3]
+        for idx in range(args.lines)
+        if idx // args.run % args.rooms == room_idx
+    ]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--lines", type=int, default=300_000)
+    parser.add_argument("--rooms", type=int, default=10)
+    parser.add_argument("--run", type=int, default=1000, help="lines in a room at once")
+    parser.add_argument("--max-growth", type=float, default=10.0, help="%%")
+    parser.add_argument("--max-enter", type=float, default=50.0, help="ms")
+    parser.add_argument("--max-page", type=float, default=20.0, help="ms")
+    args = parser.parse_args()
+
+    directory = tempfile.mkdtemp(prefix="chat-transcript-")
+    failures = []
+    try:
+        transcript = Transcript(directory)
+        samples, rate = fill(transcript, args)
+        transcript.close()
+        growth = (samples[-1] / samples[0] - 1) * 100
+        print(
+            f"{args.lines} lines appended over {args.rooms} rooms: {rate:.0f} lines/s, "
+            f"memory {samples[0] / 1024:.0f} KiB after two tenths, "
+            f"{samples[-1] / 1024:.0f} KiB at the end ({growth:+.1f} %)"
+        )
+        if growth > args.max_growth:
+            failures.append(f"the memory grew {growth:.1f} % (max {args.max_growth} %)")
+
+        room = "Room 0"
+        transcript = Transcript(directory)
+        start = time.perf_counter()
+        recent = transcript.recent(room)
+        enter = (time.perf_counter() - start) * 1000
+        size = transcript._room(room).size
+        print(
+            f"entering a room cold: {len(recent)} recent lines of a "
+            f"{size / 1024 / 1024:.1f} MiB transcript in {enter:.2f} ms "
+            f"(max {args.max_enter} ms)"
+        )
+        if enter > args.max_enter:
+            failures.append(f"entering a room took {enter:.1f} ms")
+
+        pages, times = [recent], []
+        offset = recent[0][0]
+        while offset:
+            start = time.perf_counter()
+            pages.append(transcript.older(room, offset, PAGE))
+            times.append((time.perf_counter() - start) * 1000)
+            offset = pages[-1][0][0]
+        transcript.close()
+        lines = [line for page in reversed(pages) for _, line in page]
+        print(
+            f"scrolling back: {len(times)} pages of {PAGE} lines, "
+            f"median {statistics.median(times):.2f} ms, the first {times[0]:.2f} ms, "
+            f"the last (the file's start) {times[-1]:.2f} ms (max {args.max_page} ms)"
+        )
+        if times[-1] > args.max_page:
+            failures.append(f"a page at the file's start took {times[-1]:.1f} ms")
+        if [line[3] for line in lines] != expected(args, 0):
+            failures.append("the lines read back aren't the ones appended")
+        if len(recent) != min(TRANSCRIPT_LINES, len(lines)):
+            failures.append(f"{len(recent)} recent lines kept")
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+    for failure in failures:
+        print(f"FAILED: {failure}")
+    if failures:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,222 @@
+# -*- coding: utf-8 -*-
+"""
+Large transfers: the throughput of a file sent to a room as CHUNK frames (protocol v3), and the
+chat latency of the room's members while it streams.
+
+It starts a server and connects `--receivers` ChatClients into one room, plus `--chatters`
+clients that send a CHAT_CONVERSATION message every `--interval` seconds. The receivers measure
+the latency of the chat messages, for `--baseline` seconds without a transfer, then while a
+client in another process sends a `--size` MB file to the room. It reports the transfer's
+throughput, the chat latency of both runs, and the server's memory. It fails if a receiver
+doesn't get the file as sent, if the server grows by half the file or more (it would be holding
+the transfer), or if the chat p99 during the transfer exceeds `--max-p99` ms.
+
+Example:
+        $ python -m benchmarks.bench_transfer --size 50 --receivers 5
+"""
+
+import argparse
+import asyncio
+import concurrent.futures
+import hashlib
+import os
+import sys
+import tempfile
+import time
+
+from benchmarks.bench_engine import proc_usage, start_server, wait_for_server
+from chat_client import ChatClient
+from chat_protocol import *
+
+ROOM = "Private Room 1"
+
+
+class Receiver:
+    """A member of the room: it hashes the transfer's data and times the chat messages"""
+
+    def __init__(self, idx, latency):
+        self.nickname = f"r{idx}"
+        self.latency = latency  # the phase's list, swapped by run()
+        self.digest = hashlib.sha256()
+        self.received = 0
+        self.done = asyncio.get_running_loop().create_future()
+        self.client = None
+
+    def on_frame(self, frame):
+        if frame[0] == CHAT_CONVERSATION:
+            self.latency[0].append(time.perf_counter_ns() - int(frame[3]))
+        elif frame[0] == CHUNK:
+            _, kind, data = parse_chunk_payload(frame[3])
+            if kind == CHUNK_DATA:
+                self.digest.update(data)
+                self.received += len(data)
+            elif kind != CHUNK_START and not self.done.done():
+                self.done.set_result(kind)
+
+    async def join(self, host, port):
+        self.client = ChatClient(self.nickname, host, port, on_frame=self.on_frame)
+        await self.client.connect()
+        await self.client.join_room(ROOM)
+
+
+async def chat(client, interval, until):
+    """It sends a time stamp to the room every `interval` seconds until `until`"""
+    while time.monotonic() < until:
+        client.send(str(time.perf_counter_ns()))
+        await asyncio.sleep(interval)
+
+
+async def send(host, port, path):
+    """It sends the file to the room and returns the seconds it took"""
+    async with ChatClient("sender", host, port) as client:
+        await client.join_room(ROOM)
+        start = time.perf_counter()
+        await client.send_file(path)
+        elapsed = time.perf_counter() - start
+        # the last chunks are written before the connection is closed
+        await asyncio.sleep(0.5)
+    return elapsed
+
+
+def send_process(host, port, path):
+    """send() in the process of the ProcessPoolExecutor"""
+    return asyncio.run(send(host, port, path))
+
+
+def make_file(size):
+    """It writes `size` random bytes to a temporary file and returns (path, sha256)"""
+    digest = hashlib.sha256()
+    with tempfile.NamedTemporaryFile(prefix="chat-transfer-", delete=False) as file:
+        for start in range(0, size, 1 << 20):
+            data = os.urandom(min(1 << 20, size - start))
+            digest.update(data)
+            file.write(data)
+    return file.name, digest.hexdigest()
+
+
+async def sample_memory(pid, peak, until):
+    """It keeps the peak RSS (MB) of the process in peak[0] until the future is done"""
+    while not until.done():
+        peak[0] = max(peak[0], proc_usage(pid)[1])
+        await asyncio.sleep(0.02)
+
+
+async def run(args, path):
+    host = "127.0.0.1"
+    server = start_server(
+        host, args.port, max_clients=args.receivers + args.chatters + 10
+    )
+    clients = []
+    try:
+        await wait_for_server(host, args.port)
+        latency = [[]]
+        receivers = [Receiver(idx, latency) for idx in range(args.receivers)]
+        for receiver in receivers:
+            await receiver.join(host, args.port)
+        chatters = [
+            ChatClient(f"c{idx}", host, args.port) for idx in range(args.chatters)
+        ]
+        for chatter in chatters:
+            await chatter.connect()
+            await chatter.join_room(ROOM)
+        clients = [receiver.client for receiver in receivers] + chatters
+
+        until = time.monotonic() + args.baseline
+        await asyncio.gather(*(chat(c, args.interval, until) for c in chatters))
+        await asyncio.sleep(0.2)
+        baseline, latency[0] = latency[0], []
+
+        rss_before = proc_usage(server.pid)[1]
+        peak = [rss_before]
+        loop = asyncio.get_running_loop()
+        with concurrent.futures.ProcessPoolExecutor(1) as process:
+            sending = loop.run_in_executor(process, send_process, host, args.port, path)
+            received = asyncio.gather(*(r.done for r in receivers))
+            done = asyncio.ensure_future(
+                asyncio.wait_for(asyncio.gather(sending, received), args.timeout)
+            )
+            memory = asyncio.create_task(sample_memory(server.pid, peak, done))
+            talk = [
+                asyncio.create_task(chat(c, args.interval, float("inf")))
+                for c in chatters
+            ]
+            start = time.perf_counter()
+            try:
+                await received
+                transfer_time = time.perf_counter() - start
+                send_time, _ = await done
+            finally:
+                for task in talk:
+                    task.cancel()
+                await memory
+        await asyncio.sleep(0.2)
+        during = latency[0]
+    finally:
+        for client in clients:
+            client.close()
+        server.terminate()
+        server.wait()
+    return receivers, baseline, during, transfer_time, send_time, rss_before, peak[0]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--port", type=int, default=10591)
+    parser.add_argument("--size", type=float, default=50, help="MB")
+    parser.add_argument("--receivers", type=int, default=5)
+    parser.add_argument("--chatters", type=int, default=5)
+    parser.add_argument("--interval", type=float, default=0.01, help="seconds")
+    parser.add_argument("--baseline", type=float, default=2.0, help="seconds")
+    parser.add_argument("--timeout", type=float, default=120.0, help="seconds")
+    parser.add_argument("--max-p99", type=float, default=100.0, help="ms")
+    args = parser.parse_args()
+
+    size = int(args.size * (1 << 20))
+    path, digest = make_file(size)
+    try:
+        receivers, baseline, during, transfer_time, send_time, rss_before, rss_peak = (
+            asyncio.run(run(args, path))
+        )
+    finally:
+        os.remove(path)
+
+    pct = lambda values, p: sorted(values)[min(len(values) - 1, int(len(values) * p))]
+    megabytes = size / (1 << 20)
+    print(
+        f"{megabytes:.0f} MB to {args.receivers} receivers in {transfer_time:.2f} s: "
+        f"{megabytes / transfer_time:.1f} MB/s per receiver, "
+        f"{megabytes * args.receivers / transfer_time:.1f} MB/s relayed "
+        f"(sent in {send_time:.2f} s, {size // CHUNK_SIZE + 1} chunks)"
+    )
+    failures = []
+    for label, latency in (("no transfer", baseline), ("transfer", during)):
+        if not latency:
+            failures.append(f"no chat messages received, {label}")
+            continue
+        print(
+            f"chat ms, {label:<11}: p50 {pct(latency, 0.5) / 1e6:6.2f}  "
+            f"p99 {pct(latency, 0.99) / 1e6:6.2f}  max {max(latency) / 1e6:6.2f}  "
+            f"({len(latency)} messages)"
+        )
+    print(f"server RSS: {rss_before:.1f} MB before, {rss_peak:.1f} MB peak")
+
+    for receiver in receivers:
+        if receiver.received != size or receiver.digest.hexdigest() != digest:
+            failures.append(
+                f"{receiver.nickname} got {receiver.received}/{size} bytes, "
+                f"{'same' if receiver.digest.hexdigest() == digest else 'different'} data"
+            )
+    if rss_peak - rss_before >= megabytes / 2:
+        failures.append(f"the server grew by {rss_peak - rss_before:.1f} MB")
+    if during and pct(during, 0.99) / 1e6 > args.max_p99:
+        failures.append(
+            f"chat p99 {pct(during, 0.99) / 1e6:.2f} ms > {args.max_p99} ms"
+        )
+    for failure in failures:
+        print(f"FAILED: {failure}")
+    if failures:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,1252 @@
+# -*- coding: utf-8 -*-
+"""
+The chat client library: the connection, the nickname handshake, the framing and the room state
+of a chat client, without any GUI. `ChatClient` runs in an asyncio event loop, one small object
+per connection, so one process can drive thousands of clients (bots, tests, load generators).
+`BlockingChatClient` wraps it for threads and scripts. The GUI ('chat_client_ui.py') is a thin
+layer on top of a BlockingChatClient.
+
+A client that loses its connection reconnects by itself, with exponential backoff and jitter, and
+resumes its session: it enters its room again, asks for the room's history after the last message
+it saw, and hands over only the messages it missed. Its messages that the server never relayed
+back are sent again. See Resume.
+
+With protocol v3 the received frames are Frame tuples: the server's `seq` and `time` of every
+message. A room's message is handed over once, even if the server sends it again.
+
+Once list_members() has asked for a page of its room's members, a client keeps its room's roster
+(`members`): the server sends the first page every time the client enters a room, then the
+members that enter and leave it, in place of their ENTER_ROOM / EXIT_ROOM frames.
+
+Files, and messages longer than MAX_PAYLOAD, are sent with send_file() as a transfer of CHUNK
+frames (v3): the received CHUNK frames are handed over like the others, a FileReceiver saves them.
+
+A Transcript keeps what a client has shown of its rooms: a file per room that only grows, and
+the room's recent lines in memory; the older lines are read back from the file when asked for.
+
+Example:
+        async with ChatClient("Alice", host, port) as client:
+            await client.join_room("Private Room 1", history=20)
+            client.send("Hello everybody")
+            async for msg_type, nickname, room_name, payload in client:
+                ...
+
+        client = BlockingChatClient("Bob", host, port)
+        client.connect()
+        client.send("Hi")
+        frame = client.receive(timeout=1.0)
+
+@Author: Vadim Moldavsky   vasja34@gmail.com
+@Date:   17/08/2022
+"""
+
+import asyncio
+import collections
+import io
+import json
+import os
+import queue
+import random
+import threading
+import time
+import urllib.parse
+
+from chat_protocol import *
+
+HOST = "127.0.0.1"  # 'localhost'
+PORT = 9090
+TIMEOUT = 10.0  # seconds for the connection and handshake, or an ENTER_ROOM echo
+RECONNECT_DELAY = 0.5  # seconds, the first backoff, doubled after every failed attempt
+RECONNECT_MAX_DELAY = 30.0  # seconds, the longest backoff
+RESUME_WINDOW = 1000  # the own messages not relayed back yet, sent again after a resume
+RESUME_MATCH = 8  # the last messages seen, looked for in the history after a reconnect
+CLOCK_SKEW = 5.0  # seconds, the resume's history starts this long before the last seen
+TRANSFER_READ = 64 * CHUNK_SIZE  # bytes a transfer reads from its file at once
+TRANSCRIPT_LINES = 500  # the recent lines of a room a Transcript keeps in memory
+TRANSCRIPT_ROOMS = 16  # the rooms whose transcript is open, the least recent closed
+TRANSCRIPT_FLUSH = 1.0  # seconds, a transcript's new lines wait this long at most
+TRANSCRIPT_READ = 64 * 1024  # bytes of a transcript read at once, backwards
+
+
+class RejectedError(ConnectionError):
+    """The server refused the client: the REJECT frame's payload is the reason"""
+
+
+def frame_key(frame):
+    """It returns what tells a chat message from another: (nickname, payload)"""
+    return frame[1], frame[3]
+
+
+class Resume:
+    """
+    The resume of a room after a reconnect. The client enters the room and asks for the room's
+    history after the last message it saw; until the answer is complete, the room's live
+    messages are held back. The live messages relayed before the server took the request are the
+    end of the answer too, the ones relayed after it follow the answer.
+
+    With protocol v3 the client asks for the messages after the seq it has (`after`), page by
+    page up to the room's newest one, and the messages are merged by seq. Otherwise it asks for
+    the messages since the time of the last one it saw: the answer and the live messages are
+    merged on their overlap, and cut after the last messages seen before the connection was lost.
+    """
+
+    def __init__(self, room_name, seen):
+        """
+        :param room_name: the room
+        :param seen: the (nickname, payload) of the room's messages seen, the newest last
+        """
+        self.room = room_name
+        self.seen = list(seen)
+        self.after = None  # the seq the client has, v3 only
+        self.newest = 0  # the room's newest seq, from the answer's HISTORY frame
+        self.pages = []  # the messages of the answers before this one (v3)
+        self.live = []  # the room's messages received before the answer
+        self.answer = None  # the answer's messages, once its HISTORY frame is received
+        self.count = 0  # the messages in the answer
+        self.done = asyncio.get_running_loop().create_future()
+
+    def take(self, frame):
+        """It keeps the frame if it's one of the room's messages, returns False otherwise"""
+        if frame[2] != self.room:
+            return False
+        if self.answer is not None:
+            self.answer.append(frame)  # the answer's messages come in one run
+        elif frame[0] == HISTORY:
+            self.answer, self.count = [], parse_history_answer(frame[3])[0]
+            self.newest = getattr(frame, "seq", 0)
+            if self.after is not None and self.newest < self.after:
+                self.after = 0  # the room's seqs started again: a restart, no history
+        elif frame[0] == CHAT_CONVERSATION:
+            self.live.append(frame)
+        else:
+            return False
+        return True
+
+    @property
+    def complete(self):
+        return self.answer is not None and len(self.answer) >= self.count
+
+    def next_page(self):
+        """It returns the seq to ask for the next page after, None if the answer is the last"""
+        if self.after is None or not self.answer or self.answer[-1].seq >= self.newest:
+            return None
+        self.pages += self.answer
+        self.answer = None
+        return self.pages[-1].seq
+
+    def unseen(self):
+        """It returns the messages of the answer and the live ones that weren't seen, in order"""
+        if self.after is not None:
+            frames, last = [], self.after
+            for frame in self.pages + self.answer + self.live:
+                if frame.seq > last:
+                    frames.append(frame)
+                    last = frame.seq
+            return frames
+        answer, live = self.answer, self.live
+        overlap = next(
+            (
+                k
+                for k in range(min(len(answer), len(live)), 0, -1)
+                if list(map(frame_key, answer[-k:])) == list(map(frame_key, live[:k]))
+            ),
+            0,
+        )
+        frames = answer + live[overlap:]
+        return frames[seen_end(list(map(frame_key, frames)), self.seen) :]
+
+
+def seen_end(keys, seen):
+    """
+    It returns where the messages not seen yet start in a run of messages that overlaps the
+    last ones seen: after the last run of the seen ones, or after the start of the run it has.
+    0 if the run doesn't reach back to them.
+
+    :param keys: the frame_key() of the messages of the run
+    :param seen: the frame_key() of the last messages seen, the newest last
+    """
+    if not seen:
+        return 0
+    for end in range(len(keys), len(seen) - 1, -1):  # the last run of the seen ones
+        if keys[end - len(seen) : end] == seen:
+            return end
+    for size in range(min(len(seen), len(keys)) - 1, 0, -1):  # it starts in the run
+        if keys[:size] == seen[-size:]:
+            return size
+    return 0
+
+
+class ChatClient(asyncio.BufferedProtocol):
+    """
+    One chat client. connect() opens the connection and runs the nickname handshake: the client
+    answers the server's GET_NICKNAME request, with the highest protocol both speak, and is
+    connected once the server announces it in the 'Lobby'. The socket reads straight into the
+    client's FrameDecoder, every received frame is a (msg_type, nickname, room name, payload)
+    tuple.
+
+    The received frames are queued for the async iterator, or handed to `on_frame(frame)` as
+    they arrive. The client keeps its room: join_room() leaves the current room and enters the
+    new one, and send() chats in the current room. The frames are written without waiting,
+    drain() waits while the server reads slower than the client writes.
+
+    When the connection is lost, the client reconnects (`reconnect`) and resumes its room: the
+    frames go on once it's back, `on_state("reconnecting", error)` and `on_state("resumed",
+    None)` tell when. The messages sent meanwhile are sent after the resume.
+
+    The client keeps its own copy of the server's catalog, `rooms` (a RoomCatalog): list_rooms()
+    loads it a page at a time, and from then on the server sends the rooms created and deleted,
+    applied as they come. create_room() and delete_room() change it. The ROOMS frames are handed
+    over too, for a room list to follow the catalog.
+
+    list_members() asks for a page of the members of the client's room, and from then on the
+    client keeps the room's roster: `members` (member id -> nickname) and `members_count`, the
+    pages and diffs of the ROSTER frames applied as they come. The ROSTER frames are handed over
+    too, for a member list to follow the room.
+    """
+
+    def __init__(
+        self,
+        nickname,
+        host=HOST,
+        port=PORT,
+        protocol=PROTOCOL_V3,
+        on_frame=None,
+        on_close=None,
+        bufsize=RECV_BUFSIZE,
+        reconnect=True,
+        on_state=None,
+    ):
+        """
+        :param nickname: the client's nickname, it might be not unique
+        :param host: the server's address
+        :param port: the server's port
+        :param protocol: the highest protocol version to take, PROTOCOL_V1 for v1 only
+        :param on_frame: a function (frame), called in the event loop for every received frame,
+        None to queue the frames for the async iterator
+        :param on_close: a function (exception or None), called when the client is closed for good
+        :param bufsize: the receive buffer of the client's FrameDecoder
+        :param reconnect: reconnect and resume when the connection is lost
+        :param on_state: a function (state, exception or None), called when the client starts
+        reconnecting and when it has resumed
+        """
+        self.nickname = nickname
+        self.host = host
+        self.port = port
+        self.protocol = protocol
+        self.version = PROTOCOL_V1  # the protocol of the frames after the handshake
+        self.room = None  # the room name, None before the handshake
+        self.transport = None
+        self.bufsize = bufsize
+        self.rooms = RoomCatalog.builtin()  # the client's copy of the server's catalog
+        self.decoder = FrameDecoder(bufsize, names=self.rooms.names)
+        self.frames = None if on_frame else asyncio.Queue()
+        self.on_frame = on_frame or self.frames.put_nowait
+        self.on_close = on_close
+        self.reconnect = reconnect
+        self.on_state = on_state
+        self.seq = 0  # the seq of the newest message of the room handed over, v3 only
+        self.error = None  # why the connection was closed, None if closed by the client
+        self.reconnects = 0  # the successful reconnects
+        self._closing = False  # close() was called
+        self._waiters = {}  # (msg_type, nickname, room name) -> future of the frame
+        self._closed = None
+        self._writing = None  # an Event, set while the write buffer is under its limit
+        self._session = False  # connect() succeeded: a lost connection is reconnected
+        self._reconnecting = None  # the reconnect task
+        self._resume = None  # the Resume of the room, while its history is awaited
+        self._history = 0  # the messages of a HISTORY answer still to come
+        # the (nickname, payload) of the room's last messages, and when the last one came
+        self._seen = collections.deque(maxlen=RESUME_MATCH)
+        self._seen_time = 0.0  # or when the client entered the room
+        # the client's own messages to the room, until the server relays them back
+        self._unsent = collections.deque(maxlen=RESUME_WINDOW)
+        self._transfers = set()  # the ids of the transfers being sent to the room
+        # (kind, value, future or None) of the ROOMS requests, one at a time on the wire
+        self._room_requests = collections.deque()
+        self._page = []  # the (room_id, name) of the page being received
+        self._listed = False  # list_rooms() was called: the server sends the diffs
+        # the roster of the client's room, once list_members() was called
+        self.members = {}  # member_id -> nickname, the pages received and the diffs
+        self.members_count = 0  # the members of the room, the pages not received too
+        self._member_requests = collections.deque()  # the futures (or None) of requests
+        self._members_page = []  # the (member_id, nickname) of the page being received
+        self._rostered = False  # list_members() was called: the server sends the roster
+
+    # ===========================================
+    # asyncio.BufferedProtocol
+    # ===========================================
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def get_buffer(self, sizehint):
+        return self.decoder.get_buffer(sizehint)
+
+    def buffer_updated(self, nbytes):
+        self.decoder.buffer_updated(nbytes)
+        try:
+            for frame in self.decoder:
+                msg_type = frame[0]
+                if msg_type == GET_NICKNAME:
+                    self._answer_nickname_request(frame[3])
+                    continue
+                if msg_type == REJECT:
+                    self.error = RejectedError(frame[3])
+                    self.transport.close()
+                    return
+                if msg_type == CHUNK:  # a transfer's, not a message of the room
+                    self.on_frame(frame)
+                    continue
+                if msg_type == ROOMS:
+                    self._on_rooms(frame)
+                    self.on_frame(frame)
+                    continue
+                if msg_type == ROSTER:
+                    self._on_roster(frame)
+                    self.on_frame(frame)
+                    continue
+                if self._waiters and (waiter := self._waiters.pop(frame[:3], None)):
+                    if not waiter.done():
+                        waiter.set_result(frame)
+                if (resume := self._resume) is not None and resume.take(frame):
+                    if resume.complete:
+                        self._resumed(resume)
+                    continue
+                if self._history:  # as stored, even if handed over already
+                    self._history -= 1
+                    self.on_frame(frame)
+                    continue
+                if msg_type == HISTORY:
+                    self._history = parse_history_answer(frame[3])[0]
+                    if frame[2] == self.room:  # it's the newest up to the answer
+                        self.seq = max(self.seq, getattr(frame, "seq", 0))
+                self._deliver(frame)
+        except ValueError as error:  # not a chat_protocol stream
+            self.error = ConnectionError(f"protocol error: {error}")
+            self.transport.abort()
+
+    def _on_rooms(self, frame):
+        """It applies a line of the catalog, and resolves the ROOMS request it answers"""
+        kind, value = parse_rooms_payload(frame[3])
+        if kind == "+":
+            self.rooms.add(*value)
+        elif kind == "-":
+            name = self.rooms.remove(value[0])
+            entered = self._waiters.pop((ENTER_ROOM, self.nickname, name), None)
+            if entered is not None and not entered.done():  # deleted meanwhile
+                entered.set_exception(ValueError(f"No such room: {name!r}"))
+        if frame[1] != self.nickname or not self._room_requests:
+            return  # a diff
+        if kind == "+" and self._room_requests[0][0] == "list":
+            self._page.append(value)
+            return
+        _, _, future = self._room_requests.popleft()
+        if kind == "end":
+            value, self._page = (self._page, value), []
+        if future is not None and not future.done():
+            future.set_result((kind, value))
+        if self._room_requests:
+            self._send(
+                ROOMS, rooms_id["Lobby"], rooms_payload(*self._room_requests[0][:2])
+            )
+
+    def _on_roster(self, frame):
+        """It applies a line of the room's roster, and resolves the ROSTER request it answers"""
+        kind, value = parse_roster_payload(frame[3])
+        if kind == "=":
+            self._members_page.append((value, frame[1]))
+        elif kind == "end":
+            page, self._members_page = self._members_page, []
+            if frame[1] == self.nickname and self._member_requests:
+                future = self._member_requests.popleft()
+                if future is not None and not future.done():
+                    future.set_result((page, value[0]))
+        if frame[2] != self.room:  # a room the client has left meanwhile
+            return
+        if kind in ("=", "+"):
+            if value not in self.members and kind == "+":
+                self.members_count += 1
+            self.members[value] = frame[1]
+        elif kind == "-":  # a member of a page still to load too
+            self.members.pop(value, None)
+            self.members_count = max(self.members_count - 1, 0)
+        elif kind == "end":
+            self.members_count = value[1]
+
+    def _resumed(self, resume):
+        """It hands the missed messages over once the answer is complete, or asks for more"""
+        if (after := resume.next_page()) is not None:
+            self._send(
+                HISTORY, self.rooms.ids[resume.room], history_payload(after=after)
+            )
+            return
+        self._resume = None
+        if resume.after is not None:
+            self.seq = resume.after
+        for missed in resume.unseen():
+            self._deliver(missed)
+        resume.done.set_result(None)
+
+    def _deliver(self, frame):
+        """It hands the frame over, and keeps track of the room's messages"""
+        if frame[0] == CHAT_CONVERSATION and frame[2] == self.room:
+            if seq := getattr(frame, "seq", 0):
+                if seq <= self.seq:
+                    return  # handed over already
+                self.seq = seq
+            self._seen.append((frame[1], frame[3]))
+            self._seen_time = time.time()
+            if frame[1] == self.nickname and self._unsent:
+                self._relayed(frame[3])
+        self.on_frame(frame)
+
+    def _relayed(self, payload):
+        """
+        An own message relayed back: the server has it, and the ones sent before it too (the
+        connection keeps them in order), even if their echo was dropped on the way back. They
+        all leave the unsent ones.
+        """
+        try:
+            end = self._unsent.index(payload) + 1
+        except ValueError:  # another client's, with the same nickname
+            return
+        for _ in range(end):
+            self._unsent.popleft()
+
+    def connection_lost(self, exc):
+        if self.error is None and exc is not None:
+            self.error = exc
+        elif self.error is None and not self._closing:
+            self.error = ConnectionResetError("The server closed the connection")
+        error = self.error or ConnectionResetError("The connection was closed")
+        for waiter in self._waiters.values():
+            if not waiter.done():
+                waiter.set_exception(error)
+        self._waiters.clear()
+        for _, _, future in self._room_requests:
+            if future is not None and not future.done():
+                future.set_exception(error)
+        self._room_requests.clear()
+        self._page = []
+        for future in self._member_requests:
+            if future is not None and not future.done():
+                future.set_exception(error)
+        self._member_requests.clear()
+        self._members_page = []
+        self._history = 0
+        if self._resume is not None and not self._resume.done.done():
+            self._resume.done.set_exception(error)
+        self._resume = None
+        if self._writing is not None:
+            self._writing.set()
+        if self._session and self.reconnect and not self._closing:
+            if self._reconnecting is None:
+                loop = asyncio.get_running_loop()
+                self._reconnecting = loop.create_task(self._reconnect())
+                if self.on_state:
+                    self.on_state("reconnecting", self.error)
+            return  # the frames go on after the reconnect
+        if self._reconnecting is None:
+            self._finish()
+
+    def _finish(self):
+        """It ends the frames and tells that the client is closed"""
+        if self._closed.done():  # once
+            return
+        if self.frames is not None:
+            self.frames.put_nowait(None)  # the end of the frames
+        self._closed.set_result(None)
+        if self.on_close:
+            self.on_close(self.error)
+
+    def pause_writing(self):
+        self._writing.clear()
+
+    def resume_writing(self):
+        self._writing.set()
+
+    # ===========================================
+    # Connection
+    # ===========================================
+    async def connect(self, timeout=TIMEOUT):
+        """
+        It connects to the server and runs the nickname handshake
+
+        :param timeout: seconds for both
+        :raise RejectedError: the server refused the client
+        :raise OSError: the connection failed
+        """
+        self._closed = asyncio.get_running_loop().create_future()
+        self._writing = asyncio.Event()
+        try:
+            await self._open(timeout)
+        except BaseException:
+            if not self._closed.done():  # connection_lost() might be not called
+                self._closed.set_result(None)
+            raise
+        self._session = True
+        self._seen_time = time.time()
+        return self
+
+    async def _open(self, timeout, resume=False):
+        """
+        It opens a connection and runs the handshake. After a reconnect (`resume`) it enters
+        the client's room again, and waits until the room's missed messages are handed over.
+        """
+        loop = asyncio.get_running_loop()
+        self.decoder = FrameDecoder(self.bufsize, names=self.rooms.names)
+        self.version = PROTOCOL_V1
+        self._writing.set()
+        room = self.room
+        if resume:  # before the handshake: the Lobby's messages follow it
+            self._resume = Resume(room, self._seen)
+        joined = self._wait_for(ENTER_ROOM, self.nickname, "Lobby")
+        try:
+            await asyncio.wait_for(
+                loop.create_connection(lambda: self, self.host, self.port), timeout
+            )
+            await asyncio.wait_for(joined, timeout)
+            if resume:
+                if self._listed:  # the diffs missed while away: the catalog again
+                    self.rooms.reset()
+                    self._room_request("list", 0, wait=False)
+                if self._rostered:  # the room's roster comes again when it's entered
+                    self.members.clear()
+                    self.members_count = 0
+                    self._member_request(0, wait=False)
+                if room not in self.rooms.ids or self.rooms.ids[room] >= BUILTIN_ROOMS:
+                    try:  # the server may have deleted it meanwhile, or restarted
+                        await asyncio.wait_for(self._create_room(room), timeout)
+                    except ValueError as error:
+                        raise ConnectionError(f"{room!r} is gone: {error}") from error
+                if room != "Lobby":
+                    lobby = rooms_id["Lobby"]
+                    self._send(EXIT_ROOM, lobby, "left 'Lobby'")
+                    self._send(ENTER_ROOM, self.rooms.ids[room], f"joined to '{room}'")
+                if self.version == PROTOCOL_V3 and self.seq:
+                    self._resume.after = self.seq
+                    request = history_payload(after=self.seq)
+                else:
+                    request = history_payload(since=self._seen_time - CLOCK_SKEW)
+                self._send(HISTORY, self.rooms.ids[room], request)
+                await asyncio.wait_for(self._resume.done, timeout)
+        except BaseException:
+            self._waiters.clear()
+            self._resume = None
+            if self.transport is not None:
+                self.transport.close()
+            raise
+
+    async def _reconnect(self):
+        """It reconnects with exponential backoff and full jitter, then resumes the session"""
+        delay = RECONNECT_DELAY
+        while not self._closing:
+            await asyncio.sleep(random.uniform(0, delay))
+            delay = min(delay * 2, RECONNECT_MAX_DELAY)
+            try:
+                await self._open(TIMEOUT, resume=True)
+            except (OSError, asyncio.TimeoutError):
+                continue
+            self.reconnects += 1
+            self.error = None
+            self._reconnecting = None
+            for payload in self._unsent:  # not relayed back: sent again
+                self._send(CHAT_CONVERSATION, self.rooms.ids[self.room], payload)
+            if self.on_state:
+                self.on_state("resumed", None)
+            return
+
+    def _answer_nickname_request(self, offer):
+        """It sends the nickname, and switches to the highest protocol both sides have"""
+        version = choose_protocol(parse_protocol_payload(offer), self.protocol)
+        self.transport.write(
+            msg_composer(  # the handshake frames are v1
+                msg_type=GET_NICKNAME,
+                nickname=self.nickname,
+                room_id=rooms_id["Lobby"],
+                payload=protocol_payload([version]) if version > 1 else "#Empty",
+            ).encode("utf-8")
+        )
+        if version > 1:  # all the next frames are in it, both ways
+            self.version = self.decoder.version = version
+        if self.room is None:  # a reconnect enters the client's room again
+            self.room = "Lobby"
+
+    def _wait_for(self, msg_type, nickname, room_name):
+        """It returns the future of the next frame with this msg_type, nickname and room"""
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters[msg_type, nickname, room_name] = waiter
+        return waiter
+
+    @property
+    def connected(self):
+        return self.transport is not None and not self.transport.is_closing()
+
+    @property
+    def reconnecting(self):
+        return self._reconnecting is not None
+
+    def close(self):
+        self._closing = True
+        if self._reconnecting is not None:
+            self._reconnecting.cancel()
+            self._reconnecting = None
+            if not self.connected:
+                self._finish()
+        if self.transport is not None:
+            self.transport.close()
+
+    async def wait_closed(self):
+        if self._closed is not None:
+            await self._closed
+
+    async def __aenter__(self):
+        return await self.connect()
+
+    async def __aexit__(self, *exc_info):
+        self.close()
+        await self.wait_closed()
+
+    # ===========================================
+    # Chat
+    # ===========================================
+    def _send(self, msg_type, room_id, payload):
+        if not self.connected:
+            raise ConnectionResetError("The client is not connected")
+        self.transport.write(
+            compose_frame(self.version, msg_type, self.nickname, room_id, payload)
+        )
+
+    def send(self, payload, room_name=None):
+        """
+        It sends a chat message. While the client is reconnecting, the messages to its room are
+        kept and sent after the resume.
+
+        :param payload: the message, MAX_PAYLOAD bytes (UTF-8) at most
+        :param room_name: the room, None for the client's room
+        """
+        if len(payload.encode("utf-8")) > MAX_PAYLOAD:
+            raise ValueError(f"The message exceeds {MAX_PAYLOAD} bytes (UTF-8)")
+        room_name = room_name or self.room
+        if self._reconnecting is None:
+            self._send(CHAT_CONVERSATION, self.rooms.ids[room_name], payload)
+        elif room_name != self.room:
+            raise ConnectionResetError("The client is reconnecting")
+        if room_name == self.room:
+            self._unsent.append(payload)
+
+    async def join_room(self, room_name, history=0, wait=True, timeout=TIMEOUT):
+        """
+        It moves the client to the room: EXIT_ROOM from its room and ENTER_ROOM into the new one.
+        While the client is reconnecting, it enters the room when it's back.
+
+        :param room_name: the name of the room: a built-in one, or one of the catalog
+        :param history: the number of the room's recent messages to ask for, 0 for none
+        :param wait: wait until the server relays the ENTER_ROOM back (the client is in the room)
+        :param timeout: seconds to wait
+        :raise ValueError: the room is not in the catalog, or the server has deleted it
+        """
+        if room_name not in self.rooms.ids:
+            raise ValueError(f"No such room: {room_name!r}")
+        if room_name == self.room:
+            return
+        if self._reconnecting is not None:
+            self._enter(room_name)
+            return
+        entered = self._wait_for(ENTER_ROOM, self.nickname, room_name) if wait else None
+        for transfer in self._transfers:  # while the room still takes them
+            self._send(
+                CHUNK, self.rooms.ids[self.room], chunk_payload(transfer, CHUNK_ABORT)
+            )
+        self._transfers.clear()
+        if self.room is not None:
+            self._send(EXIT_ROOM, self.rooms.ids[self.room], f"left '{self.room}'")
+        self._send(ENTER_ROOM, self.rooms.ids[room_name], f"joined to '{room_name}'")
+        self._enter(room_name)
+        if history:
+            self.history(last=history)
+        if entered is not None:
+            await asyncio.wait_for(entered, timeout)
+
+    def _enter(self, room_name):
+        """It starts the room's state: nothing seen or unsent yet"""
+        self.room = room_name
+        self.seq = 0
+        self._seen.clear()
+        self._unsent.clear()
+        self._seen_time = time.time()
+        self.members.clear()  # the room's first page comes once it's entered
+        self.members_count = 0
+
+    def _room_request(self, kind, value, wait=True):
+        """
+        It sends a ROOMS request, once the ones before are answered: a worker of a cluster
+        answers a creation later than a page. It returns the future of the answer, None without
+        `wait`.
+        """
+        if not self.connected:
+            raise ConnectionResetError("The client is not connected")
+        future = asyncio.get_running_loop().create_future() if wait else None
+        self._room_requests.append((kind, value, future))
+        if len(self._room_requests) == 1:
+            self._send(ROOMS, rooms_id["Lobby"], rooms_payload(kind, value))
+        return future
+
+    async def list_rooms(self, start=0, timeout=TIMEOUT):
+        """
+        It loads a page of the server's catalog into the client's (`rooms`): the rooms from the
+        id `start` on. From then on the server sends the rooms created and deleted, they're
+        applied as they come. The ROOMS frames are handed over too: a '+' line for every room of
+        the page, then an 'end' line with the start of the next page.
+
+        :param start: the room id the page starts from: 0, or the 'end' of the page before
+        :param timeout: seconds to wait for the page
+        :return: ([(room_id, name), ...], the start of the next page, 0 for the last page)
+        """
+        self._listed = True
+        _, page = await asyncio.wait_for(self._room_request("list", start), timeout)
+        return page
+
+    async def create_room(self, room_name, timeout=TIMEOUT):
+        """
+        It creates a room, or finds the room with this name. The server deletes a created room
+        once it has been empty for a while.
+
+        :param room_name: the name, see check_room_name()
+        :param timeout: seconds to wait for the answer
+        :return: the room id
+        :raise ValueError: the name, or the server refused the room: the reason
+        """
+        check_room_name(room_name)
+        return await asyncio.wait_for(self._create_room(room_name), timeout)
+
+    async def _create_room(self, room_name):
+        kind, value = await self._room_request("create", room_name)
+        if kind == "error":
+            raise ValueError(value)
+        return value[0]
+
+    async def delete_room(self, room_name, timeout=TIMEOUT):
+        """
+        It deletes an empty room, but a built-in one
+
+        :param room_name: the name of the room
+        :param timeout: seconds to wait for the answer
+        :raise ValueError: the server refused: the reason
+        """
+        if room_name not in self.rooms.ids:
+            raise ValueError(f"No such room: {room_name!r}")
+        request = self._room_request("delete", self.rooms.ids[room_name])
+        kind, value = await asyncio.wait_for(request, timeout)
+        if kind == "error":
+            raise ValueError(value)
+
+    def _member_request(self, after, wait=True):
+        """It sends a ROSTER request, and returns the future of the answer, None without `wait`"""
+        future = asyncio.get_running_loop().create_future() if wait else None
+        self._send(ROSTER, self.rooms.ids[self.room], roster_payload("list", after))
+        self._member_requests.append(future)
+        return future
+
+    async def list_members(self, after=0, timeout=TIMEOUT):
+        """
+        It asks for a page of the members of the client's room: the ones whose member id is
+        after `after`, the lowest first. From then on the server sends the first page of a room's
+        members when the client enters it, and the members that enter and leave its room, in
+        place of their ENTER_ROOM / EXIT_ROOM frames: they're applied to `members` as they come.
+        The ROSTER frames are handed over too.
+
+        :param after: the member id the page is after: 0, or the one of the page before
+        :param timeout: seconds to wait for the page
+        :return: ([(member_id, nickname), ...], the `after` of the next page, 0 for the last page)
+        """
+        self._rostered = True
+        return await asyncio.wait_for(self._member_request(after), timeout)
+
+    def history(self, last=None, since=None, room_name=None, after=None):
+        """
+        It asks for the history of a room: the server answers with a HISTORY frame (the payload
+        is the number of the messages) followed by the messages. The answer's messages are handed
+        over as they come, even the ones handed over already. With v3, the HISTORY frame has the
+        seq of the room's newest message: the messages after a seq come a page at a time, the
+        next page is after the seq of the last message of the page.
+
+        :param last: the number of the recent messages
+        :param since: the messages since this time (epoch seconds)
+        :param room_name: the room, None for the client's room
+        :param after: the messages after this seq (v3), the oldest first
+        :raise ValueError: none of last, since and after, or `last` isn't 1 or more
+        """
+        room_id = self.rooms.ids[room_name or self.room]
+        self._send(HISTORY, room_id, history_payload(last, since, after))
+
+    async def send_file(self, source, name=None, text=False):
+        """
+        It sends a file, or a message longer than MAX_PAYLOAD, to the client's room as a transfer
+        of CHUNK frames (protocol v3). The file is read and sent a chunk at a time, as fast as the
+        server takes them: the client's chat messages go on meanwhile, and the server relays the
+        chat messages of the room ahead of the chunks. The transfer is aborted if the client
+        leaves the room or loses the connection, it is not resumed.
+
+        :param source: a path, a binary file object, or bytes
+        :param name: the name the recipients get, None for the file's name
+        :param text: it's a message: the recipients may show it rather than save it
+        :return: the number of bytes sent
+        """
+        if isinstance(source, (str, os.PathLike)):
+            with open(source, "rb") as file:
+                return await self.send_file(
+                    file, name or os.path.basename(source), text
+                )
+        if self.version != PROTOCOL_V3:
+            raise ConnectionError("A transfer needs protocol v3")
+        if isinstance(source, (bytes, bytearray, memoryview)):
+            source = io.BytesIO(source)
+        room_id = self.rooms.ids[self.room]
+        start = source.tell()
+        size = source.seek(0, os.SEEK_END) - start
+        source.seek(start)
+        transfer = random.getrandbits(32)
+        description = {"name": name or "file", "size": size, "text": text}
+        self._send(
+            CHUNK,
+            room_id,
+            chunk_payload(transfer, CHUNK_START, json.dumps(description).encode()),
+        )
+        self._transfers.add(transfer)
+        loop = asyncio.get_running_loop()
+        sent = 0
+        try:
+            while data := await loop.run_in_executor(None, source.read, TRANSFER_READ):
+                for offset in range(0, len(data), CHUNK_SIZE):
+                    if transfer not in self._transfers:  # aborted by join_room()
+                        raise ConnectionAbortedError("The client left the room")
+                    chunk = data[offset : offset + CHUNK_SIZE]
+                    self._send(
+                        CHUNK, room_id, chunk_payload(transfer, CHUNK_DATA, chunk)
+                    )
+                    sent += len(chunk)
+                    await self.drain()
+        except BaseException:
+            if transfer in self._transfers and self.connected:
+                self._send(CHUNK, room_id, chunk_payload(transfer, CHUNK_ABORT))
+            raise
+        finally:
+            self._transfers.discard(transfer)
+        self._send(CHUNK, room_id, chunk_payload(transfer, CHUNK_END))
+        return sent
+
+    async def drain(self):
+        """It waits while the transport's write buffer is over its high-water mark"""
+        await self._writing.wait()
+
+    # ===========================================
+    # Received frames
+    # ===========================================
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        if self.frames is None:
+            raise TypeError("The frames are handed to on_frame()")
+        frame = await self.frames.get()
+        if frame is None:
+            self.frames.put_nowait(None)  # for the next reader
+            raise StopAsyncIteration
+        return frame
+
+
+class FileReceiver:
+    """
+    It saves the transfers of the received CHUNK frames into a directory, as they stream: a
+    transfer is written to its file chunk by chunk, never held whole. The transfers still open
+    when the sender is gone stay open until close().
+    """
+
+    def __init__(self, directory):
+        """
+        :param directory: where the files are saved, created on the first transfer
+        """
+        self.directory = directory
+        self.transfers = {}  # (nickname, transfer id) -> (file, path, description)
+
+    def feed(self, frame):
+        """
+        It takes a received CHUNK frame
+
+        :return: (nickname, path, description) when the frame completes a transfer, None
+        otherwise. The description is the sender's {"name": ..., "size": ..., "text": ...}
+        """
+        transfer, kind, data = parse_chunk_payload(frame[3])
+        key = frame[1], transfer
+        if kind == CHUNK_START:
+            description = json.loads(data)
+            path = self._path(description.get("name"))
+            self.transfers[key] = open(path, "xb"), path, description
+            return None
+        if key not in self.transfers:  # started before the client joined the room
+            return None
+        file, path, description = self.transfers[key]
+        if kind == CHUNK_DATA:
+            file.write(data)
+            return None
+        del self.transfers[key]
+        file.close()
+        if kind == CHUNK_END:
+            return frame[1], path, description
+        os.remove(path)  # CHUNK_ABORT
+        return None
+
+    def _path(self, name):
+        """It returns a new path in the directory for the file name, without the sender's dirs"""
+        os.makedirs(self.directory, exist_ok=True)
+        name = os.path.basename(str(name or "").replace("\\", "/"))
+        if name in ("", ".", ".."):
+            name = "file"
+        stem, ext = os.path.splitext(name)
+        path = os.path.join(self.directory, name)
+        copy = 0
+        while os.path.exists(path):
+            copy += 1
+            path = os.path.join(self.directory, f"{stem} ({copy}){ext}")
+        return path
+
+    def close(self):
+        """It drops the transfers not complete"""
+        for file, path, _ in self.transfers.values():
+            file.close()
+            os.remove(path)
+        self.transfers.clear()
+
+
+class RoomTranscript:
+    """The open transcript of a room: its file, its size, its recent lines and its newest seq"""
+
+    def __init__(self, path, max_lines):
+        self.path = path
+        self.file = open(path, "ab")
+        self.size = self.file.tell()
+        if self.size and read_back(path, self.size, 0, 1)[1][-1:] != b"\n":
+            self.file.write(b"\n")  # the end of a line cut short: the next one is whole
+            self.size += 1
+        self.lines = collections.deque(
+            transcript_lines(path, self.size, max_lines), maxlen=max_lines
+        )
+        self.seq = max((line[4] for _, line in self.lines), default=0)
+        self.flushed = time.monotonic()
+
+
+def read_back(path, end, start=0, size=TRANSCRIPT_READ):
+    """It returns (offset, bytes) of a file: up to `size` bytes before `end`, not before `start`"""
+    offset = max(start, end - size)
+    with open(path, "rb") as file:
+        file.seek(offset)
+        return offset, file.read(end - offset)
+
+
+def transcript_lines(path, end, count):
+    """
+    It returns up to `count` (offset, line) of a transcript file, the last ones before the
+    offset `end`, the oldest first. The file is read from `end` backwards, TRANSCRIPT_READ
+    bytes at a time, until it has enough whole lines: the cost doesn't grow with the file.
+    """
+    data, offset = b"", end
+    while offset > 0 and data.count(b"\n") <= count:
+        offset, block = read_back(path, offset)
+        data = block + data
+    raw = data.split(b"\n")[:-1]  # the file's lines end with a newline
+    if offset > 0:
+        raw = raw[1:]  # cut by the block
+    raw = raw[-count:] if count else []
+    offset = end - sum(len(line) + 1 for line in raw)
+    lines = []
+    for line in raw:
+        try:
+            lines.append((offset, json.loads(line)))
+        except ValueError:  # a line cut short by a crash, or not a transcript's
+            pass
+        offset += len(line) + 1
+    return lines
+
+
+class Transcript:
+    """
+    The transcripts of the rooms a client has been in, kept in a directory: a room's lines are
+    appended to a file of its own, one JSON list per line, and its recent lines, at most
+    `max_lines`, are kept in memory. A line is [time, kind, nickname, text, seq]: the kind is
+    'chat', 'event', 'note' or 'error', the seq is the server's seq of a chat message (v3), 0
+    otherwise. The older lines are read back from the end of the file a page at a time, so a
+    room's transcript costs the same after hours of chat. Only the `max_rooms` rooms used last
+    are kept open. The lines are handed over as (offset, line): the offset in the room's file
+    is where the lines before it are read from.
+
+    Example:
+        transcript = Transcript(Path.home() / ".chat-rooms" / "transcripts")
+        transcript.append("Lobby", [time.time(), "chat", "Bob", "Hi", 0])
+        recent = transcript.recent("Lobby")
+        older = transcript.older("Lobby", recent[0][0], 100)
+    """
+
+    def __init__(
+        self, directory, max_lines=TRANSCRIPT_LINES, max_rooms=TRANSCRIPT_ROOMS
+    ):
+        """
+        :param directory: the directory of the transcript files, created if needed
+        :param max_lines: the recent lines of a room kept in memory
+        :param max_rooms: the rooms kept open
+        """
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.max_lines = max_lines
+        self.max_rooms = max_rooms
+        # room name -> RoomTranscript, the last used last
+        self._rooms = collections.OrderedDict()
+
+    def path(self, room_name):
+        """It returns the path of a room's transcript file"""
+        name = urllib.parse.quote(room_name, safe=" ")
+        return os.path.join(self.directory, f"{name}.jsonl")
+
+    def _room(self, room_name):
+        """It returns the open transcript of a room, it's opened if needed"""
+        room = self._rooms.get(room_name)
+        if room is not None:
+            self._rooms.move_to_end(room_name)
+            return room
+        room = self._rooms[room_name] = RoomTranscript(
+            self.path(room_name), self.max_lines
+        )
+        if len(self._rooms) > self.max_rooms:
+            _, closed = self._rooms.popitem(last=False)
+            closed.file.close()
+        return room
+
+    def append(self, room_name, line):
+        """
+        It appends a line to a room's transcript
+
+        :param room_name: the room
+        :param line: [time, kind, nickname, text, seq]
+        :return: (offset, line)
+        """
+        room = self._room(room_name)
+        data = json.dumps(line, ensure_ascii=False, separators=(",", ":")) + "\n"
+        data = data.encode("utf-8")
+        room.file.write(data)
+        entry = room.size, line
+        room.size += len(data)
+        room.lines.append(entry)
+        if line[4]:
+            room.seq = line[4]
+        if time.monotonic() - room.flushed >= TRANSCRIPT_FLUSH:
+            room.file.flush()
+            room.flushed = time.monotonic()
+        return entry
+
+    def merge(self, room_name, lines):
+        """
+        It appends the chat messages of a history answer that aren't in the room's transcript
+        yet: the answer overlaps the transcript's last messages. With seqs (v3) the messages after
+        the room's newest seq are new, otherwise the ones after the transcript's last messages
+        found in the answer, see seen_end().
+
+        :param room_name: the room
+        :param lines: the answer's messages as 'chat' lines, the oldest first
+        :return: the (offset, line) appended
+        """
+        room = self._room(room_name)
+        if any(line[4] for line in lines):
+            if max(line[4] for line in lines) < room.seq:
+                room.seq = 0  # the room's seqs started again: a restart, no history
+            lines = [line for line in lines if line[4] > room.seq]
+        else:
+            seen = [(line[2], line[3]) for _, line in room.lines if line[1] == "chat"]
+            keys = [(line[2], line[3]) for line in lines]
+            lines = lines[seen_end(keys, seen[-RESUME_MATCH:]) :]
+        return [self.append(room_name, line) for line in lines]
+
+    def recent(self, room_name):
+        """It returns the recent (offset, line) of a room, at most `max_lines`, the oldest first"""
+        return list(self._room(room_name).lines)
+
+    def older(self, room_name, offset, count):
+        """
+        It returns up to `count` (offset, line) of a room before the line at `offset`, read from
+        its file, the oldest first. None are left before an offset 0.
+        """
+        room = self._room(room_name)
+        room.file.flush()
+        return transcript_lines(room.path, offset, count)
+
+    def lines(self, room_name):
+        """It yields all the lines of a room's transcript, the oldest first"""
+        room = self._room(room_name)
+        room.file.flush()
+        with open(room.path, "rb") as file:
+            for line in file:
+                try:
+                    yield json.loads(line)
+                except ValueError:
+                    pass
+
+    def flush(self):
+        """It writes the new lines of all the rooms to their files"""
+        for room in self._rooms.values():
+            room.file.flush()
+            room.flushed = time.monotonic()
+
+    def close(self):
+        """It writes the new lines and closes the files"""
+        for room in self._rooms.values():
+            room.file.close()
+        self._rooms.clear()
+
+
+class BlockingChatClient:
+    """
+    A ChatClient for threads and scripts: every method blocks until it's done. The clients of a
+    process share one event loop, run by a daemon thread. The received frames are queued for
+    receive() and the iterator, or handed to `on_frame(frame)` in the event loop's thread.
+    """
+
+    _loop = None
+    _lock = threading.Lock()
+
+    def __init__(
+        self,
+        nickname,
+        host=HOST,
+        port=PORT,
+        protocol=PROTOCOL_V3,
+        on_frame=None,
+        on_close=None,
+        reconnect=True,
+        on_state=None,
+    ):
+        """See ChatClient"""
+        self.frames = None if on_frame else queue.Queue()
+
+        def closed(error):
+            if self.frames is not None:
+                self.frames.put(None)  # the end of the frames
+            if on_close:
+                on_close(error)
+
+        self.client = ChatClient(
+            nickname,
+            host,
+            port,
+            protocol,
+            on_frame=on_frame or self.frames.put,
+            on_close=closed,
+            reconnect=reconnect,
+            on_state=on_state,
+        )
+        self.loop = self.event_loop()
+
+    @classmethod
+    def event_loop(cls):
+        """It returns the event loop of the blocking clients, started on the first call"""
+        with cls._lock:
+            if cls._loop is None:
+                cls._loop = asyncio.new_event_loop()
+                threading.Thread(
+                    target=cls._loop.run_forever, name="ChatClient", daemon=True
+                ).start()
+            return cls._loop
+
+    def _call(self, function, *args, timeout=None, **kwargs):
+        """It calls function(*args, **kwargs) in the event loop and returns its result"""
+
+        async def call():
+            result = function(*args, **kwargs)
+            return await result if asyncio.iscoroutine(result) else result
+
+        return asyncio.run_coroutine_threadsafe(call(), self.loop).result(timeout)
+
+    @property
+    def nickname(self):
+        return self.client.nickname
+
+    @property
+    def room(self):
+        return self.client.room
+
+    @property
+    def version(self):
+        return self.client.version
+
+    @property
+    def seq(self):
+        return self.client.seq
+
+    @property
+    def connected(self):
+        return self.client.connected
+
+    @property
+    def reconnecting(self):
+        return self.client.reconnecting
+
+    def connect(self, timeout=TIMEOUT):
+        """See ChatClient.connect()"""
+        self._call(self.client.connect, timeout)
+        return self
+
+    def join_room(self, room_name, history=0, wait=True, timeout=TIMEOUT):
+        """See ChatClient.join_room()"""
+        self._call(self.client.join_room, room_name, history, wait, timeout)
+
+    def send(self, payload, room_name=None):
+        """See ChatClient.send()"""
+        self._call(self.client.send, payload, room_name)
+
+    def list_rooms(self, start=0, timeout=TIMEOUT):
+        """See ChatClient.list_rooms()"""
+        return self._call(self.client.list_rooms, start, timeout)
+
+    @property
+    def members(self):
+        """The roster of the client's room (member_id -> nickname), a copy"""
+        return self._call(self.client.members.copy)
+
+    def list_members(self, after=0, timeout=TIMEOUT):
+        """See ChatClient.list_members()"""
+        return self._call(self.client.list_members, after, timeout)
+
+    def create_room(self, room_name, timeout=TIMEOUT):
+        """See ChatClient.create_room()"""
+        return self._call(self.client.create_room, room_name, timeout)
+
+    def delete_room(self, room_name, timeout=TIMEOUT):
+        """See ChatClient.delete_room()"""
+        self._call(self.client.delete_room, room_name, timeout)
+
+    def history(self, last=None, since=None, room_name=None, after=None):
+        """See ChatClient.history()"""
+        self._call(self.client.history, last, since, room_name, after)
+
+    def send_file(self, source, name=None, text=False, timeout=None):
+        """See ChatClient.send_file(), it returns once the whole transfer is sent"""
+        return self._call(self.client.send_file, source, name, text, timeout=timeout)
+
+    def receive(self, timeout=None):
+        """It returns the next received frame, None on timeout or once the client is closed"""
+        try:
+            return self.frames.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    def __iter__(self):
+        while (frame := self.receive()) is not None:
+            yield frame
+        self.frames.put(None)  # for the next reader
+
+    def close(self):
+        self._call(self.client.close)
+        self._call(self.client.wait_closed)
+
+    def __enter__(self):
+        return self.connect()
+
+    def __exit__(self, *exc_info):
+        self.close()
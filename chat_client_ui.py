@@ -10,70 +10,281 @@ Example:
 @Date:   17/08/2022
 """
 
+import collections
 import datetime
 import random
-import socket
 import sys
 import threading
+import time
 from pathlib import Path
 
 import PySimpleGUI as sg
 
+from chat_client import BlockingChatClient, FileReceiver, RejectedError, Transcript
 from chat_protocol import *
 
+HOST = "127.0.0.1"  # 'localhost'
+PORT = 9090
+HISTORY_LINES = 20  # the messages of a room shown when the client enters it
+DOWNLOAD_DIR = Path.home() / "Downloads" / "Chat-Rooms"  # where the received files go
+MAX_TEXT_SHOWN = 64 * BUFSIZE  # a longer message (transfer) is saved, not shown
+MORE_ROOMS = "More rooms..."  # the last entry of the room list, while pages are left
+MORE_MEMBERS = "More members..."  # the last entry of the member list, likewise
+TRANSCRIPT_DIR = Path.home() / ".chat-rooms" / "transcripts"  # the rooms' transcripts
+VIEW_LINES = 1000  # the lines the chat view keeps at the end, the oldest deleted
+VIEW_PAGE = 200  # the older lines loaded at once, the chat view scrolled to the top
+VIEW_MAX_LINES = 5000  # the lines the chat view holds at most, scrolled back
 
-def receive(client, window, nickname):
+# the chat view's text styles: tag -> (text color, background color, justification),
+# the background None for the room's color
+VIEW_STYLES = {
+    "own": ("#000000", None, "left"),
+    "other": ("#000000", None, "right"),
+    "note": ("#000000", None, "left"),
+    "event": ("#000000", "#ffd258", "left"),
+    "error": ("#FFFFFF", "#b20000", "left"),
+}
+
+
+def now(stamp=None):
     """
-    It receives messages from the server and prints them to the GUI
+    It returns the time stamp printed in the log: 'YYYY-MM-DD hh:mm:ss'
 
-    :param client: socket.socket
-    :param window: the GUI window
-    :param nickname: the nickname of the client
+    :param stamp: the time (epoch seconds), None for now
     """
-    while True:
-        time_stamp = str(datetime.datetime.now())[:19]
-        try:
-            message = client.recv(BUFSIZE).decode("utf-8")
-            msg_type, msg_nickname, msg_room_name, msg_payload = msg_parser(message)
-            if msg_type == GET_NICKNAME:
-                nick_message = msg_composer(
-                    msg_type=GET_NICKNAME,
-                    nickname=nickname,
-                    room_id=rooms_id[current_room_name],
-                ).encode("utf-8")
-                client.send(nick_message)
-                # send nickname from client to server by request from accept_new_client()
-            else:
+    if stamp is None:
+        return str(datetime.datetime.now())[:19]
+    return str(datetime.datetime.fromtimestamp(stamp))[:19]
+
+
+def window_events(window, receiver):
+    """
+    It returns the on_frame, on_close and on_state functions of a BlockingChatClient that send
+    the received frames, the end of the connection and the reconnects to the GUI window as events.
+    The CHUNK frames go to the FileReceiver, the window gets the complete transfers. The ROOMS
+    frames are the lines of the server's catalog, the window keeps its own list of the rooms. The
+    ROSTER frames are the lines of the room's members, the window keeps its own list of them too.
+    """
+
+    def on_frame(frame):
+        if frame[0] == CHUNK:
+            try:
+                received = receiver.feed(frame)
+            except (OSError, ValueError):  # a transfer that can't be saved is dropped
+                return
+            if received:
                 window.write_event_value(
-                    "-RECEIVE_THREAD-",
-                    (
-                        time_stamp,
-                        threading.current_thread().name,
-                        msg_type,
-                        msg_nickname,
-                        msg_room_name,
-                        msg_payload,
-                    ),
+                    "-FILE_RECEIVED-",
+                    (now(), threading.current_thread().name, *received),
                 )
-                # Data sent as a tuple
-        except ConnectionAbortedError:
-            time_stamp = str(datetime.datetime.now())[:19]
+            return
+        if frame[0] == ROOMS:
+            window.write_event_value("-ROOMS-", (now(), *parse_rooms_payload(frame[3])))
+            return
+        if frame[0] == ROSTER:
             window.write_event_value(
-                "-ConnectionAbortedError-",
+                "-ROSTER-",
                 (
-                    time_stamp,
-                    threading.current_thread().name,
-                ),
-            )
-        except Exception:
-            time_stamp = str(datetime.datetime.now())[:19]
-            window.write_event_value(
-                "-SocketError-",
-                (
-                    time_stamp,
-                    threading.current_thread().name,
+                    getattr(frame, "time", None) or time.time(),
+                    frame[1],
+                    frame[2],
+                    *parse_roster_payload(frame[3]),
                 ),
             )
+            return
+        # the server's time and seq of the message (protocol v3), otherwise the time it's
+        # received and 0
+        window.write_event_value(
+            "-RECEIVE_THREAD-",
+            (
+                getattr(frame, "time", None) or time.time(),
+                threading.current_thread().name,
+                *frame,
+                getattr(frame, "seq", 0),
+            ),
+        )
+
+    def on_close(error):
+        if error is None:  # closed by the client
+            return
+        event = "-REJECTED-" if isinstance(error, RejectedError) else "-SocketError-"
+        if isinstance(error, ConnectionAbortedError):
+            event = "-ConnectionAbortedError-"
+        window.write_event_value(
+            event, (now(), threading.current_thread().name, str(error))
+        )
+
+    def on_state(state, error):
+        window.write_event_value(
+            "-RECONNECT-", (now(), threading.current_thread().name, state, error)
+        )
+
+    return on_frame, on_close, on_state
+
+
+def send_file(client, source, name=None, text=False):
+    """
+    It sends a file or a long message with the client, for window.perform_long_operation()
+
+    :return: (time stamp, name, bytes sent or the error)
+    """
+    try:
+        return now(), name or Path(source).name, client.send_file(source, name, text)
+    except (OSError, ValueError) as error:
+        return now(), name or Path(source).name, error
+
+
+def room_request(function, *args):
+    """
+    It runs a rooms request of the client, for window.perform_long_operation()
+
+    :return: (time stamp, the arguments, the result or the error)
+    """
+    try:
+        return now(), args, function(*args)
+    except (OSError, TimeoutError, ValueError) as error:
+        return now(), args, error
+
+
+def room_list(room_names, following):
+    """
+    It returns the entries of the room list: the rooms in the order of their ids, and
+    MORE_ROOMS while the catalog has pages not listed yet
+
+    :param room_names: room_id -> name, the rooms the window knows
+    :param following: the start of the next page, 0 for none
+    """
+    names = [room_names[room_id] for room_id in sorted(room_names)]
+    return names + [MORE_ROOMS] if following else names
+
+
+def member_list(members, following):
+    """
+    It returns the entries of the member list: the members in the order they entered the room,
+    and MORE_MEMBERS while the room has pages not listed yet
+
+    :param members: member_id -> nickname, the members the window knows
+    :param following: the `after` of the next page, 0 for none
+    """
+    names = [members[member_id] for member_id in sorted(members)]
+    return names + [MORE_MEMBERS] if following else names
+
+
+def line_segments(line, nickname):
+    """
+    It formats a transcript's line for the chat view
+
+    :param line: [time, kind, nickname, text, seq], see Transcript
+    :param nickname: the client's nickname: its messages are on the left, the others' on the right
+    :return: a list of (text, tag) segments, the last one ends the line
+    """
+    stamp, kind, msg_nickname, text, _ = line
+    if kind == "chat":
+        tag = "own" if msg_nickname == nickname else "other"
+        return [(f"[{now(stamp)}]  {msg_nickname} wrote:\n{text}\n\n", tag)]
+    return [(f"[{now(stamp)}]  {text}\n", kind)]
+
+
+class ChatView:
+    """
+    The -OUTPUT- Multiline as a window on the current room's Transcript. Entering a room renders
+    its recent lines with one text insert, in place of the other room's. The new lines are
+    written at the end, and the oldest are deleted once there are more than VIEW_LINES while the
+    view is at the end. Scrolled to the top, the view loads the older lines from the room's
+    transcript file, VIEW_PAGE at a time, up to VIEW_MAX_LINES.
+    """
+
+    def __init__(self, element, transcript, nickname):
+        self.widget = element.Widget  # the tkinter Text
+        self.transcript = transcript
+        self.nickname = nickname
+        self.room = None
+        self.shown = collections.deque()  # (offset, text lines) of the view's lines
+        self.older = False  # the transcript may have lines older than the view's
+        self._loading = False
+        for tag, (text_color, _, justification) in VIEW_STYLES.items():
+            self.widget.tag_configure(tag, foreground=text_color, justify=justification)
+        self.widget.configure(yscrollcommand=self._scrolled)
+
+    def show(self, room_name):
+        """It renders the recent lines of the room in place of the view's"""
+        self.room = room_name
+        color = room_color(room_name)
+        self.widget.configure(background=color)
+        for tag, (_, background_color, _) in VIEW_STYLES.items():
+            self.widget.tag_configure(tag, background=background_color or color)
+        self.shown.clear()
+        self.widget.configure(state="normal")
+        self.widget.delete("1.0", "end")
+        self.widget.configure(state="disabled")
+        entries = self.transcript.recent(room_name)
+        self.older = bool(entries)
+        self._insert("end", entries)
+        self.widget.see("end")
+
+    def write(self, line, keep=True):
+        """
+        It writes a new line of the room at the end of the view
+
+        :param line: [time, kind, nickname, text, seq], see Transcript
+        :param keep: append the line to the room's transcript, or only show it
+        """
+        self.add([self.transcript.append(self.room, line) if keep else (None, line)])
+
+    def add(self, entries):
+        """It writes the room's (offset, line) at the end of the view, see Transcript"""
+        following = self.widget.yview()[1] >= 1.0
+        self._insert("end", entries)
+        # while the user reads the older lines, they are kept up to VIEW_MAX_LINES
+        excess = len(self.shown) - (VIEW_LINES if following else VIEW_MAX_LINES)
+        if excess > 0:
+            lines = sum(self.shown.popleft()[1] for _ in range(excess))
+            self.widget.configure(state="normal")
+            self.widget.delete("1.0", f"{lines + 1}.0")
+            self.widget.configure(state="disabled")
+            self.older = True
+        if following:
+            self.widget.see("end")
+
+    def _insert(self, index, entries):
+        """It inserts the (offset, line) at the end or at the top ('1.0'), returns the text lines"""
+        chunks = []  # text, tag, text, tag ... : tkinter's Text.insert() arguments
+        shown = []
+        for offset, line in entries:
+            lines = 0
+            for text, tag in line_segments(line, self.nickname):
+                chunks += (text, tag)
+                lines += text.count("\n")
+            shown.append((offset, lines))
+        if not chunks:
+            return 0
+        self.widget.configure(state="normal")
+        self.widget.insert(index, *chunks)
+        self.widget.configure(state="disabled")
+        if index == "end":
+            self.shown += shown
+        else:
+            self.shown.extendleft(reversed(shown))
+        return sum(lines for _, lines in shown)
+
+    def _scrolled(self, first, last):
+        """The Text's yscrollcommand: at the top, the older lines are loaded once it's idle"""
+        if float(first) <= 0.0 and self.older and not self._loading:
+            if len(self.shown) < VIEW_MAX_LINES:
+                self._loading = True
+                self.widget.after_idle(self._load_older)
+
+    def _load_older(self):
+        """It inserts a page of the older lines at the top, the view stays where it is"""
+        self._loading = False
+        offset = next((offset for offset, _ in self.shown if offset is not None), None)
+        entries = self.transcript.older(self.room, offset, VIEW_PAGE) if offset else []
+        if not entries:
+            self.older = False
+            return
+        top = int(self.widget.index("@0,0").split(".")[0])
+        lines = self._insert("1.0", entries)
+        self.widget.yview(f"{top + lines}.0")
 
 
 def main():
@@ -81,23 +292,12 @@ def main():
     It's a chat client that uses a socket to communicate with a server.
     The server is not included in this code. The chat server is a separate program: 'chat_server_ui.py'.
     The chat server allows multiple clients to connect to it and chat with each other in different rooms.
+    The connection, the handshake and the room state are kept by a BlockingChatClient
+    ('chat_client.py'), the window shows what it receives.
     """
-    ############################################################
-    # Client Socket  init
-    ############################################################
-    HOST = "127.0.0.1"  # 'localhost'
-    PORT = 9090
-    ADDR = (HOST, PORT)  # server_address
-    client = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-    client.connect(ADDR)
-    # Create a TCP/IP socket
-    # client = socket.create_connection(ADDR)
-
     ############################################################
     # Choose Nickname
     ############################################################
-    global current_room_name
-    current_room_name = "Lobby"
 
     # nickname = f"Nick_{random.randint(1,1000)}"
     nick_condition = False
@@ -123,7 +323,14 @@ def main():
     # PySimpleGUI   init
     ############################################################
     sg.theme("BlueMono")
-    current_room_id = rooms_id[current_room_name]
+    current_room_name = "Lobby"
+    # the rooms of the list: the built-in ones, then the catalog's pages as they come
+    room_names = {room_id: rooms_name[room_id] for room_id in range(BUILTIN_ROOMS)}
+    following = 0  # the start of the catalog's next page, 0 for none
+    # the members of the room: the pages listed, then the ones that enter and leave
+    members = {}  # member_id -> nickname
+    members_following = 0  # the `after` of the room's next page, 0 for none
+    members_count = 0  # the members of the room, the pages not listed too
 
     layout = [
         [sg.Titlebar("Chat Client")],
@@ -133,45 +340,42 @@ def main():
             ),
             sg.Push(),
             sg.Combo(  # sg.Combo sg.OptionMenu
-                [
-                    "Lobby",
-                    "Private Room 1",
-                    "Private Room 2",
-                    "Private Room 3",
-                    "Private Room 4",
-                    "Private Room 5",
-                    "Private Room 6",
-                    "Private Room 7",
-                    "Private Room 8",
-                    "Private Room 9",
-                ],
+                room_list(room_names, following),
                 font="Franklin 12",
-                size=(13, 10),
+                size=(20, 10),
                 default_value="Lobby",
                 enable_events=True,
                 readonly=True,
                 # background_color='#FFFFFF',
                 key="-ROOMS_OPTION-",
             ),
+            sg.Button("New Room...", key="-NEW_ROOM-"),
         ],
         [
-            sg.Multiline(
-                f" Hello {nickname}!\n Welcome to the lobby chat!\n\n",
+            sg.Multiline(  # the ChatView's
                 font="Franklin 11",
                 no_scrollbar=True,
                 size=(50, 20),
                 text_color="black",
-                background_color=rooms_color[current_room_name],
+                background_color=room_color(current_room_name),
                 horizontal_scroll=True,
-                autoscroll=True,
-                echo_stdout_stderr=True,
-                reroute_stdout=True,
-                # write_only=True,
-                reroute_cprint=True,
                 disabled=True,
-                # enter_submits=True,
                 key="-OUTPUT-",
             ),
+            sg.Column(
+                [
+                    [sg.Text("", font="Franklin 10", key="-MEMBERS_COUNT-")],
+                    [
+                        sg.Listbox(
+                            [],
+                            font="Franklin 10",
+                            size=(14, 17),
+                            enable_events=True,
+                            key="-MEMBERS-",
+                        )
+                    ],
+                ]
+            ),
         ],
         [
             sg.Multiline(
@@ -185,26 +389,83 @@ def main():
         ],
         [
             sg.Button("Send", size=(12, 1), key="-SEND-", button_color="#219F94"),
+            sg.Button("Send File...", key="-SEND_FILE-"),
             sg.Push(),
             sg.Button("Save Chat As...", key="-SAVE_LOG-"),
             sg.Button("Exit", size=(12, 1), key="-EXIT-"),
         ],
     ]
     window = sg.Window("", layout, finalize=True)
-    sg.cprint_set_output_destination(window, "-OUTPUT-")
+
+    # the rooms' transcripts, kept across the sessions of the nickname on the server
+    transcript = Transcript(TRANSCRIPT_DIR / f"{nickname}@{HOST}-{PORT}")
+    view = ChatView(window["-OUTPUT-"], transcript, nickname)
+    history = None  # [room name, messages to come, their lines] of a history answer
+
+    def note(kind, text, keep=True):
+        """It writes a line of the client to the view, and to the room's transcript with `keep`"""
+        view.write([time.time(), kind, nickname, text, 0], keep)
+
+    view.show(current_room_name)
+    note("note", f"Hello {nickname}! Welcome to the lobby chat!", keep=False)
 
     ############################################################
-    # Init 'receive' thread
+    # Connect: the frames are received in the client's thread, a lost
+    # connection is reconnected there too
     ############################################################
-    threading.Thread(
-        target=receive,
-        args=(
-            client,
-            window,
-            nickname,
-        ),
-        daemon=True,
-    ).start()
+    receiver = FileReceiver(DOWNLOAD_DIR)
+    on_frame, on_close, on_state = window_events(window, receiver)
+    client = BlockingChatClient(
+        nickname, HOST, PORT, on_frame=on_frame, on_close=on_close, on_state=on_state
+    )
+    try:
+        client.connect()
+        # the server answers with the recent messages
+        client.history(last=HISTORY_LINES)
+        # the first page of the catalog, its frames come as -ROOMS- events
+        window.perform_long_operation(
+            lambda: room_request(client.list_rooms), "-ROOMS_LISTED-"
+        )
+        # the first page of the room's members, its frames come as -ROSTER- events
+        window.perform_long_operation(
+            lambda: room_request(client.list_members), "-MEMBERS_LISTED-"
+        )
+    except RejectedError:
+        pass  # on_close() has sent the reason to the window
+    except (OSError, TimeoutError) as error:
+        window.write_event_value(
+            "-SocketError-", (now(), threading.current_thread().name, str(error))
+        )
+
+    def show_members(clear=False):
+        """It shows the member list, emptied with `clear`: the room's first page comes again"""
+        nonlocal members, members_following, members_count
+        if clear:
+            members, members_following, members_count = {}, 0, 0
+        window["-MEMBERS-"].update(values=member_list(members, members_following))
+        window["-MEMBERS_COUNT-"].update(f"{members_count} in the room")
+
+    def enter_room(room_name):
+        """It shows the room's transcript, and moves the client to it"""
+        nonlocal current_room_name, history
+        current_room_name = room_name  # update current_room_name
+        show_members(clear=True)
+        window["-ROOMS_OPTION-"].update(value=room_name)
+        view.show(current_room_name)
+        note(
+            "note",
+            f"Hello {nickname}! Welcome to the '{current_room_name}' chat!",
+            keep=False,
+        )
+        history = None
+
+        # EXIT_ROOM from the prev room, ENTER_ROOM and HISTORY of the new one: the messages
+        # of the history not in the transcript yet are added to it
+        if client.connected or client.reconnecting:
+            try:
+                client.join_room(current_room_name, HISTORY_LINES, wait=False)
+            except ValueError as error:  # deleted meanwhile
+                note("error", f"{error}", keep=False)
 
     while True:
         # ============================
@@ -217,74 +478,147 @@ def main():
         if event == "-ROOMS_OPTION-":
             # ============================
             room_name = values["-ROOMS_OPTION-"]
-            if room_name != current_room_name:
-                message = msg_composer(
-                    msg_type=EXIT_ROOM,
-                    nickname=nickname,
-                    room_id=rooms_id[current_room_name],  # the prev room
-                    payload=f"left '{current_room_name}'",
-                ).encode("utf-8")
-                client.send(message)
-
-                current_room_name = room_name  # update current_room_name
-
-                bg_color = rooms_color[current_room_name]
-                window["-OUTPUT-"].print("\n")  # align prev output
-                # change  background_color
-                window["-OUTPUT-"].print(
-                    "=" * 40,
-                    "\n",
-                    f"Hello {nickname}!\n Welcome to the '{current_room_name}' chat!\n\n",
-                    background_color=bg_color,
+            if room_name == MORE_ROOMS:  # the next page, the room stays
+                window["-ROOMS_OPTION-"].update(value=current_room_name)
+                if client.connected:
+                    window.perform_long_operation(
+                        lambda start=following: room_request(client.list_rooms, start),
+                        "-ROOMS_LISTED-",
+                    )
+            elif room_name != current_room_name:
+                enter_room(room_name)
+
+            # ============================
+        if event == "-NEW_ROOM-":
+            # ============================
+            room_name = sg.popup_get_text(
+                f"The name of the room, [1..{MAX_ROOM_NAME}] characters\n"
+                "The room is deleted once it's been empty for a while",
+                "New Room",
+            )
+            if room_name and client.connected:
+                window.perform_long_operation(
+                    lambda name=room_name: room_request(client.create_room, name),
+                    "-ROOM_CREATED-",
                 )
-                sg.cprint("")
 
-                message = msg_composer(
-                    msg_type=ENTER_ROOM,
-                    nickname=nickname,
-                    room_id=rooms_id[current_room_name],  # the new room
-                    payload=f"joined to '{current_room_name}'",
-                ).encode("utf-8")
-                client.send(message)
+            # ============================
+        if event == "-ROOM_CREATED-":
+            # ============================
+            time_stamp, (room_name,), room_id = values[event]
+            if isinstance(room_id, Exception):
+                sg.popup_error(f"The room '{room_name}' wasn't created:\n{room_id}")
+            else:
+                # its -ROOMS- event might be still queued
+                room_names[room_id] = room_name
+                window["-ROOMS_OPTION-"].update(
+                    values=room_list(room_names, following), value=current_room_name
+                )
+                enter_room(room_name)
+
+            # ============================
+        if event == "-ROOMS_LISTED-":
+            # ============================
+            time_stamp, _, listed = values[event]
+            if isinstance(listed, Exception):
+                note("error", f"the rooms weren't listed: {listed}", keep=False)
+
+            # ============================
+        if event == "-ROOMS-":
+            # ============================
+            time_stamp, kind, value = values[event]
+            if kind == "+":
+                room_names[value[0]] = value[1]
+            elif kind == "-" and room_names.pop(value[0], None) == current_room_name:
+                note("error", f"'{current_room_name}' was deleted")
+                enter_room("Lobby")
+            elif kind == "end":
+                following = value
+            elif kind == "error":
+                continue  # the answer of a request, shown by its event
+            window["-ROOMS_OPTION-"].update(
+                values=room_list(room_names, following), value=current_room_name
+            )
+
+            # ============================
+        if event == "-MEMBERS-":
+            # ============================
+            selected = values["-MEMBERS-"]
+            if selected and selected[0] == MORE_MEMBERS and client.connected:
+                window.perform_long_operation(
+                    lambda after=members_following: room_request(
+                        client.list_members, after
+                    ),
+                    "-MEMBERS_LISTED-",
+                )
+
+            # ============================
+        if event == "-MEMBERS_LISTED-":
+            # ============================
+            time_stamp, _, listed = values[event]
+            if isinstance(listed, Exception):
+                note("error", f"the members weren't listed: {listed}", keep=False)
+
+            # ============================
+        if event == "-ROSTER-":
+            # ============================
+            stamp, msg_nickname, msg_room_name, kind, value = values[event]
+            if msg_room_name != current_room_name:
+                continue  # a room the client has left meanwhile
+            if kind == "=":
+                members[value] = msg_nickname
+            elif kind == "+":
+                if value not in members:
+                    members_count += 1
+                members[value] = msg_nickname
+                text = f"{msg_nickname} joined to '{msg_room_name}'"
+                view.write([stamp, "event", msg_nickname, text, 0])
+            elif kind == "-":
+                members.pop(value, None)
+                members_count = max(members_count - 1, 0)
+                text = f"{msg_nickname} left '{msg_room_name}'"
+                view.write([stamp, "event", msg_nickname, text, 0])
+            elif kind == "end":
+                members_following, members_count = value
+            show_members()
 
             # ============================
         if event == "-RECEIVE_THREAD-":
             # ============================
             val = values[event]
-            time_stamp = val[0]
+            stamp = val[0]
             thread_ = val[1]
             msg_type = val[2]
             msg_nickname = val[3]
             msg_room_name = val[4]
             msg_payload = val[5]
+            seq = val[6]
             # print messages from the current_room_name only!
             if msg_room_name == current_room_name:
-                bg_color = rooms_color[msg_room_name]
-                if msg_type == EXIT_ROOM:
-                    bg_color = "#ffd258"
-                    sg.cprint(
-                        f"[{time_stamp}]  {msg_nickname} left '{msg_room_name}'",
-                        c=("#000000", bg_color),
+                if msg_type in [EXIT_ROOM, ENTER_ROOM]:
+                    text = (
+                        f"left '{msg_room_name}'"
+                        if msg_type == EXIT_ROOM
+                        else f"joined to '{msg_room_name}'"
                     )
-                elif msg_type == ENTER_ROOM:
-                    bg_color = "#ffd258"
-                    sg.cprint(
-                        f"[{time_stamp}]  {msg_nickname} joined to '{msg_room_name}'",
-                        c=("#000000", bg_color),
+                    view.write(
+                        [stamp, "event", msg_nickname, f"{msg_nickname} {text}", 0]
                     )
+                elif msg_type == HISTORY:  # the stored messages follow
+                    count, error = parse_history_answer(msg_payload)
+                    if error:
+                        note("error", f"no history: {error}", keep=False)
+                    elif count:
+                        history = [msg_room_name, count, []]
+                elif msg_type == CHAT_CONVERSATION and history:
+                    history[2].append([stamp, "chat", msg_nickname, msg_payload, seq])
+                    history[1] -= 1
+                    # the answer is complete: its messages not in the transcript are shown
+                    if not history[1]:
+                        view.add(transcript.merge(msg_room_name, history[2]))
+                        history = None
                 elif msg_type == CHAT_CONVERSATION:
-                    bg_color = rooms_color[msg_room_name]
-                    just_ = "l" if msg_nickname == nickname else "r"  # left / right
-                    sg.cprint(
-                        f"[{time_stamp}]  {msg_nickname} wrote:",
-                        c=("#000000", bg_color),
-                        justification=just_,  # left / right,
-                    )
-                    sg.cprint(
-                        f"{msg_payload}\n",
-                        c=("#000000", bg_color),
-                        justification=just_,
-                    )
+                    view.write([stamp, "chat", msg_nickname, msg_payload, seq])
 
         # window["-OUTPUT-"].print(
         #     "\n",
@@ -295,24 +629,66 @@ def main():
         # ============================
         if event == "-SEND-":
             # ============================
-            current_room_id = rooms_id[current_room_name]
             payload_ = f"{values['-INPUT-']}"
-            if len(payload_) > MAX_PAYLOAD:
+            if (
+                len(payload_.encode("utf-8")) > MAX_PAYLOAD
+                and client.version != PROTOCOL_V3
+            ):
                 sg.popup_error(
-                    f"Message exceed {MAX_PAYLOAD} characters!",
+                    f"Message exceed {MAX_PAYLOAD} bytes (UTF-8)!",
                     title="Error: Message Length Violation",
                 )
                 # Shows red error button
-            else:
-                message = msg_composer(
-                    msg_type=CHAT_CONVERSATION,
-                    nickname=nickname,
-                    room_id=current_room_id,
-                    payload=payload_,
-                ).encode("utf-8")
-                client.send(message)
+            elif len(payload_.encode("utf-8")) > MAX_PAYLOAD:  # sent as a transfer
+                text = payload_.encode("utf-8")
+                window.perform_long_operation(
+                    lambda: send_file(client, text, "message.txt", text=True),
+                    "-FILE_SENT-",
+                )
+                window["-INPUT-"].update("")
+            elif client.connected or client.reconnecting:
+                client.send(payload_)  # to the current room, sent once it's back
                 window["-INPUT-"].update("")  # clean input prompt
 
+            # ============================
+        if event == "-SEND_FILE-":
+            # ============================
+            if client.version != PROTOCOL_V3:
+                sg.popup_error("The server can't take files (protocol v3)")
+            elif fname := sg.popup_get_file("Send a file to the room", no_window=True):
+                window.perform_long_operation(
+                    lambda: send_file(client, fname), "-FILE_SENT-"
+                )
+
+            # ============================
+        if event == "-FILE_SENT-":
+            # ============================
+            time_stamp, name, sent = values[event]
+            if isinstance(sent, Exception):
+                note("error", f"'{name}' not sent: {sent}", keep=False)
+            else:
+                note("note", f"you shared '{name}' ({sent} bytes)")
+
+            # ============================
+        if event == "-FILE_RECEIVED-":
+            # ============================
+            time_stamp, thread_, msg_nickname, path, description = values[event]
+            size = description.get("size", 0)
+            if description.get("text") and size <= MAX_TEXT_SHOWN:
+                text = Path(path).read_text("utf-8", errors="replace")
+                view.write([time.time(), "chat", msg_nickname, text, 0])
+            else:
+                view.write(
+                    [
+                        time.time(),
+                        "note",
+                        msg_nickname,
+                        f"{msg_nickname} shared '{description.get('name')}' "
+                        f"({size} bytes), saved to {path}",
+                        0,
+                    ]
+                )
+
             # ============================
         if event == "-SAVE_LOG-":
             # ============================
@@ -323,7 +699,44 @@ def main():
                 file_types=(("Text Files", "*.txt"),),
                 no_window=True,
             ):
-                Path(fname).write_text(values["-OUTPUT-"])
+                # the room's whole transcript, not only the lines in the view
+                with open(fname, "w", encoding="utf-8") as file:
+                    for line in transcript.lines(current_room_name):
+                        file.writelines(
+                            text for text, _ in line_segments(line, nickname)
+                        )
+
+            # ============================
+        if event == "-RECONNECT-":
+            # ============================
+            time_stamp, thread_, state, error = values[event]
+            if state == "reconnecting":
+                # the catalog comes again after the resume: the rooms deleted meanwhile go
+                room_names = {
+                    room_id: name
+                    for room_id, name in room_names.items()
+                    if room_id < BUILTIN_ROOMS
+                }
+                following = 0
+                show_members(clear=True)  # likewise the room's members
+                note("event", f"connection lost ({error}), reconnecting...")
+            else:
+                note("event", f"reconnected to '{client.room}'")
+
+            # ============================
+        if event == "-REJECTED-":
+            # ============================
+            val = values[event]
+            time_stamp = val[0]
+            thread_ = val[1]
+            reason = val[2]
+            note(
+                "error",
+                f"Refused by server [{time_stamp}][{thread_}][{reason}]",
+                keep=False,
+            )
+            sg.popup_error(f"The server refused the connection:\n{reason}")
+            break
 
             # ============================
         if event in ["-ConnectionAbortedError-", "-SocketError-"]:
@@ -331,16 +744,19 @@ def main():
             val = values[event]
             time_stamp = val[0]
             thread_ = val[1]
-            sg.cprint("Data from Exception ", colors="yellow on red", end="")
-            sg.cprint(f"[{time_stamp}]", c=("#FFFFFF", "#b20000"), end="")
-            sg.cprint(f"[{thread_}]", c=("#FFFFFF", "#ff0000"), end="")
-            sg.cprint(f"[{event}]", c=("#FFFFFF", "#b20000"))
-            client.close()
+            note(
+                "error",
+                f"Data from Exception [{time_stamp}][{thread_}][{event}: {val[2]}]",
+                keep=False,
+            )
             break
 
     ############################################################
     # finalize Socket & GUI
     ############################################################
+    client.close()
+    receiver.close()
+    transcript.close()
     window.close()
     sys.exit()
     # trd_id._stop.set()
@@ -0,0 +1,727 @@
+# -*- coding: utf-8 -*-
+"""
+The multi-process chat server: N worker processes share the listening port (SO_REUSEPORT, the
+kernel spreads the new connections over the workers) and each one runs the asyncio ChatServer
+engine for its own clients, so the relay work uses N cores.
+
+The workers are connected by a local bus of Unix domain sockets, one link from every worker to
+every other worker and one to the supervisor (the parent process):
+    - every worker publishes the presence of its clients (join, room, leave) on all its links, so
+      every worker knows which rooms have members on which other workers, and the supervisor
+      keeps the roster of the whole cluster (the status view)
+    - every room has an owner, the worker room_id % N, that numbers its chat messages: a
+      CHAT_CONVERSATION message goes to the owner first, which stores it with the room's next
+      seq and time and sends it on to every other worker with them. Every worker stores it with
+      the owner's seq, then sends it to its members in the room: a room has the same order, the
+      same seqs (protocol v3) and the same history on every worker, and a client that reconnects
+      to another worker resumes from its seq. The members of the sender's worker get the message
+      once it's back from the owner, one bus round trip later
+    - an ENTER_ROOM or EXIT_ROOM message (a join announcement too) is sent only to the workers
+      with members in its room, as it goes to the room's members only. The roster of a room is
+      the members of the worker and the remote ones of the presence messages, with member ids
+      unique in the cluster: a worker sends the roster diffs of the remote members to its own
+      roster listeners
+    - the supervisor owns the catalog of the rooms: a worker forwards the ROOMS requests to create
+      and delete a room, the supervisor allocates the ids, deletes the rooms left empty in the
+      whole cluster, and sends every change to every worker, which passes it to its clients.
+      A worker gets the whole catalog when it connects
+    - a CHUNK frame of a transfer (v3) is sent only to the workers with members in its room, like
+      a chat message. A worker stops reading a bus link while the chunk queue of a client is
+      full, and the sender of the chunks stops being read while a bus link is full: the
+      messages of the link wait behind the transfer, up to `block_timeout`
+A bus message is: kind (1 byte) + body length (2 bytes, network order) + body. The chat messages
+are relayed on the bus as received, never decoded.
+
+The limits (max_clients, max_pending) are divided between the workers. Every worker keeps the
+history of every room, in its own `history_dir/worker-N`. With `--stats-port P` worker N serves
+its own metrics on port P + N. SO_REUSEPORT is needed: Linux, or a BSD.
+
+Example:
+        $ python -m chat_cluster --workers 4 --host 0.0.0.0 --port 9090 --max-clients 20000
+
+@Author: Vadim Moldavsky   vasja34@gmail.com
+@Date:   17/08/2022
+"""
+
+import argparse
+import asyncio
+import collections
+import itertools
+import json
+import multiprocessing
+import os
+import signal
+import struct
+import tempfile
+
+from chat_protocol import *
+from chat_registry import MAX_ROOMS, ROOM_IDLE_TIMEOUT, RoomRegistry
+from chat_server import (
+    HOST,
+    PORT,
+    ChatServer,
+    LogObserver,
+    add_server_arguments,
+    broadcast,
+    log,
+    server_options,
+    setup_logging,
+)
+
+BUS_HEADER = struct.Struct("!cH")  # kind, body length
+HELLO = b"H"  # the first message of a link, the body is the sender's worker id
+# a client joined or changed room, the body is [conn name, host, port, nickname, room_id,
+# member_id]
+PRESENCE = b"P"
+LEAVE = b"L"  # a client left, the body is its conn name
+FRAME = b"F"  # a message to relay, the body is the encoded message (v1)
+# a chat message to the owner of its room, to be numbered: the body is the encoded message (v1)
+CHAT_REQUEST = b"O"
+# a chat message numbered by the owner of its room, to every worker: the body is the seq and the
+# time (V3_STAMP) + the encoded message (v1)
+CHAT_FRAME = b"S"
+CHUNK_FRAME = b"C"  # a CHUNK frame to relay, the body is the encoded v3 frame
+# a worker's ROOMS request to the supervisor: ["create", name or "delete", room_id, host, port]
+ROOM_REQUEST = b"Q"
+# a change of the catalog, from the supervisor: [room_id, name (None: deleted), requester
+# ([worker id, host, port] or None), error (or None)], room_id None: the catalog starts again
+ROOM = b"R"
+
+STATUS_INTERVAL = 0.0  # seconds between the status lines of the supervisor, 0 for none
+CLUSTER_LOG_FORMAT = (
+    "ts=%(asctime)s level=%(levelname)s proc=%(processName)s %(message)s"
+)
+
+
+def bus_path(bus_dir, name):
+    """It returns the path of the Unix domain socket of a bus member"""
+    return os.path.join(bus_dir, f"{name}.sock")
+
+
+def bus_message(kind, body):
+    """It returns the encoded bus message"""
+    return BUS_HEADER.pack(kind, len(body)) + body
+
+
+async def read_bus(reader):
+    """It reads one bus message and returns (kind, body)"""
+    kind, size = BUS_HEADER.unpack(await reader.readexactly(BUS_HEADER.size))
+    return kind, await reader.readexactly(size)
+
+
+def presence_message(session):
+    """It returns the PRESENCE bus message of a Session"""
+    host, port = session.address[:2]
+    body = [
+        session.conn.name,
+        host,
+        port,
+        session.nickname,
+        session.room_id,
+        session.member_id,
+    ]
+    return bus_message(PRESENCE, json.dumps(body).encode("utf-8"))
+
+
+def room_message(room_id, name, requester=None, error=None):
+    """It returns the ROOM bus message of a change of the catalog"""
+    body = [room_id, name, requester, error]
+    return bus_message(ROOM, json.dumps(body).encode("utf-8"))
+
+
+async def open_link(path, hello, timeout=10.0):
+    """
+    It connects to the bus socket of another member, when it's up, and sends the HELLO
+
+    :return: the link's (StreamReader, StreamWriter)
+    """
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + timeout
+    while True:
+        try:
+            reader, writer = await asyncio.open_unix_connection(path)
+            break
+        except (FileNotFoundError, ConnectionRefusedError):
+            if loop.time() > deadline:
+                raise
+            await asyncio.sleep(0.05)
+    writer.write(bus_message(HELLO, hello))
+    return reader, writer
+
+
+class ClusterWorker(ChatServer):
+    """
+    One worker process of the cluster: the ChatServer of the clients the kernel gave to this
+    worker, plus the bus links that relay the messages to and from the other workers.
+    """
+
+    def __init__(self, worker_id, workers, bus_dir, host=HOST, port=PORT, **options):
+        """
+        :param worker_id: the worker's number, 0 .. workers - 1
+        :param workers: the number of workers in the cluster
+        :param bus_dir: the directory of the bus sockets
+        :param host: the address to listen on
+        :param port: the port to listen on, shared by all the workers
+        :param options: the other ChatServer options
+        """
+        if options.get("history_dir"):  # the segment files of every worker apart
+            options["history_dir"] = os.path.join(
+                options["history_dir"], f"worker-{worker_id}"
+            )
+        if options.get("journal_dir"):  # likewise the journal files
+            options["journal_dir"] = os.path.join(
+                options["journal_dir"], f"worker-{worker_id}"
+            )
+        if options.get("stats_port") is not None:  # one stats endpoint per worker
+            options["stats_port"] += worker_id
+        options["room_idle_timeout"] = None  # the supervisor deletes the empty rooms
+        super().__init__(host, port, reuse_port=True, **options)
+        self.rooms.path = None  # and keeps the catalog
+        # the member ids of every worker apart: worker_id + workers * n
+        self.sessions.member_ids = itertools.count(worker_id + workers, workers)
+        self.worker_id = worker_id
+        self.workers = workers
+        self.bus_dir = bus_dir
+        self.peers = {}  # worker id -> the bus link (StreamWriter) to the other worker
+        self.supervisor = None  # the bus link to the supervisor: presence and rooms
+        # the clients of the other workers
+        # worker id -> {conn name: [room_id, member_id, nickname]}
+        self.remote_sessions = {}
+        # room_id -> Counter(worker id: members), the rooms with remote members only
+        self.remote_rooms = collections.defaultdict(collections.Counter)
+        # room_id -> {member_id: nickname}, likewise
+        self.remote_rosters = collections.defaultdict(dict)
+
+    def links(self):
+        """It returns the bus links the presence is published on"""
+        return [*self.peers.values(), self.supervisor]
+
+    @staticmethod
+    def publish(message, links):
+        for link in links:
+            link.write(message)
+
+    # ===========================================
+    # ChatServer
+    # ===========================================
+    async def serve(self):
+        bus = await asyncio.start_unix_server(
+            self.on_bus_link, bus_path(self.bus_dir, f"worker-{self.worker_id}")
+        )
+        async with bus:
+            await self.connect_bus()
+            try:
+                await super().serve()
+            finally:
+                for link in self.links():
+                    link.close()
+
+    def on_handshake(self, conn, data):
+        super().on_handshake(conn, data)
+        if conn.session is not None:
+            self.publish(presence_message(conn.session), self.links())
+
+    def announce(self, message, room_id=None):
+        super().announce(message, room_id)
+        self.publish(bus_message(FRAME, message), self.room_links(room_id))
+
+    def room_links(self, room_id):
+        """It returns the links to the workers with members in the room, None: every worker"""
+        if room_id is None:
+            return self.peers.values()
+        members = self.remote_rooms.get(room_id, ())
+        return [self.peers[worker_id] for worker_id in members]
+
+    def owner(self, room_id):
+        """It returns the id of the worker that numbers the chat messages of the room"""
+        return room_id % self.workers
+
+    def relay(self, conn, data, header=None):
+        version = conn.version
+        if version == PROTOCOL_V1:
+            header = header or header_parser(data)
+        if header[0] == CHAT_CONVERSATION:
+            room_id = room_id_parser(data, header, version)
+            frame = self.frames(data, version, PROTOCOL_V1)  # the bus carries v1
+            if (owner := self.owner(room_id)) != self.worker_id:
+                # sent to the members of this worker too once the owner has numbered it
+                self.peers[owner].write(bus_message(CHAT_REQUEST, frame))
+                if self.metrics is not None:
+                    self.metrics.on_relay(room_id, len(data), 0)
+                return None
+            stamps = super().relay(conn, data, header)
+            self.publish_chat(stamps[0], frame)
+            return stamps
+        super().relay(conn, data, header)
+        if header[0] in (EXIT_ROOM, ENTER_ROOM):
+            self.publish(presence_message(conn.session), self.links())
+            links = self.room_links(room_id_parser(data, header, version))
+        else:
+            links = self.peers.values()
+        if links:  # the bus carries v1, like the history
+            frame = self.frames(data, version, PROTOCOL_V1)
+            self.publish(bus_message(FRAME, frame), links)
+        return None
+
+    def publish_chat(self, stamps, frame):
+        """
+        It sends a chat message of a room this worker owns to every other worker, with its
+        (seq, time): every worker keeps the room's history, whether it has members in the room
+        or not
+        """
+        body = V3_STAMP.pack(*stamps) + frame
+        self.publish(bus_message(CHAT_FRAME, body), self.peers.values())
+
+    def room_roster(self, room_id):
+        return super().room_roster(room_id) + list(
+            self.remote_rosters.get(room_id, {}).items()
+        )
+
+    def create_room(self, conn, name):
+        self.request_room(conn, "create", name)
+
+    def delete_room(self, conn, room_id):
+        self.request_room(conn, "delete", room_id)
+
+    def request_room(self, conn, op, value):
+        """It forwards a ROOMS request to the supervisor, the answer comes as a ROOM message"""
+        host, port = conn.address[:2]
+        body = json.dumps([op, value, host, port]).encode("utf-8")
+        self.supervisor.write(bus_message(ROOM_REQUEST, body))
+
+    def on_chunk(self, conn, data, header):
+        super().on_chunk(conn, data, header)
+        room_id = header[2]
+        if room_id == conn.session.room_id:
+            links = self.room_links(room_id)
+            self.publish(bus_message(CHUNK_FRAME, data), links)
+            if full := [
+                link
+                for link in links
+                if link.transport.get_write_buffer_size() > self.write_buffer_high
+            ]:
+                conn.pause_until(self.drain_links(full))
+
+    def on_disconnect(self, conn):
+        super().on_disconnect(conn)
+        if conn.session is not None:
+            self.publish(bus_message(LEAVE, conn.name.encode("utf-8")), self.links())
+
+    # ===========================================
+    # Bus
+    # ===========================================
+    async def connect_bus(self):
+        """It opens the bus links to the other workers and to the supervisor"""
+        hello = str(self.worker_id).encode("utf-8")
+        for worker_id in range(self.workers):
+            if worker_id != self.worker_id:
+                path = bus_path(self.bus_dir, f"worker-{worker_id}")
+                _, self.peers[worker_id] = await open_link(path, hello)
+        reader, self.supervisor = await open_link(
+            bus_path(self.bus_dir, "supervisor"), hello
+        )
+        asyncio.get_running_loop().create_task(self.read_supervisor(reader))
+
+    async def read_supervisor(self, reader):
+        """It reads the changes of the catalog sent by the supervisor"""
+        try:
+            while True:
+                kind, body = await read_bus(reader)
+                if kind == ROOM:
+                    self.on_room_change(*json.loads(body))
+        except (asyncio.IncompleteReadError, ConnectionError, asyncio.CancelledError):
+            pass  # the supervisor is gone, or the event loop is shutting down
+
+    def on_room_change(self, room_id, name, requester, error):
+        """
+        It applies a change of the catalog: to the clients that listen to it, and as the answer
+        to the client of this worker that asked for it (`requester`), if any
+        """
+        conn = None
+        if requester is not None and requester[0] == self.worker_id:
+            session = self.sessions.by_address(tuple(requester[1:]))
+            conn = session.conn if session is not None else None
+        if error is not None:
+            if conn is not None:
+                conn.send(self.rooms_frame("error", error, conn.session.nickname))
+        elif room_id is None:
+            self.rooms.catalog.reset()
+        elif name is None:
+            if (old := self.rooms.catalog.remove(room_id)) is not None:
+                self.room_deleted(room_id, old, conn)
+        elif self.rooms.catalog.names.get(room_id) == name:
+            # the answer to a room that exists
+            if conn is not None:
+                conn.send(self.rooms_frame("+", (room_id, name), conn.session.nickname))
+        else:
+            self.rooms.add(room_id, name)
+            self.room_added(room_id, name, conn)
+
+    async def on_bus_link(self, reader, writer):
+        """It reads the bus link of another worker until it's closed"""
+        peer = None
+        try:
+            while True:
+                kind, body = await read_bus(reader)
+                if kind == FRAME:
+                    self.deliver(body)
+                elif kind == CHAT_FRAME:
+                    self.deliver(body[V3_STAMP.size :], V3_STAMP.unpack_from(body))
+                elif kind == CHAT_REQUEST:  # a room of this worker: numbered here
+                    self.publish_chat(self.deliver(body), body)
+                elif kind == CHUNK_FRAME:
+                    if full := self.deliver_chunk(body):
+                        await self.wait_for_queues(full, chunks=True)
+                elif kind == PRESENCE:
+                    name, _, _, nickname, room_id, member_id = json.loads(body)
+                    self.set_remote_room(peer, name, room_id, member_id, nickname)
+                elif kind == LEAVE:
+                    name = body.decode("utf-8")
+                    self.set_remote_room(peer, name, None)
+                    del self.remote_sessions[peer][name]
+                elif kind == HELLO:
+                    peer = int(body)
+                    self.remote_sessions[peer] = {}
+        except (asyncio.IncompleteReadError, ConnectionError, asyncio.CancelledError):
+            pass  # the link is closed, or the event loop is shutting down
+        finally:
+            if peer is not None:  # the worker is gone, and so are its clients
+                for name in list(self.remote_sessions[peer]):
+                    self.set_remote_room(peer, name, None)
+                del self.remote_sessions[peer]
+            writer.close()
+
+    def set_remote_room(self, peer, name, room_id, member_id=0, nickname=None):
+        """
+        It moves a client of another worker into the room (None: out of any room), and sends the
+        roster diffs to the roster listeners of this worker
+        """
+        sessions = self.remote_sessions[peer]
+        old_room, old_id, old_nickname = sessions.get(name) or (None, 0, None)
+        if old_room is not None:
+            members = self.remote_rooms[old_room]
+            members[peer] -= 1
+            if members[peer] <= 0:
+                del members[peer]
+                if not members:
+                    del self.remote_rooms[old_room]
+            roster = self.remote_rosters[old_room]
+            roster.pop(old_id, None)
+            if not roster:
+                del self.remote_rosters[old_room]
+            self.roster_diff("-", old_room, old_id, old_nickname)
+        if room_id is not None:
+            self.remote_rooms[room_id][peer] += 1
+            self.remote_rosters[room_id][member_id] = nickname
+            self.roster_diff("+", room_id, member_id, nickname)
+        sessions[name] = [room_id, member_id, nickname]
+
+    def deliver(self, data, stamps=None):
+        """
+        It sends a message relayed by another worker to the clients of this worker. The sender
+        can't be paused from here: with the BLOCK policy a full queue just goes over its limit.
+
+        :param data: the encoded message (v1)
+        :param stamps: the (seq, time) of a chat message numbered by the owner of its room, None
+        for a chat message of a room this worker owns: it's numbered here
+        :return: the (seq, time) of a chat message, None for the other messages
+        """
+        header = header_parser(data)
+        room_id = room_id_parser(data, header)
+        stamped = None
+        if header[0] == CHAT_CONVERSATION:
+            clients = self.sessions.members(room_id)
+            stamps = self.history.append(room_id, data, PROTOCOL_V1, stamps)
+            stamped = [stamps]
+        elif header[0] in (EXIT_ROOM, ENTER_ROOM):  # the listeners get the roster diffs
+            listeners = self.roster_listeners
+            clients = [c for c in self.sessions.members(room_id) if c not in listeners]
+        else:
+            clients = self.sessions.connections()
+        broadcast(data, clients, stamped)
+        if self.metrics is not None:
+            self.metrics.on_deliver(room_id, len(data), len(clients))
+        return stamps
+
+    def deliver_chunk(self, data):
+        """
+        It sends a CHUNK frame relayed by another worker to the v3 clients of the room on this
+        worker
+
+        :return: the clients whose chunk queue is full: the bus link waits for them
+        """
+        room_id = V3_HEADER.unpack_from(data)[2]
+        clients = [
+            client
+            for client in self.sessions.members(room_id)
+            if client.version == PROTOCOL_V3
+        ]
+        full = [client for client in clients if client.send_chunk(data) is False]
+        if self.metrics is not None:
+            self.metrics.on_deliver(room_id, len(data), len(clients))
+        return full
+
+    @staticmethod
+    async def drain_links(links):
+        """It waits until the write buffers of the bus links go under their limit"""
+        await asyncio.gather(*(link.drain() for link in links), return_exceptions=True)
+
+
+def run_worker(worker_id, workers, bus_dir, host, port, log_level, options):
+    """The main function of a worker process"""
+    setup_logging(log_level, CLUSTER_LOG_FORMAT)
+    server = ClusterWorker(
+        worker_id,
+        workers,
+        bus_dir,
+        host,
+        port,
+        **options,
+    )
+    server.attach(LogObserver(names=server.rooms.catalog.names))
+    signal.signal(signal.SIGTERM, lambda *_: server.stop())
+    try:
+        server.run()
+    except KeyboardInterrupt:
+        pass
+
+
+class ClusterSupervisor:
+    """
+    The parent process of the cluster: it starts the workers and keeps the roster of all their
+    clients, from the presence messages of the bus. It owns the catalog of the rooms: it counts
+    the members of every room in the whole cluster, and deletes a created room left empty.
+    """
+
+    def __init__(
+        self,
+        host=HOST,
+        port=PORT,
+        workers=None,
+        status_interval=STATUS_INTERVAL,
+        log_level="INFO",
+        **options,
+    ):
+        """
+        :param host: the address to listen on
+        :param port: the port to listen on
+        :param workers: the number of worker processes, None for the number of CPUs
+        :param status_interval: seconds between the status lines in the log, 0 for none
+        :param log_level: the log level of the workers
+        :param options: the ChatServer options of the whole cluster, the limits are divided
+        between the workers
+        """
+        self.host = host
+        self.port = port
+        self.workers = workers or os.cpu_count() or 1
+        self.status_interval = status_interval
+        self.log_level = log_level
+        for limit in ("max_clients", "max_pending"):
+            if options.get(limit):
+                options[limit] = -(-options[limit] // self.workers)  # ceil
+        self.options = options
+        history_dir = options.get("history_dir")
+        if history_dir:
+            os.makedirs(history_dir, exist_ok=True)
+        # loaded before the workers are forked: they start with the catalog
+        self.rooms = RoomRegistry(
+            max_rooms=options.get("max_rooms", MAX_ROOMS),
+            idle_timeout=options.get("room_idle_timeout", ROOM_IDLE_TIMEOUT),
+            path=os.path.join(history_dir, "rooms.json") if history_dir else None,
+            on_expire=lambda room_id, _: self.publish(room_message(room_id, None)),
+        )
+
+        self.roster = {}  # (worker id, conn name) -> [(host, port), nickname, room_id]
+        self.room_members = collections.Counter()  # room_id -> members in the cluster
+        self.links = {}  # worker id -> the bus link (StreamWriter) to the worker
+        self.loop = None
+        self._stopped = None
+
+    def status_dict(self):
+        """It returns a dictionary of address -> [nickname, room name] of the whole cluster"""
+        return {
+            address: [nickname, self.rooms.catalog.names.get(room_id, "")]
+            for address, nickname, room_id in self.roster.values()
+        }
+
+    def publish(self, message):
+        """It sends a bus message to every worker"""
+        for link in self.links.values():
+            link.write(message)
+
+    async def on_bus_link(self, reader, writer):
+        """It reads the presence and the ROOMS requests of a worker until its link is closed"""
+        worker_id = None
+        try:
+            while True:
+                kind, body = await read_bus(reader)
+                if kind == PRESENCE:
+                    name, host, port, nickname, room_id, _ = json.loads(body)
+                    old = self.roster.get((worker_id, name))
+                    self.move_member(old[2] if old else None, room_id)
+                    self.roster[worker_id, name] = [(host, port), nickname, room_id]
+                elif kind == LEAVE:
+                    old = self.roster.pop((worker_id, body.decode("utf-8")), None)
+                    self.move_member(old[2] if old else None, None)
+                elif kind == ROOM_REQUEST:
+                    self.on_room_request(worker_id, writer, *json.loads(body))
+                elif kind == HELLO:
+                    worker_id = int(body)
+                    self.links[worker_id] = writer
+                    writer.write(room_message(None, None))  # the catalog, from scratch
+                    for room_id, name in self.rooms.created():
+                        writer.write(room_message(room_id, name))
+        except (asyncio.IncompleteReadError, ConnectionError, asyncio.CancelledError):
+            pass  # the link is closed, or the event loop is shutting down
+        finally:
+            self.links.pop(worker_id, None)
+            for key in [key for key in self.roster if key[0] == worker_id]:
+                self.move_member(self.roster.pop(key)[2], None)
+            writer.close()
+
+    def move_member(self, old_room, new_room):
+        """It counts a member that moved from a room to another one (None for none)"""
+        if old_room == new_room:
+            return
+        if old_room is not None:
+            self.room_members[old_room] -= 1
+            if self.room_members[old_room] <= 0:
+                del self.room_members[old_room]
+                self.rooms.vacated(old_room)
+        if new_room is not None:
+            if not self.room_members[new_room]:
+                self.rooms.used(new_room)
+            self.room_members[new_room] += 1
+
+    def on_room_request(self, worker_id, link, op, value, host, port):
+        """It creates or deletes a room for a client of a worker, and publishes the change"""
+        requester = [worker_id, host, port]
+        try:
+            if op == "create":
+                room_id, created = self.rooms.create(value)
+                message = room_message(room_id, value, requester)
+                if not created:  # the answer only
+                    link.write(message)
+                    return
+            elif op == "delete":
+                if self.room_members[value]:
+                    raise ValueError("The room is not empty")
+                self.rooms.delete(value)
+                message = room_message(value, None, requester)
+            else:
+                raise ValueError("Bad rooms request")
+        except (ValueError, TypeError) as error:
+            link.write(room_message(None, None, requester, str(error)))
+            return
+        self.publish(message)
+
+    def log_status(self):
+        rooms = collections.Counter(
+            room_name(room_id, self.rooms.catalog.names)
+            for _, _, room_id in self.roster.values()
+            if room_id is not None
+        )
+        log.info(
+            LogObserver.logfmt(
+                event="status",
+                sessions=len(self.roster),
+                rooms=",".join(f"{name}:{num}" for name, num in sorted(rooms.items())),
+            )
+        )
+
+    def start_workers(self, bus_dir):
+        """It starts the worker processes, they connect to the bus when it's up"""
+        processes = [
+            multiprocessing.Process(
+                target=run_worker,
+                args=(
+                    worker_id,
+                    self.workers,
+                    bus_dir,
+                    self.host,
+                    self.port,
+                    self.log_level,
+                    dict(self.options, catalog=self.rooms.catalog),
+                ),
+                name=f"worker-{worker_id}",
+            )
+            for worker_id in range(self.workers)
+        ]
+        for process in processes:
+            process.start()
+        return processes
+
+    async def serve(self, bus_dir, processes):
+        self.loop = asyncio.get_running_loop()
+        self._stopped = asyncio.Event()
+        for signum in (signal.SIGTERM, signal.SIGINT):
+            self.loop.add_signal_handler(signum, self._stopped.set)
+        bus = await asyncio.start_unix_server(
+            self.on_bus_link, bus_path(bus_dir, "supervisor")
+        )
+        log.info(LogObserver.logfmt(event="cluster", workers=self.workers))
+        self.rooms.start_timers()
+        exited = set()
+        async with bus:
+            while not self._stopped.is_set():
+                interval = self.status_interval or 1.0
+                try:
+                    await asyncio.wait_for(self._stopped.wait(), interval)
+                except asyncio.TimeoutError:
+                    pass
+                for process in processes:
+                    if process.exitcode is not None and process not in exited:
+                        exited.add(process)
+                        log.warning(
+                            LogObserver.logfmt(
+                                event="worker-exit",
+                                worker=process.name,
+                                exitcode=process.exitcode,
+                            )
+                        )
+                if self.status_interval:
+                    self.log_status()
+        for process in processes:
+            process.terminate()
+        for process in processes:
+            process.join()
+        self.rooms.save()
+
+    def run(self):
+        """It runs the cluster until SIGTERM / SIGINT"""
+        with tempfile.TemporaryDirectory(prefix="chat-bus-") as bus_dir:
+            # the workers are forked before the supervisor's event loop runs
+            processes = self.start_workers(bus_dir)
+            asyncio.run(self.serve(bus_dir, processes))
+
+
+def main(argv=None):
+    """It parses the command line and runs the multi-process chat server, without GUI"""
+    parser = argparse.ArgumentParser(
+        prog="chat_cluster", description="The multi-process chat server"
+    )
+    parser.add_argument(
+        "--workers", type=int, help="worker processes, default: the number of CPUs"
+    )
+    parser.add_argument(
+        "--status-interval",
+        type=float,
+        default=STATUS_INTERVAL,
+        help="seconds between the status lines, 0 for none",
+    )
+    add_server_arguments(parser)
+    args = parser.parse_args(argv)
+    setup_logging(args.log_level, CLUSTER_LOG_FORMAT)
+    ClusterSupervisor(
+        args.host,
+        args.port,
+        workers=args.workers,
+        status_interval=args.status_interval,
+        log_level=args.log_level,
+        **server_options(args),
+    ).run()
+    log.info(LogObserver.logfmt(event="stopped"))
+
+
+if __name__ == "__main__":
+    main()
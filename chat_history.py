@@ -0,0 +1,457 @@
+# -*- coding: utf-8 -*-
+"""
+The message history of the chat rooms. Every room keeps its recent CHAT_CONVERSATION messages in
+a bounded in-memory ring. With a history directory, the messages pushed out of the ring are
+appended to the room's segment files, and read back through mmap:
+
+    <directory>/room-<room_id>-<n>.seg: the encoded messages, one after the other, as relayed
+    <directory>/room-<room_id>-<n>.idx: the seq, the time and the protocol of every message,
+                                        17-byte records
+
+Every message starts with its own header, so a run of messages is one contiguous slice of the
+file, ready to be sent as is. The offset and the time of every message in the files are kept in
+memory, so a HISTORY request finds its slice without reading the files.
+
+Every room numbers its messages: the seq of a message is one more than the seq of the one before,
+the first one is 1. A HISTORY request finds the messages after a seq without a search, the seqs
+of a room are contiguous from its oldest stored message to its newest. In a cluster the messages
+are numbered by the worker that owns the room and stored with its seqs by every worker, see
+chat_cluster.
+
+The history survives a restart of the server: close() spills the ring into the segment files,
+and a new ChatHistory on the same directory loads the index of the segment files it finds. The
+seqs go on from the newest stored message; without a directory they start again from 1.
+
+The messages are stored encoded, in the protocol of their sender (a v3 message with its seq and
+time), and replayed as stored to the clients of that protocol: nothing is re-encoded. For the
+clients of another protocol a run of messages is transcoded once per answer, see replay(), never
+on the live relay. Storing a message is an append to the ring (and a buffered file write for the
+message pushed out of it); reading the segment files runs in a worker thread, away from the live
+relay.
+
+@Author: Vadim Moldavsky   vasja34@gmail.com
+@Date:   17/08/2022
+"""
+
+import array
+import bisect
+import collections
+import itertools
+import mmap
+import os
+import re
+import struct
+import time
+
+from chat_protocol import *
+
+HISTORY_SIZE = 100  # messages kept in memory per room
+HISTORY_MAX_REPLY = 1000  # messages in the answer to a HISTORY request
+SEGMENT_SIZE = 1 << 20  # bytes, a segment file is closed when it's over this size
+MAX_SEGMENTS = 16  # segment files kept per room, the oldest one is deleted
+INDEX = struct.Struct("QdB")  # the seq, time and protocol of a message in .idx
+SEGMENT_NAME = re.compile(r"room-(\d+)-(\d+)\.seg$")
+
+
+class Segment:
+    """
+    One segment file of a room, with the offset, the time and the protocol of every message in
+    it. The seqs of its messages are `first`, `first` + 1...
+    """
+
+    __slots__ = (
+        "path",
+        "file",
+        "index",
+        "size",
+        "offsets",
+        "times",
+        "versions",
+        "first",
+    )
+
+    def __init__(self, path, first):
+        self.path = path
+        self.file = open(path, "ab")  # None once the segment is full
+        self.index = open(index_path(path), "ab")  # the stamps, None with `file`
+        self.size = 0
+        self.offsets = array.array("Q")
+        self.times = array.array("d")
+        self.versions = array.array("B")
+        self.first = first
+
+    @classmethod
+    def load(cls, path):
+        """
+        It returns the segment of an existing file, closed for appends. The .idx record of a
+        message tells its protocol: a message without one, or cut short at the end of the file
+        (the server was killed), is left out. `first` is None if the .idx file is empty.
+        """
+        segment = cls.__new__(cls)
+        segment.path = path
+        segment.file = segment.index = None
+        segment.offsets = array.array("Q")
+        segment.times = array.array("d")
+        segment.versions = array.array("B")
+        segment.first = None
+        with open(path, "rb") as f:
+            data = memoryview(f.read())
+        try:
+            with open(index_path(path), "rb") as f:
+                records = f.read()
+        except OSError:
+            records = b""
+        records = records[: len(records) - len(records) % INDEX.size]
+        offset = 0
+        for seq, stamp, version in INDEX.iter_unpack(records):
+            try:
+                end = offset + frame_length(data, offset, version)
+            except ValueError:
+                break
+            if end > len(data):
+                break
+            if segment.first is None:
+                segment.first = seq
+            segment.offsets.append(offset)
+            segment.times.append(stamp)
+            segment.versions.append(version)
+            offset = end
+        segment.size = offset
+        return segment
+
+    def append(self, seq, stamp, frame, version):
+        self.offsets.append(self.size)
+        self.times.append(stamp)
+        self.versions.append(version)
+        self.file.write(frame)
+        self.index.write(INDEX.pack(seq, stamp, version))
+        self.size += len(frame)
+
+    def stamps(self, start, end):
+        """It returns the (seq, time) of the messages start..end-1 of the segment"""
+        return list(
+            zip(range(self.first + start, self.first + end), self.times[start:end])
+        )
+
+    def part(self, start, end):
+        """
+        It returns the read_segments() part of the messages start..end-1 of the segment: (path,
+        start offset, end offset, the number of messages)
+        """
+        if self.file is not None:
+            self.file.flush()  # the reader sees what has been written so far
+        size = self.offsets[end] if end < len(self.offsets) else self.size
+        return self.path, self.offsets[start], size, end - start
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+            self.index.close()
+            self.file = self.index = None
+
+    def remove(self):
+        self.close()
+        remove_segment(self.path)
+
+
+def index_path(path):
+    """It returns the path of the .idx file of a segment file"""
+    return os.path.splitext(path)[0] + ".idx"
+
+
+def remove_segment(path):
+    """It deletes a segment file and its .idx file"""
+    for path in (path, index_path(path)):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+
+def read_segments(parts):
+    """
+    It reads slices of the segment files through mmap, it runs in a worker thread
+
+    :param parts: a list of the Segment.part() of the messages, the oldest first
+    :return: the list of the slices, every one is a run of encoded messages
+    """
+    chunks = []
+    for path, start, end, _ in parts:
+        with open(path, "rb") as f, mmap.mmap(
+            f.fileno(), end, access=mmap.ACCESS_READ
+        ) as mm:
+            chunks.append(mm[start:end])
+    return chunks
+
+
+def replay(chunks, counts, versions, stamps, to_version):
+    """
+    It returns the stored messages of an answer in the protocol `to_version`. A run of messages of
+    that protocol is taken as stored (the v3 ones have their seq and time already), a run of
+    another protocol is transcoded at once.
+
+    :param chunks: the runs of encoded messages, the slices of read_segments() and the frames of
+    the ring
+    :param counts: the number of messages of every chunk
+    :param versions: the protocol of every message
+    :param stamps: the (seq, time) of every message
+    :return: the list of the runs of encoded messages
+    """
+    out = []
+    first = 0
+    for chunk, count in zip(chunks, counts):
+        end = first + count
+        if versions[first:end].count(to_version) == count:
+            out.append(chunk)
+            first = end
+            continue
+        view = memoryview(chunk)
+        pos = 0
+        while first < end:
+            version, start, run = versions[first], pos, first
+            while first < end and versions[first] == version:
+                pos += frame_length(view, pos, version)
+                first += 1
+            if version == to_version:
+                out.append(view[start:pos])
+            else:
+                frames = view[start:pos]
+                out.append(transcode(frames, version, to_version, stamps[run:first]))
+    return out
+
+
+def find_segments(directory):
+    """It returns room_id -> [(number, file name), ...] of the segment files in the directory"""
+    found = {}
+    for name in os.listdir(directory):
+        if match := SEGMENT_NAME.match(name):
+            room_id, number = map(int, match.groups())
+            found.setdefault(room_id, []).append((number, name))
+    return found
+
+
+class RoomHistory:
+    """The history of one room: the in-memory ring and the segment files"""
+
+    def __init__(self, room_id, ring_size=HISTORY_SIZE, directory=None, found=None):
+        """
+        :param room_id: the room
+        :param ring_size: the number of messages kept in memory
+        :param directory: the directory of the segment files, None for no files: the messages
+        pushed out of the ring are dropped
+        :param found: the (number, file name) of the room's segment files in the directory, None
+        to look for them
+        """
+        self.room_id = room_id
+        # (seq, time, encoded message, its protocol), a v3 message with its seq and time
+        self.ring = collections.deque()
+        self.ring_size = max(1, ring_size)
+        self.seq = 0  # the seq of the newest message
+        self.directory = directory
+        self.segments = []  # the oldest first, the last one is open for append
+        self._segment_ids = itertools.count()
+        if directory is not None:
+            self._load(found)
+
+    def _load(self, found=None):
+        """It loads the segment files left by the last run of the server"""
+        if found is None:
+            found = find_segments(self.directory).get(self.room_id, [])
+        found = sorted(found)
+        for _, name in found:
+            segment = Segment.load(os.path.join(self.directory, name))
+            if segment.first is None:  # no index: it follows the segment before
+                segment.first = self.seq + 1
+            self.seq = segment.first + len(segment.offsets) - 1
+            self.segments.append(segment)
+        while len(self.segments) > MAX_SEGMENTS:
+            self.segments.pop(0).remove()
+        if found:
+            self._segment_ids = itertools.count(found[-1][0] + 1)
+
+    def append(self, frame, version=PROTOCOL_V1, stamps=None):
+        """
+        It stores the encoded message
+
+        :param version: the protocol of the message
+        :param stamps: the (seq, time) the message was given elsewhere (the owner of the room in a
+        cluster), None to number it here
+        :return: (seq, time) of the message
+        """
+        if stamps is None:
+            seq, stamp = self.seq + 1, time.time()
+        else:
+            seq, stamp = stamps
+            if seq != self.seq + 1:
+                self._restart(seq)
+        if version == PROTOCOL_V3:  # replayed as stored
+            frame = restamp_v3(frame, [(seq, stamp)])
+        if len(self.ring) >= self.ring_size:
+            evicted = self.ring.popleft()
+            if self.directory is not None:
+                self._spill(*evicted)
+        self.seq = seq
+        self.ring.append((seq, stamp, frame, version))
+        return seq, stamp
+
+    def _restart(self, seq):
+        """
+        It ends the run of contiguous seqs before a message numbered elsewhere with `seq`: the
+        stored messages go on in their own segment files, or are dropped if `seq` goes back
+        """
+        if seq <= self.seq:  # numbered from the start again
+            self.ring.clear()
+            for segment in self.segments:
+                segment.remove()
+            self.segments.clear()
+        elif self.directory is not None:
+            while self.ring:
+                self._spill(*self.ring.popleft())
+            if self.segments:
+                self.segments[-1].close()
+        self.ring.clear()
+
+    def _spill(self, seq, stamp, frame, version):
+        """It appends a message pushed out of the ring to the current segment file"""
+        if not self.segments or self.segments[-1].file is None:
+            name = f"room-{self.room_id}-{next(self._segment_ids)}.seg"
+            self.segments.append(Segment(os.path.join(self.directory, name), seq))
+            if len(self.segments) > MAX_SEGMENTS:
+                self.segments.pop(0).remove()
+        segment = self.segments[-1]
+        segment.append(seq, stamp, frame, version)
+        if segment.size >= SEGMENT_SIZE:
+            segment.close()
+
+    def query(self, last=None, since=None, after=None):
+        """
+        It finds the messages of a HISTORY request. The ring part is taken at once, the segment
+        files part is a list of file slices, read later by read_segments() in a worker thread.
+
+        :param last: the number of the newest messages
+        :param since: the messages since this time (seconds since the epoch)
+        :param after: the messages after this seq, the oldest HISTORY_MAX_REPLY of them. A seq
+        over the newest one is from before a restart that started the seqs again: all of them
+        :return: (the (seq, time) of every message, the protocol of every message, the messages of
+        the ring, the read_segments() parts), the oldest first. See replay()
+        """
+        if after is not None:
+            return self._query_after(0 if after > self.seq else after)
+        if last is not None and last < 1:
+            return [], [], [], []
+        missing = min(last or HISTORY_MAX_REPLY, HISTORY_MAX_REPLY)
+        if since is None:
+            entries = list(self.ring)[-missing:]
+        else:
+            entries = [entry for entry in self.ring if entry[1] >= since][-missing:]
+            if self.ring and self.ring[0][1] < since:
+                missing = 0  # the ring reaches back before `since`
+        missing -= len(entries)
+
+        stamps, versions, parts = [], [], []
+        for segment in reversed(self.segments):
+            if missing <= 0:
+                break
+            count = len(segment.offsets)
+            first = max(0, count - missing)
+            if since is not None:
+                first = max(first, bisect.bisect_left(segment.times, since))
+            if first < count:
+                parts.insert(0, segment.part(first, count))
+                stamps[:0] = segment.stamps(first, count)
+                versions[:0] = segment.versions[first:count]
+                missing -= count - first
+            if first > 0:  # the older segments are not needed
+                break
+        return self._answer(stamps, versions, parts, entries)
+
+    def _query_after(self, after):
+        """query() of the messages after the seq `after`, the oldest first"""
+        missing = HISTORY_MAX_REPLY
+        stamps, versions, parts = [], [], []
+        for segment in self.segments:
+            count = len(segment.offsets)
+            first = max(0, after + 1 - segment.first)
+            end = min(count, first + missing)
+            if first < end:
+                parts.append(segment.part(first, end))
+                stamps += segment.stamps(first, end)
+                versions += segment.versions[first:end]
+                missing -= end - first
+        start = max(0, after + 1 - self.ring[0][0]) if self.ring else 0
+        entries = list(itertools.islice(self.ring, start, start + max(0, missing)))
+        return self._answer(stamps, versions, parts, entries)
+
+    @staticmethod
+    def _answer(stamps, versions, parts, entries):
+        """It returns the query() result of the segments' messages and the ring `entries`"""
+        stamps += [(seq, stamp) for seq, stamp, *_ in entries]
+        versions += [version for *_, version in entries]
+        return stamps, versions, [entry[2] for entry in entries], parts
+
+    def close(self):
+        """It spills the ring into the segment files (if any) and closes them"""
+        if self.directory is not None:
+            while self.ring:
+                self._spill(*self.ring.popleft())
+        for segment in self.segments:
+            segment.close()
+
+
+class ChatHistory:
+    """
+    The history of every room. The history of a room is started by its first message or request:
+    the rooms are created and deleted at runtime, thousands of them may never have a message.
+    """
+
+    def __init__(self, ring_size=HISTORY_SIZE, directory=None):
+        """
+        :param ring_size: the number of messages kept in memory per room
+        :param directory: the directory of the segment files, None for the in-memory ring only
+        """
+        self.ring_size = ring_size
+        self.directory = directory
+        self._found = {}  # room_id -> the segment files of a room not started yet
+        if directory is not None:
+            os.makedirs(directory, exist_ok=True)
+            self._found = find_segments(directory)
+        self.rooms = {}  # room_id -> RoomHistory
+
+    def room(self, room_id):
+        """It returns the RoomHistory of the room, started on its first use"""
+        history = self.rooms.get(room_id)
+        if history is None:
+            history = self.rooms[room_id] = RoomHistory(
+                room_id, self.ring_size, self.directory, self._found.pop(room_id, [])
+            )
+        return history
+
+    def append(self, room_id, frame, version=PROTOCOL_V1, stamps=None):
+        """See RoomHistory.append()"""
+        return self.room(room_id).append(frame, version, stamps)
+
+    def query(self, room_id, last=None, since=None, after=None):
+        """See RoomHistory.query()"""
+        return self.room(room_id).query(last, since, after)
+
+    def newest(self, room_id):
+        """It returns the seq of the room's newest message, 0 for none"""
+        return self.room(room_id).seq
+
+    def drop(self, room_id):
+        """It deletes the history of a deleted room: its messages and its segment files"""
+        if (history := self.rooms.pop(room_id, None)) is not None:
+            history.ring.clear()
+            for segment in history.segments:
+                segment.remove()
+        for _, name in self._found.pop(room_id, []):
+            remove_segment(os.path.join(self.directory, name))
+
+    def prune(self, room_ids):
+        """It deletes the segment files of the rooms not in `room_ids`: rooms gone meanwhile"""
+        for room_id in [room_id for room_id in self._found if room_id not in room_ids]:
+            self.drop(room_id)
+
+    def close(self):
+        for room in self.rooms.values():
+            room.close()
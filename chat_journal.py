@@ -0,0 +1,281 @@
+# -*- coding: utf-8 -*-
+"""
+The traffic journal of the chat server: a persistent, structured record of the server events,
+one JSON line per event, for whatever happens after the GUI's Network Log has scrolled away or
+the process has died:
+
+    {"ts":1697541234.444594,"event":"join","conn":"Session-7","address":"10.0.0.5:33252",
+     "nickname":"Bob"}
+    {"ts":1697541235.445149,"event":"relay","conn":"Session-7","nickname":"Bob","bytes":16,
+     "type":4,"room_id":3,"room":"Private Room 3","payload":"Hello"}
+    {"ts":1697541240.746178,"event":"leave","conn":"Session-7","nickname":"Bob",
+     "reason":"removed from chat"}
+
+The server's thread only appends the raw event to a bounded queue, with its time: no decoding,
+no formatting, no I/O, no lock. A dedicated thread takes the queued events every JOURNAL_FLUSH
+seconds, decodes and formats them, and writes them with one write per batch. When the writer
+falls behind, the oldest events are dropped, and a "dropped" record tells how many.
+
+The journal file is rotated once it reaches `max_bytes`, or `interval` seconds after it was
+opened: the active file '<name>.jsonl' is renamed '<name>-<YYYYmmdd-HHMMSS>.jsonl' (gzipped to
+'.jsonl.gz' with `compress`), and the oldest rotated files beyond `backups` are deleted.
+
+Example:
+        $ python -m chat_server --headless --journal-dir /var/log/chat --journal-compress
+        $ zcat /var/log/chat/traffic-*.jsonl.gz | jq 'select(.event == "leave")'
+
+@Author: Vadim Moldavsky   vasja34@gmail.com
+@Date:   17/08/2022
+"""
+
+import collections
+import datetime
+import gzip
+import json
+import logging
+import os
+import shutil
+import threading
+import time
+
+from chat_protocol import *
+
+JOURNAL_MAX_BYTES = 64 * 1024 * 1024  # a journal file is rotated at this size
+JOURNAL_INTERVAL = 3600.0  # seconds, a journal file is rotated after this time
+JOURNAL_BACKUPS = 24  # the rotated files kept, the older ones are deleted
+JOURNAL_QUEUE = 100_000  # the events queued for the writer, the oldest dropped beyond
+JOURNAL_FLUSH = 0.2  # seconds between two writes, at most lost if the process dies
+
+log = logging.getLogger("chat_server")
+text = json.encoder.encode_basestring  # a str as a JSON string, the non-ASCII kept
+
+
+def journal_line(stamp, event, value, names=rooms_name):
+    """
+    It returns the journal line (JSON, without the newline) of a server event, None for an event
+    that isn't journaled. The line is formatted straight, the text fields escaped by the json
+    module's C encoder: a dictionary and json.dumps() cost twice as much per relayed message.
+
+    :param stamp: the time of the event (epoch seconds)
+    :param event: the server event, see ChatServer.notify()
+    :param value: the event's value
+    :param names: the room_id -> name of the rooms, see room_name()
+    """
+    if event == "-BROADCAST_EVENT-":
+        _, name, nick, data = value
+        line = (
+            f'{{"ts":{stamp:.6f},"event":"relay","conn":{text(name)},'
+            f'"nickname":{text(nick)},"bytes":{len(data)}'
+        )
+        try:
+            header = header_parser(data)
+            msg_type, _, room, payload = frame_parser(
+                memoryview(data), 0, header, names
+            )
+            room_id = room_id_parser(data, header)
+        except ValueError:  # UnicodeDecodeError too: not text, its size only
+            return line + ',"error":"undecodable"}'
+        return (
+            f'{line},"type":{msg_type},"room_id":{room_id},"room":{text(room)},'
+            f'"payload":{text(payload)}}}'
+        )
+    if event == "-ACCEPT_NEW_CLIENT-":
+        _, name, address, nick = value
+        address = ":".join(map(str, address))
+        return (
+            f'{{"ts":{stamp:.6f},"event":"join","conn":{text(name)},'
+            f'"address":{text(address)},"nickname":{text(nick)}}}'
+        )
+    if event == "-Exception_Event-":
+        _, name, nick, reason = value
+        return (
+            f'{{"ts":{stamp:.6f},"event":"leave","conn":{text(name)},'
+            f'"nickname":{text(nick)},"reason":{text(str(reason))}}}'
+        )
+    if event == "-WARNING_EVENT-":
+        _, name, msg = value
+        return (
+            f'{{"ts":{stamp:.6f},"event":"warning","conn":{text(name)},'
+            f'"msg":{text(str(msg))}}}'
+        )
+    if event == "-ROOM_EVENT-":
+        _, _, room_id, room, created = value
+        return (
+            f'{{"ts":{stamp:.6f},"event":"room-{"created" if created else "deleted"}",'
+            f'"room_id":{room_id},"room":{text(room)}}}'
+        )
+    return None
+
+
+class TrafficJournal:
+    """
+    An observer of the server that journals its events to rotating JSON-lines files, written by
+    a thread of its own. See the module's docstring.
+    """
+
+    def __init__(
+        self,
+        directory,
+        name="traffic",
+        max_bytes=JOURNAL_MAX_BYTES,
+        interval=JOURNAL_INTERVAL,
+        backups=JOURNAL_BACKUPS,
+        compress=False,
+        queue_size=JOURNAL_QUEUE,
+        flush_interval=JOURNAL_FLUSH,
+        names=rooms_name,
+    ):
+        """
+        :param directory: the directory of the journal files, created if needed
+        :param name: the name of the journal files
+        :param max_bytes: the size a journal file is rotated at
+        :param interval: seconds a journal file is rotated after, None for never
+        :param backups: the rotated files kept, None to keep them all
+        :param compress: gzip the rotated files
+        :param queue_size: the events queued for the writer, the oldest dropped beyond
+        :param flush_interval: seconds between two writes
+        :param names: the room_id -> name of the server's catalog when the journal starts, the
+        writer keeps its own copy up to date from the -ROOM_EVENT- events
+        """
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.name = name
+        self.path = os.path.join(directory, f"{name}.jsonl")
+        self.max_bytes = max_bytes
+        self.interval = interval
+        self.backups = backups
+        self.compress = compress
+        self.flush_interval = flush_interval
+        self.names = dict(names)  # the writer's thread only, once started
+        self.records = 0  # the records written, by the writer's thread only
+        self.dropped = 0  # the events dropped from the full queue, likewise
+        self._events = collections.deque(maxlen=queue_size)
+        self._overflow = 0  # changed by the server's thread only
+        self._file = None
+        self._size = 0
+        self._opened = 0.0  # the time the journal file was opened
+        self._closing = False
+        self._wake = threading.Event()
+        self._thread = None
+
+    def write_event_value(self, event, value):
+        """It queues the event with its time, called by the server's thread"""
+        if len(self._events) == self._events.maxlen:
+            self._overflow += 1
+        self._events.append((time.time(), event, value))
+
+    def start(self):
+        """It starts the writer's thread. The file of a previous run is rotated first"""
+        if os.path.exists(self.path) and os.path.getsize(self.path):
+            self._rotate()
+        self._thread = threading.Thread(
+            target=self._run, name="TrafficJournal", daemon=True
+        )
+        self._thread.start()
+        return self
+
+    def close(self):
+        """It writes the events still queued and closes the journal"""
+        self._closing = True
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    # ===========================================
+    # The writer's thread
+    # ===========================================
+    def _run(self):
+        while True:
+            self._wake.wait(self.flush_interval)
+            closing = self._closing
+            try:
+                self._write()
+            except OSError as error:  # the batch is lost, the file is opened again
+                log.warning(f"event=journal-error path={self.path} error={error!r}")
+                if self._file is not None:
+                    self._file.close()
+                    self._file = None
+            if closing:
+                return
+
+    def _write(self):
+        """It writes the queued events as one batch, and rotates the file when it's due"""
+        events = []
+        try:
+            while True:
+                events.append(self._events.popleft())
+        except IndexError:
+            pass
+        lines = []
+        if (overflow := self._overflow) != self.dropped:
+            lines.append(
+                f'{{"ts":{time.time():.6f},"event":"dropped",'
+                f'"events":{overflow - self.dropped}}}'
+            )
+            self.dropped = overflow
+        for event in events:
+            if event[1] == "-ROOM_EVENT-":
+                _, _, room_id, room, created = event[2]
+                if created:
+                    self.names[room_id] = room
+                else:
+                    self.names.pop(room_id, None)
+            if (line := journal_line(*event, self.names)) is not None:
+                lines.append(line)
+        if not lines:
+            return
+        lines.append("")
+        data = "\n".join(lines).encode("utf-8")
+        if self._file is not None and self._size and self._due(len(data)):
+            self._file.close()
+            self._file = None
+            self._rotate()
+        if self._file is None:
+            self._file = open(self.path, "ab")
+            self._size = self._file.tell()
+            self._opened = time.time()
+        self._file.write(data)
+        self._file.flush()
+        self._size += len(data)
+        self.records += len(lines) - 1
+
+    def _due(self, size):
+        """It tells whether the journal file is rotated before `size` more bytes"""
+        if self._size + size > self.max_bytes:
+            return True
+        return self.interval is not None and time.time() - self._opened >= self.interval
+
+    def _rotate(self):
+        """It renames the journal file after its time, gzips it, and deletes the oldest ones"""
+        stamp = datetime.datetime.now().strftime("%Y%m%d-%H%M%S")
+        rotated = os.path.join(self.directory, f"{self.name}-{stamp}.jsonl")
+        suffix = 1
+        while os.path.exists(rotated) or os.path.exists(rotated + ".gz"):
+            rotated = os.path.join(
+                self.directory, f"{self.name}-{stamp}-{suffix}.jsonl"
+            )
+            suffix += 1
+        os.replace(self.path, rotated)
+        if self.compress:
+            with open(rotated, "rb") as source, gzip.open(
+                rotated + ".gz", "wb"
+            ) as target:
+                shutil.copyfileobj(source, target)
+            os.remove(rotated)
+        if self.backups is not None:
+            for path in self.rotated()[: -self.backups or None]:
+                os.remove(path)
+
+    def rotated(self):
+        """It returns the paths of the rotated journal files, the oldest first"""
+        prefix = f"{self.name}-"
+        paths = [
+            os.path.join(self.directory, name)
+            for name in os.listdir(self.directory)
+            if name.startswith(prefix) and name.endswith((".jsonl", ".jsonl.gz"))
+        ]
+        return sorted(paths, key=lambda path: (os.path.getmtime(path), path))
@@ -0,0 +1,202 @@
+# -*- coding: utf-8 -*-
+"""
+The live metrics of the chat server: counters and a latency histogram, updated by the server's
+event loop, and a local HTTP endpoint that serves their snapshot as JSON:
+
+    $ curl http://127.0.0.1:9091/stats
+    $ curl http://127.0.0.1:9091/stats?sessions=1     # with the counters of every session
+
+Updating the metrics of a relayed message costs a few integer additions and one histogram
+bucket: nothing is allocated, nothing is locked. The snapshots are taken in the event loop
+(ChatServer.stats()), so the GUI thread never reads a counter while it changes.
+
+@Author: Vadim Moldavsky   vasja34@gmail.com
+@Date:   17/08/2022
+"""
+
+import asyncio
+import collections
+import json
+import logging
+import time
+
+from chat_protocol import *
+
+STATS_PORT = 9091  # the default port of the stats endpoint
+SUB_BUCKETS = 4  # histogram buckets per power of two: 19 % wide at most
+
+log = logging.getLogger("chat_server")
+
+
+class Histogram:
+    """
+    A histogram of non-negative integers (ns) in log-linear buckets: every power of two is split
+    in SUB_BUCKETS buckets, so a percentile is known within one bucket width.
+    """
+
+    __slots__ = ("buckets", "count", "total", "max")
+
+    def __init__(self):
+        self.buckets = [0] * (65 * SUB_BUCKETS)
+        self.count = 0
+        self.total = 0
+        self.max = 0
+
+    def observe(self, value):
+        bits = value.bit_length()
+        if bits > 2:
+            self.buckets[bits * SUB_BUCKETS + ((value >> (bits - 3)) & 3)] += 1
+        else:
+            self.buckets[value] += 1
+        self.count += 1
+        self.total += value
+        if value > self.max:
+            self.max = value
+
+    @staticmethod
+    def bucket_value(index):
+        """It returns the middle of the bucket's range"""
+        bits, sub = divmod(index, SUB_BUCKETS)
+        if bits < 3:
+            return index
+        if bits == 3:  # one value per bucket
+            return SUB_BUCKETS + sub
+        return (2 * (SUB_BUCKETS + sub) + 1) << (bits - 4)
+
+    def percentile(self, p):
+        """It returns the p-th (0..1) percentile, 0 if the histogram is empty"""
+        rank = p * self.count
+        seen = 0
+        for index, count in enumerate(self.buckets):
+            seen += count
+            if count and seen >= rank:
+                return min(self.bucket_value(index), self.max)
+        return 0
+
+    def snapshot(self, scale=1e-6):
+        """It returns the count, mean, p50/p90/p99 and max, scaled (default: ns -> ms)"""
+        return {
+            "count": self.count,
+            "mean": round(self.total / self.count * scale, 3) if self.count else 0,
+            "p50": round(self.percentile(0.50) * scale, 3),
+            "p90": round(self.percentile(0.90) * scale, 3),
+            "p99": round(self.percentile(0.99) * scale, 3),
+            "max": round(self.max * scale, 3),
+        }
+
+
+class ServerMetrics:
+    """The counters of the server: per room, the relay latency and the disconnect reasons"""
+
+    def __init__(self):
+        self.started = time.time()
+        # room_id -> [msgs in, bytes in, msgs out, bytes out]
+        self.rooms = collections.defaultdict(lambda: [0, 0, 0, 0])
+        for room_id in range(BUILTIN_ROOMS):  # a created room, once it has traffic
+            self.rooms[room_id]
+        self.relay_latency = Histogram()  # ns from the receive to the last send
+        self.disconnects = collections.Counter()  # close reason -> connections
+
+    def on_relay(self, room_id, size, recipients):
+        """
+        It counts a relayed message
+
+        :param room_id: the room of the message
+        :param size: the bytes of the encoded message
+        :param recipients: the number of clients it was sent to
+        """
+        counters = self.rooms[room_id]
+        counters[0] += 1
+        counters[1] += size
+        counters[2] += recipients
+        counters[3] += size * recipients
+
+    def on_deliver(self, room_id, size, recipients):
+        """It counts a message received from another server process (cluster): sent only"""
+        counters = self.rooms[room_id]
+        counters[2] += recipients
+        counters[3] += size * recipients
+
+    def rooms_dict(self, members, names=rooms_name):
+        """
+        It returns room name -> counters
+
+        :param members: a function room_id -> the number of members
+        :param names: the room_id -> name of the server's catalog
+        """
+        return {
+            names.get(room_id, str(room_id)): {
+                "members": members(room_id),
+                "msgs_in": msgs_in,
+                "bytes_in": bytes_in,
+                "msgs_out": msgs_out,
+                "bytes_out": bytes_out,
+            }
+            for room_id, (msgs_in, bytes_in, msgs_out, bytes_out) in sorted(
+                self.rooms.items()
+            )
+        }
+
+
+def rates(previous, current):
+    """
+    It returns room name -> {"msgs_in": msgs/s, ...} between two ChatServer.stats() snapshots
+
+    :param previous: the older snapshot, None for the rates since the server started
+    :param current: the newer snapshot
+    """
+    if previous is None:
+        seconds = current["uptime_s"]
+        previous = {"rooms": {}}
+    else:
+        seconds = current["uptime_s"] - previous["uptime_s"]
+    seconds = max(seconds, 1e-9)
+    result = {}
+    for name, room in current["rooms"].items():
+        old = previous["rooms"].get(name, {})
+        result[name] = {
+            key: (room[key] - old.get(key, 0)) / seconds
+            for key in ("msgs_in", "bytes_in", "msgs_out", "bytes_out")
+        }
+    return result
+
+
+async def start_stats_endpoint(stats, host, port):
+    """
+    It starts the HTTP endpoint that serves the stats as JSON, it returns the asyncio.Server
+
+    :param stats: a function (sessions: bool) -> the stats dictionary, called in the event loop
+    :param host: the address to listen on, a local one: the endpoint has no authentication
+    :param port: the port to listen on
+    """
+
+    async def handle(reader, writer):
+        try:
+            request = await asyncio.wait_for(reader.readline(), 5.0)
+            while (await asyncio.wait_for(reader.readline(), 5.0)) not in (
+                b"\r\n",
+                b"\n",
+                b"",
+            ):
+                pass  # the headers
+            method, path, *_ = request.decode("latin-1").split() + ["", ""]
+            route, _, query = path.partition("?")
+            if method != "GET" or route not in ("/", "/stats"):
+                status, body = "404 Not Found", b'{"error": "not found"}'
+            else:
+                status = "200 OK"
+                body = json.dumps(stats(sessions="sessions=1" in query)).encode()
+            writer.write(
+                f"HTTP/1.0 {status}\r\nContent-Type: application/json\r\n"
+                f"Content-Length: {len(body)}\r\nConnection: close\r\n\r\n".encode()
+                + body
+            )
+            await writer.drain()
+        except (asyncio.TimeoutError, ConnectionError, UnicodeDecodeError):
+            pass
+        finally:
+            writer.close()
+
+    server = await asyncio.start_server(handle, host, port)
+    log.info(f"event=stats_endpoint host={host} port={port}")
+    return server
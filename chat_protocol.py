@@ -4,42 +4,173 @@ byte[2,3]: nickname_len
 byte[4,5]: room_id_len
 byte[6,7]: payload_len
 byte[8:] (nickname, room_id, payload)
+
+The lengths are the number of UTF-8 encoded bytes (the number of characters for ASCII text).
+
+Protocol v2, negotiated in the nickname handshake, has a fixed binary header:
+byte[0]: msg_type
+byte[1]: nickname_len
+byte[2,3]: room_id (big-endian)
+byte[4,5]: payload_len (big-endian)
+byte[6:] (nickname, payload)
+
+Protocol v3 adds the server's stamp to the v2 header:
+byte[0:6]: the v2 header
+byte[6:10]: seq, the room's sequence number of a relayed CHAT_CONVERSATION message (big-endian)
+byte[10:18]: time, the server's time of the relay in seconds since the epoch (a big-endian double)
+byte[18:] (nickname, payload)
+
+Every room numbers its CHAT_CONVERSATION messages 1, 2, 3... when the server relays them, the other
+frames and the frames sent by the clients have seq 0. The header of a HISTORY answer has the seq
+of the room's newest message, and a client asks for the messages after the seq N it has with a
+HISTORY request 'seq:N'.
+
+The server offers the versions it speaks in the payload of its GET_NICKNAME request
+('proto:1,2,3'), a v2 or v3 client answers with the version it takes ('proto:3') in the payload of
+its GET_NICKNAME frame. Both switch to it for all the next frames, the handshake frames are v1.
+A v1 client ignores the offer.
+
+Protocol v3 also carries the large messages and the files, as a transfer of CHUNK frames of up to
+CHUNK_SIZE bytes each: a CHUNK_START frame with the transfer's JSON description ({"name": ...,
+"size": ..., "text": ...}), the CHUNK_DATA frames and a CHUNK_END (or CHUNK_ABORT) frame, all with
+the sender's transfer id. The payload of a CHUNK frame is binary, see chunk_payload(). The server
+relays the chunks as they come, to the v3 clients of the room, and stores none of them.
+
+The rooms are a catalog owned by the server: the built-in 'Lobby' and 'Private Room 1..9' (ids
+0..9), and the rooms the clients create and delete at runtime. A room id is a 16-bit number in
+every version: the v2/v3 header field, up to 5 digits in the room_id of v1. A client asks for the
+catalog with ROOMS frames (v1, v2 and v3), see rooms_payload(): it loads the catalog a page at a
+time, and once it has asked for a page it gets the rooms created and deleted (the diffs) as they
+happen, not the whole list again. The server's RoomRegistry and every ChatClient own their
+catalog, a RoomCatalog: the `rooms_name` and `rooms_id` dictionaries of this module are only the
+built-in rooms, the parsers take the catalog's `names` to name the others.
+
+A client learns who is in its room with ROSTER frames (v1, v2 and v3), see roster_payload(): once
+it has asked for a page of its room's members, the server sends it the first page of a room's
+members every time it enters the room, then the members that enter and leave the room (the
+diffs), in place of their ENTER_ROOM / EXIT_ROOM frames. Every entry into a room has a member id,
+unique in the server, so the pages and the diffs can be applied in any order.
 """
+
+import bisect
+import functools
+import math
+import struct
+import time as _time
+import zlib
+
 BUFSIZE = 1024
+RECV_BUFSIZE = 8 * BUFSIZE  # the receive buffer of a FrameDecoder
 GET_NICKNAME = 1
 EXIT_ROOM = 2
 ENTER_ROOM = 3
 CHAT_CONVERSATION = 4
-# CLIENT_EXIT = 5
+ROSTER = 5  # the members of a room: a request of the client, or a line of the server's answer
+REJECT = 6  # the server refuses the connection, the payload is the reason
+HISTORY = 7  # the history of a room: the request, and the header of the server's answer
+CHUNK = 8  # a chunk of a transfer, v3 only
+ROOMS = 9  # the room catalog: a request of the client, or a line of the server's answer
+MAX_MSG_TYPE = 9  # the last msg_type, CHUNK is v3 only
 MAX_PAYLOAD = 90
 MAX_PRIVATE_ROOMS = 9
+BUILTIN_ROOMS = MAX_PRIVATE_ROOMS + 1  # the ids under it: the rooms nobody can delete
+MAX_ROOM_ID = 0xFFFF  # the room ids are 16-bit numbers
+MAX_ROOM_NAME = 32  # characters
 MAX_CLIENTS = 100
+HEADER_LEN = 7  # 1+2+2+2
+MAX_FRAME_LEN = HEADER_LEN + 3 * 99
+
+PROTOCOL_V1 = 1
+PROTOCOL_V2 = 2
+PROTOCOL_V3 = 3
+# the versions the server offers
+PROTOCOL_VERSIONS = (PROTOCOL_V1, PROTOCOL_V2, PROTOCOL_V3)
+V2_HEADER = struct.Struct("!BBHH")  # msg_type, nickname_len, room_id, payload_len
+V2_HEADER_LEN = V2_HEADER.size
+V3_HEADER = struct.Struct("!BBHHId")  # the v2 header, seq, time
+V3_HEADER_LEN = V3_HEADER.size
+V3_STAMP = struct.Struct("!Id")  # the seq and the time, at the end of the v3 header
+CHUNK_SIZE = 4 * BUFSIZE  # the data of one CHUNK frame
+CHUNK_HEADER = struct.Struct("!IB")  # transfer id, kind
+MAX_CHUNK_PAYLOAD = CHUNK_HEADER.size + CHUNK_SIZE
+MAX_CHUNK_FRAME_LEN = V3_HEADER_LEN + 10 + MAX_CHUNK_PAYLOAD
+CHUNK_START = 0  # the data is the transfer's description, JSON
+CHUNK_DATA = 1
+CHUNK_END = 2
+CHUNK_ABORT = 3  # the sender gave up, the data received is to be dropped
+
+
+class RoomCatalog:
+    """
+    The rooms: id -> name (`names`) and name -> id (`ids`), both dictionaries kept in step, so a
+    lookup either way is O(1) whatever the number of rooms. The ids are also kept sorted, for
+    the pages of the catalog.
+    """
+
+    def __init__(self, rooms=()):
+        """
+        :param rooms: the (room_id, name) of the rooms to start with
+        """
+        self.names = {}  # room_id -> name
+        self.ids = {}  # name -> room_id
+        self._sorted = []  # the room ids, in order
+        for room_id, name in rooms:
+            self.add(room_id, name)
+
+    def __len__(self):
+        return len(self.names)
+
+    def __contains__(self, room_id):
+        return room_id in self.names
+
+    def add(self, room_id, name):
+        """It adds the room, or renames it if the id is in the catalog, or moves the name's room"""
+        if self.ids.get(name, room_id) != room_id:  # created again, with another id
+            self.remove(self.ids[name])
+        old = self.names.get(room_id)
+        if old is None:
+            bisect.insort(self._sorted, room_id)
+        elif self.ids.get(old) == room_id:
+            del self.ids[old]
+        self.names[room_id] = name
+        self.ids[name] = room_id
+
+    def remove(self, room_id):
+        """It removes the room and returns its name, None if it's not in the catalog"""
+        name = self.names.pop(room_id, None)
+        if name is None:
+            return None
+        del self._sorted[bisect.bisect_left(self._sorted, room_id)]
+        if self.ids.get(name) == room_id:
+            del self.ids[name]
+        return name
+
+    def page(self, start=0, count=100):
+        """It returns the (room_id, name) of up to `count` rooms from the id `start` on, in order"""
+        index = bisect.bisect_left(self._sorted, start)
+        return [
+            (room_id, self.names[room_id])
+            for room_id in self._sorted[index : index + count]
+        ]
+
+    @classmethod
+    def builtin(cls):
+        """It returns a new catalog of the built-in rooms"""
+        return cls(rooms_name.items())
 
-rooms_name = {
-    0: "Lobby",
-    1: "Private Room 1",
-    2: "Private Room 2",
-    3: "Private Room 3",
-    4: "Private Room 4",
-    5: "Private Room 5",
-    6: "Private Room 6",
-    7: "Private Room 7",
-    8: "Private Room 8",
-    9: "Private Room 9",
-}
-
-rooms_id = {
-    "Lobby": 0,
-    "Private Room 1": 1,
-    "Private Room 2": 2,
-    "Private Room 3": 3,
-    "Private Room 4": 4,
-    "Private Room 5": 5,
-    "Private Room 6": 6,
-    "Private Room 7": 7,
-    "Private Room 8": 8,
-    "Private Room 9": 9,
-}
+    def reset(self, rooms=()):
+        """It drops the rooms but the built-in ones, and adds these (room_id, name)"""
+        for room_id in self._sorted[bisect.bisect_left(self._sorted, BUILTIN_ROOMS) :]:
+            self.remove(room_id)
+        for room_id, name in rooms:
+            self.add(room_id, name)
+
+
+# the built-in rooms, the same in every catalog
+rooms_name = {0: "Lobby"} | {
+    room_id: f"Private Room {room_id}" for room_id in range(1, BUILTIN_ROOMS)
+}  # room_id -> name
+rooms_id = {name: room_id for room_id, name in rooms_name.items()}  # name -> room_id
 
 rooms_color = {
     "Lobby": "#FFFFFF",  # bg_color
@@ -55,12 +186,49 @@ rooms_color = {
 }  # just for message coloring
 
 
-def msg_parser(message):
+def room_color(name):
+    """It returns the background color of the room's messages, a steady pick for a new room"""
+    color = rooms_color.get(name)
+    if color is None:
+        palette = list(rooms_color.values())[1:]
+        color = palette[zlib.crc32(name.encode("utf-8")) % len(palette)]
+    return color
+
+
+def room_name(room_id, names=rooms_name):
+    """
+    It returns the name of the room, '#<room_id>' for a room not in the catalog (yet)
+
+    :param names: the catalog's room_id -> name, the built-in rooms by default
+    """
+    name = names.get(room_id)
+    return f"#{room_id}" if name is None else name
+
+
+def check_room_name(name):
+    """
+    It checks the name of a new room
+
+    :raise ValueError: the reason the name can't be taken
+    """
+    if not name or len(name) > MAX_ROOM_NAME:
+        raise ValueError(f"A room name has 1..{MAX_ROOM_NAME} characters")
+    if name != name.strip() or not name.isprintable():
+        raise ValueError("A room name can't start or end with spaces, or have controls")
+    if name.startswith("#") or ":" in name:
+        raise ValueError("A room name can't start with '#' or have ':'")
+
+
+def msg_parser(message, names=rooms_name):
+    if not isinstance(message, str):  # encoded
+        return frame_parser(memoryview(message), names=names)
+    if not message.isascii():  # the lengths count the encoded bytes
+        return frame_parser(memoryview(message.encode("utf-8")), names=names)
     msg_type = int(message[0])
     msg_nickname_len = int(message[1:3])
     room_id_len = int(message[3:5])
     payload_len = int(message[5:7])
-    if msg_type > 6:
+    if msg_type > MAX_MSG_TYPE or msg_type == CHUNK:
         raise ValueError("Unknown msg_type")
     if payload_len > 90:
         raise ValueError("msg_len > 90")
@@ -73,8 +241,7 @@ def msg_parser(message):
     msg_nickname = message[c1:c2]
     c1 = c2
     c2 = c1 + room_id_len
-    room_id = int(message[c1:c2])
-    msg_room_name = rooms_name[room_id]
+    msg_room_name = room_name(int(message[c1:c2]), names)
     c1 = c2
     c2 = c1 + payload_len
     msg_payload = message[c1:c2]
@@ -83,11 +250,11 @@ def msg_parser(message):
 
 def msg_composer(msg_type, nickname="#Empty", room_id=0, payload="#Empty"):
     msg_type = str(msg_type)
-    tmp = len(nickname)
+    tmp = len(nickname.encode("utf-8"))
     nickname_len = str(tmp) if tmp > 9 else f"0{tmp}"
     tmp = len(str(room_id))
     room_id_len = str(tmp) if tmp > 9 else f"0{tmp}"
-    tmp = len(payload)
+    tmp = len(payload.encode("utf-8"))
     payload_len = str(tmp) if tmp > 9 else f"0{tmp}"
     return "".join(
         [
@@ -100,3 +267,684 @@ def msg_composer(msg_type, nickname="#Empty", room_id=0, payload="#Empty"):
             payload,
         ]
     )
+
+
+def history_payload(last=None, since=None, after=None):
+    """
+    It returns the payload of a HISTORY request: the last `last` messages of the room, the
+    messages since the time `since` (seconds since the epoch), or the messages after the seq
+    `after` (protocol v3). The server answers a request it can't parse with a HISTORY frame
+    whose payload is 'error:<reason>', see parse_history_answer().
+
+    :raise ValueError: none of them, or `last` isn't 1 or more
+    """
+    if after is not None:
+        return f"seq:{after}"
+    if since is not None:
+        return f"since:{since}"
+    if last is None or last < 1:
+        raise ValueError("A history request needs last >= 1, since or after")
+    return f"last:{last}"
+
+
+def parse_history_payload(payload):
+    """
+    It parses the payload of a HISTORY request
+
+    :return: (last, since, after), two of them are None
+    :raise ValueError: not a request, `last` under 1, `after` under 0, or `since` not finite
+    """
+    kind, _, value = payload.partition(":")
+    try:
+        if kind == "last" and (last := int(value)) >= 1:
+            return last, None, None
+        if kind == "since" and math.isfinite(since := float(value)):
+            return None, since, None
+        if kind == "seq" and (after := int(value)) >= 0:
+            return None, None, after
+    except ValueError:
+        pass
+    raise ValueError("Bad history request")
+
+
+def parse_history_answer(payload):
+    """
+    It parses the payload of the server's HISTORY frame
+
+    :return: (the number of the messages that follow, None), or (0, the reason) when the server
+    couldn't parse the request
+    """
+    kind, _, reason = payload.partition(":")
+    if kind == "error":
+        return 0, reason
+    return int(payload), None
+
+
+def rooms_payload(kind, value=""):
+    """
+    It returns the payload of a ROOMS frame. The client's requests:
+        'list:<start>'      a page of the catalog, the rooms from the id `start` on, and from
+                            then on the diffs
+        'create:<name>'     a new room, or the room with this name if there is one
+        'delete:<room_id>'  an empty room
+    The lines of the server's answers and diffs:
+        '+<room_id>:<name>' a room of the catalog, or a created one
+        '-<room_id>:<name>' a deleted room
+        'end:<start>'       the end of a page: the start of the next one, 0 for the last page
+        'error:<reason>'    the request failed
+    The server answers a client's request with frames that have the client's nickname, the diffs
+    have the nickname '#Empty'.
+
+    :param kind: 'list', 'create', 'delete', '+', '-', 'end' or 'error'
+    :param value: (room_id, name) for '+' and '-', the request's value otherwise
+    """
+    if kind in ("+", "-"):
+        return f"{kind}{value[0]}:{value[1]}"
+    return f"{kind}:{value}"
+
+
+def parse_rooms_payload(payload):
+    """
+    It parses the payload of a ROOMS frame, see rooms_payload()
+
+    :return: (kind, value): value is (room_id, name) for '+' and '-', the id for 'list', 'delete'
+    and 'end', the text for 'create' and 'error'
+    """
+    if payload[:1] in ("+", "-"):
+        room_id, _, name = payload[1:].partition(":")
+        return payload[0], (int(room_id), name)
+    kind, _, value = payload.partition(":")
+    if kind in ("list", "delete", "end"):
+        return kind, int(value)
+    if kind in ("create", "error"):
+        return kind, value
+    raise ValueError("Bad rooms frame")
+
+
+def roster_payload(kind, value=""):
+    """
+    It returns the payload of a ROSTER frame. The client's request:
+        'list:<after>'          a page of the members of the client's room: the ones whose
+                                member id is after `after`, the lowest first
+    The lines of the server's pages and diffs, the frame's nickname is the member's:
+        '=<member_id>'          a member of the room, a line of a page
+        '+<member_id>'          a member entered the room
+        '-<member_id>'          a member left the room, or the chat
+        'end:<after>:<count>'   the end of a page: the id the next page is after, 0 for the last
+                                page, and the number of the room's members
+    The 'end' of the answer to a request has the client's nickname, the 'end' of the page sent
+    when the client enters a room has the nickname '#Empty'.
+
+    :param kind: 'list', '=', '+', '-' or 'end'
+    :param value: the member id, (after, count) for 'end', `after` for 'list'
+    """
+    if kind in ("=", "+", "-"):
+        return f"{kind}{value}"
+    if kind == "end":
+        return f"end:{value[0]}:{value[1]}"
+    return f"{kind}:{value}"
+
+
+def parse_roster_payload(payload):
+    """
+    It parses the payload of a ROSTER frame, see roster_payload()
+
+    :return: (kind, value): value is the member id for '=', '+' and '-', `after` for 'list',
+    (after, count) for 'end'
+    """
+    if payload[:1] in ("=", "+", "-"):
+        return payload[0], int(payload[1:])
+    kind, _, value = payload.partition(":")
+    if kind == "list":
+        return kind, int(value)
+    if kind == "end":
+        after, _, count = value.partition(":")
+        return kind, (int(after), int(count))
+    raise ValueError("Bad roster frame")
+
+
+def protocol_payload(versions):
+    """It returns the payload of the protocol offer (GET_NICKNAME request) or answer: 'proto:1,2'"""
+    return "proto:" + ",".join(map(str, versions))
+
+
+def parse_protocol_payload(payload):
+    """
+    It parses the protocol offer or answer of a GET_NICKNAME frame
+
+    :return: the versions, an empty tuple if the payload is not a protocol offer
+    """
+    kind, _, value = payload.partition(":")
+    if kind != "proto":
+        return ()
+    try:
+        return tuple(int(version) for version in value.split(","))
+    except ValueError:
+        return ()
+
+
+def choose_protocol(offered, highest=PROTOCOL_VERSIONS[-1]):
+    """It returns the highest version both sides speak: of the offered ones, up to `highest`"""
+    return max(
+        (v for v in offered if v in PROTOCOL_VERSIONS and v <= highest),
+        default=PROTOCOL_V1,
+    )
+
+
+def compose_frame(version, msg_type, nickname="#Empty", room_id=0, payload="#Empty"):
+    """It returns the encoded frame in the protocol `version`, see msg_composer()"""
+    if version == PROTOCOL_V2:
+        return msg_composer_v2(msg_type, nickname, room_id, payload)
+    if version == PROTOCOL_V3:
+        return msg_composer_v3(msg_type, nickname, room_id, payload)
+    return msg_composer(msg_type, nickname, room_id, payload).encode("utf-8")
+
+
+def compose_frames(version, frames):
+    """
+    It returns a run of frames encoded in the protocol `version`, see compose_frame(). The v2
+    frames are written by encode_v2_into() into one buffer allocated at its final size.
+
+    :param frames: the (msg_type, nickname, room_id, payload) of every frame
+    """
+    if version != PROTOCOL_V2:
+        return b"".join([compose_frame(version, *frame) for frame in frames])
+    frames = [
+        (msg_type, nickname.encode("utf-8"), room_id, payload.encode("utf-8"))
+        for msg_type, nickname, room_id, payload in frames
+    ]
+    buf = bytearray(
+        sum(V2_HEADER_LEN + len(frame[1]) + len(frame[3]) for frame in frames)
+    )
+    offset = 0
+    for msg_type, nickname, room_id, payload in frames:
+        offset = encode_v2_into(buf, offset, msg_type, nickname, room_id, payload)
+    return bytes(buf)
+
+
+def header_parser(view, start=0):
+    """
+    It parses the fixed 7-byte header of the frame starting at view[start], straight from the
+    bytes: no decoding, no int() on string slices.
+
+    :param view: the received bytes, a bytes-like object or a memoryview of it
+    :param start: the offset of the frame
+    :return: (msg_type, nickname_len, room_id_len, payload_len)
+    """
+    header = bytes(view[start : start + HEADER_LEN])
+    if len(header) < HEADER_LEN or not header.isdigit():
+        raise ValueError("Bad frame header")
+    msg_type = header[0] - 48  # ord("0")
+    msg_nickname_len = header[1] * 10 + header[2] - 528  # 11 * ord("0")
+    room_id_len = header[3] * 10 + header[4] - 528
+    payload_len = header[5] * 10 + header[6] - 528
+    if msg_type > MAX_MSG_TYPE or msg_type == CHUNK:
+        raise ValueError("Unknown msg_type")
+    if payload_len > MAX_PAYLOAD:
+        raise ValueError("msg_len > 90")
+    if msg_nickname_len > 10:
+        raise ValueError("nickname_len > 10")
+    return msg_type, msg_nickname_len, room_id_len, payload_len
+
+
+def frame_parser(view, start=0, header=None, names=rooms_name):
+    """
+    It parses the complete frame starting at view[start] straight from the buffer, the text
+    fields are decoded from the memoryview without intermediate bytes objects.
+
+    :param view: a memoryview of the received bytes
+    :param start: the offset of the frame in the view
+    :param header: the frame's header_parser() result, if already known
+    :param names: the catalog's room_id -> name, see room_name()
+    :return: (msg_type, msg_nickname, msg_room_name, msg_payload)
+    """
+    msg_type, msg_nickname_len, room_id_len, payload_len = header or header_parser(
+        view, start
+    )
+    c1 = start + HEADER_LEN
+    c2 = c1 + msg_nickname_len
+    msg_nickname = str(view[c1:c2], "utf-8")
+    c1 = c2
+    c2 = c1 + room_id_len
+    msg_room_name = room_name(int(bytes(view[c1:c2])), names)
+    c1 = c2
+    c2 = c1 + payload_len
+    if c2 > len(view):
+        raise ValueError("Incomplete frame")
+    msg_payload = str(view[c1:c2], "utf-8")
+    return msg_type, msg_nickname, msg_room_name, msg_payload
+
+
+def room_id_parser(message, header=None, version=PROTOCOL_V1):
+    """
+    It returns the room_id of the encoded frame without decoding the other fields, it is all the
+    relay needs besides the msg_type.
+
+    :param message: the encoded frame
+    :param header: the frame's header_parser() result, if already known
+    :param version: the protocol of the frame: the v2 and v3 headers have the room_id
+    """
+    if version == PROTOCOL_V2:
+        return (header or header_parser_v2(message))[2]
+    if version == PROTOCOL_V3:
+        return (header or header_parser_v3(message))[2]
+    header = header or header_parser(message)
+    c1 = HEADER_LEN + header[1]
+    return int(message[c1 : c1 + header[2]])
+
+
+# ===========================================
+# Protocol v2
+# ===========================================
+@functools.lru_cache(maxsize=1024)
+def _v2_frame_struct(nickname_len, payload_len):
+    """The Struct of a whole v2 frame with these lengths, header and text fields"""
+    return struct.Struct(f"!BBHH{nickname_len}s{payload_len}s")
+
+
+def encode_v2_into(buf, offset, msg_type, nickname, room_id, payload):
+    """
+    It encodes a v2 frame straight into a preallocated buffer
+
+    :param buf: a bytearray or a writable memoryview, with room for the frame at `offset`
+    :param offset: where the frame starts
+    :param nickname: the encoded nickname (bytes)
+    :param room_id: the room id (int)
+    :param payload: the encoded payload (bytes)
+    :return: the offset after the frame
+    """
+    nickname_len = len(nickname)
+    payload_len = len(payload)
+    frame = _v2_frame_struct(nickname_len, payload_len)
+    frame.pack_into(
+        buf, offset, msg_type, nickname_len, room_id, payload_len, nickname, payload
+    )
+    return offset + frame.size
+
+
+def msg_composer_v2(msg_type, nickname="#Empty", room_id=0, payload="#Empty"):
+    """It returns the encoded v2 frame (bytes), the v2 msg_composer()"""
+    nickname = nickname.encode("utf-8")
+    payload = payload.encode("utf-8")
+    return b"".join(
+        [
+            V2_HEADER.pack(msg_type, len(nickname), room_id, len(payload)),
+            nickname,
+            payload,
+        ]
+    )
+
+
+def header_parser_v2(view, start=0):
+    """
+    It parses the 6-byte v2 header of the frame starting at view[start]
+
+    :return: (msg_type, nickname_len, room_id, payload_len)
+    """
+    if len(view) - start < V2_HEADER_LEN:
+        raise ValueError("Bad frame header")
+    header = V2_HEADER.unpack_from(view, start)
+    if header[0] > MAX_MSG_TYPE or header[0] == CHUNK:
+        raise ValueError("Unknown msg_type")
+    if header[3] > MAX_PAYLOAD:
+        raise ValueError("msg_len > 90")
+    if header[1] > 10:
+        raise ValueError("nickname_len > 10")
+    return header
+
+
+def frame_parser_v2(view, start=0, header=None):
+    """
+    It parses the complete v2 frame starting at view[start], the text fields are decoded
+    from the memoryview without intermediate bytes objects
+
+    :return: (msg_type, msg_nickname, room_id, msg_payload)
+    """
+    msg_type, nickname_len, room_id, payload_len = header or header_parser_v2(
+        view, start
+    )
+    c1 = start + V2_HEADER_LEN
+    c2 = c1 + nickname_len
+    c3 = c2 + payload_len
+    if c3 > len(view):
+        raise ValueError("Incomplete frame")
+    return msg_type, str(view[c1:c2], "utf-8"), room_id, str(view[c2:c3], "utf-8")
+
+
+def v1_to_v2(data):
+    """It transcodes a run of complete v1 frames to v2, see transcode()"""
+    return transcode(data, PROTOCOL_V1, PROTOCOL_V2)
+
+
+def v2_to_v1(data):
+    """It transcodes a run of complete v2 frames to v1, see transcode()"""
+    return transcode(data, PROTOCOL_V2, PROTOCOL_V1)
+
+
+# ===========================================
+# Protocol v3
+# ===========================================
+class Frame(tuple):
+    """
+    A received v3 frame: (msg_type, nickname, room name, payload) like the frames of v1 and v2,
+    with the server's stamp as attributes. `seq` is the room's sequence number of a relayed
+    CHAT_CONVERSATION message (0 for the other frames), `time` the server's time of the relay.
+    """
+
+    seq = 0
+    time = None
+
+
+def msg_composer_v3(
+    msg_type, nickname="#Empty", room_id=0, payload="#Empty", seq=0, time=0.0
+):
+    """
+    It returns the encoded v3 frame (bytes), the v3 msg_composer(). The payload of a CHUNK frame
+    is bytes, see chunk_payload().
+    """
+    nickname = nickname.encode("utf-8")
+    if isinstance(payload, str):
+        payload = payload.encode("utf-8")
+    return b"".join(
+        [
+            V3_HEADER.pack(msg_type, len(nickname), room_id, len(payload), seq, time),
+            nickname,
+            payload,
+        ]
+    )
+
+
+def header_parser_v3(view, start=0):
+    """
+    It parses the 18-byte v3 header of the frame starting at view[start]
+
+    :return: (msg_type, nickname_len, room_id, payload_len, seq, time)
+    """
+    if len(view) - start < V3_HEADER_LEN:
+        raise ValueError("Bad frame header")
+    header = V3_HEADER.unpack_from(view, start)
+    if header[0] == CHUNK:
+        if header[3] > MAX_CHUNK_PAYLOAD:
+            raise ValueError(f"chunk_len > {MAX_CHUNK_PAYLOAD}")
+    elif header[0] > MAX_MSG_TYPE:
+        raise ValueError("Unknown msg_type")
+    elif header[3] > MAX_PAYLOAD:
+        raise ValueError("msg_len > 90")
+    if header[1] > 10:
+        raise ValueError("nickname_len > 10")
+    return header
+
+
+def frame_parser_v3(view, start=0, header=None, names=rooms_name):
+    """
+    It parses the complete v3 frame starting at view[start]
+
+    :param names: the catalog's room_id -> name, see room_name()
+    :return: a Frame (msg_type, msg_nickname, msg_room_name, msg_payload) with its seq and time,
+    the payload of a CHUNK frame is bytes
+    """
+    msg_type, nickname_len, room_id, payload_len, seq, time = (
+        header or header_parser_v3(view, start)
+    )
+    c1 = start + V3_HEADER_LEN
+    c2 = c1 + nickname_len
+    c3 = c2 + payload_len
+    if c3 > len(view):
+        raise ValueError("Incomplete frame")
+    if msg_type == CHUNK:
+        payload = bytes(view[c2:c3])
+    else:
+        payload = str(view[c2:c3], "utf-8")
+    name = room_name(room_id, names)
+    frame = Frame((msg_type, str(view[c1:c2], "utf-8"), name, payload))
+    frame.seq, frame.time = seq, time
+    return frame
+
+
+def v1_to_v3(data, stamps=None):
+    """It transcodes a run of complete v1 frames to v3, see transcode()"""
+    return transcode(data, PROTOCOL_V1, PROTOCOL_V3, stamps)
+
+
+def chunk_payload(transfer, kind, data=b""):
+    """
+    It returns the payload of a CHUNK frame (bytes)
+
+    :param transfer: the transfer id, a 32-bit number picked by the sender
+    :param kind: CHUNK_START, CHUNK_DATA, CHUNK_END or CHUNK_ABORT
+    :param data: CHUNK_SIZE bytes at most
+    """
+    return CHUNK_HEADER.pack(transfer, kind) + data
+
+
+def parse_chunk_payload(payload):
+    """
+    It parses the payload of a CHUNK frame
+
+    :return: (transfer id, kind, data)
+    """
+    if len(payload) < CHUNK_HEADER.size:
+        raise ValueError("Bad chunk")
+    transfer, kind = CHUNK_HEADER.unpack_from(payload)
+    return transfer, kind, payload[CHUNK_HEADER.size :]
+
+
+def v3_to_v1(data):
+    """It transcodes a run of complete v3 frames to v1, the stamps are dropped, see transcode()"""
+    return transcode(data, PROTOCOL_V3, PROTOCOL_V1)
+
+
+# ===========================================
+# Transcoding
+# ===========================================
+def transcode(data, version, to_version, stamps=None):
+    """
+    It transcodes a run of complete frames from the protocol `version` to `to_version`, the text
+    fields are copied as they are. A run of v3 frames is stamped again even to v3: the seq and
+    the time of the relayed frames are the server's.
+
+    :param data: the encoded frames (bytes-like)
+    :param version: their protocol, PROTOCOL_V1, PROTOCOL_V2 or PROTOCOL_V3
+    :param to_version: the protocol of the result
+    :param stamps: the (seq, time) of every frame to v3, None for seq 0 and the time now
+    :return: the frames (bytes)
+    :raise ValueError: a CHUNK frame to v1 or v2, it has no encoding there
+    """
+    if version == to_version:
+        return restamp_v3(data, stamps) if version == PROTOCOL_V3 else bytes(data)
+    view = memoryview(data)
+    out = bytearray()
+    pos = 0
+    stamps = iter(stamps or ())
+    now = None
+    while pos < len(view):
+        if version == PROTOCOL_V1:
+            msg_type, nickname_len, room_id_len, payload_len = header_parser(view, pos)
+            c1 = pos + HEADER_LEN
+            c2 = c1 + nickname_len
+            room_id = int(bytes(view[c2 : c2 + room_id_len]))
+            c3 = c2 + room_id_len
+        else:
+            if version == PROTOCOL_V2:
+                header = header_parser_v2(view, pos)
+                c1 = pos + V2_HEADER_LEN
+            else:
+                header = header_parser_v3(view, pos)
+                c1 = pos + V3_HEADER_LEN
+            msg_type, nickname_len, room_id, payload_len = header[:4]
+            c2 = c3 = c1 + nickname_len
+        pos = c3 + payload_len
+        if msg_type == CHUNK and to_version != PROTOCOL_V3:
+            raise ValueError(f"CHUNK frame in v{to_version}")
+        if to_version == PROTOCOL_V1:
+            room = b"%d" % room_id
+            out += b"%d%02d%02d%02d" % (msg_type, nickname_len, len(room), payload_len)
+            out += view[c1:c2]
+            out += room
+        else:
+            if to_version == PROTOCOL_V2:
+                out += V2_HEADER.pack(msg_type, nickname_len, room_id, payload_len)
+            else:
+                seq, stamp = next(stamps, (0, None))
+                if stamp is None:
+                    stamp = now = now or _time.time()
+                out += V3_HEADER.pack(
+                    msg_type, nickname_len, room_id, payload_len, seq, stamp
+                )
+            out += view[c1:c2]
+        out += view[c3:pos]
+    return bytes(out)
+
+
+def frame_length(view, start=0, version=PROTOCOL_V1):
+    """
+    It returns the length of the frame of the protocol `version` at view[start], from its header
+
+    :raise ValueError: a bad header, or one cut short
+    """
+    if version == PROTOCOL_V1:
+        header = header_parser(view, start)
+        return HEADER_LEN + header[1] + header[2] + header[3]
+    if version == PROTOCOL_V2:
+        header = header_parser_v2(view, start)
+        return V2_HEADER_LEN + header[1] + header[3]
+    header = header_parser_v3(view, start)
+    return V3_HEADER_LEN + header[1] + header[3]
+
+
+def restamp_v3(data, stamps=None):
+    """
+    It returns a copy of a run of complete v3 frames with the new stamps: only the seq and the
+    time of the headers are written, see transcode()
+    """
+    out = bytearray(data)
+    pos = 0
+    stamps = iter(stamps or ())
+    now = None
+    while pos < len(out):
+        header = header_parser_v3(out, pos)
+        seq, stamp = next(stamps, (0, None))
+        if stamp is None:
+            stamp = now = now or _time.time()
+        V3_STAMP.pack_into(out, pos + V2_HEADER_LEN, seq, stamp)
+        pos += V3_HEADER_LEN + header[1] + header[3]
+    return bytes(out)
+
+
+class FrameDecoder:
+    """
+    Incremental decoder of the frames received from a stream socket. TCP may split a frame over
+    several reads or merge several frames into one read, so the received bytes are kept in a
+    reusable buffer until they make complete frames.
+
+    The socket reads straight into the buffer, no copy:
+        n = client.recv_into(decoder.get_buffer())
+        decoder.buffer_updated(n)
+        for msg_type, msg_nickname, msg_room_name, msg_payload in decoder:
+            ...
+
+    `get_buffer()` / `buffer_updated()` are also the asyncio.BufferedProtocol interface.
+    The protocol `version` may change between two frames, after the handshake. The v3 frames
+    are Frame tuples, with the server's stamp.
+    """
+
+    def __init__(self, bufsize=RECV_BUFSIZE, version=PROTOCOL_V1, names=rooms_name):
+        """
+        :param bufsize: the size of the receive buffer, at least one frame of MAX_FRAME_LEN, and
+        of MAX_CHUNK_FRAME_LEN for the CHUNK frames of v3
+        :param version: PROTOCOL_V1, PROTOCOL_V2 or PROTOCOL_V3, the encoding of the frames
+        :param names: the catalog's room_id -> name, that names the rooms of the frames
+        """
+        self.version = version
+        self.names = names
+        if bufsize < MAX_FRAME_LEN:
+            raise ValueError(f"bufsize < {MAX_FRAME_LEN}")
+        self._buf = bytearray(bufsize)
+        self._view = memoryview(self._buf)
+        self._start = 0  # the first byte not decoded yet
+        self._end = 0  # the end of the received bytes
+
+    def get_buffer(self, sizehint=-1):
+        """
+        It returns the free tail of the buffer to receive into. The incomplete frame left at the
+        end of the last read is moved to the front when the tail gets short.
+        """
+        longest = MAX_CHUNK_FRAME_LEN if self.version == PROTOCOL_V3 else MAX_FRAME_LEN
+        if self._start == self._end:
+            self._start = self._end = 0
+        elif len(self._buf) - self._end < longest:
+            pending = self._end - self._start
+            self._buf[:pending] = bytes(self._view[self._start : self._end])
+            self._start, self._end = 0, pending
+        return self._view[self._end :]
+
+    def buffer_updated(self, nbytes):
+        """It marks nbytes more bytes received into the buffer returned by get_buffer()"""
+        self._end += nbytes
+
+    def _complete(self):
+        """
+        It returns (start, end, header) of the next complete frame and marks it decoded, or
+        returns None if there is no complete frame in the buffer
+        """
+        start = self._start
+        if self.version == PROTOCOL_V2:
+            if self._end - start < V2_HEADER_LEN:
+                return None
+            header = header_parser_v2(self._view, start)
+            end = start + V2_HEADER_LEN + header[1] + header[3]
+        elif self.version == PROTOCOL_V3:
+            if self._end - start < V3_HEADER_LEN:
+                return None
+            header = header_parser_v3(self._view, start)
+            end = start + V3_HEADER_LEN + header[1] + header[3]
+            if end - start > len(self._buf):
+                raise ValueError("Frame longer than the buffer")
+        else:
+            if self._end - start < HEADER_LEN:
+                return None
+            header = header_parser(self._view, start)
+            end = start + HEADER_LEN + header[1] + header[2] + header[3]
+        if end > self._end:
+            return None
+        self._start = end
+        return start, end, header
+
+    def raw_frames(self):
+        """
+        It yields (encoded bytes, header) of every complete frame. The bytes are the frame as
+        received, ready to be relayed, the header is the header_parser() tuple (v2 and v3: the
+        header_parser_v2() and header_parser_v3() tuples).
+        """
+        while frame := self._complete():
+            yield bytes(self._view[frame[0] : frame[1]]), frame[2]
+
+    def __iter__(self):
+        """It yields every complete frame as (msg_type, nickname, room name, payload)"""
+        while frame := self._complete():
+            if self.version == PROTOCOL_V2:
+                msg_type, nickname, room_id, payload = frame_parser_v2(
+                    self._view, frame[0], frame[2]
+                )
+                yield msg_type, nickname, room_name(room_id, self.names), payload
+            elif self.version == PROTOCOL_V3:
+                yield frame_parser_v3(self._view, frame[0], frame[2], self.names)
+            else:
+                yield frame_parser(self._view, frame[0], frame[2], self.names)
+
+    def feed(self, data):
+        """
+        It appends the bytes to the buffer and returns the list of the complete frames
+
+        :param data: any bytes-like object, it may hold parts of frames or many frames
+        """
+        frames = []
+        data = memoryview(data)
+        while data:
+            buf = self.get_buffer()
+            n = min(len(buf), len(data))
+            buf[:n] = data[:n]
+            self.buffer_updated(n)
+            data = data[n:]
+            frames.extend(self)
+        return frames
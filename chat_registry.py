@@ -0,0 +1,404 @@
+# -*- coding: utf-8 -*-
+"""
+The session registry of the chat server: one compact `Session` record per joined client, indexed
+by socket fd, address, nickname and room. Every lookup is a dictionary lookup, O(1) whatever the
+number of clients, and removing a client never shifts the other clients.
+
+The registry is changed by the server's event loop and read by the GUI thread, so every method
+takes the registry's lock. A subscriber (the Status window) gets every membership change as it
+happens, instead of reading the whole registry again: see subscribe() and MembershipDiffs.
+
+The room registry (RoomRegistry) owns the catalog of the rooms: the built-in ones, and the ones the
+clients create at runtime. It allocates their ids, and deletes a created room once it has been
+empty for a while.
+
+@Author: Vadim Moldavsky   vasja34@gmail.com
+@Date:   17/08/2022
+"""
+
+import asyncio
+import itertools
+import json
+import os
+import threading
+import time
+
+from chat_protocol import *
+
+MAX_ROOMS = 10_000  # the rooms in the catalog, the built-in ones included
+ROOM_IDLE_TIMEOUT = 60.0  # seconds a created room stays empty before it's deleted
+
+
+class Session:
+    """
+    The record of one joined client: its connection (the object the messages are sent through),
+    socket fd, address, nickname, room and traffic counters.
+    """
+
+    __slots__ = (
+        "conn",
+        "fd",
+        "address",
+        "nickname",
+        "room_id",
+        "member_id",
+        "joined_at",
+        "msgs_in",
+        "bytes_in",
+        "msgs_out",
+        "bytes_out",
+    )
+
+    def __init__(self, conn, fd, address, nickname, room_id=None):
+        self.conn = conn
+        self.fd = fd
+        self.address = address
+        self.nickname = nickname
+        self.room_id = room_id  # None between EXIT_ROOM and ENTER_ROOM
+        self.member_id = 0  # the id of its entry into the room, see SessionRegistry
+        self.joined_at = time.time()
+        self.msgs_in = self.bytes_in = 0
+        self.msgs_out = self.bytes_out = 0
+
+    def __repr__(self):
+        return (
+            f"Session({self.fd}, {self.address}, {self.nickname!r}, {self.room_id!r})"
+        )
+
+
+class SessionRegistry:
+    """
+    The joined clients, indexed by:
+        fd       -> Session
+        address  -> Session
+        nickname -> {Session, ...}  (nicknames might be not unique)
+        room_id  -> {conn, ...}     (the connections the room's messages are sent to)
+        room_id  -> {member_id: nickname}   (the room's roster)
+    Every entry into a room gets a new member id from `member_ids`, an increasing count: the
+    roster's pages are in the order of the ids.
+    """
+
+    def __init__(self, on_room_empty=None, on_room_used=None, names=rooms_name):
+        """
+        :param on_room_empty: a function (room_id), called when the last member leaves a room
+        :param on_room_used: a function (room_id), called when an empty room gets a member
+        :param names: the room_id -> name of the server's catalog, see RoomRegistry
+        """
+        self.names = names
+        self._lock = threading.RLock()
+        self._by_fd = {}
+        self._by_address = {}
+        self._by_nickname = {}
+        self._rooms = {}  # the rooms with members only
+        self._rosters = {}  # likewise
+        self.member_ids = itertools.count(1)
+        self._listeners = []  # called with (address, [nickname, room name] or None)
+        self.on_room_empty = on_room_empty
+        self.on_room_used = on_room_used
+
+    def __len__(self):
+        return len(self._by_fd)
+
+    # ===========================================
+    # Changes
+    # ===========================================
+    def add(self, conn, fd, address, nickname, room_id=None):
+        """
+        It registers a joined client and returns its Session
+
+        :param conn: the client's connection, the object with send()
+        :param fd: the file descriptor of the client's socket
+        :param address: the client's (ip, port)
+        :param nickname: the client's nickname
+        :param room_id: the room the client joins, None for no room
+        """
+        session = Session(conn, fd, address, nickname)
+        with self._lock:
+            self._by_fd[fd] = session
+            self._by_address[address] = session
+            self._by_nickname.setdefault(nickname, set()).add(session)
+            if room_id is not None:
+                self._enter(session, room_id)
+            self._changed(session)
+        return session
+
+    def remove(self, session):
+        """It removes the session from every index"""
+        with self._lock:
+            if self._by_fd.get(session.fd) is not session:
+                return
+            del self._by_fd[session.fd]
+            del self._by_address[session.address]
+            same_nick = self._by_nickname[session.nickname]
+            same_nick.discard(session)
+            if not same_nick:
+                del self._by_nickname[session.nickname]
+            self._exit(session)
+            for listener in self._listeners:
+                listener(session.address, None)
+
+    def enter_room(self, session, room_id):
+        """It moves the session from its room (if any) into the room"""
+        with self._lock:
+            self._exit(session)
+            self._enter(session, room_id)
+            self._changed(session)
+
+    def exit_room(self, session, room_id):
+        """It takes the session out of the room, if the session is in it"""
+        with self._lock:
+            if session.room_id == room_id:
+                self._exit(session)
+                self._changed(session)
+
+    def _enter(self, session, room_id):
+        members = self._rooms.get(room_id)
+        if members is None:
+            members = self._rooms[room_id] = set()
+            if self.on_room_used:
+                self.on_room_used(room_id)
+        members.add(session.conn)
+        session.room_id = room_id
+        session.member_id = next(self.member_ids)
+        self._rosters.setdefault(room_id, {})[session.member_id] = session.nickname
+
+    def _exit(self, session):
+        if session.room_id is None:
+            return
+        members = self._rooms[session.room_id]
+        members.discard(session.conn)
+        roster = self._rosters[session.room_id]
+        roster.pop(session.member_id, None)
+        if not members:
+            del self._rooms[session.room_id]
+            del self._rosters[session.room_id]
+            if self.on_room_empty:
+                self.on_room_empty(session.room_id)
+        session.room_id = None
+        session.member_id = 0
+
+    def _changed(self, session):
+        for listener in self._listeners:
+            listener(session.address, [session.nickname, self.room_name(session)])
+
+    # ===========================================
+    # Subscribers
+    # ===========================================
+    def subscribe(self, listener):
+        """
+        It subscribes a listener to the membership changes: joins, leaves and room moves. The
+        listener is called in the thread that changes the registry (the server's event loop),
+        under the registry's lock, so it must be quick, see MembershipDiffs.
+
+        :param listener: a function (address, [nickname, room name] or None for a leave)
+        :return: the status_dict() the changes apply to, taken with the subscription
+        """
+        with self._lock:
+            self._listeners.append(listener)
+            return self.status_dict()
+
+    def unsubscribe(self, listener):
+        with self._lock:
+            if listener in self._listeners:
+                self._listeners.remove(listener)
+
+    # ===========================================
+    # Lookups
+    # ===========================================
+    def by_fd(self, fd):
+        with self._lock:
+            return self._by_fd.get(fd)
+
+    def by_address(self, address):
+        with self._lock:
+            return self._by_address.get(address)
+
+    def by_nickname(self, nickname):
+        """It returns a tuple of the sessions with this nickname"""
+        with self._lock:
+            return tuple(self._by_nickname.get(nickname, ()))
+
+    def members(self, room_id):
+        """It returns a snapshot (tuple) of the connections in the room"""
+        with self._lock:
+            return tuple(self._rooms.get(room_id, ()))
+
+    def roster(self, room_id):
+        """It returns a snapshot (list) of the (member_id, nickname) of the room's members"""
+        with self._lock:
+            return list(self._rosters.get(room_id, {}).items())
+
+    def count(self, room_id):
+        """It returns the number of the members of the room"""
+        with self._lock:
+            return len(self._rooms.get(room_id, ()))
+
+    def connections(self):
+        """It returns a snapshot (tuple) of all the connections"""
+        with self._lock:
+            return tuple(session.conn for session in self._by_fd.values())
+
+    def room_name(self, session):
+        """It returns the name of the session's room, '' between EXIT_ROOM and ENTER_ROOM"""
+        with self._lock:
+            return self.names.get(session.room_id, "")
+
+    def sessions(self):
+        """It returns a snapshot (tuple) of all the sessions"""
+        with self._lock:
+            return tuple(self._by_fd.values())
+
+    def status_dict(self):
+        """It returns a dictionary of address -> [nickname, room name], for the Status window"""
+        with self._lock:
+            return {
+                session.address: [session.nickname, self.room_name(session)]
+                for session in self._by_fd.values()
+            }
+
+
+class MembershipDiffs:
+    """
+    A SessionRegistry listener that keeps the membership changes until its consumer takes them,
+    coalesced per address: a client that joins, moves and leaves between two drain() calls is
+    one change. The changes are bounded by the number of clients, so none is ever dropped, and
+    the server's thread only stores a dictionary item.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._changes = {}
+
+    def __call__(self, address, state):
+        with self._lock:
+            self._changes[address] = state
+
+    def __len__(self):
+        return len(self._changes)
+
+    def drain(self):
+        """It takes the changes: a dictionary of address -> [nickname, room name] or None"""
+        with self._lock:
+            changes, self._changes = self._changes, {}
+        return changes
+
+
+class RoomRegistry:
+    """
+    The rooms of the server, in the registry's own RoomCatalog (`catalog`): the lookups of a room
+    by id or name are O(1). The registry allocates the ids of the rooms the clients create,
+    and deletes a created room once it has been empty for `idle_timeout` seconds: the server calls
+    vacated() and used() as the rooms lose their last member and get a first one. The built-in
+    rooms are never deleted. With a `path`, the catalog is saved there by save() and loaded when
+    the registry starts, so the rooms keep their ids (and their history) over a restart.
+    """
+
+    def __init__(
+        self,
+        catalog=None,
+        max_rooms=MAX_ROOMS,
+        idle_timeout=ROOM_IDLE_TIMEOUT,
+        path=None,
+        on_expire=None,
+    ):
+        """
+        :param catalog: the RoomCatalog the rooms are kept in, None for a new one of the built-in
+        rooms
+        :param max_rooms: the max number of rooms, the built-in ones included
+        :param idle_timeout: seconds a created room stays empty before it's deleted, None to keep
+        the empty rooms (they're deleted by someone else: the cluster's supervisor)
+        :param path: the JSON file of the catalog, None to start with the built-in rooms only
+        :param on_expire: a function (room_id, name), called when an empty room is deleted
+        """
+        self.catalog = RoomCatalog.builtin() if catalog is None else catalog
+        self.max_rooms = min(max_rooms, MAX_ROOM_ID + 1)
+        self.idle_timeout = idle_timeout
+        self.path = path
+        self.on_expire = on_expire
+        self._next_id = BUILTIN_ROOMS  # where the search for a free id starts
+        self._idle = {}  # room_id -> the TimerHandle of the empty room's deletion
+        if path is not None and os.path.exists(path):
+            with open(path, encoding="utf-8") as file:
+                self.catalog.reset(tuple(room) for room in json.load(file))
+
+    def __len__(self):
+        return len(self.catalog)
+
+    def create(self, name):
+        """
+        It creates a room, a new one is empty until a client enters it
+
+        :return: (room_id, True), or (room_id, False) if there is a room with this name already
+        :raise ValueError: the name can't be taken, or the catalog is full
+        """
+        check_room_name(name)
+        if (room_id := self.catalog.ids.get(name)) is not None:
+            return room_id, False
+        if len(self.catalog) >= self.max_rooms:
+            raise ValueError(f"There are {len(self.catalog)} rooms already")
+        room_id = self._next_id
+        while room_id in self.catalog:  # the ids are reused once they wrap around
+            room_id = room_id + 1 if room_id < MAX_ROOM_ID else BUILTIN_ROOMS
+        self._next_id = room_id + 1 if room_id < MAX_ROOM_ID else BUILTIN_ROOMS
+        self.catalog.add(room_id, name)
+        self.vacated(room_id)
+        return room_id, True
+
+    def add(self, room_id, name):
+        """It adds a room created by someone else (the cluster's supervisor)"""
+        self.catalog.add(room_id, name)
+
+    def delete(self, room_id):
+        """
+        It deletes a room, the caller checks that it's empty
+
+        :return: the room's name
+        :raise ValueError: a built-in room, or no such room
+        """
+        if room_id < BUILTIN_ROOMS:
+            raise ValueError("A built-in room can't be deleted")
+        self.used(room_id)  # its deletion timer, if any
+        name = self.catalog.remove(room_id)
+        if name is None:
+            raise ValueError(f"No room {room_id}")
+        return name
+
+    def vacated(self, room_id):
+        """It starts the idle timer of an empty room, it's deleted when the timer expires"""
+        if (
+            self.idle_timeout is None
+            or room_id < BUILTIN_ROOMS
+            or room_id in self._idle
+            or room_id not in self.catalog
+        ):
+            return
+        self._idle[room_id] = asyncio.get_running_loop().call_later(
+            self.idle_timeout, self._expire, room_id
+        )
+
+    def used(self, room_id):
+        """It stops the idle timer of a room that got a member"""
+        if (timer := self._idle.pop(room_id, None)) is not None:
+            timer.cancel()
+
+    def created(self):
+        """It returns the (room_id, name) of the rooms created by the clients, in order"""
+        return self.catalog.page(BUILTIN_ROOMS, len(self.catalog))
+
+    def start_timers(self):
+        """It starts the idle timers of the created rooms, empty when the server starts"""
+        for room_id, _ in self.created():
+            self.vacated(room_id)
+
+    def _expire(self, room_id):
+        del self._idle[room_id]
+        name = self.catalog.remove(room_id)
+        if name is not None and self.on_expire:
+            self.on_expire(room_id, name)
+
+    def save(self):
+        """It writes the created rooms to the `path` file, if any"""
+        if self.path is None:
+            return
+        with open(self.path, "w", encoding="utf-8") as file:
+            json.dump(self.created(), file)
@@ -0,0 +1,1616 @@
+# -*- coding: utf-8 -*-
+"""
+The chat server engine. A single asyncio event loop accepts the clients, runs the nickname
+handshake, relays the messages to the rooms and cleans up after the disconnects. There is no
+thread per client, so one process can keep thousands of connections on one core.
+
+The engine does not import any GUI module. Its events go to the attached observers, any object
+with `write_event_value(event, value)`: the GUI window ('chat_server_ui.py', the engine runs in a
+background thread) or, in headless mode, a LogObserver that writes one structured (logfmt) line
+per event to stdout. With a `journal_dir` a TrafficJournal ('chat_journal.py') keeps them on
+disk too, written by a thread of its own.
+
+Example:
+        $ python -m chat_server                        # with the GUI
+        $ python -m chat_server --headless --host 0.0.0.0 --port 9090 --max-clients 5000
+
+@Author: Vadim Moldavsky   vasja34@gmail.com
+@Date:   17/08/2022
+"""
+
+import argparse
+import asyncio
+import collections
+import concurrent.futures
+import datetime
+import heapq
+import itertools
+import logging
+import os
+import signal
+import socket
+import struct
+import sys
+import time
+
+try:
+    import resource  # Unix only
+except ImportError:
+    resource = None
+
+from chat_history import HISTORY_SIZE, ChatHistory, read_segments, replay
+from chat_journal import (
+    JOURNAL_BACKUPS,
+    JOURNAL_INTERVAL,
+    JOURNAL_MAX_BYTES,
+    TrafficJournal,
+)
+from chat_metrics import ServerMetrics, start_stats_endpoint
+from chat_protocol import *
+from chat_registry import (
+    MAX_ROOMS,
+    ROOM_IDLE_TIMEOUT,
+    RoomRegistry,
+    SessionRegistry,
+)
+
+HOST = "127.0.0.1"  # 'localhost'
+PORT = 9090
+
+# what to do when the outbound queue of a client is full
+DROP_OLDEST = "drop-oldest"  # drop the oldest queued message
+DISCONNECT = "disconnect"  # disconnect the slow client
+BLOCK = "block"  # stop reading from the sender until the queue drains, or timeout
+OUTBOX_SIZE = 256  # messages in the outbound queue of a client
+BLOCK_TIMEOUT = 5.0  # seconds
+HANDSHAKE_TIMEOUT = 10.0  # seconds a new client has to answer GET_NICKNAME
+MAX_PENDING_HANDSHAKES = 1000  # the new clients that haven't sent their nickname yet
+REFUSED_REPORT_INTERVAL = 1.0  # seconds between two reports of the refused clients
+# the transport's write buffer, before the outbound queue fills
+WRITE_BUFFER_HIGH = 64 * BUFSIZE
+# seconds the frames for a client are collected before they're written together,
+# 0: until the end of the event loop iteration, None: every frame is written at once
+COALESCE_TICK = 0.0
+COALESCE_MAX_FRAMES = 64  # frames in one write, a fuller batch is written at once
+COALESCE_MAX_BYTES = 16 * BUFSIZE  # bytes in one write, likewise
+CHUNK_QUEUE = 16  # CHUNK frames queued for a client, the sender waits for more
+ROOMS_PAGE = 100  # the rooms in one page of the catalog
+ROSTER_PAGE = 100  # the members in one page of a room's roster
+# TCP_NOTSENT_LOWAT of the client sockets: the unsent bytes the kernel takes, beyond them
+# the frames wait in the server's queues, where a chat message goes ahead of the chunks
+SEND_LOWAT = 16 * BUFSIZE
+
+log = logging.getLogger("chat_server")
+
+
+def broadcast(message, clients, stamps=None, version=PROTOCOL_V1):
+    """
+    It takes a message and a list of clients, and sends the message to each client in the list
+
+    :param message: The message to be sent to all clients. The message is already encoded
+    :param clients: A list (snapshot) of the clients the message is sent to
+    :param stamps: the (seq, time) of the message, see ClientConnection.send()
+    :param version: the protocol of the message, see ClientConnection.send()
+    :return: the clients whose outbound queue is full (BLOCK policy)
+    """
+    return [
+        client for client in clients if client.send(message, stamps, version) is False
+    ]
+
+
+def route(message, session, sessions, header=None, version=PROTOCOL_V1):
+    """
+    It updates the room index of the session registry from the ENTER_ROOM / EXIT_ROOM frames and
+    returns the connections the message should be relayed to. CHAT_CONVERSATION and ENTER_ROOM
+    frames go only to the members of the frame's room, an EXIT_ROOM frame to the members left and
+    the client that left: with thousands of rooms, a client hears of the rooms it's in only. The
+    other frames still go to every client.
+    Only the header and the room_id are read from the encoded message, nothing is decoded.
+
+    :param message: the encoded message received from the client
+    :param session: the Session of the client that sent the message
+    :param sessions: the SessionRegistry
+    :param header: the message's header in its protocol, if already known: always for v2 and v3
+    :param version: the protocol of the message
+    :return: the connections the message should be sent to
+    """
+    if version == PROTOCOL_V1:
+        header = header or header_parser(message)
+    msg_type = header[0]
+    room_id = room_id_parser(message, header, version)
+    if msg_type == CHAT_CONVERSATION:
+        return sessions.members(room_id)
+    if msg_type == EXIT_ROOM:
+        sessions.exit_room(session, room_id)
+        return (*sessions.members(room_id), session.conn)
+    if msg_type == ENTER_ROOM:
+        sessions.enter_room(session, room_id)
+        return sessions.members(room_id)
+    return sessions.connections()
+
+
+def raise_open_files_limit():
+    """
+    It raises the soft limit of open file descriptors to the hard limit, every connected client
+    holds one socket.
+    """
+    if resource is None:
+        return
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if hard == resource.RLIM_INFINITY or soft < hard:
+        resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+
+
+_now = [0, ""]  # the second of the last time stamp, and the time stamp
+
+
+def now():
+    """
+    It returns the time stamp printed in the log: 'YYYY-MM-DD hh:mm:ss'. It changes once per
+    second, it's formatted once per second.
+    """
+    second = int(time.time())
+    if second != _now[0]:
+        _now[:] = second, str(datetime.datetime.fromtimestamp(second))
+    return _now[1]
+
+
+class ClientConnection(asyncio.BufferedProtocol):
+    """
+    One connected client. The connection is created by the event loop for every accepted socket.
+    The socket reads straight into the connection's FrameDecoder and every complete frame is handed
+    to the server: the first one answers the GET_NICKNAME request, all the next ones are relayed.
+    The nickname handshake registers the client's Session in the server's SessionRegistry, and
+    negotiates the protocol version of the next frames. The frames of the client are relayed in
+    its protocol, they're transcoded only for the clients of another one: see ChatServer.frames().
+
+    The messages sent to the client go through a bounded outbound queue. The messages queued
+    within one tick of the server (`coalesce_tick`) are written together, with one writelines()
+    call: one send syscall for up to `coalesce_max_frames` messages instead of one per message.
+    The queue is written out as fast as the client reads: while the transport's write buffer is
+    over its high-water mark the messages wait in the queue, and when the queue is full the
+    server's overflow policy decides: DROP_OLDEST, DISCONNECT, or BLOCK the sender for up to
+    `block_timeout` seconds. BLOCK loses no message but holds the whole room back to its slowest
+    reader, until the timeout disconnects it.
+
+    The CHUNK frames of a transfer (v3) go through a queue of their own, of up to `chunk_queue`
+    chunks: they're written when the outbound queue is empty, so a chat message waits behind the
+    transport's write buffer at most, never behind the rest of a transfer. A chunk is never
+    dropped: when the queue is full the sender stops being read, as with BLOCK.
+    """
+
+    _ids = itertools.count(1)
+
+    def __init__(self, server):
+        self.server = server
+        self.name = f"Session-{next(self._ids)}"
+        self.transport = None
+        self.address = None
+        self.fd = None
+        self.session = None  # set by the nickname handshake
+        self.handshake_timer = None  # the deadline, while the handshake is pending
+        self.admitted = False  # set by the admission control, refused otherwise
+        self.decoder = FrameDecoder()
+        self.version = PROTOCOL_V1  # the protocol of the frames after the handshake
+        self.close_reason = "removed from chat"
+
+        self.outbox = collections.deque()  # the outbound queue
+        self.outbox_bytes = 0  # queued since the last write
+        self.flush_scheduled = False  # on the server's next tick
+        self.dropped = 0  # messages dropped by the DROP_OLDEST policy
+        self._writing_paused = False
+        self._reading_paused = 0  # the waits that stopped the reading
+        # set while the outbound queue is under its limit
+        self._not_full = asyncio.Event()
+        self._not_full.set()
+        self.chunks = collections.deque()  # the CHUNK frames, behind the outbound queue
+        self._chunks_not_full = asyncio.Event()
+        self._chunks_not_full.set()
+
+    @property
+    def queue_depth(self):
+        """The number of messages waiting in the outbound queue"""
+        return len(self.outbox)
+
+    # ===========================================
+    # asyncio.BufferedProtocol
+    # ===========================================
+    def connection_made(self, transport):
+        self.transport = transport
+        self.address = transport.get_extra_info("peername")
+        self.fd = transport.get_extra_info("socket").fileno()
+        transport.set_write_buffer_limits(high=self.server.write_buffer_high)
+        sock = transport.get_extra_info("socket")
+        if self.server.send_buffer:
+            sock.setsockopt(
+                socket.SOL_SOCKET, socket.SO_SNDBUF, self.server.send_buffer
+            )
+        if self.server.send_lowat and hasattr(socket, "TCP_NOTSENT_LOWAT"):
+            sock.setsockopt(
+                socket.IPPROTO_TCP, socket.TCP_NOTSENT_LOWAT, self.server.send_lowat
+            )
+        self.server.on_connect(self)
+
+    def get_buffer(self, sizehint):
+        return self.decoder.get_buffer(sizehint)
+
+    def buffer_updated(self, nbytes):
+        self.decoder.buffer_updated(nbytes)
+        self._process()
+
+    def connection_lost(self, exc):
+        self.outbox.clear()
+        self.chunks.clear()
+        self._not_full.set()  # release the senders waiting for this client
+        self._chunks_not_full.set()
+        self.server.on_disconnect(self)
+
+    def pause_writing(self):
+        self._writing_paused = True
+
+    def resume_writing(self):
+        self._writing_paused = False
+        self._flush()
+
+    def set_protocol(self, version):
+        """It switches the frames received and sent from now on to the protocol `version`"""
+        self.version = version
+        self.decoder.version = version
+
+    # ===========================================
+    # Inbound
+    # ===========================================
+    def _process(self):
+        """It hands the complete frames in the decoder to the server"""
+        try:
+            for message, header in self.decoder.raw_frames():
+                if self.version == PROTOCOL_V3 and header[0] == CHUNK:
+                    self.server.on_chunk(self, message, header)  # relayed as received
+                    if self._reading_paused or self.transport.is_closing():
+                        break
+                    continue
+                # in the protocol of the client, with its header: see ChatServer.frames()
+                if self.session is None:
+                    self.server.on_handshake(self, message)
+                else:
+                    self.server.on_message(self, message, header)
+                if self._reading_paused or self.transport.is_closing():
+                    break  # the next frames wait in the decoder
+        except ValueError:  # not a chat_protocol stream, no more frames can be found
+            self.close("removed from chat: protocol error")
+
+    def wait_for(self, recipients, chunks=False):
+        """
+        It stops reading from this client until the outbound queues of the recipients go under
+        their limit. The recipients still full after `block_timeout` seconds are disconnected.
+
+        :param recipients: the sessions whose queue is full
+        :param chunks: wait for their chunk queues instead
+        """
+        self.pause_until(self.server.wait_for_queues(recipients, chunks))
+
+    def pause_until(self, awaitable):
+        """It stops reading from this client until the awaitable is done"""
+        self._reading_paused += 1
+        if self._reading_paused == 1:
+            self.transport.pause_reading()
+        self.server.loop.create_task(self._resume_after(awaitable))
+
+    async def _resume_after(self, awaitable):
+        try:
+            await awaitable
+        finally:
+            self._reading_paused -= 1
+            if not self._reading_paused and not self.transport.is_closing():
+                self.transport.resume_reading()
+                self._process()  # the frames waiting in the decoder
+
+    # ===========================================
+    # Outbound
+    # ===========================================
+    def send(self, message, stamps=None, version=PROTOCOL_V1, stamped=False):
+        """
+        It queues the encoded message for the client. The queued messages are written together on
+        the server's next tick, or at once when they fill a batch (`coalesce_max_frames` or
+        `coalesce_max_bytes`). While the client doesn't keep up they wait in the queue and the
+        writer sends them when the client reads the previous ones (the event loop also handles
+        the partial writes).
+
+        :param message: the encoded message, or run of messages
+        :param stamps: the (seq, time) of every message, for a v3 client: None for seq 0 and the
+        time now
+        :param version: the protocol of the message, it's transcoded for a client of another one
+        :param stamped: the message is in the client's protocol and its v3 frames have their seq
+        and time already (the history): it's sent as it is
+        :return: False if the queue is full and the sender has to wait (BLOCK policy)
+        """
+        if self.transport.is_closing():
+            return True
+        server = self.server
+        if not stamped and (self.version != version or version == PROTOCOL_V3):
+            message = server.frames(message, version, self.version, stamps)
+        if (session := self.session) is not None:
+            session.msgs_out += 1
+            session.bytes_out += len(message)
+        if (
+            server.coalesce_tick is None
+            and not self.outbox
+            and not self._writing_paused
+        ):
+            self.transport.write(message)  # no coalescing
+            server.frames_sent += 1
+            server.writes += 1
+            return True
+        if len(self.outbox) >= server.outbox_size and not self._writing_paused:
+            self._flush()  # full before the tick, but the client keeps up
+        if len(self.outbox) >= server.outbox_size:
+            policy = server.overflow_policy
+            if policy == DROP_OLDEST:
+                self.outbox.popleft()
+                self.dropped += 1
+            elif policy == DISCONNECT:
+                self.abort("removed from chat: slow consumer")
+                return True
+            else:  # BLOCK: over the limit, until the sender's wait times out
+                self._not_full.clear()
+                self.outbox.append(message)
+                return False
+        self.outbox.append(message)
+        self.outbox_bytes += len(message)
+        if len(self.outbox) >= server.outbox_size:
+            self._not_full.clear()
+        if self._writing_paused:
+            return True
+        if (
+            len(self.outbox) >= server.coalesce_max_frames
+            or self.outbox_bytes >= server.coalesce_max_bytes
+        ):
+            self._flush()
+        elif not self.flush_scheduled:
+            self.flush_scheduled = True
+            server.schedule_flush(self)
+        return True
+
+    def send_chunk(self, message):
+        """
+        It queues a CHUNK frame (v3, encoded) for the client, after the queued messages. The
+        chunks are written one by one while the transport accepts them and the outbound queue is
+        empty.
+
+        :param message: the encoded CHUNK frame, as received from the sender
+        :return: False if the chunk queue is full and the sender has to wait
+        """
+        if self.transport.is_closing():
+            return True
+        server = self.server
+        if (session := self.session) is not None:
+            session.msgs_out += 1
+            session.bytes_out += len(message)
+        if not self.outbox and not self.chunks and not self._writing_paused:
+            self.transport.write(message)
+            server.frames_sent += 1
+            server.writes += 1
+            return True
+        self.chunks.append(message)
+        if not self._writing_paused and not self.flush_scheduled:
+            self._flush()
+        if len(self.chunks) >= server.chunk_queue:
+            self._chunks_not_full.clear()
+            return False
+        return True
+
+    def _flush(self):
+        """
+        The writer: it writes the queued messages while the transport accepts them, in batches of
+        up to `coalesce_max_frames` messages or `coalesce_max_bytes` bytes, one writelines() each,
+        then the queued chunks
+        """
+        server = self.server
+        outbox = self.outbox
+        while outbox and not self._writing_paused:
+            batch = [outbox.popleft()]
+            size = len(batch[0])
+            while (
+                outbox
+                and len(batch) < server.coalesce_max_frames
+                and size < server.coalesce_max_bytes
+            ):
+                batch.append(outbox.popleft())
+                size += len(batch[-1])
+            self.transport.writelines(batch)
+            server.frames_sent += len(batch)
+            server.writes += 1
+        self.outbox_bytes = 0
+        if len(outbox) < server.outbox_size:
+            self._not_full.set()
+        chunks = self.chunks
+        while chunks and not outbox and not self._writing_paused:
+            self.transport.write(chunks.popleft())
+            server.frames_sent += 1
+            server.writes += 1
+        if len(chunks) < server.chunk_queue:
+            self._chunks_not_full.set()
+
+    def close(self, reason=None):
+        """It closes the connection after the queued messages are written, not the chunks"""
+        if reason:
+            self.close_reason = reason
+        self.transport.writelines(self.outbox)
+        self.outbox.clear()
+        self.chunks.clear()
+        self.transport.close()
+
+    def abort(self, reason=None):
+        """It closes the connection at once, the queued messages are dropped"""
+        if reason:
+            self.close_reason = reason
+        self.outbox.clear()
+        self.chunks.clear()
+        self.transport.abort()
+
+
+class LogObserver:
+    """
+    The headless observer of the server: it writes the server events to the log, one logfmt line
+    per event (key=value pairs). The relayed messages are logged at DEBUG level only, they are not
+    decoded at all at the INFO level.
+    """
+
+    def __init__(self, logger=log, names=rooms_name):
+        """
+        :param logger: the logger of the events
+        :param names: the room_id -> name of the server's catalog, see RoomRegistry
+        """
+        self.log = logger
+        self.names = names
+        # the server doesn't send the relayed messages to an observer that drops them
+        self.relay_events = logger.isEnabledFor(logging.DEBUG)
+
+    @staticmethod
+    def logfmt(**fields):
+        """It returns the fields as 'key=value key="value with spaces"'"""
+        items = []
+        for key, value in fields.items():
+            value = str(value)
+            if not value or any(char in value for char in ' "=\\'):
+                value = '"' + value.replace("\\", "\\\\").replace('"', '\\"') + '"'
+            items.append(f"{key}={value}")
+        return " ".join(items)
+
+    def write_event_value(self, event, value):
+        if event == "-ACCEPT_NEW_CLIENT-":
+            _, name, address, nick = value
+            self.log.info(
+                self.logfmt(
+                    event="join",
+                    conn=name,
+                    address=":".join(map(str, address)),
+                    nickname=nick,
+                )
+            )
+        elif event == "-BROADCAST_EVENT-":
+            _, name, nick, data = value
+            msg_type, _, room_name, payload = msg_parser(data, self.names)
+            self.log.debug(
+                self.logfmt(
+                    event="relay",
+                    conn=name,
+                    nickname=nick,
+                    type=msg_type,
+                    room=room_name,
+                    payload=payload,
+                )
+            )
+        elif event == "-Exception_Event-":
+            _, name, nick, reason = value
+            self.log.info(
+                self.logfmt(event="leave", conn=name, nickname=nick, reason=reason)
+            )
+        elif event == "-WARNING_EVENT-":
+            _, name, msg = value
+            self.log.warning(self.logfmt(event="warning", conn=name, msg=msg))
+        elif event == "-ROOM_EVENT-":
+            _, _, room_id, room_name, created = value
+            self.log.info(
+                self.logfmt(
+                    event="room-created" if created else "room-deleted",
+                    room_id=room_id,
+                    room=room_name,
+                )
+            )
+
+
+class EventBuffer:
+    """
+    An observer that keeps the server events in a bounded buffer, for a consumer that polls them
+    on its own tick (the GUI). The server's thread only appends to a deque, it never waits for the
+    consumer: when the consumer falls behind, the oldest events are dropped and counted.
+    """
+
+    def __init__(self, maxlen=10_000):
+        self._events = collections.deque(maxlen=maxlen)
+        self._overflow = 0  # changed by the server's thread only
+        self._reported = 0  # changed by the consumer's thread only
+
+    def __len__(self):
+        return len(self._events)
+
+    def write_event_value(self, event, value):
+        if len(self._events) == self._events.maxlen:
+            self._overflow += 1
+        self._events.append((event, value))
+
+    def drain(self):
+        """
+        It takes all the buffered events, called by the consumer
+
+        :return: (a list of (event, value), the number of events dropped since the last drain)
+        """
+        events = []
+        try:
+            while True:
+                events.append(self._events.popleft())
+        except IndexError:
+            pass
+        overflow = self._overflow
+        dropped, self._reported = overflow - self._reported, overflow
+        return events, dropped
+
+
+class ChatServer:
+    """
+    The asyncio chat server. The joined clients are kept in `sessions`, a SessionRegistry indexed
+    by fd, address, nickname and room. The server events go to the attached observers.
+    """
+
+    def __init__(
+        self,
+        host=HOST,
+        port=PORT,
+        observers=(),
+        max_clients=MAX_CLIENTS,
+        outbox_size=OUTBOX_SIZE,
+        overflow_policy=DROP_OLDEST,
+        block_timeout=BLOCK_TIMEOUT,
+        write_buffer_high=WRITE_BUFFER_HIGH,
+        send_buffer=None,
+        send_lowat=SEND_LOWAT,
+        handshake_timeout=HANDSHAKE_TIMEOUT,
+        max_pending=MAX_PENDING_HANDSHAKES,
+        max_per_address=None,
+        reuse_port=False,
+        history_size=HISTORY_SIZE,
+        history_dir=None,
+        coalesce_tick=COALESCE_TICK,
+        coalesce_max_frames=COALESCE_MAX_FRAMES,
+        coalesce_max_bytes=COALESCE_MAX_BYTES,
+        chunk_queue=CHUNK_QUEUE,
+        max_rooms=MAX_ROOMS,
+        room_idle_timeout=ROOM_IDLE_TIMEOUT,
+        catalog=None,
+        metrics=True,
+        stats_port=None,
+        journal_dir=None,
+        journal_max_bytes=JOURNAL_MAX_BYTES,
+        journal_interval=JOURNAL_INTERVAL,
+        journal_backups=JOURNAL_BACKUPS,
+        journal_compress=False,
+    ):
+        """
+        :param host: the address to listen on
+        :param port: the port to listen on
+        :param observers: the objects whose `write_event_value(event, value)` gets the server
+        events: the GUI window, a LogObserver. See also attach()
+        :param max_clients: the max number of clients in the chat, the pending handshakes included
+        :param outbox_size: the max number of messages in the outbound queue of a client
+        :param overflow_policy: DROP_OLDEST, DISCONNECT or BLOCK, when an outbound queue is full
+        :param block_timeout: seconds a sender waits for a full queue (BLOCK policy)
+        :param write_buffer_high: bytes buffered by the transport before the queue is used
+        :param send_buffer: SO_SNDBUF of the client sockets, None for the OS default. The OS may
+        buffer megabytes for a client that doesn't read before the outbound queue fills
+        :param send_lowat: TCP_NOTSENT_LOWAT of the client sockets (Linux, macOS), None for the OS
+        default: the bytes not sent yet the kernel takes for a client. Beyond them the frames
+        wait in the server's queues, where a chat message is written ahead of the chunks of a
+        transfer
+        :param handshake_timeout: seconds a new client has to answer GET_NICKNAME, it is
+        disconnected after that
+        :param max_pending: the max number of pending handshakes
+        :param max_per_address: the max number of connections from one IP address, None for no
+        limit
+        :param reuse_port: bind with SO_REUSEPORT, for several server processes on one port
+        :param history_size: the chat messages kept in memory per room, for the HISTORY requests
+        :param history_dir: the directory of the history segment files, None for the in-memory
+        history only
+        :param coalesce_tick: seconds the messages for a client are collected before they're
+        written together, 0 for the end of the event loop iteration, None to write every message
+        at once. A longer tick means fewer send syscalls and a higher latency
+        :param coalesce_max_frames: the max messages in one write, a full batch is written at once
+        :param coalesce_max_bytes: the max bytes in one write, likewise
+        :param chunk_queue: the max CHUNK frames queued for a client, the sender of a transfer
+        stops being read while a recipient's chunk queue is full
+        :param max_rooms: the max number of rooms, the built-in ones included
+        :param room_idle_timeout: seconds a room created by a client stays empty before it's
+        deleted. With a `history_dir` the catalog of the rooms is kept there too
+        :param catalog: the RoomCatalog the server starts with, None for a new one of the built-in
+        rooms (and of the rooms kept in `history_dir`)
+        :param metrics: count the messages and bytes per room and the relay latency, see stats()
+        :param stats_port: the port of the local HTTP stats endpoint (127.0.0.1), None for none
+        :param journal_dir: the directory of the traffic journal (every relayed message, join,
+        leave and room change as a JSON line), None for no journal
+        :param journal_max_bytes: the size a journal file is rotated at
+        :param journal_interval: seconds a journal file is rotated after, None for never
+        :param journal_backups: the rotated journal files kept
+        :param journal_compress: gzip the rotated journal files
+        """
+        if overflow_policy not in (DROP_OLDEST, DISCONNECT, BLOCK):
+            raise ValueError(f"Unknown overflow_policy: {overflow_policy}")
+        self.host = host
+        self.port = port
+        self.observers = []
+        self._relay_observers = []  # the observers of the -BROADCAST_EVENT-
+        for observer in observers:
+            self.attach(observer)
+        self.max_clients = max_clients
+        self.outbox_size = outbox_size
+        self.overflow_policy = overflow_policy
+        self.block_timeout = block_timeout
+        self.write_buffer_high = write_buffer_high
+        self.send_buffer = send_buffer
+        self.send_lowat = send_lowat
+        self.handshake_timeout = handshake_timeout
+        self.max_pending = max_pending
+        self.max_per_address = max_per_address
+        self.reuse_port = reuse_port
+        self.coalesce_tick = coalesce_tick
+        self.coalesce_max_frames = max(1, coalesce_max_frames)
+        self.coalesce_max_bytes = coalesce_max_bytes
+        self.chunk_queue = max(1, chunk_queue)
+
+        # the write coalescing: the clients to flush on the next tick, and the totals
+        self._flush_pending = []
+        self._flush_handle = None
+        self._frames_source = None  # the last message transcoded
+        self._frames = {}  # its encodings, by protocol
+        self.frames_sent = 0  # messages written to the clients
+        self.writes = 0  # write calls: a send syscall each, or less when buffered
+
+        # the nickname handshakes: in progress now, and since the server started
+        self.handshakes_pending = 0
+        self.handshakes_completed = 0
+        self.handshakes_timed_out = 0
+
+        # the admission control
+        self.connections_per_ip = collections.Counter()  # of the admitted connections
+        self.refused = 0  # the clients refused since the server started
+        self._refused_reasons = collections.Counter()  # not reported yet
+        self._refused_report = None  # the next report, while the clients are refused
+
+        self.rooms = RoomRegistry(
+            catalog,
+            max_rooms=max_rooms,
+            idle_timeout=room_idle_timeout,
+            path=os.path.join(history_dir, "rooms.json") if history_dir else None,
+            on_expire=self.room_deleted,
+        )
+        self.rooms_listeners = set()  # the clients that get the diffs of the catalog
+        # the clients that get the rosters of their rooms and their diffs, see presence()
+        self.roster_listeners = set()
+        # the joined clients
+        self.sessions = SessionRegistry(
+            self.rooms.vacated, self.rooms.used, self.rooms.catalog.names
+        )
+        self.metrics = ServerMetrics() if metrics else None
+        self.stats_port = stats_port
+        self.history = ChatHistory(history_size, history_dir)
+        self.history.prune(
+            self.rooms.catalog.names
+        )  # the history of the rooms gone with the catalog
+        self.journal = None
+        if journal_dir:
+            self.journal = TrafficJournal(
+                journal_dir,
+                max_bytes=journal_max_bytes,
+                interval=journal_interval,
+                backups=journal_backups,
+                compress=journal_compress,
+                names=self.rooms.catalog.names,
+            )
+            self.attach(self.journal)
+
+        self.loop = None
+        self._server = None
+
+    def attach(self, observer):
+        """
+        It attaches an observer of the server events, e.g. the GUI window. The observer's
+        `write_event_value(event, value)` is called from the server's thread. An observer with
+        `relay_events = False` doesn't get the -BROADCAST_EVENT- of every relayed message.
+        """
+        self.observers.append(observer)
+        if getattr(observer, "relay_events", True):
+            self._relay_observers.append(observer)
+
+    def notify(self, event, value):
+        """It sends an event to the observers"""
+        for observer in self.observers:
+            observer.write_event_value(event, value)
+
+    # ===========================================
+    # Connection callbacks
+    # ===========================================
+    def admission_check(self, conn):
+        """It returns the reason the new connection is refused, or None if it's admitted"""
+        if len(self.sessions) + self.handshakes_pending >= self.max_clients:
+            return f"The chat is full: {self.max_clients} clients"
+        if self.handshakes_pending >= self.max_pending:
+            return "Too many clients are joining now, try again later"
+        ip = conn.address[0]
+        if self.max_per_address and self.connections_per_ip[ip] >= self.max_per_address:
+            return f"Too many connections from {ip}"
+        return None
+
+    def refuse(self, conn, reason):
+        """
+        It sends the REJECT frame to the client and closes the connection. The refused clients are
+        reported with one warning per REFUSED_REPORT_INTERVAL, not one per client.
+        """
+        self.refused += 1
+        conn.send(msg_composer(msg_type=REJECT, payload=reason).encode("utf-8"))
+        conn.close(f"refused: {reason}")
+        self._refused_reasons[reason] += 1
+        if self._refused_report is None:
+            self.report_refused()
+
+    def report_refused(self):
+        """It reports the clients refused since the last report"""
+        if not self._refused_reasons:
+            self._refused_report = None
+            return
+        count = sum(self._refused_reasons.values())
+        reasons = ", ".join(
+            f"{reason} ({num})" for reason, num in self._refused_reasons.items()
+        )
+        self._refused_reasons.clear()
+        self.notify(
+            "-WARNING_EVENT-",
+            (now(), "Admission", f"{count} client(s) refused: {reasons}"),
+        )
+        self._refused_report = self.loop.call_later(
+            REFUSED_REPORT_INTERVAL, self.report_refused
+        )
+
+    def on_connect(self, conn):
+        if reason := self.admission_check(conn):
+            self.refuse(conn, reason)
+            return
+        conn.admitted = True
+        self.connections_per_ip[conn.address[0]] += 1
+        # the handshake is a state of the connection: the event loop goes on with the other
+        # clients until this one answers, or its deadline disconnects it
+        self.handshakes_pending += 1
+        conn.handshake_timer = self.loop.call_later(
+            self.handshake_timeout, self.on_handshake_timeout, conn
+        )
+        conn.send(
+            msg_composer(
+                msg_type=GET_NICKNAME, payload=protocol_payload(PROTOCOL_VERSIONS)
+            ).encode("utf-8")
+        )
+
+    def end_handshake(self, conn):
+        """It stops the handshake deadline of the connection, True if the handshake was pending"""
+        if conn.handshake_timer is None:
+            return False
+        conn.handshake_timer.cancel()
+        conn.handshake_timer = None
+        self.handshakes_pending -= 1
+        return True
+
+    def on_handshake_timeout(self, conn):
+        if not self.end_handshake(conn):
+            return
+        self.handshakes_timed_out += 1
+        conn.abort("removed from chat: handshake timeout")
+        self.notify(
+            "-WARNING_EVENT-",
+            (
+                now(),
+                conn.name,
+                f"The client {conn.address} did not send its nickname within "
+                f"{self.handshake_timeout} s and is disconnected !",
+            ),
+        )
+
+    def on_handshake(self, conn, data):
+        self.end_handshake(conn)
+        try:
+            _, msg_nickname, _, msg_payload = msg_parser(data)
+        except Exception:
+            conn.close()
+            return
+        if (version := choose_protocol(parse_protocol_payload(msg_payload))) > 1:
+            conn.set_protocol(version)
+        conn.session = self.sessions.add(
+            conn, conn.fd, conn.address, msg_nickname, rooms_id["Lobby"]
+        )
+        self.handshakes_completed += 1
+
+        message = msg_composer(
+            msg_type=ENTER_ROOM,
+            nickname=msg_nickname,
+            room_id=rooms_id["Lobby"],
+            payload=f"{msg_nickname} joined to the 'Lobby' !",
+        ).encode("utf-8")
+        self.announce(message, rooms_id["Lobby"])
+        session = conn.session
+        self.roster_diff("+", session.room_id, session.member_id, msg_nickname, conn)
+
+        self.notify(
+            "-ACCEPT_NEW_CLIENT-",
+            (now(), conn.name, conn.address, msg_nickname),
+        )
+
+    def on_message(self, conn, data, header=None):
+        """
+        It relays the encoded message as received: the same bytes object is sent to every
+        recipient of the sender's protocol, it is never decoded and re-encoded. The recipients of
+        another protocol get it transcoded once per protocol, see frames(). The GUI gets the
+        encoded message too (v1) and decodes it only when it prints it.
+
+        :param header: the message's header in the sender's protocol, if already known: always
+        for v2 and v3
+        """
+        session = conn.session
+        session.msgs_in += 1
+        session.bytes_in += len(data)
+        version = conn.version
+        try:
+            if version == PROTOCOL_V1:
+                header = header or header_parser(data)
+            # a request to the server, not relayed: answered in v1 like the server's own frames
+            if header[0] in (HISTORY, ROOMS, ROSTER):
+                if version != PROTOCOL_V1:
+                    data = transcode(data, version, PROTOCOL_V1)
+                    header = header_parser(data)
+                if header[0] == HISTORY:
+                    self.on_history_request(conn, data, header)
+                elif header[0] == ROOMS:
+                    self.on_rooms_request(conn, data, header)
+                else:
+                    self.on_roster_request(conn, data, header)
+                return
+            if room_id_parser(data, header, version) not in self.rooms.catalog:
+                self.unknown_room(conn, data, header)
+                return
+            if (metrics := self.metrics) is None:
+                self.relay(conn, data, header)
+            else:
+                start = time.perf_counter_ns()
+                self.relay(conn, data, header)
+                metrics.relay_latency.observe(time.perf_counter_ns() - start)
+        except (ValueError, struct.error, UnicodeDecodeError) as error:
+            self.notify(
+                "-WARNING_EVENT-",
+                (now(), conn.name, f"Bad frame from {conn.address}: {error}"),
+            )
+            conn.close("removed from chat: bad frame")  # cleaned up by on_disconnect()
+            return
+        except Exception:
+            log.exception(LogObserver.logfmt(event="error", conn=conn.name))
+            conn.close("removed from chat: server error")
+            return
+        if self._relay_observers:
+            data = self.frames(data, version, PROTOCOL_V1)
+            event = (now(), conn.name, session.nickname, data)
+            for observer in self._relay_observers:
+                observer.write_event_value("-BROADCAST_EVENT-", event)
+
+    def relay(self, conn, data, header=None):
+        """
+        It routes the encoded message of the client and sends it to the recipients. A chat
+        message is stored first: its seq and time go to the v3 clients. The client stops being
+        read while the recipients' queues are full (BLOCK policy).
+
+        :param conn: the ClientConnection the message was received from
+        :param data: the encoded message, in the client's protocol
+        :param header: the message's header in the client's protocol, if already known: always
+        for v2 and v3
+        :return: the [(seq, time)] of a chat message, None for the other messages
+        """
+        version = conn.version
+        if version == PROTOCOL_V1:
+            header = header or header_parser(data)
+        room_id = room_id_parser(data, header, version)
+        session = conn.session
+        stamps = None
+        if header[0] == CHAT_CONVERSATION:
+            stamps = [self.history.append(room_id, data, version)]
+        left = session.room_id, session.member_id
+        clients = route(data, session, self.sessions, header, version)
+        if header[0] in (ENTER_ROOM, EXIT_ROOM) and self.roster_listeners:
+            clients = self.presence(conn, left, clients)
+        if full := broadcast(data, clients, stamps, version):
+            conn.wait_for(full)
+        if header[0] == ENTER_ROOM and conn in self.roster_listeners:
+            self.send_roster_page(conn, session.room_id, 0)
+        if self.metrics is not None:
+            self.metrics.on_relay(room_id, len(data), len(clients))
+        return stamps
+
+    async def wait_for_queues(self, recipients, chunks=False):
+        """
+        It waits until the outbound queues (or the chunk queues) of the recipients go under their
+        limit. The recipients that never went under it in `block_timeout` seconds are
+        disconnected: not the ones full again by then, they keep reading.
+        """
+        waiters = [
+            asyncio.create_task(
+                (recipient._chunks_not_full if chunks else recipient._not_full).wait()
+            )
+            for recipient in recipients
+        ]
+        _, pending = await asyncio.wait(waiters, timeout=self.block_timeout)
+        for recipient, waiter in zip(recipients, waiters):
+            if waiter in pending:
+                waiter.cancel()
+                if not recipient.transport.is_closing():
+                    recipient.abort("removed from chat: slow consumer")
+
+    def on_chunk(self, conn, data, header):
+        """
+        It relays a CHUNK frame of a transfer (v3) as received, to the other v3 clients in the
+        room: the chunks stream through the server, a transfer is never stored nor held whole.
+        The sender stops being read while a recipient's chunk queue is full, for up to
+        `block_timeout` seconds. A chunk to a room the sender is not in is dropped.
+
+        :param conn: the ClientConnection the chunk was received from
+        :param data: the encoded v3 CHUNK frame
+        :param header: the frame's header_parser_v3() result
+        """
+        session = conn.session
+        session.msgs_in += 1
+        session.bytes_in += len(data)
+        room_id = header[2]
+        if room_id != session.room_id:
+            return
+        clients = [
+            client
+            for client in self.sessions.members(room_id)
+            if client is not conn and client.version == PROTOCOL_V3
+        ]
+        if full := [client for client in clients if client.send_chunk(data) is False]:
+            conn.wait_for(full, chunks=True)
+        if self.metrics is not None:
+            self.metrics.on_relay(room_id, len(data), len(clients))
+
+    def on_history_request(self, conn, data, header):
+        """
+        It answers a HISTORY request: a HISTORY frame whose payload is the number of messages,
+        followed by the stored messages of the room, the oldest first. The messages in memory are
+        taken at once, the older ones are read from the segment files in a worker thread. A v3
+        client gets the messages with their seq and time, and the seq of the room's newest
+        message in the HISTORY frame: after a 'seq:N' request it has all the messages up to it,
+        or asks for the next ones.
+        """
+        room_id = room_id_parser(data, header)
+        try:
+            last, since, after = parse_history_payload(
+                frame_parser(memoryview(data), 0, header)[3]
+            )
+        except ValueError as error:  # answered, the client stays
+            answer = msg_composer(HISTORY, "#Empty", room_id, f"error:{error}")
+            conn.send(answer.encode("utf-8"))
+            return
+        stamps, versions, frames, parts = self.history.query(
+            room_id, last, since, after
+        )
+        if not parts:
+            self.send_history(conn, room_id, stamps, versions, frames)
+            return
+
+        def on_read(future):
+            if future.exception() is None:
+                chunks = future.result() + frames
+                counts = [part[3] for part in parts] + [1] * len(frames)
+                self.send_history(conn, room_id, stamps, versions, chunks, counts)
+            else:  # deleted by the retention meanwhile, the ring is still worth sending
+                ring = len(stamps) - len(frames)
+                self.send_history(conn, room_id, stamps[ring:], versions[ring:], frames)
+
+        self.loop.run_in_executor(None, read_segments, parts).add_done_callback(on_read)
+
+    def send_history(self, conn, room_id, stamps, versions, chunks, counts=None):
+        """
+        It sends the HISTORY frame and the stored messages in the client's protocol, as one
+        write: the messages of the client's protocol as stored, the others transcoded a run at a
+        time, see replay()
+
+        :param stamps: the (seq, time) of every message
+        :param versions: the protocol of every message
+        :param chunks: the encoded messages, or runs of them, the oldest first
+        :param counts: the number of messages of every chunk, None for one each
+        """
+        if conn.transport.is_closing():
+            return
+        version = conn.version
+        header = msg_composer(
+            msg_type=HISTORY, room_id=room_id, payload=str(len(stamps))
+        )
+        newest = (self.history.newest(room_id), time.time())
+        header = transcode(header.encode("utf-8"), PROTOCOL_V1, version, [newest])
+        frames = replay(chunks, counts or [1] * len(chunks), versions, stamps, version)
+        conn.send(b"".join([header, *frames]), version=version, stamped=True)
+
+    # ===========================================
+    # Rooms
+    # ===========================================
+    @staticmethod
+    def rooms_frame(kind, value, nickname="#Empty"):
+        """It returns the encoded ROOMS frame, see rooms_payload()"""
+        return msg_composer(ROOMS, nickname, 0, rooms_payload(kind, value)).encode(
+            "utf-8"
+        )
+
+    def on_rooms_request(self, conn, data, header):
+        """
+        It answers a ROOMS request: a page of the catalog (the client gets the diffs from then
+        on), or the creation or the deletion of a room
+        """
+        kind, value = parse_rooms_payload(frame_parser(memoryview(data), 0, header)[3])
+        if kind == "list":
+            self.rooms_listeners.add(conn)
+            self.send_rooms_page(conn, value)
+        elif kind == "create":
+            self.create_room(conn, value)
+        elif kind == "delete":
+            self.delete_room(conn, value)
+        else:
+            raise ValueError("Bad rooms request")
+
+    def send_rooms_page(self, conn, start):
+        """
+        It sends the rooms from the id `start` on, ROOMS_PAGE at most, as one write in the
+        client's protocol
+        """
+        nickname = conn.session.nickname
+        page = self.rooms.catalog.page(start, ROOMS_PAGE + 1)
+        following = page.pop()[0] if len(page) > ROOMS_PAGE else 0
+        frames = [(ROOMS, nickname, 0, rooms_payload("+", room)) for room in page]
+        frames.append((ROOMS, nickname, 0, rooms_payload("end", following)))
+        conn.send(compose_frames(conn.version, frames), version=conn.version)
+
+    def create_room(self, conn, name):
+        """It creates a room for the client, or finds the room with this name"""
+        try:
+            room_id, created = self.rooms.create(name)
+        except ValueError as error:
+            conn.send(self.rooms_frame("error", error, conn.session.nickname))
+            return
+        if created:
+            self.room_added(room_id, name, conn)
+        else:
+            conn.send(self.rooms_frame("+", (room_id, name), conn.session.nickname))
+
+    def delete_room(self, conn, room_id):
+        """It deletes an empty room for the client"""
+        try:
+            if self.sessions.count(room_id):
+                raise ValueError("The room is not empty")
+            name = self.rooms.delete(room_id)
+        except ValueError as error:
+            conn.send(self.rooms_frame("error", error, conn.session.nickname))
+            return
+        self.room_deleted(room_id, name, conn)
+
+    def room_added(self, room_id, name, requester=None):
+        """
+        It sends the new room to the clients that listen to the catalog, and as the answer to the
+        client that created it
+
+        :param requester: the ClientConnection that asked for the room, None for none
+        """
+        listeners = self.rooms_listeners - {requester}
+        broadcast(self.rooms_frame("+", (room_id, name)), listeners)
+        if requester is not None:
+            requester.send(
+                self.rooms_frame("+", (room_id, name), requester.session.nickname)
+            )
+        self.notify("-ROOM_EVENT-", (now(), "Rooms", room_id, name, True))
+
+    def room_deleted(self, room_id, name, requester=None):
+        """It drops the history of a deleted room and sends its deletion, like room_added()"""
+        self.history.drop(room_id)
+        if self.metrics is not None:
+            self.metrics.rooms.pop(room_id, None)
+        listeners = self.rooms_listeners - {requester}
+        broadcast(self.rooms_frame("-", (room_id, name)), listeners)
+        if requester is not None:
+            requester.send(
+                self.rooms_frame("-", (room_id, name), requester.session.nickname)
+            )
+        self.notify("-ROOM_EVENT-", (now(), "Rooms", room_id, name, False))
+
+    # ===========================================
+    # Rosters
+    # ===========================================
+    @staticmethod
+    def roster_frame(kind, value, nickname, room_id):
+        """It returns the encoded ROSTER frame, see roster_payload()"""
+        return msg_composer(
+            ROSTER, nickname, room_id, roster_payload(kind, value)
+        ).encode("utf-8")
+
+    def on_roster_request(self, conn, data, header):
+        """
+        It answers a ROSTER request with a page of the members of the client's room. From then on
+        the client is a roster listener: it gets the first page of a room's members when it
+        enters the room, and the diffs of its room.
+        """
+        kind, value = parse_roster_payload(frame_parser(memoryview(data), 0, header)[3])
+        if kind != "list":
+            raise ValueError("Bad roster request")
+        self.roster_listeners.add(conn)
+        self.send_roster_page(conn, conn.session.room_id, value, conn.session.nickname)
+
+    def room_roster(self, room_id):
+        """It returns the (member_id, nickname) of the room's members"""
+        return self.sessions.roster(room_id)
+
+    def send_roster_page(self, conn, room_id, after, nickname="#Empty"):
+        """
+        It sends the members of the room after the member id `after`, ROSTER_PAGE at most, as one
+        write in the client's protocol. The page's 'end' has the nickname of the client for the
+        answer to its request.
+        """
+        roster = self.room_roster(room_id) if room_id is not None else []
+        page = heapq.nsmallest(
+            ROSTER_PAGE + 1, (member for member in roster if member[0] > after)
+        )
+        following = page[ROSTER_PAGE - 1][0] if len(page) > ROSTER_PAGE else 0
+        frames = [
+            (ROSTER, member, room_id, roster_payload("=", member_id))
+            for member_id, member in page[:ROSTER_PAGE]
+        ]
+        end = roster_payload("end", (following, len(roster)))
+        frames.append((ROSTER, nickname, room_id or 0, end))
+        conn.send(compose_frames(conn.version, frames), version=conn.version)
+
+    def roster_diff(self, kind, room_id, member_id, nickname, exclude=None):
+        """
+        It sends a member's entry ('+') or leave ('-') of the room to the roster listeners in the
+        room, but `exclude`
+        """
+        listeners = self.roster_listeners
+        if not listeners:
+            return
+        if len(listeners) < self.sessions.count(room_id):
+            clients = [c for c in listeners if c.session.room_id == room_id]
+        else:
+            clients = [c for c in self.sessions.members(room_id) if c in listeners]
+        clients = [client for client in clients if client is not exclude]
+        if clients:
+            broadcast(self.roster_frame(kind, member_id, nickname, room_id), clients)
+
+    def presence(self, conn, left, clients):
+        """
+        It sends the roster diffs of the client's ENTER_ROOM / EXIT_ROOM to the roster listeners
+        of the room it left and of the room it entered, and returns the recipients of the frame
+        that still get it: the clients that aren't roster listeners, and the client itself (the
+        echo). A client that doesn't listen hears of the presence from the frame as before.
+
+        :param conn: the ClientConnection that sent the frame, its registry entry is up to date
+        :param left: (room_id, member_id) of the client before the frame
+        :param clients: the frame's recipients, see route()
+        """
+        session = conn.session
+        if (session.room_id, session.member_id) != left:
+            if left[0] is not None:
+                self.roster_diff("-", left[0], left[1], session.nickname)
+            if session.room_id is not None:
+                self.roster_diff(
+                    "+", session.room_id, session.member_id, session.nickname, conn
+                )
+        listeners = self.roster_listeners
+        return [c for c in clients if c is conn or c not in listeners]
+
+    def unknown_room(self, conn, data, header):
+        """
+        A frame to a room not in the catalog: deleted meanwhile, or never created. It's dropped,
+        and an ENTER_ROOM is answered with the room's deletion (a diff: not the answer to a
+        request)
+        """
+        if header[0] == ENTER_ROOM:
+            room_id = room_id_parser(data, header, conn.version)
+            name = room_name(room_id, self.rooms.catalog.names)
+            conn.send(self.rooms_frame("-", (room_id, name)))
+
+    def frames(self, message, version, to_version, stamps=None):
+        """
+        It returns the encoded message (or run of messages) of the protocol `version` in the
+        protocol `to_version`, the v3 frames stamped with `stamps` (see ClientConnection.send()).
+        A message sent to many clients is transcoded once per protocol: the encodings of the
+        last one are kept. A message is transcoded only for the clients of another protocol
+        than its sender's, the v3 frames are stamped again only.
+        """
+        if message is not self._frames_source:
+            self._frames_source = message
+            self._frames = {} if version == PROTOCOL_V3 else {version: message}
+        frames = self._frames.get(to_version)
+        if frames is None:
+            frames = transcode(message, version, to_version, stamps)
+            self._frames[to_version] = frames
+        return frames
+
+    def schedule_flush(self, conn):
+        """It writes the queued messages of the connection on the next tick"""
+        self._flush_pending.append(conn)
+        if self._flush_handle is None:
+            if self.coalesce_tick:
+                self._flush_handle = self.loop.call_later(
+                    self.coalesce_tick, self.flush_all
+                )
+            else:
+                self._flush_handle = self.loop.call_soon(self.flush_all)
+
+    def flush_all(self):
+        """The tick: it writes the queued messages of every client that got some"""
+        self._flush_handle = None
+        pending, self._flush_pending = self._flush_pending, []
+        for conn in pending:
+            conn.flush_scheduled = False
+            if not conn.transport.is_closing():
+                conn._flush()
+
+    def announce(self, message, room_id=None):
+        """
+        It sends a message of the server (encoded) to the members of the room, None: everyone.
+        The roster listeners don't get the ENTER_ROOM / EXIT_ROOM messages, see presence().
+        """
+        if room_id is None:
+            clients = self.sessions.connections()
+        else:
+            clients = self.sessions.members(room_id)
+        if self.roster_listeners and header_parser(message)[0] in (
+            ENTER_ROOM,
+            EXIT_ROOM,
+        ):
+            clients = [c for c in clients if c not in self.roster_listeners]
+        broadcast(message, clients)
+
+    def on_disconnect(self, conn):
+        self.end_handshake(conn)
+        if self.metrics is not None:
+            self.metrics.disconnects[conn.close_reason] += 1
+        if conn.admitted:
+            ip = conn.address[0]
+            self.connections_per_ip[ip] -= 1
+            if not self.connections_per_ip[ip]:
+                del self.connections_per_ip[ip]
+        if conn.session is None:  # refused, or closed during the handshake
+            return
+        self.rooms_listeners.discard(conn)
+        self.roster_listeners.discard(conn)
+        session = conn.session
+        room_id, member_id = session.room_id, session.member_id
+        self.sessions.remove(session)
+        if room_id is not None:
+            self.roster_diff("-", room_id, member_id, session.nickname)
+        self.notify(
+            "-Exception_Event-",
+            (now(), conn.name, conn.session.nickname, conn.close_reason),
+        )
+
+    def stats(self, sessions=False):
+        """
+        It returns the live metrics of the server, a JSON-ready dictionary. It runs in the event
+        loop, see run_in_loop()
+
+        :param sessions: add the counters of every session
+        """
+        metrics = self.metrics or ServerMetrics()
+        result = {
+            "uptime_s": round(time.time() - metrics.started, 3),
+            "connections": sum(self.connections_per_ip.values()),
+            "handshaking": self.handshakes_pending,
+            "sessions": len(self.sessions),
+            "handshakes": {
+                "completed": self.handshakes_completed,
+                "timed_out": self.handshakes_timed_out,
+            },
+            "refused": self.refused,
+            "catalog_rooms": len(self.rooms),
+            "frames_sent": self.frames_sent,
+            "writes": self.writes,
+            "rooms": metrics.rooms_dict(
+                lambda room_id: len(self.sessions.members(room_id)),
+                self.rooms.catalog.names,
+            ),
+            "relay_latency_ms": metrics.relay_latency.snapshot(),
+            "disconnects": dict(metrics.disconnects),
+        }
+        if sessions:
+            result["session_counters"] = [
+                {
+                    "nickname": session.nickname,
+                    "address": ":".join(map(str, session.address)),
+                    "room": self.sessions.room_name(session),
+                    "msgs_in": session.msgs_in,
+                    "bytes_in": session.bytes_in,
+                    "msgs_out": session.msgs_out,
+                    "bytes_out": session.bytes_out,
+                    "queue_depth": session.conn.queue_depth,
+                    "dropped": session.conn.dropped,
+                }
+                for session in self.sessions.sessions()
+            ]
+        return result
+
+    def run_in_loop(self, function, *args, timeout=5.0):
+        """
+        It calls function(*args) in the server's event loop and returns its result. Safe to
+        call from any thread, e.g. the GUI thread reading stats()
+        """
+        future = concurrent.futures.Future()
+
+        def call():
+            try:
+                future.set_result(function(*args))
+            except Exception as error:
+                future.set_exception(error)
+
+        self.loop.call_soon_threadsafe(call)
+        return future.result(timeout)
+
+    def queue_depths(self):
+        """It returns a dictionary of address -> (outbound queue depth, dropped messages)"""
+        return {
+            session.address: (session.conn.queue_depth, session.conn.dropped)
+            for session in self.sessions.sessions()
+        }
+
+    # ===========================================
+    # Event loop
+    # ===========================================
+    async def serve(self):
+        """It binds the server socket and serves the clients until stop() is called"""
+        self.loop = asyncio.get_running_loop()
+        self._server = await self.loop.create_server(
+            lambda: ClientConnection(self),
+            self.host,
+            self.port,
+            backlog=self.max_clients,  # listens for max_clients active connections
+            reuse_port=self.reuse_port,
+        )
+        log.info(LogObserver.logfmt(event="listening", host=self.host, port=self.port))
+        self.rooms.start_timers()
+        if self.journal is not None:
+            self.journal.start()
+        stats_server = None
+        if self.stats_port is not None:
+            stats_server = await start_stats_endpoint(
+                lambda sessions: self.stats(sessions), "127.0.0.1", self.stats_port
+            )
+        async with self._server:
+            try:
+                await self._server.serve_forever()
+            except asyncio.CancelledError:
+                pass
+            finally:
+                for conn in self.sessions.connections():
+                    conn.close()
+                self.history.close()
+                self.rooms.save()
+                if stats_server is not None:
+                    stats_server.close()
+                if self.journal is not None:
+                    self.journal.close()
+
+    def run(self):
+        """It runs the server in the calling thread until stop() is called"""
+        raise_open_files_limit()
+        asyncio.run(self.serve())
+
+    def stop(self):
+        """It stops the server. Safe to call from any thread"""
+        if self.loop is not None and self._server is not None:
+            self.loop.call_soon_threadsafe(self._server.close)
+
+
+def add_server_arguments(parser):
+    """It adds the ChatServer options to the argparse parser, see server_options()"""
+    parser.add_argument("--host", default=HOST)
+    parser.add_argument("--port", type=int, default=PORT)
+    parser.add_argument("--max-clients", type=int, default=MAX_CLIENTS)
+    parser.add_argument(
+        "--overflow-policy",
+        choices=(DROP_OLDEST, DISCONNECT, BLOCK),
+        default=DROP_OLDEST,
+        help="when the outbound queue of a client is full",
+    )
+    parser.add_argument(
+        "--max-pending",
+        type=int,
+        default=MAX_PENDING_HANDSHAKES,
+        help="max clients in the nickname handshake at once",
+    )
+    parser.add_argument(
+        "--max-per-address", type=int, help="max connections from one IP address"
+    )
+    parser.add_argument("--outbox-size", type=int, default=OUTBOX_SIZE)
+    parser.add_argument(
+        "--handshake-timeout",
+        type=float,
+        default=HANDSHAKE_TIMEOUT,
+        help="seconds a new client has to send its nickname",
+    )
+    parser.add_argument(
+        "--history-size",
+        type=int,
+        default=HISTORY_SIZE,
+        help="chat messages kept in memory per room",
+    )
+    parser.add_argument(
+        "--history-dir", help="keep the older messages in segment files there"
+    )
+    parser.add_argument(
+        "--log-level",
+        default="INFO",
+        choices=("DEBUG", "INFO", "WARNING", "ERROR"),
+        help="DEBUG logs every relayed message",
+    )
+    parser.add_argument(
+        "--coalesce-tick",
+        type=float,
+        default=COALESCE_TICK,
+        help="seconds the messages for a client are collected before one write, "
+        "0: the end of the event loop iteration",
+    )
+    parser.add_argument(
+        "--no-coalesce",
+        action="store_true",
+        help="write every message at once, one send syscall per message",
+    )
+    parser.add_argument(
+        "--coalesce-max-frames",
+        type=int,
+        default=COALESCE_MAX_FRAMES,
+        help="max messages in one write",
+    )
+    parser.add_argument(
+        "--coalesce-max-bytes",
+        type=int,
+        default=COALESCE_MAX_BYTES,
+        help="max bytes in one write",
+    )
+    parser.add_argument(
+        "--chunk-queue",
+        type=int,
+        default=CHUNK_QUEUE,
+        help="max chunks of a transfer queued for a client",
+    )
+    parser.add_argument(
+        "--max-rooms",
+        type=int,
+        default=MAX_ROOMS,
+        help="max rooms in the catalog, the built-in ones included",
+    )
+    parser.add_argument(
+        "--room-idle-timeout",
+        type=float,
+        default=ROOM_IDLE_TIMEOUT,
+        help="seconds a created room stays empty before it's deleted",
+    )
+    parser.add_argument(
+        "--send-lowat",
+        type=int,
+        default=SEND_LOWAT,
+        help="TCP_NOTSENT_LOWAT of the client sockets, 0 for the OS default",
+    )
+    parser.add_argument(
+        "--stats-port",
+        type=int,
+        help="serve the live metrics as JSON on http://127.0.0.1:PORT/stats",
+    )
+    parser.add_argument(
+        "--no-metrics",
+        action="store_true",
+        help="don't count the messages per room and the relay latency",
+    )
+    parser.add_argument(
+        "--journal-dir",
+        help="journal the relayed messages, joins and leaves there, as JSON lines",
+    )
+    parser.add_argument(
+        "--journal-max-bytes",
+        type=int,
+        default=JOURNAL_MAX_BYTES,
+        help="size a journal file is rotated at",
+    )
+    parser.add_argument(
+        "--journal-interval",
+        type=float,
+        default=JOURNAL_INTERVAL,
+        help="seconds a journal file is rotated after, 0 for never",
+    )
+    parser.add_argument(
+        "--journal-backups",
+        type=int,
+        default=JOURNAL_BACKUPS,
+        help="rotated journal files kept",
+    )
+    parser.add_argument(
+        "--journal-compress", action="store_true", help="gzip the rotated journal files"
+    )
+
+
+def server_options(args):
+    """It returns the ChatServer keyword arguments (but host and port) of the parsed arguments"""
+    return dict(
+        max_clients=args.max_clients,
+        overflow_policy=args.overflow_policy,
+        outbox_size=args.outbox_size,
+        handshake_timeout=args.handshake_timeout,
+        max_pending=args.max_pending,
+        max_per_address=args.max_per_address,
+        history_size=args.history_size,
+        history_dir=args.history_dir,
+        coalesce_tick=None if args.no_coalesce else args.coalesce_tick,
+        coalesce_max_frames=args.coalesce_max_frames,
+        coalesce_max_bytes=args.coalesce_max_bytes,
+        chunk_queue=args.chunk_queue,
+        max_rooms=args.max_rooms,
+        room_idle_timeout=args.room_idle_timeout,
+        send_lowat=args.send_lowat or None,
+        metrics=not args.no_metrics,
+        stats_port=args.stats_port,
+        journal_dir=args.journal_dir,
+        journal_max_bytes=args.journal_max_bytes,
+        journal_interval=args.journal_interval or None,
+        journal_backups=args.journal_backups,
+        journal_compress=args.journal_compress,
+    )
+
+
+def setup_logging(level, fmt="ts=%(asctime)s level=%(levelname)s %(message)s"):
+    """It sends the log to stdout, as logfmt lines"""
+    logging.basicConfig(
+        stream=sys.stdout, level=level, format=fmt, datefmt="%Y-%m-%dT%H:%M:%S"
+    )
+
+
+def main(argv=None):
+    """
+    It parses the command line and runs the chat server: with the GUI ('chat_server_ui.py'), or
+    with `--headless` without importing any GUI module, logging the server events to stdout.
+    """
+    parser = argparse.ArgumentParser(prog="chat_server", description="The chat server")
+    parser.add_argument(
+        "--headless", action="store_true", help="no GUI, log the events to stdout"
+    )
+    add_server_arguments(parser)
+    args = parser.parse_args(argv)
+    options = server_options(args)
+
+    if not args.headless:
+        import chat_server_ui  # PySimpleGUI is imported only here
+
+        chat_server_ui.main(args.host, args.port, **options)
+        return
+
+    setup_logging(args.log_level)
+    server = ChatServer(args.host, args.port, **options)
+    server.attach(LogObserver(names=server.rooms.catalog.names))
+    signal.signal(signal.SIGTERM, lambda *_: server.stop())
+    try:
+        server.run()
+    except KeyboardInterrupt:
+        pass
+    log.info(
+        LogObserver.logfmt(
+            event="stopped", frames_sent=server.frames_sent, writes=server.writes
+        )
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -3,181 +3,418 @@
 Dependencies: PySimpleGUI:  https://pypi.org/project/PySimpleGUI/
                             pip install PySimpleGUI
 
+The GUI is an observer of the chat server engine ('chat_server.py'). To run the server without
+the GUI: python -m chat_server --headless
+
 Example:
         $ python "C:/Users/User/Documents/Python/Chat-Rooms-Project/chat_server_ui.py"
+        $ python -m chat_server --host 0.0.0.0 --port 9090
 
 @Author: Vadim Moldavsky   vasja34@gmail.com
 @Date:   17/08/2022
 """
 
-import datetime
-import socket
+import collections
+import concurrent.futures
+import itertools
 import sys
 import threading
+import time
 from pathlib import Path
 
 import PySimpleGUI as sg
 
 from chat_protocol import *
-
-
-def broadcast(message, clients):
+from chat_metrics import rates
+from chat_registry import MembershipDiffs
+from chat_server import HOST, PORT, ChatServer, EventBuffer
+
+LOG_TICK_MS = 40  # the Network Log is updated once per tick
+LOG_LINES = 5000  # the Network Log keeps the recent lines only
+LOG_EVENTS = 10_000  # the server events buffered between two ticks
+METRICS_TICK = 1.0  # seconds, the Status window's Metrics tab is updated once per tick
+STATS_TIMEOUT = 0.05  # seconds, the window waits this long at most for stats()
+STATUS_TICK = 0.25  # seconds, the Status window applies the membership changes per tick
+PAGE_ROWS = 100  # the users shown per page, and the members shown per room
+
+# the Network Log's text styles: tag -> (text color, background color)
+LOG_STYLES = {
+    "accept": ("#FFFFFF", "#546393"),
+    "accept2": ("#FFFFFF", "#7186c7"),
+    "broadcast": ("white", "green"),
+    "room": ("#000000", "#ffd258"),
+    "room2": ("#000000", "#cca746"),
+    "chat": ("#FFFFFF", "#4d4d4d"),
+    "chat2": ("#FFFFFF", "#737373"),
+    "exception": ("#FFFFFF", "#800080"),
+    "exception2": ("#FFFFFF", "#cc00cc"),
+    "warning": ("red", "yellow"),
+    "warning2": ("#000000", "#ffd258"),
+    "warning3": ("#000000", "#cca746"),
+}
+
+
+def log_segments(event, val, names=rooms_name):
     """
-    It takes a message and a list of clients, and sends the message to each client in the list
+    It formats a server event as one Network Log line
 
-    :param message: The message to be sent to all clients. The message is already encoded
-    :param clients: A list of all the clients connected to the server
+    :param event: the server event
+    :param val: the event's value
+    :param names: the room_id -> name of the server's rooms, see NetworkLog
+    :return: a list of (text, tag) segments, the last one ends the line
+    """
+    if event == "-ACCEPT_NEW_CLIENT-":
+        time_stamp, thread_, address, nick = val
+        return [
+            ("accept_client()", "accept"),
+            (f"[{time_stamp}]", "accept2"),
+            (f"[{thread_}]", "accept"),
+            (f"[New client connected with address: {address}]", "accept2"),
+            (f"[Nickname of the client is: {nick}]\n", "accept"),
+        ]
+    if event == "-BROADCAST_EVENT-":
+        time_stamp, thread_, nick, message = val
+        # the server relays the encoded message, it is decoded only here
+        msg_type, msg_nickname, msg_room_name, msg_payload = msg_parser(message, names)
+        style = "room" if msg_type in [EXIT_ROOM, ENTER_ROOM] else "chat"
+        return [
+            ("broadcast()     ", "broadcast"),
+            (f"[{time_stamp}]", style),
+            (f"[{thread_}]", style + "2"),
+            (
+                f"[<{msg_type}><{msg_nickname}><{msg_room_name}><{msg_payload}>]\n",
+                style,
+            ),
+        ]
+    if event == "-Exception_Event-":
+        time_stamp, thread_, nick, msg = val
+        return [
+            ("Exception_Event ", "exception"),
+            (f"[{time_stamp}]", "exception2"),
+            (f"[{thread_}]", "exception"),
+            (f"[{nick} {msg}]\n", "exception2"),
+        ]
+    if event == "-ROOM_EVENT-":
+        time_stamp, thread_, room_id, name, created = val
+        return [
+            ("rooms           ", "room"),
+            (f"[{time_stamp}]", "room2"),
+            (f"[{thread_}]", "room"),
+            (f"[{'created' if created else 'deleted'} {room_id}: '{name}']\n", "room2"),
+        ]
+    if event == "-WARNING_EVENT-":
+        time_stamp, thread_, msg = val
+        return [
+            ("WARNING         ", "warning"),
+            (f"[{time_stamp}]", "warning2"),
+            (f"[{thread_}]", "warning3"),
+            (f"[{msg}]\n", "warning2"),
+        ]
+    return []
+
+
+class NetworkLog:
+    """
+    The Network Log: a bounded ring of the recent lines in the -OUTPUT- Multiline. The server
+    events of a tick are written with one text insert, and the oldest lines are deleted once there
+    are more than `max_lines`. The lines deleted, or never shown, are counted in `dropped`.
+    The log keeps its own copy of the server's room names, from the -ROOM_EVENT- events: the
+    server's catalog is changed by the server's thread.
     """
-    for client in clients:
-        client.send(message)
 
+    def __init__(self, element, max_lines=LOG_LINES, names=rooms_name):
+        self.widget = element.Widget  # the tkinter Text
+        self.max_lines = max_lines
+        self.names = dict(names)  # room_id -> name
+        self.dropped = 0
+        for tag, (text_color, background_color) in LOG_STYLES.items():
+            self.widget.tag_configure(
+                tag, foreground=text_color, background=background_color
+            )
 
-def handle(client, clients, nicknames, addresses, status_dict, window):
+    def write(self, events, dropped=0):
+        """
+        It writes the events to the log
+
+        :param events: a list of (event, value)
+        :param dropped: the events dropped before they got here
+        """
+        self.dropped += dropped
+        if len(events) > self.max_lines:  # they would be deleted at once
+            self.dropped += len(events) - self.max_lines
+            events = events[-self.max_lines :]
+        chunks = []  # text, tag, text, tag ... : tkinter's Text.insert() arguments
+        for event, val in events:
+            if event == "-ROOM_EVENT-":
+                _, _, room_id, name, created = val
+                if created:
+                    self.names[room_id] = name
+                else:
+                    self.names.pop(room_id, None)
+            for text, tag in log_segments(event, val, self.names):
+                chunks += (text, tag)
+        if not chunks:
+            return
+        self.widget.configure(state="normal")
+        self.widget.insert("end", *chunks)
+        excess = int(self.widget.index("end-1c").split(".")[0]) - 1 - self.max_lines
+        if excess > 0:
+            self.widget.delete("1.0", f"{excess + 1}.0")
+            self.dropped += excess
+        self.widget.configure(state="disabled")
+        self.widget.see("end")
+
+
+def metrics_rows(previous, stats):
     """
-    It receives a message from a client, broadcasts it to all clients, and then sends an event to the
-    GUI.
-
-    :param client: the client socket
-    :param clients: list of clients
-    :param nicknames: list of nicknames
-    :param addresses: list of tuples of (ip, port)
-    :param status_dict: a dictionary that stores the status of each client
-    :param window: the tkinter window
+    It returns the rows of the Metrics tab's table: the members and the traffic rates of every
+    room between two ChatServer.stats() snapshots
     """
-    while True:
-        idx = clients.index(client)
-        nick = nicknames[idx]
-        time_stamp = str(datetime.datetime.now())[:19]
-        try:
-            message = client.recv(BUFSIZE)  # encoded
-            broadcast(message, clients)
-            # sent event to gui
-            window.write_event_value(
-                "-BROADCAST_EVENT-",
-                (
-                    time_stamp,
-                    threading.current_thread().name,
-                    nick,
-                    message.decode("utf-8"),
-                ),
-            )
-        except Exception:
-            clients.remove(client)
-            client.close()
-            nick = nicknames.pop(idx)
-            addr = addresses[idx]
-            del status_dict[addr]
-            addresses.remove(addr)
-
-            msg = "removed from chat"
-            # sent event to gui
-            window.write_event_value(
-                "-Exception_Event-",
-                (
-                    time_stamp,
-                    threading.current_thread().name,
-                    nick,
-                    msg,
-                ),
-            )
-            break
+    room_rates = rates(previous, stats)
+    return [
+        [
+            name,
+            room["members"],
+            f"{room_rates[name]['msgs_in']:.1f}",
+            f"{room_rates[name]['msgs_out']:.1f}",
+            f"{room_rates[name]['bytes_in'] / 1024:.1f}",
+            f"{room_rates[name]['bytes_out'] / 1024:.1f}",
+        ]
+        for name, room in stats["rooms"].items()
+    ]
+
+
+def metrics_summary(stats):
+    """It returns the text of the Metrics tab: connections, relay latency, disconnect reasons"""
+    latency = stats["relay_latency_ms"]
+    lines = [
+        f"Connections: {stats['connections']}   Joined: {stats['sessions']}   "
+        f"Handshaking: {stats['handshaking']}   Refused: {stats['refused']}",
+        f"Relay latency (receive -> last send), ms: p50 {latency['p50']}   "
+        f"p90 {latency['p90']}   p99 {latency['p99']}   max {latency['max']}",
+        f"Writes per message sent: "
+        f"{stats['writes'] / max(stats['frames_sent'], 1):.2f}",
+        "Disconnects: "
+        + (
+            ", ".join(f"{reason} ({n})" for reason, n in stats["disconnects"].items())
+            or "none"
+        ),
+    ]
+    return "\n".join(lines)
+
 
+def update_metrics(status_window, previous, stats):
+    """It updates the Metrics tab of the Status window with the new ChatServer.stats()"""
+    status_window["-METRICS_ROOMS-"].update(values=metrics_rows(previous, stats))
+    status_window["-METRICS_SUMMARY-"].update(metrics_summary(stats))
 
-def accept_new_client(server, clients, nicknames, addresses, status_dict, window):
+
+def room_text(room, members, shown):
+    """It returns the text of a room's node in the Rooms tab"""
+    icon = "🗫" if room == "Lobby" else "🗪"
+    hidden = f", {members - shown} not shown" if members > shown else ""
+    return f"{icon} {room}  ({members}{hidden})"
+
+
+def user_text(nickname, tab=4):
+    """It returns the text of a user's node in the Rooms tab"""
+    return f"{' ' * tab}😎 {nickname}"
+
+
+class StatusView:
     """
-    It accepts new clients and starts a new thread for each one
-
-    :param server: the socket object
-    :param clients: a list of all the clients connected to the server
-    :param nicknames: a list of nicknames of all clients
-    :param addresses: a list of all the addresses of the clients
-    :param status_dict: a dictionary that contains the client's nickname and the room they're in
-    :param window: the window object
+    The Rooms and Users tabs of the Status window, kept up to date by the membership changes of
+    the SessionRegistry instead of being rebuilt. The changes are applied every STATUS_TICK as
+    edits of the tkinter Treeviews: a user's node is inserted, moved to another room or deleted,
+    and the other nodes are left alone. Whatever the number of users, the widgets hold a page of
+    them only: the first PAGE_ROWS members of every room, and PAGE_ROWS users in the Users tab.
+    The built-in rooms are always in the tree, a created room is inserted with its first member
+    and deleted with its last one: the catalog's empty rooms are not shown.
     """
-    while True:
-        if len(clients) < MAX_CLIENTS:
-            time_stamp = str(datetime.datetime.now())[:19]
-            client, address = server.accept()
-
-            nick_request_msg = msg_composer(msg_type=GET_NICKNAME).encode("utf-8")
-            client.send(nick_request_msg)
-            response_msg = client.recv(BUFSIZE).decode("utf-8")
-            _, msg_nickname, msg_room_name, _ = msg_parser(response_msg)
-
-            nicknames.append(msg_nickname)
-            clients.append(client)
-            addresses.append(address)  # client.getsockname()
-            status_dict[address] = [msg_nickname, msg_room_name]
-
-            # ===========================================
-            threading.Thread(  # Init 'handle' thread
-                target=handle,
-                args=(client, clients, nicknames, addresses, status_dict, window),
-                daemon=True,
-            ).start()
-            # ===========================================
-            message = msg_composer(
-                msg_type=ENTER_ROOM,
-                nickname=msg_nickname,
-                room_id=rooms_id["Lobby"],
-                payload=f"{msg_nickname} joined to the 'Lobby' !",
-            ).encode("utf-8")
-            broadcast(message, clients)
-
-            window.write_event_value(
-                "-ACCEPT_NEW_CLIENT-",
-                (time_stamp, threading.current_thread().name, address, msg_nickname),
-            )
-        else:
-            sg.cprint("WARNING   ", c="red on yellow", end="")
-            sg.cprint(
-                f"Num clients in chat achieved the max allowed: {MAX_CLIENTS}. The new clients will be refused !"
-            )
 
+    def __init__(self, window, server):
+        self.window = window
+        self.server = server
+        self.tree_element = window["-STATUS_ROOMS-"]
+        self.table_element = window["-STATUS_USERS-"]
+        self.tree = self.tree_element.Widget  # the tkinter ttk.Treeview
+        self.table = self.table_element.Widget
+        self.diffs = MembershipDiffs()
+        # address -> [nickname, room name], in the order the users joined
+        self.users = server.sessions.subscribe(self.diffs)
+        self.builtin = {rooms_name[room_id] for room_id in range(BUILTIN_ROOMS)}
+        # room name -> {address: None}, the members in the order they entered the room
+        self.members = collections.defaultdict(
+            dict, {room: {} for room in self.builtin}
+        )
+        for address, (_, room) in self.users.items():
+            if room:  # not between EXIT_ROOM and ENTER_ROOM
+                self.members[room][address] = None
+        # room name -> the addresses in the tree
+        self.shown = collections.defaultdict(list)
+        self.rows = []  # the rows in the Users table
+        self.offset = 0  # the index of the page's first user
+        self.update_rooms(self.members)
+        self.update_users()
+
+    @staticmethod
+    def node_id(address):
+        return f"{address[0]}:{address[1]}"
+
+    def refresh(self):
+        """It applies the membership changes since the last tick"""
+        rooms = set()  # the rooms with new or gone members
+        renamed = []  # the addresses that got a new nickname (reused by a new client)
+        for address, state in self.diffs.drain().items():
+            old = self.users.get(address)
+            old_room = old[1] if old else ""
+            new_room = state[1] if state else ""
+            if state is None:
+                self.users.pop(address, None)
+            else:
+                self.users[address] = state
+                if old and old[0] != state[0]:
+                    renamed.append(address)
+            if old_room != new_room:
+                if old_room:
+                    self.members[old_room].pop(address, None)
+                    rooms.add(old_room)
+                if new_room:
+                    self.members[new_room][address] = None
+                    rooms.add(new_room)
+        if rooms:
+            self.update_rooms(rooms)
+        for address in renamed:
+            if self.tree.exists(node := self.node_id(address)):
+                self.tree.item(node, text=user_text(self.users[address][0]))
+        self.update_users()
+
+    def update_rooms(self, rooms):
+        """It updates the members shown under the rooms, see refresh()"""
+        wanted = {
+            room: list(itertools.islice(self.members[room], PAGE_ROWS))
+            for room in rooms
+        }
+        keep = set().union(*wanted.values())
+        for room in rooms:  # a user that left a room is in one of the rooms updated
+            for address in self.shown[room]:
+                if address not in keep:
+                    node = self.node_id(address)
+                    self.tree.delete(node)
+                    del self.tree_element.IdToKey[node]
+                    del self.tree_element.KeyToID[address]
+        for room in rooms:
+            if not self.members[room] and room not in self.builtin:
+                self.remove_room(room)
+                continue
+            if room not in self.tree_element.KeyToID:  # a created room's first member
+                self.insert_room(room)
+            parent = self.tree_element.KeyToID[room]
+            for index, address in enumerate(wanted[room]):
+                node = self.node_id(address)
+                if not self.tree.exists(node):
+                    self.tree.insert(
+                        parent,
+                        index,
+                        iid=node,
+                        text=user_text(self.users[address][0]),
+                        values=[f"🖥 {address}"],
+                    )
+                    self.tree_element.IdToKey[node] = address
+                    self.tree_element.KeyToID[address] = node
+                elif self.tree.parent(node) != parent or self.tree.index(node) != index:
+                    self.tree.move(node, parent, index)
+            self.shown[room] = wanted[room]
+            self.tree.item(
+                parent,
+                text=room_text(room, len(self.members[room]), len(wanted[room])),
+            )
 
-def get_status(status_dict):
+    def insert_room(self, room):
+        """It inserts the node of a created room, after the ones shown"""
+        node = f"room:{room}"
+        self.tree.insert("", "end", iid=node, text=room_text(room, 0, 0), values=[""])
+        self.tree_element.IdToKey[node] = room
+        self.tree_element.KeyToID[room] = node
+
+    def remove_room(self, room):
+        """It deletes the node of a created room left empty (its members' nodes are gone)"""
+        del self.members[room]
+        self.shown.pop(room, None)
+        node = self.tree_element.KeyToID.pop(room, None)
+        if node is not None:
+            self.tree.delete(node)
+            del self.tree_element.IdToKey[node]
+
+    def update_users(self):
+        """
+        It updates the page of the Users tab: the rows that changed, and the queue depths of the
+        users shown
+        """
+        if self.offset >= len(self.users):
+            self.offset = max(0, (len(self.users) - 1) // PAGE_ROWS * PAGE_ROWS)
+        rows = []
+        page = itertools.islice(
+            self.users.items(), self.offset, self.offset + PAGE_ROWS
+        )
+        for number, (address, (nickname, room)) in enumerate(page, self.offset + 1):
+            session = self.server.sessions.by_address(address)
+            depth, dropped = (
+                (session.conn.queue_depth, session.conn.dropped) if session else (0, 0)
+            )
+            icon = "🗫" if room == "Lobby" else "🗪"
+            rows.append([number, f"😎 {nickname}", f"{icon}  {room}", depth, dropped])
+        for index, row in enumerate(rows):
+            node = str(index + 1)  # PySimpleGUI's Table row ids: 1, 2, ...
+            if index >= len(self.rows):
+                self.table.insert("", "end", iid=node, values=row)
+            elif row != self.rows[index]:
+                self.table.item(node, values=row)
+        for index in range(len(rows), len(self.rows)):
+            self.table.delete(str(index + 1))
+        self.rows = rows
+        self.table_element.Values = [row[1:] for row in rows]
+        self.window["-STATUS_PAGE-"].update(
+            f"Users {self.offset + 1 if rows else 0}-{self.offset + len(rows)} "
+            f"of {len(self.users)}"
+        )
+
+    def page(self, step):
+        """It shows the next (step=1) or the previous (step=-1) page of the Users tab"""
+        last = max(0, (len(self.users) - 1) // PAGE_ROWS * PAGE_ROWS)
+        self.offset = min(max(self.offset + step * PAGE_ROWS, 0), last)
+        self.update_users()
+
+    def close(self):
+        self.server.sessions.unsubscribe(self.diffs)
+
+
+def get_status(stats=None):
     """
     It creates a window with a tabbed layout.  The first tab is a tree element that shows the chat rooms
-    and the users in each room.  The second tab is a table element that shows the users and the room
-    they are in.
+    with users and the users in each room.  The second tab is a table element that shows the users, the room
+    they are in and their outbound queue, one page at a time. The users are filled in and kept up
+    to date by a StatusView. The third tab shows the live metrics of the server, updated by
+    update_metrics().
 
-    :param status_dict: a dictionary of dictionaries.  The outer dictionary is keyed by the address of
-    the client.  The inner dictionary is keyed by the name of the field.
+    :param stats: the ChatServer.stats() snapshot, None if the server has no metrics
     :return: A window object.
     """
     # treedata.Insert(parent, fullname, f, values=[], icon=folder_icon)
+    # the built-in rooms, StatusView adds the created rooms that have members
     tree_data = sg.TreeData()
-    tree_data.Insert("", "Lobby", "🗫 Lobby", [""])
-    tree_data.Insert("", "Private Room 1", "🗪 Private Room 1", [""])
-    tree_data.Insert("", "Private Room 2", "🗪 Private Room 2", [""])
-    tree_data.Insert("", "Private Room 3", "🗪 Private Room 3", [""])
-    tree_data.Insert("", "Private Room 4", "🗪 Private Room 4", [""])
-    tree_data.Insert("", "Private Room 5", "🗪 Private Room 5", [""])
-    tree_data.Insert("", "Private Room 6", "🗪 Private Room 6", [""])
-    tree_data.Insert("", "Private Room 7", "🗪 Private Room 7", [""])
-    tree_data.Insert("", "Private Room 8", "🗪 Private Room 8", [""])
-    tree_data.Insert("", "Private Room 9", "🗪 Private Room 9", [""])
-
-    table_data = []
-    user_idx = 0
-    room_idx = 1
-    tab = 4
-    # status_dict[addresses[idx]] = [msg_nickname, msg_room_name]
-    for addr, val in status_dict.items():
-        nick = val[user_idx]
-        room = val[room_idx]
-        icon = "🗫" if room == "Lobby" else "🗪"
-        table_data.append([f"😎 {nick}", f"{icon}  {room}"])
-        tree_data.Insert(room, nick, f"{' '*tab}😎 {nick}", [f"🖥 {addr}"])
+    for room_id in range(BUILTIN_ROOMS):
+        name = rooms_name[room_id]
+        tree_data.Insert("", name, room_text(name, 0, 0), [""])
 
     sg.theme("DarkAmber")
     users_layout = [
         [sg.Text("Users joined to the chat rooms:")],
         [
             sg.Table(
-                values=table_data,
+                values=[],
                 font="Franklin, 14",
-                headings=["User", "Room"],
+                headings=["User", "Room", "Queue", "Dropped"],
                 max_col_width=15,
                 auto_size_columns=True,
                 # vertical_scroll_only=False,
@@ -194,6 +431,11 @@ def get_status(status_dict):
                 tooltip="",
             ),
         ],
+        [
+            sg.Button("◀", key="-STATUS_PREV-"),
+            sg.Text("", key="-STATUS_PAGE-"),
+            sg.Button("▶", key="-STATUS_NEXT-"),
+        ],
     ]
 
     rooms_layout = [
@@ -217,9 +459,42 @@ def get_status(status_dict):
         ],
     ]
 
+    metrics_layout = [
+        [sg.Text("Live metrics, the rates are per second:")],
+        [
+            sg.Table(
+                values=metrics_rows(None, stats) if stats else [],
+                font="Franklin, 14",
+                headings=["Room", "Members", "Msgs in", "Msgs out", "KB in", "KB out"],
+                auto_size_columns=True,
+                justification="right",
+                num_rows=BUILTIN_ROOMS,
+                key="-METRICS_ROOMS-",
+                expand_x=True,
+            ),
+        ],
+        [
+            sg.Text(
+                metrics_summary(stats) if stats else "The metrics are disabled",
+                font="Franklin, 12",
+                key="-METRICS_SUMMARY-",
+            )
+        ],
+    ]
+
     layout = [
         [sg.Titlebar("Clients Status")],
-        [sg.TabGroup([[sg.Tab("Rooms", rooms_layout), sg.Tab("Users", users_layout)]])],
+        [
+            sg.TabGroup(
+                [
+                    [
+                        sg.Tab("Rooms", rooms_layout),
+                        sg.Tab("Users", users_layout),
+                        sg.Tab("Metrics", metrics_layout),
+                    ]
+                ]
+            )
+        ],
         [
             sg.Push(),
             sg.Button("Exit", size=(12, 1), key="-EXIT-"),
@@ -233,29 +508,31 @@ def get_status(status_dict):
     return status_window
 
 
-def main():
+def read_stats(server, last=None):
     """
-    The main function of the chat server. It creates a server socket, binds it to a port and listens for
-    incoming connections.
+    It returns the server's stats() taken in its event loop, None without metrics. The window
+    waits STATS_TIMEOUT at most: while the event loop is busy (a storm, a BLOCK wait) it gets
+    `last` back, the metrics are shown again on a later tick.
     """
-    ############################################################
-    # Server Socket  init
-    ############################################################
-    HOST = "127.0.0.1"  # 'localhost'
-    PORT = 9090
-    ADDR = (HOST, PORT)
+    if server.metrics is None or server.loop is None:
+        return None
+    try:
+        return server.run_in_loop(server.stats, timeout=STATS_TIMEOUT)
+    except concurrent.futures.TimeoutError:
+        return last
 
-    server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-    server.bind(ADDR)
-    server.listen(MAX_CLIENTS)  # listens for MAX_CLIENTS active connections
-    print("Server is running. Waiting for a connection...")
-
-    ############################################################
-    # Vars  init
-    ############################################################
-    clients, nicknames, addresses = [], [], []
-    status_dict = {}
 
+def main(host=HOST, port=PORT, **options):
+    """
+    The main function of the chat server. It opens the server window and runs the asyncio chat
+    server engine ('chat_server.py') in a background thread. The engine binds the server socket,
+    listens for incoming connections and sends its events to an EventBuffer, attached as an
+    observer. The window takes the buffered events every LOG_TICK_MS and writes them to the log.
+
+    :param host: the address to listen on
+    :param port: the port to listen on
+    :param options: the other ChatServer options, e.g. max_clients
+    """
     ############################################################
     # PySimpleGUI  init
     ############################################################
@@ -263,7 +540,7 @@ def main():
 
     layout = [
         [sg.Titlebar("Chat Server")],
-        [sg.Text("Network Log")],
+        [sg.Text("Network Log"), sg.Push(), sg.Text("", key="-LOG_DROPPED-")],
         [
             sg.Multiline(
                 "Server Side Network Sniffing!\n\n",
@@ -273,7 +550,7 @@ def main():
                 horizontal_scroll=True,
                 echo_stdout_stderr=True,
                 reroute_stdout=True,
-                # write_only=True,
+                write_only=True,  # not read back at every tick
                 reroute_cprint=True,
                 disabled=True,
                 autoscroll=True,
@@ -291,102 +568,70 @@ def main():
 
     main_window = sg.Window("", layout, finalize=True)
     status_window = None  # start with main_window open
+    status_view = None  # the Rooms and Users tabs of status_window
+    status_time = 0.0
+    stats = None  # the last metrics snapshot shown in the Status window
+    stats_time = 0.0
     sg.cprint_set_output_destination(main_window, "-OUTPUT-")
 
     ############################################################
-    # Init 'accept_new_client' thread
+    # Init 'ChatServer' thread
     ############################################################
-    threading.Thread(
-        target=accept_new_client,
-        args=(
-            server,
-            clients,
-            nicknames,
-            addresses,
-            status_dict,
-            main_window,
-        ),
-        daemon=True,
-    ).start()
+    options.setdefault("max_clients", MAX_CLIENTS)
+    server = ChatServer(host, port, **options)
+    events = EventBuffer(LOG_EVENTS)  # the server's thread never waits for the GUI
+    server.attach(events)
+    # the room names before the server's thread changes them
+    network_log = NetworkLog(main_window["-OUTPUT-"], names=server.rooms.catalog.names)
+    threading.Thread(target=server.run, name="ChatServer", daemon=True).start()
+    print(f"Server is running on {host}:{port}. Waiting for a connection...")
 
     ############################################################
     # main loop
     ############################################################
     while True:
         # ===========================================
-        window, event, values = sg.read_all_windows()
+        window, event, values = sg.read_all_windows(timeout=LOG_TICK_MS)
         # ===========================================
+        dropped = network_log.dropped
+        network_log.write(*events.drain())
+        if network_log.dropped != dropped:
+            main_window["-LOG_DROPPED-"].update(
+                f"{network_log.dropped} lines dropped from view"
+            )
+
         if event in [sg.WIN_CLOSED, "-EXIT-"]:
             if window == status_window:  # if closing status_window, mark as closed
+                status_view.close()
                 window.close()
-                status_window = None
+                status_window = status_view = None
             elif window == main_window:  # if closing main_window, exit program
                 break
 
-            # ============================
-        if event == "-ACCEPT_NEW_CLIENT-":
-            # ============================
-            val = values[event]
-            time_stamp = val[0]
-            thread_ = val[1]
-            address = val[2]
-            nick = val[3]
-            sg.cprint("accept_client()", c=("#FFFFFF", "#546393"), end="")
-            sg.cprint(f"[{time_stamp}]", c=("#FFFFFF", "#7186c7"), end="")
-            sg.cprint(f"[{thread_}]", c=("#FFFFFF", "#546393"), end="")
-            sg.cprint(
-                f"[New client connected with address: {address}]",
-                c=("#FFFFFF", "#7186c7"),
-                end="",
-            )
-            sg.cprint(f"[Nickname of the client is: {nick}]", c=("#FFFFFF", "#546393"))
-
-            # ============================
-        if event == "-BROADCAST_EVENT-":
-            # ============================
-            val = values[event]
-            time_stamp = val[0]
-            thread_ = val[1]
-            nick = val[2]
-            msg_type, msg_nickname, msg_room_name, msg_payload = msg_parser(val[3])
-            sg.cprint("broadcast()     ", colors="white on green", end="")
-            if msg_type in [EXIT_ROOM, ENTER_ROOM]:
-                bg_color1 = "#ffd258"
-                bg_color2 = "#cca746"
-                txt_color = "#000000"
-            else:
-                bg_color1 = "#4d4d4d"
-                bg_color2 = "#737373"
-                txt_color = "#FFFFFF"
-            # end if
-            sg.cprint(f"[{time_stamp}]", c=(txt_color, bg_color1), end="")
-            sg.cprint(f"[{thread_}]", c=(txt_color, bg_color2), end="")
-            sg.cprint(
-                f"[<{msg_type}><{msg_nickname}><{msg_room_name}><{msg_payload}>]",
-                c=(txt_color, bg_color1),
-            )
-
-            # update status_dict
-            idx = nicknames.index(msg_nickname)
-            status_dict[addresses[idx]] = [msg_nickname, msg_room_name]
-
             # ============================
         if event == "-GET_STATUS-" and not status_window:
             # ============================
-            status_window = get_status(status_dict)
-
-        # ============================
-        if event == "-Exception_Event-":
-            # ============================
-            val = values[event]
-            time_stamp = val[0]
-            thread_ = val[1]
-            nick = val[2]
-            msg = val[3]
-            sg.cprint("Exception_Event ", c=("#FFFFFF", "#800080"), end="")
-            sg.cprint(f"[{time_stamp}]", c=("#FFFFFF", "#cc00cc"), end="")
-            sg.cprint(f"[{thread_}]", c=("#FFFFFF", "#800080"), end="")
-            sg.cprint(f"[{nick} {msg}]", c=("#FFFFFF", "#cc00cc"))
+            stats = read_stats(server, stats)
+            stats_time = time.monotonic()
+            status_window = get_status(stats)
+            status_view = StatusView(status_window, server)
+            status_time = time.monotonic()
+
+        if status_view and time.monotonic() - status_time >= STATUS_TICK:
+            status_view.refresh()
+            status_time = time.monotonic()
+        if event in ("-STATUS_PREV-", "-STATUS_NEXT-") and status_view:
+            status_view.page(-1 if event == "-STATUS_PREV-" else 1)
+
+        if (
+            status_window
+            and server.metrics is not None
+            and time.monotonic() - stats_time >= METRICS_TICK
+        ):
+            previous, stats = stats, read_stats(server, stats)
+            stats_time = time.monotonic()
+            if stats is not previous:  # a new snapshot, not the last one kept
+                update_metrics(status_window, previous, stats)
 
             # ============================
         if event == "-SAVE_LOG-":
@@ -398,12 +643,12 @@ def main():
                 file_types=(("Text Files", "*.txt"),),
                 no_window=True,
             ):
-                Path(fname).write_text(values["-OUTPUT-"])
+                Path(fname).write_text(main_window["-OUTPUT-"].get())
 
     ############################################################
     # finalize Server Socket & GUI
     ############################################################
-    # server.close()
+    server.stop()
     window.close()
     sys.exit()
 